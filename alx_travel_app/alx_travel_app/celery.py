@@ -1,6 +1,8 @@
 """
 Celery configuration for ALX Travel App
-This file can be used for asynchronous task processing (optional)
+
+Start a worker with:
+    celery -A alx_travel_app worker -B -l info
 """
 
 import os
@@ -50,6 +50,7 @@ INSTALLED_APPS = [
     # Third-party apps
     'rest_framework',
     'rest_framework.authtoken',
+    'django_filters',
     'corsheaders',
     'drf_yasg',
 ]
@@ -62,9 +63,20 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Enables the viewsets' filterset_fields and ordering_fields
+    'DEFAULT_FILTER_BACKENDS': [
+        'django_filters.rest_framework.DjangoFilterBackend',
+        'rest_framework.filters.OrderingFilter',
+    ],
+    # Lists stay unpaginated unless the client sends ?page_size/?cursor (keyset)
+    # or ?limit/?offset (offset with estimated count).
+    'DEFAULT_PAGINATION_CLASS': 'listings.pagination.OptInPagination',
+    'PAGE_SIZE': 20,
 }
 
 MIDDLEWARE = [
+    # First, so its timings cover every other middleware; inert unless REQUEST_PROFILING_ENABLED
+    'listings.middleware.RequestProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -95,6 +107,101 @@ TEMPLATES = [
 WSGI_APPLICATION = 'alx_travel_app.wsgi.application'
 
 
+# Cache
+# Local memory by default; point CACHE_URL at a shared cache (e.g. redis://...) in production
+# so every worker sees the same listing response cache and version counters.
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# Versioned response cache for listing reads (see listings/cache.py)
+LISTING_CACHE_ENABLED = env.bool('LISTING_CACHE_ENABLED', default=True)
+LISTING_CACHE_TIMEOUT = env.int('LISTING_CACHE_TIMEOUT', default=300)
+
+# Seconds the listing and amenity counts ?amenities= plans its query with are reused (see listings/amenities.py)
+AMENITY_STATS_TIMEOUT = env.int('AMENITY_STATS_TIMEOUT', default=300)
+
+
+# Request profiling (see listings/middleware.py): Server-Timing headers on every response and
+# JSON logs for a sample of requests plus every slow one. Off by default.
+REQUEST_PROFILING_ENABLED = env.bool('REQUEST_PROFILING_ENABLED', default=False)
+REQUEST_PROFILING_SAMPLE_RATE = env.float('REQUEST_PROFILING_SAMPLE_RATE', default=0.01)
+REQUEST_PROFILING_SLOW_REQUEST_MS = env.float('REQUEST_PROFILING_SLOW_REQUEST_MS', default=1000)
+REQUEST_PROFILING_REPEAT_THRESHOLD = env.int('REQUEST_PROFILING_REPEAT_THRESHOLD', default=3)
+REQUEST_PROFILING_SLOWEST_QUERIES = env.int('REQUEST_PROFILING_SLOWEST_QUERIES', default=5)
+
+
+# Rows read per query by the streaming booking and payment exports (see listings/exports.py)
+EXPORT_CHUNK_SIZE = env.int('EXPORT_CHUNK_SIZE', default=2000)
+
+# Most stays one POST /api/bookings/batch/ may reserve (see listings/reservations.py)
+BOOKING_BATCH_MAX_SIZE = env.int('BOOKING_BATCH_MAX_SIZE', default=100)
+
+
+# Celery
+# Payment emails are queued by tasks and delivered in batches (see listings/email_tasks.py)
+
+CELERY_BROKER_URL = env('CELERY_BROKER_URL', default='redis://localhost:6379/0')
+CELERY_TASK_ALWAYS_EAGER = env.bool('CELERY_TASK_ALWAYS_EAGER', default=False)
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_BEAT_SCHEDULE = {
+    # Safety net for emails whose delivery task was lost or failed
+    'deliver-queued-emails': {
+        'task': 'listings.tasks.deliver_queued_emails',
+        'schedule': 60.0,
+    },
+    'reconcile-pending-payments': {
+        'task': 'listings.tasks.reconcile_payments',
+        'schedule': 300.0,
+    },
+}
+
+# Email outbox: emails claimed per transaction, and how long a delivery task waits
+# so emails queued close together share one SMTP connection
+EMAIL_OUTBOX_BATCH_SIZE = env.int('EMAIL_OUTBOX_BATCH_SIZE', default=100)
+EMAIL_OUTBOX_FLUSH_DELAY = env.int('EMAIL_OUTBOX_FLUSH_DELAY', default=5)
+EMAIL_OUTBOX_MAX_ATTEMPTS = env.int('EMAIL_OUTBOX_MAX_ATTEMPTS', default=5)
+
+
+# Chapa HTTP transport (see listings/chapa_utils.py)
+# Keep-alive connections per worker process, timeouts in seconds, and retries for verify calls
+
+CHAPA_POOL_SIZE = env.int('CHAPA_POOL_SIZE', default=10)
+CHAPA_CONNECT_TIMEOUT = env.float('CHAPA_CONNECT_TIMEOUT', default=3.05)
+CHAPA_READ_TIMEOUT = env.float('CHAPA_READ_TIMEOUT', default=10)
+CHAPA_VERIFY_RETRIES = env.int('CHAPA_VERIFY_RETRIES', default=3)
+CHAPA_RETRY_BACKOFF = env.float('CHAPA_RETRY_BACKOFF', default=0.3)
+
+# Chapa circuit breaker and bulkhead (see listings/circuit_breaker.py). The breaker opens when,
+# of the last WINDOW calls (at least MIN_CALLS), FAILURE_RATE failed or SLOW_CALL_RATE took
+# SLOW_CALL_SECONDS or more; it refuses calls for OPEN_SECONDS, then lets HALF_OPEN_PROBES
+# calls through and closes if they all succeed. SHARED publishes the open state through the
+# cache to every process. At most MAX_IN_FLIGHT Chapa calls run at once per process.
+CHAPA_BREAKER_ENABLED = env.bool('CHAPA_BREAKER_ENABLED', default=True)
+CHAPA_BREAKER_WINDOW = env.int('CHAPA_BREAKER_WINDOW', default=20)
+CHAPA_BREAKER_MIN_CALLS = env.int('CHAPA_BREAKER_MIN_CALLS', default=10)
+CHAPA_BREAKER_FAILURE_RATE = env.float('CHAPA_BREAKER_FAILURE_RATE', default=0.5)
+CHAPA_BREAKER_SLOW_CALL_SECONDS = env.float('CHAPA_BREAKER_SLOW_CALL_SECONDS', default=5.0)
+CHAPA_BREAKER_SLOW_CALL_RATE = env.float('CHAPA_BREAKER_SLOW_CALL_RATE', default=0.5)
+CHAPA_BREAKER_OPEN_SECONDS = env.float('CHAPA_BREAKER_OPEN_SECONDS', default=30)
+CHAPA_BREAKER_HALF_OPEN_PROBES = env.int('CHAPA_BREAKER_HALF_OPEN_PROBES', default=3)
+CHAPA_BREAKER_SHARED = env.bool('CHAPA_BREAKER_SHARED', default=False)
+CHAPA_MAX_IN_FLIGHT = env.int('CHAPA_MAX_IN_FLIGHT', default=100)
+
+# Async payment views (see listings/async_views.py): Chapa connections open at once per
+# ASGI worker, and threads (so database connections) their ORM steps share
+CHAPA_ASYNC_MAX_CONNECTIONS = env.int('CHAPA_ASYNC_MAX_CONNECTIONS', default=100)
+ASYNC_ORM_THREADS = env.int('ASYNC_ORM_THREADS', default=10)
+
+# Pending payment sweep (see listings/reconciliation.py): concurrent verify calls,
+# verify calls per second across them, and how old a payment must be before it is swept
+PAYMENT_RECONCILE_WORKERS = env.int('PAYMENT_RECONCILE_WORKERS', default=8)
+PAYMENT_RECONCILE_RATE_LIMIT = env.float('PAYMENT_RECONCILE_RATE_LIMIT', default=20.0)
+PAYMENT_RECONCILE_CHUNK_SIZE = env.int('PAYMENT_RECONCILE_CHUNK_SIZE', default=200)
+PAYMENT_RECONCILE_MIN_AGE = env.int('PAYMENT_RECONCILE_MIN_AGE', default=300)
+
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -118,6 +225,10 @@ if 'test' in sys.argv or 'pytest' in sys.argv:
             'NAME': ':memory:',
         }
     }
+    # Cached responses would leak between test cases; cache tests enable it explicitly
+    LISTING_CACHE_ENABLED = False
+    # Run tasks inline so tests don't need a broker
+    CELERY_TASK_ALWAYS_EAGER = True
 
 
 # Password validation
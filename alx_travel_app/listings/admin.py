@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Listing, Booking, Review, Payment
+from .models import Amenity, Listing, Booking, Review, Payment, PaymentCallback, QueuedEmail, DailyRevenue
 
 
 @admin.register(Listing)
@@ -10,12 +10,19 @@ class ListingAdmin(admin.ModelAdmin):
     readonly_fields = ('listing_id', 'created_at', 'updated_at')
 
 
+@admin.register(Amenity)
+class AmenityAdmin(admin.ModelAdmin):
+    list_display = ('name', 'slug', 'bit')
+    search_fields = ('name', 'slug')
+    readonly_fields = ('bit',)
+
+
 @admin.register(Booking)
 class BookingAdmin(admin.ModelAdmin):
     list_display = ('booking_id', 'listing', 'guest', 'check_in_date', 'check_out_date', 'status', 'total_price', 'created_at')
     list_filter = ('status', 'created_at', 'check_in_date')
     search_fields = ('guest__username', 'listing__title', 'booking_id')
-    readonly_fields = ('booking_id', 'created_at')
+    readonly_fields = ('booking_id', 'created_at', 'cancelled_at')
     date_hierarchy = 'check_in_date'
 
 
@@ -50,3 +57,25 @@ class PaymentAdmin(admin.ModelAdmin):
         }),
     )
 
+
+@admin.register(DailyRevenue)
+class DailyRevenueAdmin(admin.ModelAdmin):
+    list_display = ('day', 'listing', 'host', 'currency', 'revenue', 'bookings', 'cancellations')
+    list_filter = ('currency', 'day')
+    search_fields = ('listing__title', 'host__username')
+    date_hierarchy = 'day'
+
+
+@admin.register(PaymentCallback)
+class PaymentCallbackAdmin(admin.ModelAdmin):
+    list_display = ('tx_ref', 'received_at', 'processed_at')
+    search_fields = ('tx_ref',)
+    readonly_fields = ('received_at', 'processed_at')
+
+
+@admin.register(QueuedEmail)
+class QueuedEmailAdmin(admin.ModelAdmin):
+    list_display = ('to', 'subject', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('to', 'subject')
+    readonly_fields = ('created_at', 'sent_at')
@@ -0,0 +1,241 @@
+"""
+Amenity index for listings
+
+Listing.amenities stays the comma-separated text clients send and receive.
+On every save it is parsed into the Amenity vocabulary and kept in two
+derived forms, so "has WiFi and Pool" is answered without substring matches
+(which would also match "Pool Table" for "Pool"):
+
+- Listing.amenity_mask: one bit per amenity, so a listing is tested with a
+  single integer AND while scanning; this is the fast path for common
+  amenities, which most listings match anyway
+- ListingAmenity rows with a unique (amenity, listing) index, used to start
+  from the few listings offering a rare amenity instead of scanning them all,
+  and for amenities beyond the 63 that fit in the mask
+"""
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils.text import slugify
+
+from .models import Amenity, Listing, ListingAmenity
+from .pagination import estimate_count
+
+logger = logging.getLogger(__name__)
+
+# Bits 0-62 of a signed 64-bit column
+MASK_BITS = 63
+
+# An amenity offered by less than this share of listings drives the query from the index;
+# below it, fetching each match by key costs less than testing the mask on every listing
+SELECTIVE_SHARE = 0.05
+
+# Listings counted to size the share where the database keeps no table statistics
+LISTING_COUNT_CAP = 10000000
+
+LISTINGS_KEY = 'amenities:listings'
+
+
+def parse_amenities(text):
+    """
+    Split an amenities string into {slug: display name}
+
+    "WiFi, Pool,  wifi" -> {'wifi': 'WiFi', 'pool': 'Pool'}
+    """
+    amenities = {}
+    for name in (text or '').split(','):
+        name = ' '.join(name.split())
+        slug = slugify(name)[:100]
+        if slug and slug not in amenities:
+            amenities[slug] = name[:100]
+    return amenities
+
+
+def parse_amenity_filter(value):
+    """Slugs requested by ?amenities=wifi,pool (names are accepted too)"""
+    return sorted(parse_amenities(value))
+
+
+def amenity_mask(bits):
+    """Combine amenity bits (None for amenities without one) into a mask"""
+    mask = 0
+    for bit in bits:
+        if bit is not None:
+            mask |= 1 << bit
+    return mask
+
+
+def get_or_create_amenities(amenities):
+    """
+    Return Amenity rows for {slug: name}, creating missing ones
+
+    New amenities take the next free mask bit while any are left.
+
+    Returns:
+        dict: slug -> (amenity id, bit or None)
+    """
+    def lookup():
+        rows = Amenity.objects.filter(slug__in=amenities).values_list('slug', 'id', 'bit')
+        return {slug: (amenity_id, bit) for slug, amenity_id, bit in rows}
+
+    found = lookup()
+    missing = [slug for slug in amenities if slug not in found]
+    if not missing:
+        return found
+
+    highest = Amenity.objects.exclude(bit=None).order_by('-bit').values_list('bit', flat=True).first()
+    next_bit = 0 if highest is None else highest + 1
+    new = []
+    for slug in missing:
+        new.append(Amenity(slug=slug, name=amenities[slug], bit=next_bit if next_bit < MASK_BITS else None))
+        next_bit += 1
+    Amenity.objects.bulk_create(new, ignore_conflicts=True)
+
+    found = lookup()
+    # A concurrent writer took the same bit; these amenities go without one
+    lost = [Amenity(slug=slug, name=amenities[slug]) for slug in missing if slug not in found]
+    if lost:
+        Amenity.objects.bulk_create(lost, ignore_conflicts=True)
+        found = lookup()
+    return found
+
+
+def sync_listing_amenities(listing):
+    """
+    Bring a listing's amenity mask and index rows in line with its text
+
+    Args:
+        listing: Listing model instance that was created or changed
+    """
+    amenities = get_or_create_amenities(parse_amenities(listing.amenities))
+    ids = [amenity_id for amenity_id, _ in amenities.values()]
+    mask = amenity_mask(bit for _, bit in amenities.values())
+    with transaction.atomic():
+        ListingAmenity.objects.filter(listing_id=listing.pk).exclude(amenity_id__in=ids).delete()
+        ListingAmenity.objects.bulk_create(
+            [ListingAmenity(listing_id=listing.pk, amenity_id=amenity_id) for amenity_id in ids],
+            ignore_conflicts=True,
+        )
+        if listing.amenity_mask != mask:
+            Listing.objects.filter(pk=listing.pk).update(amenity_mask=mask)
+            listing.amenity_mask = mask
+
+
+def amenity_offers(amenity_ids):
+    """
+    How many listings offer each amenity, counted up to the selective threshold
+
+    The listing count and the per-amenity counts are cached for
+    AMENITY_STATS_TIMEOUT seconds, so ?amenities= requests don't count the
+    listing table, or an amenity's index entries, every time.
+
+    Returns:
+        tuple: (selective threshold, {amenity_id: listings offering it, at most the threshold})
+    """
+    timeout = getattr(settings, 'AMENITY_STATS_TIMEOUT', 300)
+    listings = cache.get(LISTINGS_KEY)
+    if listings is None:
+        listings, _ = estimate_count(Listing.objects.all(), cap=LISTING_COUNT_CAP)
+        cache.set(LISTINGS_KEY, listings, timeout)
+    selective = int(listings * SELECTIVE_SHARE)
+
+    keys = {amenity_id: f'amenities:offered:{amenity_id}' for amenity_id in amenity_ids}
+    cached = cache.get_many(keys.values())
+    offered, stale = {}, {}
+    for amenity_id, key in keys.items():
+        threshold, count = cached.get(key, (None, None))
+        if threshold != selective:
+            # Each count stops at the threshold, so a common amenity costs a bounded index range
+            count = ListingAmenity.objects.filter(amenity_id=amenity_id).values('pk')[:selective].count()
+            stale[key] = (selective, count)
+        offered[amenity_id] = count
+    if stale:
+        cache.set_many(stale, timeout)
+    return selective, offered
+
+
+def filter_amenities(queryset, slugs):
+    """
+    Restrict a listing queryset to listings offering every amenity
+
+    Amenities with a mask bit are checked together with one AND on
+    amenity_mask. If one of the requested amenities is rare, the query
+    starts from its index entries rather than from every listing. An
+    unknown amenity matches nothing.
+
+    Args:
+        queryset: Listing queryset
+        slugs: Amenity slugs, e.g. ['pool', 'wifi']
+    """
+    slugs = set(slugs)
+    if not slugs:
+        return queryset
+    amenities = list(Amenity.objects.filter(slug__in=slugs).values_list('id', 'bit'))
+    if len(amenities) < len(slugs):
+        return queryset.none()
+
+    mask = amenity_mask(bit for _, bit in amenities)
+    if mask:
+        queryset = queryset.alias(amenity_match=F('amenity_mask').bitand(mask)).filter(amenity_match=mask)
+    for amenity_id, bit in amenities:
+        if bit is None:
+            queryset = queryset.filter(
+                Exists(ListingAmenity.objects.filter(amenity_id=amenity_id, listing_id=OuterRef('pk')))
+            )
+
+    selective, offered = amenity_offers([amenity_id for amenity_id, _ in amenities])
+    rarest = min(offered, key=offered.get)
+    if offered[rarest] < selective:
+        queryset = queryset.filter(pk__in=ListingAmenity.objects.filter(amenity_id=rarest).values('listing_id'))
+    return queryset
+
+
+def rebuild_amenity_index(batch_size=1000):
+    """
+    Rebuild amenity masks and index rows from every listing's amenities text
+
+    Returns:
+        int: Number of ListingAmenity rows written
+    """
+    created = 0
+    # Nothing to roll back to partway, and a savepoint makes SQLite journal every page touched
+    with transaction.atomic(savepoint=False):
+        ListingAmenity.objects.all().delete()
+        rows = Listing.objects.order_by('pk').values_list('pk', 'amenities', 'amenity_mask')
+
+        last = None
+        while True:
+            batch = list((rows if last is None else rows.filter(pk__gt=last))[:batch_size])
+            if not batch:
+                break
+            last = batch[-1][0]
+
+            parsed = {pk: parse_amenities(text) for pk, text, _ in batch}
+            vocabulary = {}
+            for amenities in parsed.values():
+                vocabulary.update(amenities)
+            found = get_or_create_amenities(vocabulary)
+
+            links = [
+                ListingAmenity(listing_id=pk, amenity_id=found[slug][0])
+                for pk, amenities in parsed.items()
+                for slug in amenities
+            ]
+            ListingAmenity.objects.bulk_create(links, batch_size=batch_size)
+            created += len(links)
+
+            # Listings share a handful of amenity sets, so one UPDATE per mask beats bulk_update's CASE
+            stale = defaultdict(list)
+            for pk, _, current in batch:
+                mask = amenity_mask(found[slug][1] for slug in parsed[pk])
+                if mask != current:
+                    stale[mask].append(pk)
+            for mask, pks in stale.items():
+                Listing.objects.filter(pk__in=pks).update(amenity_mask=mask)
+
+    logger.info(f"Amenity index rebuilt with {created} entries")
+    return created
@@ -0,0 +1,209 @@
+"""
+Async payment views, for deployments served by alx_travel_app/asgi.py
+
+Initiating and verifying a payment is mostly waiting on Chapa. These views
+await Chapa on the event loop, so a slow Chapa holds coroutines rather than
+worker threads and the rest of the API keeps being served.
+
+DRF views are sync only, so these are plain Django async views with the
+same authentication, permissions and responses as
+BookingViewSet.initiate_payment and PaymentViewSet.verify_status, routed
+under /api/async/ next to the DRF actions they mirror.
+Database work never runs on the event loop: each step runs on a thread
+pool of ASYNC_ORM_THREADS threads, so however many payments are in flight
+only that many threads and database connections are in use.
+"""
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.exceptions import (
+    APIException, AuthenticationFailed, NotAuthenticated, NotFound, PermissionDenied
+)
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .chapa_async import get_async_chapa_client
+from .instrumentation import hook_thread_connections
+from .models import Booking, Payment
+from .payment_actions import (
+    ChapaUnavailable, chapa_failure, payment_to_initiate, record_initiation, record_verification, verification_refusal
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def orm_executor():
+    """The thread pool database steps run on, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'ASYNC_ORM_THREADS', 10), thread_name_prefix='async-orm'
+            )
+        return _executor
+
+
+def reset_orm_executor():
+    """Forget the pool, e.g. in a forked child where its threads don't exist"""
+    global _executor, _executor_lock
+
+    _executor_lock = threading.Lock()
+    _executor = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_orm_executor)
+
+
+def orm_step(func):
+    """
+    Make a sync function an awaitable that runs on the ORM thread pool
+
+    Pool threads keep their connections between steps, so like a request
+    each step closes those that outlived CONN_MAX_AGE or broke. A step is
+    its own transaction.
+    """
+    def step(*args, **kwargs):
+        close_old_connections()
+        hook_thread_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    @functools.wraps(func)
+    async def run(*args, **kwargs):
+        return await sync_to_async(step, thread_sensitive=False, executor=orm_executor())(*args, **kwargs)
+
+    return run
+
+
+def error_response(exc, authenticators=()):
+    """JSON response for a DRF exception, as DRF's exception handler writes it"""
+    response = JsonResponse({'detail': exc.detail}, status=exc.status_code)
+    if getattr(exc, 'wait', None):
+        response['Retry-After'] = '%d' % exc.wait
+    if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+        header = authenticators[0].authenticate_header(None) if authenticators else None
+        if header:
+            response['WWW-Authenticate'] = header
+        else:
+            response.status_code = 403
+    return response
+
+
+@orm_step
+def authenticate(request):
+    """
+    Authenticate a request with the API's authentication classes
+
+    Returns:
+        tuple: (user, None), or (None, error response)
+    """
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = drf_request.user
+    except APIException as exc:
+        return None, error_response(exc, drf_request.authenticators)
+    if not user.is_authenticated:
+        return None, error_response(NotAuthenticated(), drf_request.authenticators)
+    return user, None
+
+
+@orm_step
+def visible_booking(user, pk):
+    """The booking if the user is its guest or host, with what Chapa is sent and its payment loaded"""
+    return (
+        Booking.objects.select_related('guest', 'listing').with_payment()
+        .filter(Q(guest=user) | Q(listing__host=user), pk=pk)
+        .first()
+    )
+
+
+@orm_step
+def visible_payment(user, pk):
+    """The payment if the user is its booking's guest or host"""
+    return (
+        Payment.objects.select_related('booking__listing', 'booking__guest')
+        .filter(Q(booking__guest=user) | Q(booking__listing__host=user), pk=pk)
+        .first()
+    )
+
+
+@csrf_exempt
+@require_POST
+async def initiate_payment(request, pk):
+    """
+    Initiate payment for a booking; POST /api/async/bookings/{id}/initiate_payment/
+
+    Returns:
+        - checkout_url: URL to redirect user to Chapa payment page
+        - payment_id: Payment ID for reference
+    """
+    user, error = await authenticate(request)
+    if error:
+        return error
+    booking = await visible_booking(user, pk)
+    if booking is None:
+        return error_response(NotFound())
+
+    # Only guest can initiate payment
+    if booking.guest_id != user.pk:
+        return error_response(PermissionDenied("You can only initiate payment for your own bookings."))
+
+    payment, refusal = await orm_step(payment_to_initiate)(booking)
+    if refusal:
+        body, status = refusal
+        return JsonResponse(body, status=status)
+
+    try:
+        result = await get_async_chapa_client().initiate_payment(payment, booking)
+        body, status = await orm_step(record_initiation)(payment, result)
+    except ChapaUnavailable as e:
+        return error_response(e)
+    except Exception as e:
+        body, status = chapa_failure(e, 'payment initiation')
+    return JsonResponse(body, status=status)
+
+
+@csrf_exempt
+@require_POST
+async def verify_status(request, pk):
+    """
+    Verify the status of a payment with Chapa; POST /api/async/payments/{id}/verify_status/
+
+    Returns:
+        - status: Current payment status (completed, failed, pending)
+        - amount: Payment amount
+        - transaction_id: Chapa transaction ID
+    """
+    user, error = await authenticate(request)
+    if error:
+        return error
+    payment = await visible_payment(user, pk)
+    if payment is None:
+        return error_response(NotFound())
+
+    refusal = verification_refusal(payment)
+    if refusal:
+        body, status = refusal
+        return JsonResponse(body, status=status)
+
+    try:
+        result = await get_async_chapa_client().verify_payment(payment.chapa_reference)
+        body, status = await orm_step(record_verification)(payment, result)
+    except ChapaUnavailable as e:
+        return error_response(e)
+    except Exception as e:
+        body, status = chapa_failure(e, 'payment verification')
+    return JsonResponse(body, status=status)
@@ -0,0 +1,118 @@
+"""
+Availability index for listings
+
+Every night held by a booking is stored as a BookedNight row. Searching for
+listings free between two dates then only touches the index entries for that
+night range instead of scanning the bookings table.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Max
+
+from .models import Booking, BookedNight
+
+logger = logging.getLogger(__name__)
+
+# Booking statuses whose nights are unavailable to other guests
+HOLDING_STATUSES = ('pending', 'confirmed', 'completed')
+
+
+def iter_nights(check_in, check_out):
+    """Yield each night of a stay, from check-in up to (not including) check-out"""
+    night = check_in
+    while night < check_out:
+        yield night
+        night += timedelta(days=1)
+
+
+def booked_nights_for(booking):
+    """Build the BookedNight rows for a booking without saving them"""
+    return [
+        BookedNight(listing_id=booking.listing_id, booking_id=booking.pk, night=night)
+        for night in iter_nights(booking.check_in_date, booking.check_out_date)
+    ]
+
+
+def hold_nights(booking):
+    """Record the nights of an active booking in the availability index"""
+    BookedNight.objects.bulk_create(booked_nights_for(booking), ignore_conflicts=True)
+
+
+def release_nights(booking):
+    """Remove a booking's nights from the availability index"""
+    BookedNight.objects.filter(booking_id=booking.pk).delete()
+
+
+def sync_booking_nights(booking):
+    """
+    Bring the availability index in line with a booking's status and dates
+
+    Args:
+        booking: Booking model instance that was created or changed
+    """
+    with transaction.atomic():
+        release_nights(booking)
+        if booking.status in HOLDING_STATUSES:
+            hold_nights(booking)
+
+
+def filter_available(queryset, check_in, check_out):
+    """
+    Restrict a Listing queryset to listings free for every night of a stay
+
+    Args:
+        queryset: Listing queryset
+        check_in: First night of the stay
+        check_out: Departure date (that night is not needed)
+    """
+    taken = BookedNight.objects.filter(
+        night__gte=check_in,
+        night__lt=check_out,
+    ).values('listing_id')
+    return queryset.exclude(pk__in=taken)
+
+
+def booked_nights_version(check_in, check_out):
+    """
+    Version of the nights booked during a stay, in one query over the index
+
+    Nights are only ever inserted and deleted, and their ids only grow, so
+    (count, highest id) changes whenever any listing is taken or freed for
+    a night of the stay.
+
+    Returns:
+        tuple: (count, highest id or None)
+    """
+    row = BookedNight.objects.filter(night__gte=check_in, night__lt=check_out).aggregate(
+        count=Count('*'), last=Max('pk'),
+    )
+    return row['count'], row['last']
+
+
+def rebuild_availability_index(batch_size=5000):
+    """
+    Rebuild the availability index from the bookings table
+
+    Returns:
+        int: Number of nights indexed
+    """
+    indexed = 0
+    with transaction.atomic():
+        BookedNight.objects.all().delete()
+        batch = []
+        bookings = Booking.objects.filter(status__in=HOLDING_STATUSES).only(
+            'pk', 'listing_id', 'check_in_date', 'check_out_date'
+        )
+        for booking in bookings.iterator(chunk_size=batch_size):
+            batch.extend(booked_nights_for(booking))
+            if len(batch) >= batch_size:
+                BookedNight.objects.bulk_create(batch, ignore_conflicts=True)
+                indexed += len(batch)
+                batch = []
+        BookedNight.objects.bulk_create(batch, ignore_conflicts=True)
+        indexed += len(batch)
+
+    logger.info(f"Availability index rebuilt with {indexed} nights")
+    return indexed
@@ -0,0 +1,93 @@
+"""
+Performance benchmarks for the listings app
+
+Run with ``python manage.py benchmark <name> [options]``. Each benchmark
+creates its own data inside a transaction that is rolled back when it
+finishes, so it can be pointed at a copy of any database without leaving
+rows behind.
+"""
+import time
+from contextlib import contextmanager
+
+from django.db import transaction
+
+
+class Benchmark:
+    """Base class for a named benchmark exposed by the benchmark command"""
+    name = None
+    help = ''
+
+    def add_arguments(self, parser):
+        """Register benchmark-specific command line options"""
+
+    def run(self, out, **options):
+        """Run the benchmark, writing a report to ``out``"""
+        raise NotImplementedError
+
+
+@contextmanager
+def rolled_back():
+    """Run the enclosed block in a transaction that is always rolled back"""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def measure(func, repeat=1):
+    """Call ``func`` ``repeat`` times and return the elapsed seconds of each call"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def percentile(samples, pct):
+    """Return the pct-th percentile (0-100) of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def format_latency(samples):
+    """Summarise latency samples (seconds) as p50/p95/p99 in milliseconds"""
+    return 'p50={:.2f}ms p95={:.2f}ms p99={:.2f}ms'.format(
+        percentile(samples, 50) * 1000,
+        percentile(samples, 95) * 1000,
+        percentile(samples, 99) * 1000,
+    )
+
+
+def get_benchmarks():
+    """Return the registered benchmarks keyed by name"""
+    from .amenities import AmenityBenchmark
+    from .api import ApiBenchmark
+    from .availability import AvailabilityBenchmark
+    from .batch import BatchBenchmark
+    from .callbacks import CallbackBenchmark
+    from .chapa import ChapaBenchmark
+    from .concurrency import ConcurrencyBenchmark
+    from .emails import EmailBenchmark
+    from .exports import ExportBenchmark
+    from .reservations import ReservationBenchmark
+    from .search import SearchBenchmark
+    from .visibility import VisibilityBenchmark
+
+    benchmarks = [
+        AmenityBenchmark,
+        ApiBenchmark,
+        AvailabilityBenchmark,
+        BatchBenchmark,
+        CallbackBenchmark,
+        ChapaBenchmark,
+        ConcurrencyBenchmark,
+        EmailBenchmark,
+        ExportBenchmark,
+        ReservationBenchmark,
+        SearchBenchmark,
+        VisibilityBenchmark,
+    ]
+    return {benchmark.name: benchmark() for benchmark in benchmarks}
@@ -0,0 +1,84 @@
+"""
+Multi-amenity filtering: amenity index vs substring matches on the text field
+"""
+import random
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db.models import Q
+
+from listings.amenities import filter_amenities, parse_amenities, rebuild_amenity_index
+from listings.models import Listing
+
+from . import Benchmark, format_latency, measure, rolled_back
+
+# (name, share of listings offering it)
+AMENITIES = (
+    ('WiFi', 0.9), ('Kitchen', 0.7), ('Parking', 0.5), ('Air Conditioning', 0.4), ('Washer', 0.35),
+    ('Pool', 0.15), ('Pool Table', 0.05), ('Gym', 0.1), ('Hot Tub', 0.08), ('Beach Access', 0.06),
+    ('Fireplace', 0.07), ('Pet Friendly', 0.2), ('Workspace', 0.25), ('EV Charger', 0.03), ('Sauna', 0.02),
+)
+
+
+def filter_amenities_by_substring(queryset, slugs):
+    """The pre-index approach: every amenity name must appear in the text"""
+    names = dict((slug, name) for name, _ in AMENITIES for slug in parse_amenities(name))
+    condition = Q()
+    for slug in slugs:
+        condition &= Q(amenities__icontains=names[slug])
+    return queryset.filter(condition)
+
+
+class AmenityBenchmark(Benchmark):
+    name = 'amenities'
+    help = 'Compare multi-amenity filtering through the amenity index with substring matches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=1000000)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def run(self, out, **options):
+        rng = random.Random(options['seed'])
+        with rolled_back():
+            self.populate(out, rng, options)
+
+            filters = (['wifi'], ['wifi', 'pool'], ['wifi', 'pool', 'parking'], ['sauna', 'hot-tub'])
+            listings = Listing.objects.filter(is_available=True)
+            for slugs in filters:
+                for label, apply in (('index', filter_amenities), ('substring', filter_amenities_by_substring)):
+                    queryset = apply(listings, slugs)
+                    page = measure(lambda: list(queryset.values_list('pk', flat=True)[:20]), options['repeat'])
+                    count = measure(queryset.count, options['repeat'])
+                    out.write(
+                        f"{','.join(slugs):>20} {label:>9} matches={queryset.count():>7} "
+                        f'first page: {format_latency(page)} | count: {format_latency(count)}'
+                    )
+
+    def populate(self, out, rng, options):
+        """Insert listings with random amenity strings, then build the index"""
+        host = User.objects.create(username=f'bench-host-{uuid.uuid4().hex[:8]}')
+        batch_size = options['batch_size']
+        created = 0
+        while created < options['listings']:
+            count = min(batch_size, options['listings'] - created)
+            Listing.objects.bulk_create([
+                Listing(
+                    listing_id=uuid.UUID(int=rng.getrandbits(128)),
+                    title=f'Benchmark listing {created + i}',
+                    description='Benchmark data',
+                    price_per_night=Decimal('100.00'),
+                    location='Benchmark',
+                    amenities=', '.join(name for name, share in AMENITIES if rng.random() < share),
+                    host=host,
+                )
+                for i in range(count)
+            ], batch_size=batch_size)
+            created += count
+            out.write(f'  {created} listings...')
+
+        # bulk_create skips the save signal that maintains the index
+        indexed = rebuild_amenity_index(batch_size=batch_size)
+        out.write(f'Created {created} listings with {indexed} amenity entries')
@@ -0,0 +1,381 @@
+"""
+Latency, SQL queries and response size of every API route
+
+Each route registered in listings.urls is requested through the full
+middleware stack against synthetic datasets (see listings.synthetic) of the
+sizes given, and the results are compared with the baseline file committed
+next to this module. A route regresses when it issues more queries than the
+baseline allows, or when its median latency or response size grows by more
+than the threshold.
+
+Every request runs in a savepoint that is rolled back, so writes such as
+cancel or DELETE see the same rows on every repetition. Chapa calls go to a
+local stub server and the listing response cache is bypassed, so each
+request does its full database work.
+"""
+import json
+import os
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import override_settings
+from django.urls import URLPattern, reverse
+from rest_framework.test import APIClient
+
+from listings.chapa_utils import reset_chapa_client
+from listings.models import Booking, Listing, Payment, Review
+from listings.ratings import apply_review_delta
+from listings.synthetic import (
+    create_listing_chunk,
+    create_user_chunk,
+    finish_synthetic_data,
+    listing_chunks,
+    plan_synthetic_data,
+    user_chunks,
+)
+
+from . import Benchmark, format_latency, percentile, rolled_back
+from .chapa import StubChapaServer
+
+BASELINE_PATH = Path(__file__).with_name('api_baseline.json')
+
+# Median latency may exceed the baseline by this much on top of the threshold,
+# so sub-millisecond routes don't fail on timer noise
+LATENCY_SLACK_MS = 1.0
+
+LISTING_DATA = {
+    'title': 'Benchmark Loft',
+    'description': 'Two bedrooms near the market',
+    'price_per_night': '120.00',
+    'location': 'Nairobi',
+    'amenities': 'WiFi, Kitchen, Workspace',
+}
+
+
+class Route:
+    """
+    One method of one URL in the API
+
+    ``pk`` names the probe row the URL points at (see create_probe), and
+    string values in ``params`` and ``data`` may reference probe ids and
+    dates as {listing}, {check_in} and so on. ``user`` is 'guest', 'host',
+    'admin' or None for an anonymous request.
+    """
+
+    def __init__(self, url_name, method, user=None, pk=None, params=None, data=None, status=200):
+        self.url_name = url_name
+        self.method = method
+        self.user = user
+        self.pk = pk
+        self.params = params or {}
+        self.data = data
+        self.status = status
+
+    @property
+    def name(self):
+        return f'{self.method.upper()} {self.url_name}'
+
+
+PAGE = {'page_size': 20}
+
+ROUTES = [
+    Route('listing-list', 'get', params=PAGE),
+    Route('listing-list', 'post', user='host', data=LISTING_DATA, status=201),
+    Route('listing-detail', 'get', pk='listing'),
+    Route('listing-detail', 'put', user='host', pk='listing', data=LISTING_DATA),
+    Route('listing-detail', 'patch', user='host', pk='listing', data={'price_per_night': '95.00'}),
+    Route('listing-detail', 'delete', user='host', pk='listing', status=204),
+    Route('listing-reviews', 'get', pk='listing', params=PAGE),
+    Route('listing-my-listings', 'get', user='host', params=PAGE),
+    Route('listing-available', 'get', params=PAGE),
+    Route('listing-cache-stats', 'get', user='admin'),
+    Route('booking-list', 'get', user='guest', params=PAGE),
+    Route('booking-list', 'post', user='guest', status=201, data={
+        'listing_id': '{spare}', 'check_in_date': '{check_in}', 'check_out_date': '{check_out}',
+    }),
+    Route('booking-batch', 'post', user='guest', status=201, data={'bookings': [
+        {'listing_id': '{listing}', 'check_in_date': '{check_in}', 'check_out_date': '{check_out}'},
+        {'listing_id': '{spare}', 'check_in_date': '{check_in}', 'check_out_date': '{check_out}'},
+    ]}),
+    Route('booking-detail', 'get', user='guest', pk='booking'),
+    Route('booking-detail', 'put', user='guest', pk='booking', data={
+        'listing_id': '{listing}', 'check_in_date': '{check_in}', 'check_out_date': '{check_out}',
+    }),
+    Route('booking-detail', 'patch', user='guest', pk='booking', data={
+        'check_in_date': '{check_in}', 'check_out_date': '{check_out}',
+    }),
+    Route('booking-detail', 'delete', user='guest', pk='booking', status=204),
+    Route('booking-my-bookings', 'get', user='guest', params=PAGE),
+    Route('booking-export', 'get', user='host'),
+    Route('booking-cancel', 'patch', user='guest', pk='booking'),
+    Route('booking-confirm', 'patch', user='host', pk='booking'),
+    Route('booking-initiate-payment', 'post', user='guest', pk='booking'),
+    Route('review-list', 'get', params=PAGE),
+    Route('review-list', 'post', user='guest', status=201, data={
+        'listing_id': '{spare}', 'rating': 4, 'comment': 'Quiet and clean.',
+    }),
+    Route('review-detail', 'get', pk='review'),
+    Route('review-detail', 'put', user='guest', pk='review', data={'rating': 3, 'comment': 'Fine.'}),
+    Route('review-detail', 'patch', user='guest', pk='review', data={'rating': 5}),
+    Route('review-detail', 'delete', user='guest', pk='review', status=204),
+    Route('payment-list', 'get', user='guest', params=PAGE),
+    Route('payment-list', 'post', user='guest', status=201, data={'booking_id': '{booking}', 'amount': '240.00'}),
+    Route('payment-detail', 'get', user='guest', pk='payment'),
+    Route('payment-detail', 'put', user='guest', pk='payment', data={'amount': '240.00', 'currency': 'ETB'}),
+    Route('payment-detail', 'patch', user='guest', pk='payment', data={'currency': 'ETB'}),
+    Route('payment-detail', 'delete', user='guest', pk='payment', status=204),
+    Route('payment-export', 'get', user='host'),
+    Route('payment-chapa-breaker', 'get', user='admin'),
+    Route('payment-verify-status', 'post', user='guest', pk='payment'),
+    Route('payment-verify', 'post', data={'tx_ref': '{payment}'}, status=202),
+    Route('analytics-host', 'get', user='host'),
+]
+
+
+def registered_routes():
+    """Return (url name, method) for every viewset route in listings.urls"""
+    from listings.urls import router
+
+    routes = set()
+    for pattern in router.urls:
+        actions = getattr(pattern.callback, 'actions', None)
+        if isinstance(pattern, URLPattern) and actions:
+            routes.update((pattern.name, method) for method in actions)
+    return routes
+
+
+class QueryCounter:
+    """Database execute wrapper counting the statements a request issues"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def create_dataset(listings, seed=42):
+    """Generate a synthetic dataset with a quarter as many users as listings"""
+    plan = plan_synthetic_data(max(2, listings // 4), listings, seed=seed)
+    for index in user_chunks(plan):
+        create_user_chunk(plan, index)
+    for index in listing_chunks(plan):
+        create_listing_chunk(plan, index)
+    finish_synthetic_data()
+
+
+def create_probe():
+    """
+    Create the rows routes point at, owned by the busiest users
+
+    The guest is the user with the most bookings and the host the user with
+    the most listings, so their list routes return full pages.
+    """
+    guest = User.objects.annotate(stays=Count('bookings')).order_by('-stays', 'pk').first()
+    host = (
+        User.objects.exclude(pk=guest.pk).annotate(owned=Count('listings')).order_by('-owned', 'pk').first()
+    )
+    admin = User.objects.create(username=f'api-benchmark-admin-{host.pk}', is_staff=True)
+
+    listing, spare = [
+        Listing.objects.create(host=host, **{**LISTING_DATA, 'price_per_night': Decimal('120.00')})
+        for _ in range(2)
+    ]
+    check_in = date.today() + timedelta(days=400)
+    booking = Booking.objects.create(
+        listing=listing,
+        guest=guest,
+        check_in_date=check_in,
+        check_out_date=check_in + timedelta(days=2),
+        total_price=Decimal('240.00'),
+    )
+    payment = Payment.objects.create(booking=booking, amount=booking.total_price)
+    Payment.objects.filter(pk=payment.pk).update(chapa_reference=str(payment.pk))
+    review = Review.objects.create(listing=listing, reviewer=guest, rating=4, comment='Lovely stay.')
+    apply_review_delta(listing.pk, added=review.rating)
+    return {
+        'users': {'guest': guest, 'host': host, 'admin': admin},
+        'values': {
+            'listing': str(listing.pk),
+            'spare': str(spare.pk),
+            'booking': str(booking.pk),
+            'payment': str(payment.pk),
+            'review': str(review.pk),
+            'check_in': str(check_in + timedelta(days=10)),
+            'check_out': str(check_in + timedelta(days=13)),
+        },
+    }
+
+
+def fill(value, values):
+    if isinstance(value, str):
+        return value.format(**values)
+    if isinstance(value, list):
+        return [fill(item, values) for item in value]
+    if isinstance(value, dict):
+        return {key: fill(item, values) for key, item in value.items()}
+    return value
+
+
+def request_route(client, route, probe):
+    """Send one request for a route and return the response"""
+    values = probe['values']
+    kwargs = {'pk': values[route.pk]} if route.pk else {}
+    path = reverse(route.url_name, kwargs=kwargs)
+    client.force_authenticate(user=probe['users'][route.user] if route.user else None)
+    if route.method == 'get':
+        params = {key: fill(value, values) for key, value in route.params.items()}
+        return client.get(path, params)
+    data = fill(route.data or {}, values)
+    return getattr(client, route.method)(path, data, format='json')
+
+
+def run_route(client, route, probe, repeat):
+    """
+    Time ``repeat`` requests of a route, each rolled back afterwards
+
+    Returns:
+        dict: Latency samples in seconds, and the queries and response bytes
+        of the last request
+    """
+    samples = []
+    counter = QueryCounter()
+    # The first request warms per-process caches and is not counted
+    for attempt in range(repeat + 1):
+        counter.count = 0
+        with rolled_back(), connection.execute_wrapper(counter):
+            started = time.perf_counter()
+            response = request_route(client, route, probe)
+            # Streamed responses run their queries while the body is read
+            body = b''.join(response.streaming_content) if response.streaming else response.content
+            elapsed = time.perf_counter() - started
+        if response.status_code != route.status:
+            raise CommandError(
+                f'{route.name} returned {response.status_code}, expected {route.status}: {body[:200]!r}'
+            )
+        if attempt:
+            samples.append(elapsed)
+    return {'samples': samples, 'queries': counter.count, 'bytes': len(body)}
+
+
+def summarize(result):
+    """Baseline entry for a route's results"""
+    samples = result['samples']
+    return {
+        'p50_ms': round(percentile(samples, 50) * 1000, 2),
+        'p95_ms': round(percentile(samples, 95) * 1000, 2),
+        'queries': result['queries'],
+        'bytes': result['bytes'],
+    }
+
+
+def find_regressions(current, baseline, threshold):
+    """
+    Compare a route's summary with its baseline entry
+
+    Returns:
+        list: Descriptions of each metric over its budget
+    """
+    regressions = []
+    if current['queries'] > baseline['queries']:
+        regressions.append(f"queries {baseline['queries']} -> {current['queries']}")
+    latency_budget = baseline['p50_ms'] * (1 + threshold) + LATENCY_SLACK_MS
+    if current['p50_ms'] > latency_budget:
+        regressions.append(f"p50 {baseline['p50_ms']:.2f}ms -> {current['p50_ms']:.2f}ms")
+    if current['bytes'] > baseline['bytes'] * (1 + threshold):
+        regressions.append(f"bytes {baseline['bytes']} -> {current['bytes']}")
+    return regressions
+
+
+def load_baseline(path):
+    try:
+        with open(path) as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return {}
+
+
+def write_baseline(path, baseline):
+    with open(path, 'w') as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write('\n')
+
+
+class ApiBenchmark(Benchmark):
+    name = 'api'
+    help = 'Measure every API route against synthetic datasets and compare with the stored baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[100, 1000],
+            help='Number of listings in each dataset',
+        )
+        parser.add_argument('--repeat', type=int, default=20, help='Requests timed per route')
+        parser.add_argument(
+            '--route', action='append', choices=sorted({route.name for route in ROUTES}),
+            help='Only run the named route (repeatable)',
+        )
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the datasets')
+        parser.add_argument('--baseline', default=str(BASELINE_PATH), help='Baseline file to compare with')
+        parser.add_argument(
+            '--threshold', type=float, default=0.5,
+            help='Allowed growth of median latency and response size, as a fraction of the baseline',
+        )
+        parser.add_argument(
+            '--update-baseline', action='store_true',
+            help='Record the results as the new baseline instead of comparing',
+        )
+
+    def run(self, out, **options):
+        routes = [route for route in ROUTES if not options['route'] or route.name in options['route']]
+        baseline = load_baseline(options['baseline'])
+        server = StubChapaServer()
+        regressions = []
+
+        with server, mock.patch.dict(os.environ, {
+            'CHAPA_SECRET_KEY': os.environ.get('CHAPA_SECRET_KEY', 'CHASECK_TEST-benchmark'),
+            'CHAPA_API_URL': server.url,
+        }), override_settings(LISTING_CACHE_ENABLED=False, ALLOWED_HOSTS=['testserver']):
+            reset_chapa_client()
+            try:
+                for size in options['sizes']:
+                    with rolled_back():
+                        create_dataset(size, seed=options['seed'])
+                        probe = create_probe()
+                        client = APIClient()
+                        out.write(f'{size} listings:')
+
+                        for route in routes:
+                            result = run_route(client, route, probe, options['repeat'])
+                            current = summarize(result)
+                            line = (
+                                f"  {route.name:<34} {format_latency(result['samples'])} "
+                                f"queries={current['queries']} bytes={current['bytes']}"
+                            )
+                            expected = baseline.get(str(size), {}).get(route.name)
+                            if options['update_baseline']:
+                                baseline.setdefault(str(size), {})[route.name] = current
+                            elif expected is None:
+                                line += ' (no baseline)'
+                            else:
+                                problems = find_regressions(current, expected, options['threshold'])
+                                if problems:
+                                    line += f" REGRESSED: {', '.join(problems)}"
+                                    regressions.append(f'{route.name} at {size} listings')
+                            out.write(line)
+            finally:
+                reset_chapa_client()
+
+        if options['update_baseline']:
+            write_baseline(options['baseline'], baseline)
+            out.write(f"Baseline written to {options['baseline']}")
+        elif regressions:
+            raise CommandError(f"{len(regressions)} route(s) regressed: {'; '.join(regressions)}")
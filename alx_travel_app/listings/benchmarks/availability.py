@@ -0,0 +1,114 @@
+"""
+Date-range availability search: availability index vs scanning bookings
+"""
+import random
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+
+from listings.availability import HOLDING_STATUSES, booked_nights_for, filter_available
+from listings.models import Booking, BookedNight, Listing
+
+from . import Benchmark, format_latency, measure, rolled_back
+
+
+def filter_available_by_scan(queryset, check_in, check_out):
+    """The pre-index approach: exclude listings with an overlapping booking"""
+    overlapping = Booking.objects.filter(
+        status__in=HOLDING_STATUSES,
+        check_in_date__lt=check_out,
+        check_out_date__gt=check_in,
+    ).values('listing_id')
+    return queryset.exclude(pk__in=overlapping)
+
+
+class AvailabilityBenchmark(Benchmark):
+    name = 'availability'
+    help = 'Compare availability search through the index with scanning bookings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=100000)
+        parser.add_argument('--bookings', type=int, default=5000000)
+        parser.add_argument('--queries', type=int, default=100)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def run(self, out, **options):
+        rng = random.Random(options['seed'])
+        with rolled_back():
+            start = self.populate(out, rng, options)
+            horizon = (options['bookings'] // max(options['listings'], 1)) * 4 + 7
+
+            stays = []
+            for _ in range(options['queries']):
+                check_in = start + timedelta(days=rng.randrange(horizon))
+                stays.append((check_in, check_in + timedelta(days=rng.randint(1, 7))))
+
+            listings = Listing.objects.all()
+            for label, search in (('index', filter_available), ('scan', filter_available_by_scan)):
+                page_samples = []
+                count_samples = []
+                for check_in, check_out in stays:
+                    queryset = search(listings, check_in, check_out)
+                    page_samples += measure(lambda: list(queryset.values_list('pk', flat=True)[:20]))
+                    count_samples += measure(queryset.count)
+                out.write(f'{label:>6} first page: {format_latency(page_samples)}')
+                out.write(f'{label:>6} full count: {format_latency(count_samples)}')
+
+    def populate(self, out, rng, options):
+        """Insert listings with back-to-back, non-overlapping bookings"""
+        batch_size = options['batch_size']
+        host = User.objects.create(username=f'bench-host-{uuid.uuid4().hex[:8]}')
+        guest = User.objects.create(username=f'bench-guest-{uuid.uuid4().hex[:8]}')
+        start = date.today()
+
+        listings = [
+            Listing(
+                listing_id=uuid.UUID(int=rng.getrandbits(128)),
+                title=f'Benchmark listing {i}',
+                description='Benchmark data',
+                price_per_night=Decimal('100.00'),
+                location='Benchmark',
+                amenities='WiFi',
+                host=host,
+            )
+            for i in range(options['listings'])
+        ]
+        Listing.objects.bulk_create(listings, batch_size=batch_size)
+        out.write(f'Created {len(listings)} listings')
+
+        per_listing = options['bookings'] // max(len(listings), 1)
+        bookings, nights, created = [], [], 0
+        for listing in listings:
+            check_in = start
+            for _ in range(per_listing):
+                check_in += timedelta(days=rng.randint(0, 3))
+                check_out = check_in + timedelta(days=rng.randint(1, 3))
+                booking = Booking(
+                    booking_id=uuid.UUID(int=rng.getrandbits(128)),
+                    listing_id=listing.pk,
+                    guest=guest,
+                    check_in_date=check_in,
+                    check_out_date=check_out,
+                    total_price=Decimal('100.00') * (check_out - check_in).days,
+                    status=rng.choice(('pending', 'confirmed', 'cancelled')),
+                )
+                bookings.append(booking)
+                if booking.status in HOLDING_STATUSES:
+                    nights.extend(booked_nights_for(booking))
+                check_in = check_out
+
+            if len(bookings) >= batch_size:
+                Booking.objects.bulk_create(bookings, batch_size=batch_size)
+                BookedNight.objects.bulk_create(nights, batch_size=batch_size)
+                created += len(bookings)
+                bookings, nights = [], []
+                out.write(f'  {created} bookings...')
+
+        Booking.objects.bulk_create(bookings, batch_size=batch_size)
+        BookedNight.objects.bulk_create(nights, batch_size=batch_size)
+        created += len(bookings)
+        out.write(f'Created {created} bookings')
+        return start
@@ -0,0 +1,83 @@
+"""
+Booking throughput of POST /api/bookings/batch/ against one POST /api/bookings/ per stay
+"""
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import CommandError
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from listings.models import Listing
+
+from . import Benchmark, measure, percentile, rolled_back
+
+
+class BatchBenchmark(Benchmark):
+    name = 'batch'
+    help = 'Compare bookings per second of the batch endpoint with single booking requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=100, help='Stays per batch')
+        parser.add_argument('--listings', type=int, default=20, help='Listings the stays are spread over')
+        parser.add_argument('--rounds', type=int, default=10, help='Times each way of booking is timed')
+
+    def run(self, out, **options):
+        size = options['size']
+        with rolled_back(), override_settings(ALLOWED_HOSTS=['testserver']):
+            stays = self.populate(options)
+            client = APIClient()
+            client.force_authenticate(user=self.guest)
+
+            def singles():
+                for stay in stays:
+                    self.expect(client.post('/api/bookings/', stay, format='json'), 201)
+
+            def batch():
+                self.expect(client.post('/api/bookings/batch/', {'bookings': stays}, format='json'), 201)
+
+            rates = {}
+            for label, func in (('single', singles), ('batch', batch)):
+                # Each round books the same stays, so it is rolled back; the first warms up
+                samples = [self.timed(func) for _ in range(options['rounds'] + 1)][1:]
+                elapsed = percentile(samples, 50)
+                rates[label] = size / elapsed
+                out.write(f'{label:>6}: {size} bookings in p50={elapsed * 1000:.1f}ms, {rates[label]:.0f} bookings/s')
+            out.write(f"Batch throughput: {rates['batch'] / rates['single']:.1f}x single requests")
+
+    def timed(self, func):
+        with rolled_back():
+            return measure(func)[0]
+
+    def expect(self, response, status):
+        if response.status_code != status:
+            raise CommandError(f'Expected {status}, got {response.status_code}: {response.content[:200]!r}')
+
+    def populate(self, options):
+        """Create a guest and the listings, and return non-overlapping one-night stays over them"""
+        tag = uuid.uuid4().hex[:8]
+        host = User.objects.create(username=f'bench-host-{tag}')
+        self.guest = User.objects.create(username=f'bench-guest-{tag}')
+        listings = Listing.objects.bulk_create([
+            Listing(
+                title=f'Benchmark listing {i}',
+                description='Benchmark data',
+                price_per_night=Decimal('100.00'),
+                location='Benchmark',
+                amenities='WiFi',
+                host=host,
+            )
+            for i in range(options['listings'])
+        ])
+        start = date.today() + timedelta(days=30)
+        stays = []
+        for i in range(options['size']):
+            check_in = start + timedelta(days=i // len(listings))
+            stays.append({
+                'listing_id': str(listings[i % len(listings)].pk),
+                'check_in_date': check_in.isoformat(),
+                'check_out_date': (check_in + timedelta(days=1)).isoformat(),
+            })
+        return stays
@@ -0,0 +1,94 @@
+"""
+Payment callback latency: acknowledge-then-verify vs verifying inline
+"""
+import os
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from rest_framework.test import APIRequestFactory
+
+from listings.callbacks import process_callback
+from listings.chapa_utils import ChapaAPIClient
+from listings.models import Booking, Listing, Payment
+from listings.views import PaymentViewSet
+
+from . import Benchmark, format_latency, measure, rolled_back
+from .chapa import StubChapaServer
+
+
+class CallbackBenchmark(Benchmark):
+    name = 'callbacks'
+    help = 'Measure callback response latency against a slow Chapa stub'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--callbacks', type=int, default=200)
+        parser.add_argument(
+            '--chapa-ms', type=float, default=250.0,
+            help='Simulated Chapa verify response time',
+        )
+
+    def run(self, out, **options):
+        server = StubChapaServer(response_latency=options['chapa_ms'] / 1000)
+        with server, rolled_back(), mock.patch.dict(os.environ, {
+            'CHAPA_SECRET_KEY': os.environ.get('CHAPA_SECRET_KEY', 'CHASECK_TEST-benchmark'),
+            'CHAPA_API_URL': server.url,
+        }):
+            tx_refs = self.populate(options['callbacks'])
+            view = PaymentViewSet.as_view({'post': 'verify'}, **PaymentViewSet.verify.kwargs)
+            factory = APIRequestFactory()
+
+            def callback(tx_ref):
+                request = factory.post('/api/payments/verify/', {'tx_ref': tx_ref}, format='json')
+                response = view(request)
+                if response.status_code not in (200, 202):
+                    raise RuntimeError(response.data)
+
+            # Inside the rolled-back transaction on_commit never fires, so only the ack is timed
+            new = []
+            for tx_ref in tx_refs:
+                new += measure(lambda: callback(tx_ref))
+            duplicate = []
+            for tx_ref in tx_refs:
+                duplicate += measure(lambda: callback(tx_ref))
+            out.write(f'      new callback ack: {format_latency(new)}')
+            out.write(f'duplicate callback ack: {format_latency(duplicate)}')
+
+            # What each callback used to cost: verifying with Chapa before responding
+            client = ChapaAPIClient()
+            inline = []
+            for tx_ref in tx_refs[:max(len(tx_refs) // 10, 1)]:
+                inline += measure(lambda: process_callback(tx_ref, client=client))
+            client.close()
+            out.write(f'   inline verification: {format_latency(inline)}')
+
+    def populate(self, count):
+        """Create one pending payment per callback"""
+        tag = uuid.uuid4().hex[:8]
+        host = User.objects.create(username=f'bench-host-{tag}')
+        guest = User.objects.create(username=f'bench-guest-{tag}')
+        listing = Listing.objects.create(
+            title='Benchmark listing',
+            description='Benchmark data',
+            price_per_night=Decimal('100.00'),
+            location='Benchmark',
+            amenities='WiFi',
+            host=host,
+        )
+        start = date.today()
+        bookings = Booking.objects.bulk_create([
+            Booking(
+                listing=listing,
+                guest=guest,
+                check_in_date=start + timedelta(days=2 * i),
+                check_out_date=start + timedelta(days=2 * i + 1),
+                total_price=Decimal('100.00'),
+            )
+            for i in range(count)
+        ])
+        payments = Payment.objects.bulk_create([
+            Payment(booking=booking, amount=booking.total_price) for booking in bookings
+        ])
+        return [str(payment.payment_id) for payment in payments]
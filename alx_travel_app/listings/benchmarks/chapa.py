@@ -0,0 +1,188 @@
+"""
+Chapa API latency with a pooled keep-alive session vs a connection per call
+"""
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+
+from listings.chapa_utils import ChapaAPIClient, build_chapa_session
+
+from . import Benchmark, format_latency
+
+
+class StubChapaHandler(BaseHTTPRequestHandler):
+    """Answers initialize and verify requests like the Chapa API"""
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately; don't let Nagle hold the body back
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        # Stand-in for the TCP + TLS handshake a real connection pays once
+        time.sleep(server.handshake_latency)
+
+    def do_GET(self):
+        reference = self.path.rstrip('/').rsplit('/', 1)[-1]
+        self.respond({
+            'status': 'success',
+            'message': 'Payment details',
+            'data': {
+                'status': self.server.verify_statuses.get(reference, 'success'),
+                'amount': '100.00',
+                'currency': 'ETB',
+                'reference': f'CHAPA-{reference}',
+                'tx_ref': reference,
+                'method': 'telebirr',
+            },
+        })
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        self.respond({
+            'status': 'success',
+            'message': 'Hosted Link',
+            'data': {
+                'checkout_url': f"https://checkout.chapa.co/{payload.get('tx_ref')}",
+                'tx_ref': payload.get('tx_ref'),
+            },
+        })
+
+    def respond(self, body):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            status = server.fail_statuses.pop(0) if server.fail_statuses else server.fault_status or 200
+        time.sleep(server.response_latency)
+        if server.drop_connections:
+            # Hang up without answering, like a crashed upstream
+            self.close_connection = True
+            return
+
+        data = json.dumps(body if status == 200 else {'status': 'failed', 'message': 'Unavailable'}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubChapaServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Chapa API, run in a background thread
+
+    Counts connections and requests, and can answer the next requests with
+    error statuses to exercise retries. Verified transactions succeed unless
+    verify_statuses maps their reference to another Chapa status.
+
+    Faults for the circuit breaker: while fault_status is set every request
+    is answered with it, while drop_connections is set connections are
+    closed without an answer, and response_latency can be raised at any time.
+    """
+    daemon_threads = True
+    # Accept backlog; the async benchmark opens many connections at once
+    request_queue_size = 128
+
+    def __init__(self, handshake_latency=0.0, response_latency=0.0):
+        super().__init__(('127.0.0.1', 0), StubChapaHandler)
+        self.handshake_latency = handshake_latency
+        self.response_latency = response_latency
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.fail_statuses = []
+        self.fault_status = None
+        self.drop_connections = False
+        self.verify_statuses = {}
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f'http://{host}:{port}/v1'
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class UnpooledSession:
+    """Session stand-in that opens a new connection per call, like bare requests.get/post"""
+
+    def __init__(self):
+        self.headers = {}
+
+    def get(self, url, **kwargs):
+        return requests.get(url, headers=self.headers, **kwargs)
+
+    def post(self, url, **kwargs):
+        return requests.post(url, headers=self.headers, **kwargs)
+
+    def close(self):
+        pass
+
+
+class ChapaBenchmark(Benchmark):
+    name = 'chapa'
+    help = 'Compare Chapa verify latency with and without a pooled keep-alive session'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=500)
+        parser.add_argument('--clients', type=int, default=8)
+        parser.add_argument(
+            '--handshake-ms', type=float, default=20.0,
+            help='Simulated TCP + TLS setup time per new connection',
+        )
+        parser.add_argument('--response-ms', type=float, default=2.0)
+
+    def run(self, out, **options):
+        server = StubChapaServer(
+            handshake_latency=options['handshake_ms'] / 1000,
+            response_latency=options['response_ms'] / 1000,
+        )
+        with server, mock.patch.dict(os.environ, {
+            'CHAPA_SECRET_KEY': os.environ.get('CHAPA_SECRET_KEY', 'CHASECK_TEST-benchmark'),
+            'CHAPA_API_URL': server.url,
+        }):
+            for label, session in (
+                ('unpooled', UnpooledSession()),
+                ('pooled', build_chapa_session(pool_size=options['clients'])),
+            ):
+                client = ChapaAPIClient(session=session)
+                connections = server.connections
+                samples = self.run_clients(client, options['clients'], options['calls'])
+                client.close()
+                out.write(
+                    f'{label:>8} verify: {format_latency(samples)} '
+                    f'connections={server.connections - connections}'
+                )
+
+    def run_clients(self, client, clients, calls):
+        """Verify ``calls`` references from ``clients`` threads sharing one client"""
+        def verify(i):
+            started = time.perf_counter()
+            result = client.verify_payment(f'bench-{i}')
+            if not result['success']:
+                raise RuntimeError(result['error'])
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            return list(pool.map(verify, range(calls)))
@@ -0,0 +1,161 @@
+"""
+Payment initiations in flight against a slow Chapa: WSGI workers vs the ASGI path
+
+A burst of initiations arrives at once while Chapa takes --response-ms to
+answer. The sync run serves them through the WSGI handler on a fixed pool
+of worker threads, as gunicorn's sync workers would; the async run sends
+them all to the async views through the ASGI application on one event loop.
+In both, one listing request arrives just after the burst, to show whether
+browsing still gets served while Chapa is slow.
+
+Views run their database work on their own threads, which need committed
+rows, so this benchmark cleans up after itself instead of rolling back.
+Point it at a database that threads can share (not in-memory SQLite).
+"""
+import asyncio
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+
+import httpx
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.test import Client
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from listings.chapa_async import get_async_chapa_client, reset_async_chapa_clients
+from listings.chapa_utils import reset_chapa_client
+from listings.models import Booking, Listing
+
+from . import Benchmark, format_latency
+from .chapa import StubChapaServer
+
+
+class ConcurrencyBenchmark(Benchmark):
+    name = 'concurrency'
+    help = 'Compare payment initiations under a slow Chapa through sync WSGI workers and the async views'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=400, help='Initiations arriving at once')
+        parser.add_argument('--workers', type=int, default=8, help='WSGI worker threads for the sync run')
+        parser.add_argument('--response-ms', type=float, default=500.0, help='Time Chapa takes to answer')
+
+    def run(self, out, **options):
+        payments = options['payments']
+        server = StubChapaServer(response_latency=options['response_ms'] / 1000)
+        with server, mock.patch.dict(os.environ, {
+            'CHAPA_SECRET_KEY': os.environ.get('CHAPA_SECRET_KEY', 'CHASECK_TEST-benchmark'),
+            'CHAPA_API_URL': server.url,
+        }), override_settings(LISTING_CACHE_ENABLED=False, ALLOWED_HOSTS=['testserver']):
+            reset_chapa_client()
+            host, guest, token, bookings = self.populate(payments * 2)
+            try:
+                out.write(f"{payments} payment initiations at once, Chapa answering in {options['response_ms']:.0f}ms")
+                self.report(out, f"sync ({options['workers']} WSGI workers)", self.run_sync(
+                    token, bookings[:payments], options['workers'],
+                ))
+                self.report(out, (
+                    f'async (ASGI, {settings.CHAPA_ASYNC_MAX_CONNECTIONS} Chapa connections, '
+                    f'{settings.ASYNC_ORM_THREADS} ORM threads)'
+                ), asyncio.run(self.run_async(token, bookings[payments:])))
+            finally:
+                reset_chapa_client()
+                Listing.objects.filter(host=host).delete()
+                User.objects.filter(pk__in=[host.pk, guest.pk]).delete()
+
+    def populate(self, count):
+        """A guest with ``count`` unpaid bookings, and the guest's API token"""
+        tag = uuid.uuid4().hex[:8]
+        host = User.objects.create(username=f'bench-host-{tag}')
+        guest = User.objects.create(username=f'bench-guest-{tag}', email=f'bench-guest-{tag}@example.com')
+        listing = Listing.objects.create(
+            title='Benchmark listing',
+            description='Benchmark data',
+            price_per_night=Decimal('100.00'),
+            location='Benchmark',
+            amenities='WiFi',
+            host=host,
+        )
+        start = date.today() + timedelta(days=1)
+        bookings = Booking.objects.bulk_create([
+            Booking(
+                listing=listing,
+                guest=guest,
+                check_in_date=start + timedelta(days=2 * i),
+                check_out_date=start + timedelta(days=2 * i + 1),
+                total_price=Decimal('100.00'),
+            )
+            for i in range(count)
+        ])
+        return host, guest, Token.objects.create(user=guest).key, [booking.pk for booking in bookings]
+
+    def report(self, out, label, result):
+        latencies, elapsed, probe, failures = result
+        out.write(
+            f'{label}:\n'
+            f'  makespan={elapsed:.2f}s throughput={len(latencies) / elapsed:.1f} payments/s failures={failures}\n'
+            f'  payment latency {format_latency(latencies)}\n'
+            f'  listing request during the burst: {probe * 1000:.0f}ms'
+        )
+
+    def run_sync(self, token, bookings, workers):
+        """Queue every initiation, then a listing request, on a pool of WSGI worker threads"""
+        local = threading.local()
+        started = time.perf_counter()
+
+        def request(method, path, **headers):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            response = getattr(local.client, method)(path, **headers)
+            return time.perf_counter() - started, response.status_code
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(
+                    request, 'post', f'/api/bookings/{pk}/initiate_payment/', HTTP_AUTHORIZATION=f'Token {token}'
+                )
+                for pk in bookings
+            ]
+            probe = pool.submit(request, 'get', '/api/listings/', QUERY_STRING='fields=title')
+            results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - started
+        return (
+            [latency for latency, _ in results], elapsed, probe.result()[0],
+            sum(status != 200 for _, status in results),
+        )
+
+    async def run_async(self, token, bookings):
+        """Send every initiation, then a listing request, to the ASGI application at once"""
+        transport = httpx.ASGITransport(app=get_asgi_application())
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver', timeout=None) as client:
+            started = time.perf_counter()
+
+            async def request(method, path, **kwargs):
+                response = await client.request(method, path, **kwargs)
+                return time.perf_counter() - started, response.status_code
+
+            initiations = [
+                asyncio.create_task(request(
+                    'POST', f'/api/async/bookings/{pk}/initiate_payment/',
+                    headers={'Authorization': f'Token {token}'},
+                ))
+                for pk in bookings
+            ]
+            probe = asyncio.create_task(request('GET', '/api/listings/', params={'fields': 'title'}))
+            results = await asyncio.gather(*initiations)
+            elapsed = time.perf_counter() - started
+            probe_latency, _ = await probe
+
+        await get_async_chapa_client().aclose()
+        reset_async_chapa_clients()
+        return (
+            [latency for latency, _ in results], elapsed, probe_latency,
+            sum(status != 200 for _, status in results),
+        )
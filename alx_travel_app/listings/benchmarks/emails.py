@@ -0,0 +1,121 @@
+"""
+Payment email throughput: one connection per email vs the batched outbox
+"""
+import time
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.test.utils import override_settings
+
+from listings.email_tasks import drain_email_outbox, queue_payment_email, send_payment_confirmation_email
+from listings.models import Booking, Listing, Payment
+
+from . import Benchmark, format_latency, measure, rolled_back
+
+# Connection setup cost applied by SimulatedSMTPBackend, in seconds
+CONNECT_LATENCY = {'value': 0.0}
+
+
+class SimulatedSMTPBackend(locmem.EmailBackend):
+    """Locmem backend that pays a fixed cost per connection, like an SMTP handshake"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.opened = False
+
+    def open(self):
+        if self.opened:
+            return False
+        time.sleep(CONNECT_LATENCY['value'])
+        self.opened = True
+        return True
+
+    def close(self):
+        self.opened = False
+
+    def send_messages(self, messages):
+        # Like the SMTP backend: connect on demand and hang up if we opened the connection
+        new_connection = self.open()
+        try:
+            return super().send_messages(messages)
+        finally:
+            if new_connection:
+                self.close()
+
+
+class EmailBenchmark(Benchmark):
+    name = 'emails'
+    help = 'Compare sending payment emails inline with draining the batched outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--emails', type=int, default=500)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument(
+            '--connect-ms', type=float, default=50.0,
+            help='Simulated SMTP connection setup time per connection',
+        )
+
+    def run(self, out, **options):
+        CONNECT_LATENCY['value'] = options['connect_ms'] / 1000
+        backend = f'{SimulatedSMTPBackend.__module__}.{SimulatedSMTPBackend.__name__}'
+
+        with rolled_back(), override_settings(EMAIL_BACKEND=backend):
+            payments = self.populate(options['emails'])
+
+            mail.outbox = []
+            inline_samples = []
+            for payment in payments:
+                inline_samples += measure(lambda: send_payment_confirmation_email(payment.booking, payment))
+            inline_total = sum(inline_samples)
+            out.write(f'inline  request path: {format_latency(inline_samples)}')
+            out.write(
+                f'inline  delivered={len(mail.outbox)} '
+                f'throughput={len(payments) / inline_total:.1f} emails/s'
+            )
+
+            mail.outbox = []
+            queue_samples = []
+            for payment in payments:
+                queue_samples += measure(lambda: queue_payment_email(payment, 'confirmation'))
+            out.write(f'queued  request path: {format_latency(queue_samples)}')
+
+            started = time.perf_counter()
+            counts = drain_email_outbox(batch_size=options['batch_size'])
+            elapsed = time.perf_counter() - started
+            out.write(
+                f"batched delivered={counts['sent']} "
+                f"throughput={counts['sent'] / elapsed:.1f} emails/s"
+            )
+
+    def populate(self, count):
+        """Create one pending payment per email, sharing a listing and guest"""
+        tag = uuid.uuid4().hex[:8]
+        host = User.objects.create(username=f'bench-host-{tag}')
+        guest = User.objects.create(username=f'bench-guest-{tag}', email='guest@example.com')
+        listing = Listing.objects.create(
+            title='Benchmark listing',
+            description='Benchmark data',
+            price_per_night=Decimal('100.00'),
+            location='Benchmark',
+            amenities='WiFi',
+            host=host,
+        )
+        start = date.today()
+        bookings = Booking.objects.bulk_create([
+            Booking(
+                listing=listing,
+                guest=guest,
+                check_in_date=start + timedelta(days=2 * i),
+                check_out_date=start + timedelta(days=2 * i + 1),
+                total_price=Decimal('100.00'),
+            )
+            for i in range(count)
+        ])
+        Payment.objects.bulk_create([
+            Payment(booking=booking, amount=booking.total_price) for booking in bookings
+        ])
+        return list(Payment.objects.select_related('booking__guest', 'booking__listing').filter(booking__in=bookings))
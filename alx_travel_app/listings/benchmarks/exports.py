@@ -0,0 +1,135 @@
+"""
+Memory and throughput of the streaming booking export vs serializing a list
+"""
+import time
+import tracemalloc
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from listings.models import Booking, Listing
+from listings.serializers import BookingSerializer, optimize_for_serializer
+from listings.views import BookingViewSet
+
+from . import Benchmark, rolled_back
+
+
+def megabytes(size):
+    return size / (1024 * 1024)
+
+
+class ExportBenchmark(Benchmark):
+    name = 'exports'
+    help = 'Measure peak memory and rows/s of streaming a host booking export'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000000)
+        parser.add_argument('--output', choices=['csv', 'ndjson'], default='csv')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument(
+            '--compare-rows', type=int, default=20000,
+            help='Rows serialized as one JSON list, as my_bookings does, for comparison',
+        )
+
+    def run(self, out, **options):
+        with rolled_back():
+            host = self.populate(out, options['rows'], options['batch_size'])
+            self.stream(out, host, options['rows'], options['output'])
+            self.serialize(out, options['compare_rows'])
+
+    def populate(self, out, rows, batch_size):
+        """Insert ``rows`` bookings on one listing, one batch in memory at a time"""
+        tag = uuid.uuid4().hex[:8]
+        host = User.objects.create(username=f'bench-host-{tag}')
+        guest = User.objects.create(username=f'bench-guest-{tag}')
+        listing = Listing.objects.create(
+            title='Benchmark listing',
+            description='Benchmark data',
+            price_per_night=Decimal('100.00'),
+            location='Benchmark',
+            amenities='WiFi',
+            host=host,
+        )
+        start = date.today()
+        # Stays may overlap: the export never looks at availability
+        days = 36500
+        started = time.perf_counter()
+        for first in range(0, rows, batch_size):
+            Booking.objects.bulk_create([
+                Booking(
+                    listing=listing,
+                    guest=guest,
+                    check_in_date=start + timedelta(days=i % days),
+                    check_out_date=start + timedelta(days=i % days + 1),
+                    total_price=Decimal('100.00'),
+                    status='completed',
+                )
+                for i in range(first, min(first + batch_size, rows))
+            ])
+        out.write(f'Inserted {rows} bookings in {time.perf_counter() - started:.1f}s')
+        return host
+
+    def stream(self, out, host, rows, output):
+        """
+        Read the export response to the end, once timed and once with memory tracing
+
+        Tracing slows allocation-heavy code several times over, so
+        throughput comes from the untraced pass.
+        """
+        started = time.perf_counter()
+        written, lines = self.read_export(host, output)
+        elapsed = time.perf_counter() - started
+        exported = lines - 1 if output == 'csv' else lines
+        out.write(
+            f'Streamed {exported} rows ({megabytes(written):.0f}MB of {output}) in {elapsed:.1f}s, '
+            f'{exported / elapsed:.0f} rows/s'
+        )
+
+        checkpoints = sorted({rows * share // 10 for share in range(1, 11)})
+        tracemalloc.start()
+
+        def sample(lines):
+            while checkpoints and checkpoints[0] <= lines:
+                current, peak = tracemalloc.get_traced_memory()
+                out.write(
+                    f'  {checkpoints.pop(0):>9} rows: current={megabytes(current):.1f}MB peak={megabytes(peak):.1f}MB'
+                )
+
+        self.read_export(host, output, sample)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        out.write(f'Peak traced memory while streaming: {megabytes(peak):.1f}MB')
+
+    def read_export(self, host, output, progress=None):
+        """Return (bytes, lines) of a host's booking export"""
+        request = APIRequestFactory().get('/api/bookings/export/', {'output': output})
+        force_authenticate(request, user=host)
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            response = BookingViewSet.as_view({'get': 'export'})(request)
+        written = 0
+        lines = 0
+        for chunk in response.streaming_content:
+            written += len(chunk)
+            lines += chunk.count(b'\n')
+            if progress:
+                progress(lines)
+        return written, lines
+
+    def serialize(self, out, rows):
+        """Peak memory of rendering ``rows`` bookings as one nested JSON list"""
+        serializer = BookingSerializer()
+        bookings = optimize_for_serializer(Booking.objects.order_by('created_at'), serializer)[:rows]
+        tracemalloc.start()
+        started = time.perf_counter()
+        JSONRenderer().render(BookingSerializer(bookings, many=True).data)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        out.write(
+            f'Serialized {rows} rows as a JSON list in {elapsed:.1f}s, peak traced memory {megabytes(peak):.1f}MB'
+        )
@@ -0,0 +1,115 @@
+"""
+Reservation throughput and double-booking check under concurrent clients
+"""
+import random
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection
+
+from listings.models import Booking, Listing
+from listings.reservations import BookingConflict, reserve_booking
+
+from . import Benchmark
+
+
+def count_overlaps(listing_ids):
+    """Count pairs of active bookings on the same listing that share a night"""
+    stays = defaultdict(list)
+    bookings = Booking.objects.filter(listing_id__in=listing_ids).exclude(status='cancelled')
+    for listing_id, check_in, check_out in bookings.values_list('listing_id', 'check_in_date', 'check_out_date'):
+        stays[listing_id].append((check_in, check_out))
+
+    overlaps = 0
+    for ranges in stays.values():
+        ranges.sort()
+        for (_, previous_out), (next_in, _) in zip(ranges, ranges[1:]):
+            if next_in < previous_out:
+                overlaps += 1
+    return overlaps
+
+
+class ReservationBenchmark(Benchmark):
+    name = 'reservations'
+    help = 'Measure reservation throughput with 1, 8 and 32 concurrent clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=20)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--clients', default='1,8,32', help='Comma-separated client counts')
+        parser.add_argument('--horizon-days', type=int, default=120)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def run(self, out, **options):
+        # Threads need committed rows, so this benchmark cleans up after itself
+        tag = uuid.uuid4().hex[:8]
+        host = User.objects.create(username=f'bench-host-{tag}')
+        guest = User.objects.create(username=f'bench-guest-{tag}')
+        listings = [
+            Listing.objects.create(
+                title=f'Benchmark listing {i}',
+                description='Benchmark data',
+                price_per_night=Decimal('100.00'),
+                location='Benchmark',
+                amenities='WiFi',
+                host=host,
+            )
+            for i in range(options['listings'])
+        ]
+        listing_ids = [listing.pk for listing in listings]
+
+        try:
+            for clients in (int(value) for value in options['clients'].split(',')):
+                rng = random.Random(options['seed'])
+                start = date.today() + timedelta(days=1)
+                requests = []
+                for _ in range(options['requests']):
+                    check_in = start + timedelta(days=rng.randrange(options['horizon_days']))
+                    requests.append((rng.choice(listing_ids), check_in, check_in + timedelta(days=rng.randint(1, 4))))
+
+                outcomes = self.run_clients(clients, guest, requests)
+                overlaps = count_overlaps(listing_ids)
+                out.write(
+                    f'clients={clients:>3} requests={len(requests)} '
+                    f"created={outcomes['created']} conflicts={outcomes['conflict']} "
+                    f"throughput={outcomes['throughput']:.1f} req/s overlaps={overlaps}"
+                )
+                Booking.objects.filter(listing_id__in=listing_ids).delete()
+        finally:
+            Listing.objects.filter(pk__in=listing_ids).delete()
+            User.objects.filter(pk__in=[host.pk, guest.pk]).delete()
+
+    def run_clients(self, clients, guest, requests):
+        """Replay the requests over a pool of client threads"""
+        def reserve(request):
+            listing_id, check_in, check_out = request
+            try:
+                while True:
+                    try:
+                        reserve_booking(listing_id, guest, check_in, check_out)
+                        return 'created'
+                    except OperationalError as e:
+                        # SQLite reports lock contention instead of waiting on it
+                        if 'locked' not in str(e):
+                            raise
+                        time.sleep(0.001)
+            except BookingConflict:
+                return 'conflict'
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = list(pool.map(reserve, requests))
+        elapsed = time.perf_counter() - started
+
+        return {
+            'created': results.count('created'),
+            'conflict': results.count('conflict'),
+            'throughput': len(requests) / elapsed,
+        }
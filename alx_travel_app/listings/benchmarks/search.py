@@ -0,0 +1,88 @@
+"""
+Listing search: full-text index vs LIKE scans
+"""
+import random
+import uuid
+from itertools import accumulate
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection
+
+from listings.models import Listing
+from listings.search import LikeSearchBackend, get_search_backend, rebuild_search_index, search_listings
+
+from . import Benchmark, format_latency, measure, rolled_back
+
+SYLLABLES = ('ba', 'ke', 'li', 'mo', 'nu', 'sa', 'te', 'vi', 'ro', 'da', 'fu', 'ga', 'hi', 'jo', 'pe', 'zu')
+LOCATIONS = ('Addis Ababa', 'Mombasa', 'Nairobi', 'Zanzibar', 'Kigali', 'Lalibela', 'Gondar', 'Arusha')
+
+
+class SearchBenchmark(Benchmark):
+    name = 'search'
+    help = 'Compare listing search through the full-text index with LIKE scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=1000000)
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--vocabulary', type=int, default=20000, help='Distinct words in listing text')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def run(self, out, **options):
+        rng = random.Random(options['seed'])
+        with rolled_back():
+            self.populate(out, rng, options)
+
+            # Mid-frequency terms like real searches; two-word queries end in a prefix
+            middle = self.vocabulary[len(self.vocabulary) // 20:len(self.vocabulary) // 4]
+            queries = []
+            for _ in range(options['queries']):
+                first, second = rng.sample(middle, 2)
+                queries.append(rng.choice((first, f'{first} {second[:4]}')))
+
+            listings = Listing.objects.filter(is_available=True)
+            for backend in (get_search_backend(), LikeSearchBackend(connection)):
+                page_samples = []
+                count_samples = []
+                for query in queries:
+                    results = search_listings(listings, query, backend).order_by('-search_rank')
+                    page_samples += measure(lambda: list(results.values_list('pk', flat=True)[:20]))
+                    count_samples += measure(results.count)
+                out.write(f'{backend.name:>6} first page: {format_latency(page_samples)}')
+                out.write(f'{backend.name:>6} full count: {format_latency(count_samples)}')
+
+    def populate(self, out, rng, options):
+        """Insert listings with Zipf-distributed text, then index them in one pass"""
+        self.vocabulary = sorted({
+            ''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(options['vocabulary'])
+        })
+        rng.shuffle(self.vocabulary)
+        cum_weights = list(accumulate(1 / rank for rank in range(1, len(self.vocabulary) + 1)))
+
+        def text(words):
+            return ' '.join(rng.choices(self.vocabulary, cum_weights=cum_weights, k=words))
+
+        host = User.objects.create(username=f'bench-host-{uuid.uuid4().hex[:8]}')
+        batch_size = options['batch_size']
+        created = 0
+        while created < options['listings']:
+            count = min(batch_size, options['listings'] - created)
+            Listing.objects.bulk_create([
+                Listing(
+                    listing_id=uuid.UUID(int=rng.getrandbits(128)),
+                    title=text(3).title(),
+                    description=text(30),
+                    price_per_night=Decimal(rng.randint(20, 500)),
+                    location=rng.choice(LOCATIONS),
+                    amenities='WiFi',
+                    host=host,
+                )
+                for _ in range(count)
+            ])
+            created += count
+            out.write(f'  {created} listings...')
+
+        # bulk_create skips the save signals that maintain the index
+        indexed = rebuild_search_index()
+        out.write(f'Created {created} listings, indexed {indexed}')
@@ -0,0 +1,145 @@
+"""
+Booking and payment lists of a large host: visibility branches vs one OR filter
+"""
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from listings.models import Booking, Listing, Payment
+from listings.serializers import optimize_for_serializer
+from listings.views import BookingViewSet, PaymentViewSet
+from listings.visibility import VisibilityMixin
+
+from . import Benchmark, format_latency, measure, rolled_back
+
+
+class OrFilterMixin:
+    """The pre-branch visibility filter: one OR across the listing join, then DISTINCT"""
+    or_filter = None
+
+    def get_queryset(self):
+        user = self.request.user
+        rows = self.queryset.model.objects.filter(self.or_filter(user)).distinct()
+        return optimize_for_serializer(rows, self.get_serializer())
+
+    def get_visibility_branches(self):
+        # No branches: the paginator reads the queryset as it is
+        return []
+
+    def filter_queryset(self, queryset):
+        return super(VisibilityMixin, self).filter_queryset(queryset)
+
+
+class OrFilterBookingViewSet(OrFilterMixin, BookingViewSet):
+    @staticmethod
+    def or_filter(user):
+        return Q(guest=user) | Q(listing__host=user)
+
+
+class OrFilterPaymentViewSet(OrFilterMixin, PaymentViewSet):
+    @staticmethod
+    def or_filter(user):
+        return Q(booking__guest=user) | Q(booking__listing__host=user)
+
+
+class VisibilityBenchmark(Benchmark):
+    name = 'visibility'
+    help = 'Compare booking and payment lists read branch by branch with the OR + DISTINCT filter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookings', type=int, default=100000, help="Bookings of the measured host's listings")
+        parser.add_argument('--listings', type=int, default=50, help="The measured host's listings")
+        parser.add_argument('--other-bookings', type=int, default=100000, help="Bookings of other hosts' listings")
+        parser.add_argument('--guest-bookings', type=int, default=20, help='Bookings made by the measured guest')
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--queries', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def run(self, out, **options):
+        with rolled_back():
+            host, guest = self.populate(out, options)
+            params = {'page_size': options['page_size']}
+            cases = [
+                ('host', host, 'bookings', params),
+                ('host', host, 'payments', params),
+                ('guest', guest, 'bookings', params),
+                ('guest', guest, 'bookings', {}),
+            ]
+            views = {
+                'branches': {'bookings': BookingViewSet, 'payments': PaymentViewSet},
+                'or': {'bookings': OrFilterBookingViewSet, 'payments': OrFilterPaymentViewSet},
+            }
+            for role, user, resource, query in cases:
+                shape = 'first page' if query else 'whole list'
+                for label, viewsets in views.items():
+                    view = viewsets[resource].as_view({'get': 'list'})
+                    samples = measure(lambda: self.get(view, resource, query, user), options['queries'])
+                    out.write(f'{label:>8} {role} {resource} {shape}: {format_latency(samples)}')
+
+    def get(self, view, resource, params, user):
+        request = APIRequestFactory().get(f'/api/{resource}/', params)
+        force_authenticate(request, user=user)
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            response = view(request)
+        response.render()
+        return response
+
+    def populate(self, out, options):
+        """
+        Insert the measured host's bookings, each with a payment, and other hosts' bookings
+
+        The measured guest's bookings are on other hosts' listings, so a guest
+        list is a handful of rows among all of them.
+        """
+        tag = uuid.uuid4().hex[:8]
+        host = User.objects.create(username=f'bench-host-{tag}')
+        guest = User.objects.create(username=f'bench-guest-{tag}')
+        others = User.objects.bulk_create([User(username=f'bench-user-{tag}-{i}') for i in range(100)])
+
+        def listing(owner, i):
+            return Listing(
+                title=f'Benchmark listing {i}',
+                description='Benchmark data',
+                price_per_night=Decimal('100.00'),
+                location='Benchmark',
+                amenities='WiFi',
+                host=owner,
+            )
+
+        hosted = Listing.objects.bulk_create([listing(host, i) for i in range(options['listings'])])
+        elsewhere = Listing.objects.bulk_create([listing(others[i % len(others)], i) for i in range(1000)])
+
+        start = date.today()
+        batch_size = options['batch_size']
+
+        def insert(count, listings, guest_for, with_payments):
+            # Stays may overlap: lists never look at availability
+            for first in range(0, count, batch_size):
+                bookings = Booking.objects.bulk_create([
+                    Booking(
+                        listing=listings[i % len(listings)],
+                        guest=guest_for(i),
+                        check_in_date=start + timedelta(days=i % 3650),
+                        check_out_date=start + timedelta(days=i % 3650 + 1),
+                        total_price=Decimal('100.00'),
+                    )
+                    for i in range(first, min(first + batch_size, count))
+                ])
+                if with_payments:
+                    Payment.objects.bulk_create([
+                        Payment(booking=booking, amount=booking.total_price) for booking in bookings
+                    ])
+
+        insert(options['bookings'], hosted, lambda i: others[i % len(others)], True)
+        insert(options['other_bookings'], elsewhere, lambda i: others[i % len(others)], False)
+        insert(options['guest_bookings'], elsewhere, lambda i: guest, False)
+        out.write(
+            f"Inserted {options['bookings']} bookings with payments for the host on {options['listings']} "
+            f"listings, {options['other_bookings']} for other hosts and {options['guest_bookings']} for the guest"
+        )
+        return host, guest
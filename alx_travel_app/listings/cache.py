@@ -0,0 +1,161 @@
+"""
+Versioned response cache for listing reads
+
+Cached responses are keyed by the request's normalized query params plus a
+version counter: a global one for list responses and one per listing for
+detail responses. Writes never delete cache entries; they bump the relevant
+counter (see listings.signals), which makes every key built from the old
+value unreachable. Invalidation is therefore O(1) and never scans keys; stale
+entries simply expire.
+
+Works with any Django cache backend: local memory for tests and a shared
+cache (e.g. Redis) in production, configured through CACHE_URL.
+"""
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+GLOBAL_VERSION_KEY = 'listings:version'
+HITS_KEY = 'listings:cache:hits'
+MISSES_KEY = 'listings:cache:misses'
+
+
+def listing_version_key(listing_id):
+    return f'listings:version:{listing_id}'
+
+
+def cache_enabled():
+    return getattr(settings, 'LISTING_CACHE_ENABLED', True)
+
+
+def cache_timeout():
+    return getattr(settings, 'LISTING_CACHE_TIMEOUT', 300)
+
+
+def initial_version():
+    """
+    Starting value for a version counter.
+
+    Time-based rather than 1, so a counter that was evicted from the cache
+    restarts at a value no older entry was built with.
+    """
+    return time.time_ns() // 1000
+
+
+def get_versions(*keys):
+    """Return the current value of each version counter, creating missing ones"""
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, initial_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, initial_version(), timeout=None)
+
+
+def invalidate_listing(listing_id):
+    """Invalidate one listing's detail responses and every list response"""
+    def bump():
+        bump_version(listing_version_key(listing_id))
+        bump_version(GLOBAL_VERSION_KEY)
+
+    # Bump after commit so a concurrent read can't cache pre-commit data under the new version
+    transaction.on_commit(bump)
+
+
+def invalidate_listings():
+    """Invalidate every list response, leaving detail responses cached"""
+    transaction.on_commit(lambda: bump_version(GLOBAL_VERSION_KEY))
+
+
+def increment_counter(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def cache_stats():
+    """Return the response cache hit/miss counters"""
+    stats = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits = stats.get(HITS_KEY, 0)
+    misses = stats.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0,
+    }
+
+
+def response_cache_key(request, listing_id=None):
+    """Build the cache key for a read request from its path and sorted query params"""
+    params = sorted(
+        (key, sorted(values)) for key, values in request.query_params.lists()
+    )
+    digest = hashlib.sha1(repr((request.path, params)).encode('utf-8')).hexdigest()
+
+    if listing_id is None:
+        (version,) = get_versions(GLOBAL_VERSION_KEY)
+        return f'listings:response:list:{version}:{digest}'
+    (version,) = get_versions(listing_version_key(listing_id))
+    return f'listings:response:detail:{listing_id}:{version}:{digest}'
+
+
+class CachedReadMixin:
+    """
+    Serve list and retrieve from the versioned response cache.
+
+    Only the rendered data is cached, so content negotiation still happens
+    per request. Responses carry an X-Cache: HIT/MISS header. The row
+    versions behind the response's ETag (see listings.conditional) are
+    cached next to the data, so hits still carry validators.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, None, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            # Normalize so the key matches the version bumped for instance.pk
+            listing_id = str(uuid.UUID(str(kwargs.get(self.lookup_url_kwarg or self.lookup_field))))
+        except ValueError:
+            return super().retrieve(request, *args, **kwargs)
+        return self.cached_response(super().retrieve, request, listing_id, *args, **kwargs)
+
+    def cached_response(self, handler, request, listing_id, *args, **kwargs):
+        if not cache_enabled():
+            return handler(request, *args, **kwargs)
+
+        key = response_cache_key(request, listing_id)
+        versions_key = f'{key}:versions'
+        cached = cache.get_many([key, versions_key])
+        if key in cached:
+            increment_counter(HITS_KEY)
+            self.known_row_versions = cached.get(versions_key)
+            response = Response(cached[key])
+            response['X-Cache'] = 'HIT'
+            return response
+
+        increment_counter(MISSES_KEY)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            entries = {key: response.data}
+            versions = getattr(self, 'rendered_row_versions', lambda: None)()
+            if versions is not None:
+                entries[versions_key] = versions
+            cache.set_many(entries, timeout=cache_timeout())
+        response['X-Cache'] = 'MISS'
+        return response
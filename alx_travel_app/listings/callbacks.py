@@ -0,0 +1,117 @@
+"""
+Idempotent handling of Chapa payment callbacks
+
+The callback view only records the tx_ref and acknowledges; verifying with
+Chapa happens in a Celery worker. A tx_ref is processed at most once, so
+Chapa's retries cost one indexed lookup and never repeat side effects.
+Payments Chapa still reports as pending are picked up by the periodic
+reconciliation sweep (see listings.reconciliation).
+"""
+import logging
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .chapa_utils import get_chapa_client, update_payment_status
+from .email_tasks import dispatch_payment_email
+from .models import Payment, PaymentCallback
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_PAYMENT_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+class VerificationUnavailable(Exception):
+    """Chapa could not be asked about the payment; the callback can be retried"""
+
+
+def record_callback(tx_ref):
+    """
+    Record a callback and queue its verification once
+
+    Args:
+        tx_ref: Transaction reference sent by Chapa (the payment_id)
+
+    Returns:
+        str: 'duplicate' if this tx_ref was seen before, 'unknown' if no
+        payment matches it, otherwise 'accepted'
+    """
+    if PaymentCallback.objects.filter(tx_ref=tx_ref).exists():
+        return 'duplicate'
+
+    try:
+        if not Payment.objects.filter(payment_id=tx_ref).exists():
+            return 'unknown'
+    except ValidationError:
+        return 'unknown'
+
+    try:
+        with transaction.atomic():
+            PaymentCallback.objects.create(tx_ref=tx_ref)
+    except IntegrityError:
+        # A concurrent retry recorded it first
+        return 'duplicate'
+
+    from .tasks import process_payment_callback
+
+    transaction.on_commit(lambda: process_payment_callback.delay(tx_ref))
+    return 'accepted'
+
+
+def process_callback(tx_ref, client=None):
+    """
+    Verify a recorded callback's payment with Chapa and apply the outcome
+
+    The Chapa call is made without holding any lock; the payment row is then
+    locked and re-checked, so a concurrent sweep or status poll that already
+    settled it is never applied twice.
+
+    Args:
+        tx_ref: Transaction reference of a recorded callback
+        client: ChapaAPIClient to use; defaults to the process-wide client
+
+    Returns:
+        str: Resulting payment status, or 'skipped' if it was already settled
+
+    Raises:
+        VerificationUnavailable: Chapa could not verify the payment
+    """
+    payment = Payment.objects.filter(payment_id=tx_ref).only('status', 'chapa_reference').first()
+    if payment is None or payment.status in TERMINAL_PAYMENT_STATUSES:
+        mark_processed(tx_ref)
+        return 'skipped'
+
+    client = client or get_chapa_client()
+    result = client.verify_payment(payment.chapa_reference or tx_ref)
+    if not result['success']:
+        raise VerificationUnavailable(result.get('error', 'Verification failed'))
+
+    chapa_status = (result.get('status') or 'pending').lower()
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update().select_related('booking').get(payment_id=tx_ref)
+        if payment.status in TERMINAL_PAYMENT_STATUSES:
+            outcome = 'skipped'
+        elif chapa_status == 'success':
+            update_payment_status(
+                payment,
+                'completed',
+                transaction_id=result.get('reference'),
+                payment_method=result.get('method')
+            )
+            dispatch_payment_email(payment, 'confirmation')
+            outcome = 'completed'
+        elif chapa_status == 'failed':
+            update_payment_status(payment, 'failed', error_message='Payment failed')
+            dispatch_payment_email(payment, 'failure', 'Your payment failed. Please try again.')
+            outcome = 'failed'
+        else:
+            outcome = 'pending'
+        mark_processed(tx_ref)
+
+    logger.info(f"Callback for payment {tx_ref} processed: {outcome}")
+    return outcome
+
+
+def mark_processed(tx_ref):
+    PaymentCallback.objects.filter(tx_ref=tx_ref).update(processed_at=timezone.now())
@@ -0,0 +1,173 @@
+"""
+Async Chapa API client for the views served over ASGI
+
+AsyncChapaAPIClient sends the same requests as ChapaAPIClient through an
+httpx.AsyncClient, so a payment waiting on Chapa holds a coroutine on the
+event loop instead of a worker thread. Use get_async_chapa_client(): it
+keeps one client, and so one keep-alive pool, per event loop.
+"""
+import asyncio
+import logging
+import weakref
+
+import httpx
+from django.conf import settings
+
+from .chapa_utils import (
+    chapa_config, initiate_payload, parse_initiate_response, parse_verify_response, refused_result
+)
+from .circuit_breaker import CallRefused, async_chapa_call
+from .instrumentation import outbound_call
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = frozenset({500, 502, 503, 504})
+
+
+class AsyncChapaAPIClient:
+    """Client for the Chapa Payment Gateway API, for use on an event loop"""
+
+    def __init__(self, transport=None):
+        """
+        Initialize the client with the same configuration as ChapaAPIClient
+
+        Args:
+            transport: httpx transport to send requests through; a pooled
+                transport is built when omitted
+        """
+        config = chapa_config()
+        self.api_url = config['api_url']
+        self.callback_url = config['callback_url']
+        self.verify_retries = getattr(settings, 'CHAPA_VERIFY_RETRIES', 3)
+        self.retry_backoff = getattr(settings, 'CHAPA_RETRY_BACKOFF', 0.3)
+
+        if transport is None:
+            limits = httpx.Limits(
+                max_connections=getattr(settings, 'CHAPA_ASYNC_MAX_CONNECTIONS', 100),
+                max_keepalive_connections=getattr(settings, 'CHAPA_POOL_SIZE', 10),
+            )
+            # Failed connection attempts are retried for every method since nothing was sent
+            transport = httpx.AsyncHTTPTransport(limits=limits, retries=self.verify_retries)
+        read_timeout = getattr(settings, 'CHAPA_READ_TIMEOUT', 10)
+        self.client = httpx.AsyncClient(
+            headers=config['headers'],
+            # Waiting for a free connection counts against the read timeout too
+            timeout=httpx.Timeout(read_timeout, connect=getattr(settings, 'CHAPA_CONNECT_TIMEOUT', 3.05)),
+            transport=transport,
+        )
+
+    async def aclose(self):
+        """Close the pooled connections"""
+        await self.client.aclose()
+
+    async def initiate_payment(self, payment_obj, booking_obj):
+        """
+        Initiate a payment with Chapa API
+
+        Args:
+            payment_obj: Payment model instance
+            booking_obj: Booking model instance with guest and listing loaded
+
+        Returns:
+            dict: Response from Chapa API containing checkout_url and reference
+        """
+        try:
+            payload = initiate_payload(payment_obj, booking_obj, self.callback_url)
+
+            async with async_chapa_call():
+                with outbound_call('chapa'):
+                    response = await self.client.post(f'{self.api_url}/transaction/initialize', json=payload)
+                    response.raise_for_status()
+            return parse_initiate_response(response.json(), payment_obj.payment_id)
+
+        except CallRefused as e:
+            return refused_result(e)
+        except httpx.HTTPError as e:
+            logger.error(f"Request error during payment initiation: {str(e)}")
+            return {
+                'success': False,
+                'error': f'Request failed: {str(e)}',
+            }
+        except Exception as e:
+            logger.error(f"Unexpected error during payment initiation: {str(e)}")
+            return {
+                'success': False,
+                'error': f'Unexpected error: {str(e)}',
+            }
+
+    async def verify_payment(self, transaction_reference):
+        """
+        Verify a payment status with Chapa API
+
+        Args:
+            transaction_reference: The transaction reference/payment_id from Chapa
+
+        Returns:
+            dict: Payment status information
+        """
+        try:
+            async with async_chapa_call():
+                with outbound_call('chapa'):
+                    response = await self.get_with_retries(f'{self.api_url}/transaction/verify/{transaction_reference}')
+                    response.raise_for_status()
+            return parse_verify_response(response.json(), transaction_reference)
+
+        except CallRefused as e:
+            return refused_result(e)
+        except httpx.HTTPError as e:
+            logger.error(f"Request error during payment verification: {str(e)}")
+            return {
+                'success': False,
+                'error': f'Verification request failed: {str(e)}',
+            }
+        except Exception as e:
+            logger.error(f"Unexpected error during payment verification: {str(e)}")
+            return {
+                'success': False,
+                'error': f'Unexpected error: {str(e)}',
+            }
+
+    async def get_with_retries(self, url):
+        """
+        GET a URL, retrying 5xx responses and read errors with exponential backoff
+
+        Matches the retries of the sync client's session; only idempotent
+        requests go through here.
+        """
+        for attempt in range(self.verify_retries + 1):
+            if attempt:
+                await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            try:
+                response = await self.client.get(url)
+            except (httpx.ReadError, httpx.ReadTimeout, httpx.RemoteProtocolError):
+                if attempt == self.verify_retries:
+                    raise
+                continue
+            if response.status_code not in RETRY_STATUSES or attempt == self.verify_retries:
+                return response
+
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_chapa_client():
+    """
+    Return the running event loop's Chapa client, creating it on first use
+
+    httpx connections belong to the loop that opened them, so each loop (one
+    per ASGI worker process) gets its own client. Must be called from a
+    coroutine.
+
+    Raises:
+        ValueError: CHAPA_SECRET_KEY is not set
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncChapaAPIClient()
+    return client
+
+
+def reset_async_chapa_clients():
+    """Drop every loop's client so the next call builds a new one"""
+    _clients.clear()
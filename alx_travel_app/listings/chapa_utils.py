@@ -1,32 +1,187 @@
 """
 Utility functions for Chapa API integration
+
+Use get_chapa_client() rather than constructing ChapaAPIClient directly: it
+returns one client per process whose pooled session keeps connections to
+Chapa alive between requests.
 """
 import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
 import requests
 import logging
 from django.conf import settings
 from django.utils import timezone
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .circuit_breaker import CallRefused, chapa_call, reset_chapa_breaker
+from .instrumentation import outbound_call
 
 logger = logging.getLogger(__name__)
 
 
-class ChapaAPIClient:
-    """Client for interacting with Chapa Payment Gateway API"""
+def build_chapa_session(pool_size=None, verify_retries=None, retry_backoff=None):
+    """
+    Build a requests session with a keep-alive connection pool for Chapa
 
-    def __init__(self):
-        """Initialize Chapa API client with configuration"""
-        self.secret_key = os.getenv('CHAPA_SECRET_KEY')
-        self.api_url = os.getenv('CHAPA_API_URL', 'https://api.chapa.co/v1')
-        self.callback_url = os.getenv('CHAPA_CALLBACK_URL', 'http://localhost:8000/api/payments/verify/')
-        
-        if not self.secret_key:
-            raise ValueError("CHAPA_SECRET_KEY environment variable is not set")
-        
-        self.headers = {
-            'Authorization': f'Bearer {self.secret_key}',
+    Only GET requests (payment verification) are retried on 5xx responses and
+    read errors; initialize is a POST and must not be replayed. Failed
+    connection attempts are retried for every method since nothing was sent.
+
+    Args:
+        pool_size: Connections kept open per host
+        verify_retries: Retries for idempotent requests
+        retry_backoff: Backoff factor in seconds between retries
+
+    Returns:
+        requests.Session: Session safe to share between threads
+    """
+    if pool_size is None:
+        pool_size = getattr(settings, 'CHAPA_POOL_SIZE', 10)
+    if verify_retries is None:
+        verify_retries = getattr(settings, 'CHAPA_VERIFY_RETRIES', 3)
+    if retry_backoff is None:
+        retry_backoff = getattr(settings, 'CHAPA_RETRY_BACKOFF', 0.3)
+
+    retry = Retry(
+        total=verify_retries,
+        connect=verify_retries,
+        read=verify_retries,
+        status=verify_retries,
+        backoff_factor=retry_backoff,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset({'GET'}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # The cookie jar is the only per-request state a Session mutates; keep it empty when shared
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def chapa_config():
+    """
+    Chapa credentials and endpoints from the environment
+
+    Raises:
+        ValueError: CHAPA_SECRET_KEY is not set
+    """
+    secret_key = os.getenv('CHAPA_SECRET_KEY')
+    if not secret_key:
+        raise ValueError("CHAPA_SECRET_KEY environment variable is not set")
+    return {
+        'secret_key': secret_key,
+        'api_url': os.getenv('CHAPA_API_URL', 'https://api.chapa.co/v1'),
+        'callback_url': os.getenv('CHAPA_CALLBACK_URL', 'http://localhost:8000/api/payments/verify/'),
+        'headers': {
+            'Authorization': f'Bearer {secret_key}',
             'Content-Type': 'application/json'
+        },
+    }
+
+
+def initiate_payload(payment_obj, booking_obj, callback_url):
+    """Body of a transaction/initialize request for a payment"""
+    return {
+        'amount': str(float(payment_obj.amount)),
+        'currency': payment_obj.currency,
+        'email': booking_obj.guest.email,
+        'first_name': booking_obj.guest.first_name or booking_obj.guest.username,
+        'last_name': booking_obj.guest.last_name or '',
+        'phone_number': '',  # Add phone if available in User model
+        'tx_ref': str(payment_obj.payment_id),  # Use payment_id as reference
+        'callback_url': callback_url,
+        'return_url': callback_url,
+        'customization[title]': f'Travel Booking - {booking_obj.listing.title}',
+        'customization[description]': f'Booking from {booking_obj.check_in_date} to {booking_obj.check_out_date}',
+    }
+
+
+def parse_initiate_response(data, payment_id):
+    """Result dict of a transaction/initialize response body"""
+    if data.get('status') == 'success':
+        logger.info(f"Payment initiated successfully for payment {payment_id}")
+        return {
+            'success': True,
+            'checkout_url': data.get('data', {}).get('checkout_url'),
+            'reference': data.get('data', {}).get('tx_ref'),
+        }
+    error_msg = data.get('message', 'Unknown error')
+    logger.error(f"Payment initiation failed: {error_msg}")
+    return {
+        'success': False,
+        'error': error_msg,
+    }
+
+
+def parse_verify_response(data, transaction_reference):
+    """Result dict of a transaction/verify response body"""
+    if data.get('status') == 'success':
+        transaction_data = data.get('data', {})
+        logger.info(f"Payment verification successful for {transaction_reference}")
+        return {
+            'success': True,
+            'status': transaction_data.get('status'),  # success, failed, pending
+            'amount': transaction_data.get('amount'),
+            'currency': transaction_data.get('currency'),
+            'reference': transaction_data.get('reference'),
+            'tx_ref': transaction_data.get('tx_ref'),
+            'charge': transaction_data.get('charge'),
+            'method': transaction_data.get('method'),
+            'received_amount': transaction_data.get('received_amount'),
         }
+    error_msg = data.get('message', 'Verification failed')
+    logger.error(f"Payment verification error: {error_msg}")
+    return {
+        'success': False,
+        'error': error_msg,
+    }
+
+
+def refused_result(exc):
+    """Result dict of a call the circuit breaker or bulkhead refused to send"""
+    logger.info(f"Chapa call refused ({exc.reason}), retry in {exc.retry_after}s")
+    return {
+        'success': False,
+        'error': 'Payment provider is temporarily unavailable',
+        'unavailable': True,
+        'retry_after': exc.retry_after,
+    }
+
+
+class ChapaAPIClient:
+    """Client for interacting with Chapa Payment Gateway API"""
+
+    def __init__(self, session=None):
+        """
+        Initialize Chapa API client with configuration
+
+        Args:
+            session: requests session to send requests through; a pooled
+                session is built when omitted
+        """
+        config = chapa_config()
+        self.secret_key = config['secret_key']
+        self.api_url = config['api_url']
+        self.callback_url = config['callback_url']
+        self.headers = config['headers']
+        self.timeout = (
+            getattr(settings, 'CHAPA_CONNECT_TIMEOUT', 3.05),
+            getattr(settings, 'CHAPA_READ_TIMEOUT', 10),
+        )
+        self.session = session or build_chapa_session()
+        self.session.headers.update(self.headers)
+
+    def close(self):
+        """Close the pooled connections"""
+        self.session.close()
 
     def initiate_payment(self, payment_obj, booking_obj):
         """
@@ -40,45 +195,19 @@ class ChapaAPIClient:
             dict: Response from Chapa API containing checkout_url and reference
         """
         try:
-            payload = {
-                'amount': str(float(payment_obj.amount)),
-                'currency': payment_obj.currency,
-                'email': booking_obj.guest.email,
-                'first_name': booking_obj.guest.first_name or booking_obj.guest.username,
-                'last_name': booking_obj.guest.last_name or '',
-                'phone_number': '',  # Add phone if available in User model
-                'tx_ref': str(payment_obj.payment_id),  # Use payment_id as reference
-                'callback_url': self.callback_url,
-                'return_url': self.callback_url,
-                'customization[title]': f'Travel Booking - {booking_obj.listing.title}',
-                'customization[description]': f'Booking from {booking_obj.check_in_date} to {booking_obj.check_out_date}',
-            }
+            payload = initiate_payload(payment_obj, booking_obj, self.callback_url)
 
-            response = requests.post(
-                f'{self.api_url}/transaction/initialize',
-                json=payload,
-                headers=self.headers,
-                timeout=10
-            )
-
-            response.raise_for_status()
-            data = response.json()
-
-            if data.get('status') == 'success':
-                logger.info(f"Payment initiated successfully for payment {payment_obj.payment_id}")
-                return {
-                    'success': True,
-                    'checkout_url': data.get('data', {}).get('checkout_url'),
-                    'reference': data.get('data', {}).get('tx_ref'),
-                }
-            else:
-                error_msg = data.get('message', 'Unknown error')
-                logger.error(f"Payment initiation failed: {error_msg}")
-                return {
-                    'success': False,
-                    'error': error_msg,
-                }
+            with chapa_call(), outbound_call('chapa'):
+                response = self.session.post(
+                    f'{self.api_url}/transaction/initialize',
+                    json=payload,
+                    timeout=self.timeout
+                )
+                response.raise_for_status()
+            return parse_initiate_response(response.json(), payment_obj.payment_id)
 
+        except CallRefused as e:
+            return refused_result(e)
         except requests.exceptions.RequestException as e:
             logger.error(f"Request error during payment initiation: {str(e)}")
             return {
@@ -103,38 +232,16 @@ class ChapaAPIClient:
             dict: Payment status information
         """
         try:
-            response = requests.get(
-                f'{self.api_url}/transaction/verify/{transaction_reference}',
-                headers=self.headers,
-                timeout=10
-            )
-
-            response.raise_for_status()
-            data = response.json()
-
-            if data.get('status') == 'success':
-                transaction_data = data.get('data', {})
-                logger.info(f"Payment verification successful for {transaction_reference}")
-                
-                return {
-                    'success': True,
-                    'status': transaction_data.get('status'),  # success, failed, pending
-                    'amount': transaction_data.get('amount'),
-                    'currency': transaction_data.get('currency'),
-                    'reference': transaction_data.get('reference'),
-                    'tx_ref': transaction_data.get('tx_ref'),
-                    'charge': transaction_data.get('charge'),
-                    'method': transaction_data.get('method'),
-                    'received_amount': transaction_data.get('received_amount'),
-                }
-            else:
-                error_msg = data.get('message', 'Verification failed')
-                logger.error(f"Payment verification error: {error_msg}")
-                return {
-                    'success': False,
-                    'error': error_msg,
-                }
+            with chapa_call(), outbound_call('chapa'):
+                response = self.session.get(
+                    f'{self.api_url}/transaction/verify/{transaction_reference}',
+                    timeout=self.timeout
+                )
+                response.raise_for_status()
+            return parse_verify_response(response.json(), transaction_reference)
 
+        except CallRefused as e:
+            return refused_result(e)
         except requests.exceptions.RequestException as e:
             logger.error(f"Request error during payment verification: {str(e)}")
             return {
@@ -149,6 +256,51 @@ class ChapaAPIClient:
             }
 
 
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_chapa_client():
+    """
+    Return the process-wide Chapa client, creating it on first use
+
+    Pooled sockets must not be shared between processes, so a forked worker
+    (gunicorn, Celery prefork) gets its own client instead of the parent's.
+
+    Raises:
+        ValueError: CHAPA_SECRET_KEY is not set
+    """
+    global _client, _client_pid
+
+    pid = os.getpid()
+    client = _client
+    if client is not None and _client_pid == pid:
+        return client
+
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            _client = ChapaAPIClient()
+            _client_pid = pid
+        return _client
+
+
+def reset_chapa_client():
+    """Drop the process-wide client, breaker and bulkhead so the next call builds new ones"""
+    global _client, _client_pid, _client_lock
+
+    # After fork the lock may have been copied while held by another thread
+    _client_lock = threading.Lock()
+    _client = None
+    _client_pid = None
+    # A child starts with no calls in flight
+    reset_chapa_breaker()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_chapa_client)
+
+
 def create_payment_for_booking(booking_obj):
     """
     Create a Payment record for a booking
@@ -159,15 +311,32 @@ def create_payment_for_booking(booking_obj):
     Returns:
         Payment: The created Payment instance
     """
+    payment = build_payment_for_booking(booking_obj)
+    payment.save(force_insert=True)
+    logger.info(f"Payment created for booking {booking_obj.booking_id}")
+    return payment
+
+
+def build_payment_for_booking(booking_obj):
+    """
+    Build the Payment record for a booking without saving it, for bulk_create
+
+    Args:
+        booking_obj: Booking model instance
+
+    Returns:
+        Payment: The unsaved Payment instance
+    """
     from .models import Payment
-    
-    payment = Payment.objects.create(
+
+    payment = Payment(
         booking=booking_obj,
         amount=booking_obj.total_price,
         currency='ETB'  # Default to Ethiopian Birr
     )
-    
-    logger.info(f"Payment created for booking {booking_obj.booking_id}")
+
+    # The new payment is the latest; keep Booking.payment from querying for it
+    booking_obj.latest_payments = [payment]
     return payment
 
 
@@ -184,8 +353,11 @@ def update_payment_status(payment_obj, status, transaction_id=None,
         payment_method: Payment method used
         error_message: Error message if payment failed
     """
+    from .cache import invalidate_listings
     from .models import Booking
-    
+    from .revenue import record_completed_payments
+
+    newly_completed = status == 'completed' and payment_obj.status != 'completed'
     payment_obj.status = status
     
     if transaction_id:
@@ -202,10 +374,15 @@ def update_payment_status(payment_obj, status, transaction_id=None,
     
     if status == 'completed':
         payment_obj.completed_at = timezone.now()
-        # Update booking status to confirmed when payment is completed
-        payment_obj.booking.status = 'confirmed'
-        payment_obj.booking.save()
+        # Confirm the booking, unless it was cancelled meanwhile and its nights released
+        confirmed = Booking.objects.filter(pk=payment_obj.booking_id, status='pending').update(status='confirmed')
+        if confirmed:
+            payment_obj.booking.status = 'confirmed'
+            # update() skips the Booking signals that normally do this
+            invalidate_listings()
     
     payment_obj.save()
+    if newly_completed:
+        record_completed_payments([payment_obj])
     logger.info(f"Payment {payment_obj.payment_id} status updated to {status}")
 
@@ -0,0 +1,388 @@
+"""
+Circuit breaker and bulkhead around calls to Chapa
+
+When Chapa degrades, every payment request would otherwise wait out the
+full timeout, holding a worker all the while. The breaker watches the last
+CHAPA_BREAKER_WINDOW calls: once enough of them failed or were slow it
+opens and calls are refused at once for CHAPA_BREAKER_OPEN_SECONDS. It then
+half-opens, letting CHAPA_BREAKER_HALF_OPEN_PROBES calls through; it closes
+when they all succeed and opens again on the first that doesn't. With
+CHAPA_BREAKER_SHARED the open state is also written to the cache, so every
+process using that cache stops calling Chapa together.
+
+The bulkhead caps the Chapa calls in flight in a process at
+CHAPA_MAX_IN_FLIGHT; calls over the cap are refused rather than queued.
+
+Both live once per process and are shared by its threads and event loops.
+Wrap each request to Chapa in chapa_call(), or in async_chapa_call() on an
+event loop.
+"""
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+SHARED_OPEN_KEY = 'chapa:breaker:open_until'
+
+
+class CallRefused(Exception):
+    """A call to Chapa was refused without being sent"""
+
+    def __init__(self, reason, retry_after):
+        """
+        Args:
+            reason: 'circuit_open' or 'bulkhead_full'
+            retry_after: Seconds until a call may be admitted again
+        """
+        super().__init__(f'Chapa call refused: {reason}')
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Failure- and latency-rate circuit breaker, safe to share between threads
+
+    Args:
+        window: Recent calls the rates are computed over
+        minimum_calls: Calls needed in the window before it can trip
+        failure_rate: Share of failed calls that trips it
+        slow_call_seconds: Duration above which a call counts as slow
+        slow_call_rate: Share of slow calls that trips it
+        open_seconds: How long it refuses calls once tripped
+        half_open_probes: Calls let through to test Chapa, all of which must succeed
+        shared: Publish the open state through the cache
+        clock: Monotonic clock, replaceable in tests
+    """
+
+    def __init__(self, window=20, minimum_calls=10, failure_rate=0.5, slow_call_seconds=5.0,
+                 slow_call_rate=0.5, open_seconds=30.0, half_open_probes=3, shared=False,
+                 clock=time.monotonic):
+        self.minimum_calls = minimum_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.shared = shared
+        self.clock = clock
+        self.lock = threading.Lock()
+
+        self.state = CLOSED
+        # (failed, slow) of recent calls while closed
+        self.outcomes = deque(maxlen=window)
+        self.open_until = 0.0
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        self.counters = {
+            'calls': 0,
+            'failures': 0,
+            'slow_calls': 0,
+            'refused': 0,
+            'trips': 0,
+        }
+
+    def acquire(self):
+        """
+        Admit a call
+
+        Returns:
+            bool: True if the call is a half-open probe
+
+        Raises:
+            CallRefused: The breaker is open, or half-open with every probe taken
+        """
+        return self.admit(self.shared_open_until() if self.shared and self.state == CLOSED else None)
+
+    async def aacquire(self):
+        """acquire() for an event loop: the shared state is read with the async cache API"""
+        return self.admit(await self.ashared_open_until() if self.shared and self.state == CLOSED else None)
+
+    def admit(self, shared_until):
+        """Admit a call given when another process opened the breaker until, if it did"""
+        with self.lock:
+            now = self.clock()
+            if shared_until and self.state == CLOSED:
+                # Tripped by another process
+                self.state = OPEN
+                self.open_until = now + shared_until - time.time()
+
+            if self.state == OPEN:
+                if now < self.open_until:
+                    self.counters['refused'] += 1
+                    raise CallRefused('circuit_open', math.ceil(self.open_until - now))
+                self.state = HALF_OPEN
+                self.probes_in_flight = 0
+                self.probe_successes = 0
+
+            if self.state == HALF_OPEN:
+                if self.probes_in_flight + self.probe_successes >= self.half_open_probes:
+                    self.counters['refused'] += 1
+                    raise CallRefused('circuit_open', 1)
+                self.probes_in_flight += 1
+                return True
+            return False
+
+    def record(self, probe, failed, duration):
+        """
+        Record the outcome of an admitted call
+
+        Args:
+            probe: What acquire() returned for the call
+            failed: Whether Chapa failed to answer; None if the call was abandoned
+            duration: Seconds the call took
+        """
+        tripped, closed = self.tally(probe, failed, duration)
+        if self.shared and tripped:
+            cache.set(SHARED_OPEN_KEY, time.time() + self.open_seconds, timeout=math.ceil(self.open_seconds))
+        if self.shared and closed:
+            cache.delete(SHARED_OPEN_KEY)
+
+    async def arecord(self, probe, failed, duration):
+        """record() for an event loop: the shared state is written with the async cache API"""
+        tripped, closed = self.tally(probe, failed, duration)
+        if self.shared and tripped:
+            await cache.aset(SHARED_OPEN_KEY, time.time() + self.open_seconds, timeout=math.ceil(self.open_seconds))
+        if self.shared and closed:
+            await cache.adelete(SHARED_OPEN_KEY)
+
+    def tally(self, probe, failed, duration):
+        """
+        Count the outcome of an admitted call
+
+        Cache calls may be network round trips, so publishing the change to
+        the shared state is left to the caller, outside the lock.
+
+        Returns:
+            tuple: (tripped, closed), whether the call opened or closed the breaker
+        """
+        slow = duration >= self.slow_call_seconds
+        tripped = closed = False
+        with self.lock:
+            if probe:
+                self.probes_in_flight -= 1
+            if failed is None:
+                return tripped, closed
+            self.counters['calls'] += 1
+            self.counters['failures'] += failed
+            self.counters['slow_calls'] += slow
+
+            if probe and self.state == HALF_OPEN:
+                if failed or slow:
+                    tripped = self.trip()
+                else:
+                    self.probe_successes += 1
+                    if self.probe_successes >= self.half_open_probes:
+                        self.state = CLOSED
+                        self.outcomes.clear()
+                        closed = True
+            elif not probe and self.state == CLOSED:
+                self.outcomes.append((failed, slow))
+                if len(self.outcomes) >= self.minimum_calls:
+                    failure_rate, slow_call_rate = self.rates()
+                    if failure_rate >= self.failure_rate or slow_call_rate >= self.slow_call_rate:
+                        tripped = self.trip()
+
+        if tripped:
+            logger.warning(f"Chapa circuit breaker opened for {self.open_seconds}s")
+        if closed:
+            logger.info("Chapa circuit breaker closed")
+        return tripped, closed
+
+    def rates(self):
+        """(failure rate, slow call rate) of the recent calls; call with the lock held"""
+        if not self.outcomes:
+            return 0.0, 0.0
+        failures = sum(1 for failed, _ in self.outcomes if failed)
+        slow_calls = sum(1 for _, slow in self.outcomes if slow)
+        return failures / len(self.outcomes), slow_calls / len(self.outcomes)
+
+    def trip(self):
+        """Open the breaker; call with the lock held"""
+        self.state = OPEN
+        self.open_until = self.clock() + self.open_seconds
+        self.outcomes.clear()
+        self.counters['trips'] += 1
+        return True
+
+    def shared_open_until(self):
+        """Wall-clock time another process opened the breaker until, if it still is"""
+        open_until = cache.get(SHARED_OPEN_KEY)
+        return open_until if open_until and open_until > time.time() else None
+
+    async def ashared_open_until(self):
+        """shared_open_until() for an event loop"""
+        open_until = await cache.aget(SHARED_OPEN_KEY)
+        return open_until if open_until and open_until > time.time() else None
+
+    def stats(self):
+        """State, recent rates and counters"""
+        with self.lock:
+            failure_rate, slow_call_rate = self.rates()
+            return {
+                'state': self.state,
+                'retry_after': max(0, math.ceil(self.open_until - self.clock())) if self.state == OPEN else 0,
+                'recent_calls': len(self.outcomes),
+                'recent_failure_rate': failure_rate,
+                'recent_slow_call_rate': slow_call_rate,
+                **self.counters,
+            }
+
+
+class Bulkhead:
+    """Cap on concurrent calls, refusing rather than queueing those over it"""
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.refused = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a slot
+
+        Raises:
+            CallRefused: Every slot is taken
+        """
+        with self.lock:
+            if self.in_flight >= self.max_in_flight:
+                self.refused += 1
+                raise CallRefused('bulkhead_full', 1)
+            self.in_flight += 1
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        with self.lock:
+            return {'max_in_flight': self.max_in_flight, 'in_flight': self.in_flight, 'refused': self.refused}
+
+
+_breaker = None
+_bulkhead = None
+_lock = threading.Lock()
+
+
+def get_chapa_breaker():
+    """Return the process-wide Chapa breaker and bulkhead, creating them on first use"""
+    global _breaker, _bulkhead
+
+    with _lock:
+        if _breaker is None:
+            _breaker = CircuitBreaker(
+                window=settings.CHAPA_BREAKER_WINDOW,
+                minimum_calls=settings.CHAPA_BREAKER_MIN_CALLS,
+                failure_rate=settings.CHAPA_BREAKER_FAILURE_RATE,
+                slow_call_seconds=settings.CHAPA_BREAKER_SLOW_CALL_SECONDS,
+                slow_call_rate=settings.CHAPA_BREAKER_SLOW_CALL_RATE,
+                open_seconds=settings.CHAPA_BREAKER_OPEN_SECONDS,
+                half_open_probes=settings.CHAPA_BREAKER_HALF_OPEN_PROBES,
+                shared=settings.CHAPA_BREAKER_SHARED,
+            )
+            _bulkhead = Bulkhead(settings.CHAPA_MAX_IN_FLIGHT)
+        return _breaker, _bulkhead
+
+
+def reset_chapa_breaker():
+    """
+    Drop the breaker and bulkhead so the next call builds them from settings
+
+    Called by reset_chapa_client(), including in forked children.
+    """
+    global _breaker, _bulkhead, _lock
+
+    # After fork the lock may have been copied while held by another thread
+    _lock = threading.Lock()
+    _breaker = None
+    _bulkhead = None
+
+
+def chapa_answered(exc):
+    """Whether an exception from an HTTP client carries a 4xx response, i.e. Chapa is up"""
+    response = getattr(exc, 'response', None)
+    return response is not None and getattr(response, 'status_code', 500) < 500
+
+
+@contextmanager
+def chapa_call():
+    """
+    Guard one request to Chapa with the breaker and the bulkhead
+
+    Exceptions raised in the block count as failures, except HTTP errors
+    for 4xx responses, so check the response status inside it. Does
+    nothing when CHAPA_BREAKER_ENABLED is off.
+
+    Raises:
+        CallRefused: Before the request is sent, when the breaker is open or the bulkhead full
+    """
+    if not getattr(settings, 'CHAPA_BREAKER_ENABLED', True):
+        yield
+        return
+    breaker, bulkhead = get_chapa_breaker()
+    bulkhead.acquire()
+    try:
+        probe = breaker.acquire()
+        failed = None
+        started = time.monotonic()
+        try:
+            yield
+            failed = False
+        except Exception as exc:
+            failed = not chapa_answered(exc)
+            raise
+        finally:
+            breaker.record(probe, failed, time.monotonic() - started)
+    finally:
+        bulkhead.release()
+
+
+@asynccontextmanager
+async def async_chapa_call():
+    """
+    chapa_call() for coroutines on an event loop
+
+    Reads and writes the shared breaker state through the async cache API,
+    so a slow cache holds up only the calling coroutine, not the whole loop.
+    """
+    if not getattr(settings, 'CHAPA_BREAKER_ENABLED', True):
+        yield
+        return
+    breaker, bulkhead = get_chapa_breaker()
+    bulkhead.acquire()
+    try:
+        probe = await breaker.aacquire()
+        failed = None
+        started = time.monotonic()
+        try:
+            yield
+            failed = False
+        except Exception as exc:
+            failed = not chapa_answered(exc)
+            raise
+        finally:
+            await breaker.arecord(probe, failed, time.monotonic() - started)
+    finally:
+        bulkhead.release()
+
+
+def chapa_breaker_stats():
+    """Breaker and bulkhead state of this process"""
+    breaker, bulkhead = get_chapa_breaker()
+    return {
+        'enabled': getattr(settings, 'CHAPA_BREAKER_ENABLED', True),
+        **breaker.stats(),
+        'bulkhead': bulkhead.stats(),
+    }
@@ -0,0 +1,406 @@
+"""
+Conditional GET for listing and review reads
+
+List and detail responses carry a strong ETag and a Last-Modified header,
+both derived from the row versions of what the response renders: the
+number of rows and their latest updated_at. The count catches deletions,
+which leave no newer timestamp behind; the ETag also hashes the request
+URL and the negotiated media type, since both shape the body.
+
+Related rows rendered by nested serializers, such as a listing's host and
+reviews, are versioned too: on their primary key and updated_at, or, for
+users, which record no modification time, on the fields rendered from them.
+Their versions are folded into the ETag. A response rendering users gets
+no Last-Modified, as no timestamp would move when a user is renamed.
+Lists whose rows depend on other tables through a filter, such as the
+availability search, also fold in a version of the rows the filter reads,
+and get no Last-Modified either.
+
+A request carrying If-None-Match or If-Modified-Since reads the versions
+before anything is rendered and gets a 304 if they are unchanged. That is
+one aggregate query over the rows, or for a page of a list the paginator's
+own queries without prefetches, plus one query for the related rows; pages
+are versioned on their rows and links, so keyset pages still never count
+the list. Other requests take the versions from the rows and relations they
+render, or from the response cache, at no extra query.
+
+Last-Modified has one-second resolution; clients should prefer the ETag.
+"""
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import serializers
+
+CONDITIONAL_HEADERS = (
+    'HTTP_IF_MATCH', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE', 'HTTP_IF_UNMODIFIED_SINCE',
+)
+
+
+def row_versions(queryset, timestamps=('updated_at',)):
+    """
+    Count and latest modification time of a queryset's rows, in one query
+
+    Args:
+        queryset: The rows a response renders, filtered but not paginated
+        timestamps: Fields whose latest value versions the rows, which may
+            span relations the response renders too
+
+    Returns:
+        tuple: (count, datetime or None)
+    """
+    aggregates = {'count': Count('*')}
+    aggregates.update({f'latest_{i}': Max(field) for i, field in enumerate(timestamps)})
+    row = queryset.order_by().prefetch_related(None).aggregate(**aggregates)
+    count = row.pop('count')
+    return count, max((value for value in row.values() if value is not None), default=None)
+
+
+def loaded_value(instance, path):
+    """
+    Value of a field, following a __ path through relations already loaded
+
+    Raises:
+        LookupError: Reading it would query the database
+    """
+    *relations, field = path.split('__')
+    for name in relations:
+        if not instance._meta.get_field(name).is_cached(instance):
+            raise LookupError(path)
+        instance = getattr(instance, name)
+        if instance is None:
+            return None
+    if field in instance.get_deferred_fields():
+        raise LookupError(path)
+    return getattr(instance, field)
+
+
+def loaded_row_versions(rows, timestamps=('updated_at',)):
+    """
+    row_versions() of rows already in memory, without querying
+
+    Raises:
+        LookupError: A timestamp is on a relation that wasn't loaded
+    """
+    values = [loaded_value(row, path) for row in rows for path in timestamps]
+    return len(rows), max((value for value in values if value is not None), default=None)
+
+
+def version_fields(serializer):
+    """
+    Fields the rows of a nested model serializer are versioned on
+
+    Rows with an updated_at are versioned on it. Others, such as users,
+    record no modification time, so they are versioned on the fields the
+    serializer renders from them.
+    """
+    opts = serializer.Meta.model._meta
+    pk = opts.pk.name
+    concrete = {field.name for field in opts.concrete_fields if not field.is_relation}
+    if 'updated_at' in concrete:
+        return (pk, 'updated_at')
+    rendered = (field.source for field in serializer.fields.values() if not field.write_only)
+    return (pk, *(name for name in rendered if name in concrete and name != pk))
+
+
+def rendered_relations(serializer, prefix=''):
+    """
+    Related rows a serializer renders through nested model serializers
+
+    Returns:
+        list: (path from the root model, version_fields()) per nested serializer
+    """
+    relations = []
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        child = field.child if isinstance(field, serializers.ListSerializer) else field
+        if isinstance(child, serializers.ModelSerializer):
+            path = prefix + field.source
+            relations.append((path, version_fields(child)))
+            relations += rendered_relations(child, path + '__')
+    return relations
+
+
+def related_rows(model, pks, relations):
+    """
+    Version fields of the rows related to some rows, in one query
+
+    Args:
+        model: Model of the rows
+        pks: Their primary keys, as a list or a values('pk') queryset
+        relations: rendered_relations() of what is rendered with them
+
+    Returns:
+        dict: path -> set of version field tuples
+    """
+    columns = [f'{path}__{name}' for path, fields in relations for name in fields]
+    related = {path: set() for path, _ in relations}
+    for row in model._default_manager.filter(pk__in=pks).order_by().values_list(*columns):
+        start = 0
+        for path, fields in relations:
+            values = row[start:start + len(fields)]
+            start += len(fields)
+            # Outer joins give nulls where a row has nothing related
+            if values[0] is not None:
+                related[path].add(values)
+    return related
+
+
+def loaded_instances(rows, path):
+    """
+    Instances a __ path leads to from rows, through relations already loaded
+
+    Raises:
+        LookupError: Following it would query the database
+    """
+    instances = rows
+    for name in path.split('__'):
+        following = []
+        for instance in instances:
+            field = instance._meta.get_field(name)
+            if field.one_to_many or field.many_to_many:
+                prefetched = getattr(instance, '_prefetched_objects_cache', {})
+                if name not in prefetched:
+                    raise LookupError(path)
+                following.extend(prefetched[name])
+            else:
+                if not field.is_cached(instance):
+                    raise LookupError(path)
+                related = getattr(instance, name)
+                if related is not None:
+                    following.append(related)
+        instances = following
+    return instances
+
+
+def loaded_related_rows(rows, relations):
+    """
+    related_rows() of rows already in memory, without querying
+
+    Raises:
+        LookupError: A relation or a version field wasn't loaded
+    """
+    related = {}
+    for path, fields in relations:
+        values = set()
+        for instance in loaded_instances(rows, path):
+            if instance.get_deferred_fields().intersection(fields):
+                raise LookupError(path)
+            values.add(tuple(getattr(instance, name) for name in fields))
+        related[path] = values
+    return related
+
+
+def related_versions(relations, related):
+    """
+    Version of the related rows a response renders
+
+    Returns:
+        tuple: (digest, latest updated_at or None, whether every relation has an updated_at)
+    """
+    digest = hashlib.sha1(repr(sorted(
+        (path, sorted(map(repr, related[path]))) for path, _ in relations
+    )).encode('utf-8')).hexdigest()
+    timestamps = [values[-1] for path, fields in relations if fields[-1] == 'updated_at' for values in related[path]]
+    timestamped = all(fields[-1] == 'updated_at' for _, fields in relations)
+    return digest, max(timestamps, default=None), timestamped
+
+
+def validators(request, count, last_modified, page=None, related=None, extra=None):
+    """
+    (ETag, Last-Modified) of a response rendering rows with these versions
+
+    Args:
+        page: The paginator's links and counts, for a page of a list
+        related: related_versions() of the related rows rendered with them
+        extra: Versions of other rows the response depends on, such as
+            those a filter reads; they have no timestamp
+
+    Returns:
+        tuple: (quoted strong ETag, Unix timestamp or None)
+    """
+    version = (
+        request.build_absolute_uri(),
+        request.accepted_media_type,
+        count,
+        last_modified.timestamp() if last_modified else None,
+        page,
+        related[0] if related else None,
+        extra,
+    )
+    etag = quote_etag(hashlib.sha1(repr(version).encode('utf-8')).hexdigest())
+    if related:
+        _, related_modified, timestamped = related
+        # Nothing would move Last-Modified when an untimestamped row changes
+        last_modified = max(filter(None, (last_modified, related_modified)), default=None) if timestamped else None
+    if extra is not None:
+        last_modified = None
+    return etag, int(last_modified.timestamp()) if last_modified else None
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+class ConditionalReadMixin:
+    """
+    Answer list and retrieve with 304 Not Modified while their rows are unchanged
+
+    Views with other conditional actions call conditional_response() from
+    them, and override get_version_relations() when those render other rows
+    than get_serializer() does. Override get_version_extras() when the rows
+    listed depend on other tables, through a filter.
+    """
+    known_row_versions = None
+    rendered_rows = None
+    rendered_page = False
+    listed_queryset = None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, lambda: self.filter_queryset(self.get_queryset()), request, *args, **kwargs
+        )
+
+    def filter_queryset(self, queryset):
+        # The versions and the list itself share one pass of the filter backends
+        if self.action != 'list':
+            return super().filter_queryset(queryset)
+        if self.listed_queryset is None:
+            self.listed_queryset = super().filter_queryset(queryset)
+        return self.listed_queryset
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, None, request, *args, **kwargs)
+
+    def get_version_timestamps(self):
+        """Fields of the rendered rows whose latest value versions the response"""
+        return ('updated_at',)
+
+    def get_version_relations(self):
+        """Related rows the response renders, as rendered_relations() gives them"""
+        return rendered_relations(self.get_serializer())
+
+    def get_version_extras(self):
+        """Versions of other rows the response depends on, or None"""
+        return None
+
+    def related_versions(self, rows=None, queryset=None):
+        """
+        related_versions() of the relations rendered with rows, or with a queryset's rows
+
+        Rows whose relations are loaded are read without querying; otherwise
+        the related rows are read in one query.
+        """
+        relations = self.get_version_relations()
+        if not relations or rows is not None and not rows:
+            return None
+        if rows is not None:
+            try:
+                return related_versions(relations, loaded_related_rows(rows, relations))
+            except LookupError:
+                model, pks = rows[0]._meta.model, [row.pk for row in rows]
+        else:
+            model, pks = queryset.model, queryset.order_by().values('pk')
+        return related_versions(relations, related_rows(model, pks, relations))
+
+    def detail_queryset(self):
+        """The queryset get_object() looks the object up in, narrowed to it"""
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return self.filter_queryset(self.get_queryset()).filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+
+    def get_object(self):
+        obj = super().get_object()
+        self.rendered_rows = [obj]
+        return obj
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        self.rendered_page = page is not None
+        return page
+
+    def get_serializer(self, *args, **kwargs):
+        if args and kwargs.get('many'):
+            self.rendered_rows = args[0]
+        return super().get_serializer(*args, **kwargs)
+
+    def page_versions(self, rows):
+        """
+        Row versions of a page: its rows plus the paginator's links and counts
+
+        Pages are versioned on their own rows rather than the whole list, so
+        a keyset page never needs a COUNT(*).
+        """
+        count, last_modified = loaded_row_versions(rows, self.get_version_timestamps())
+        envelope = self.get_paginated_response([]).data
+        page = sorted((key, value) for key, value in envelope.items() if key != 'results')
+        return count, last_modified, page, self.related_versions(rows), self.get_version_extras()
+
+    def current_row_versions(self, queryset):
+        """Row versions the response would have, read before anything is serialized"""
+        if queryset is None:
+            queryset = self.detail_queryset()
+        else:
+            queryset = queryset()
+            page = self.paginate_queryset(queryset.prefetch_related(None))
+            if page is not None:
+                return self.page_versions(page)
+        count, last_modified = row_versions(queryset, self.get_version_timestamps())
+        related = self.related_versions(queryset=queryset) if count else None
+        return count, last_modified, None, related, self.get_version_extras()
+
+    def rendered_row_versions(self):
+        """Row versions of the response just built, None if they are unknown"""
+        if self.known_row_versions is not None:
+            return self.known_row_versions
+        if self.rendered_rows is None:
+            return None
+        # An evaluated queryset iterates its cached rows
+        rows = list(self.rendered_rows)
+        try:
+            if self.rendered_page and not self.detail:
+                return self.page_versions(rows)
+            count, last_modified = loaded_row_versions(rows, self.get_version_timestamps())
+            return count, last_modified, None, self.related_versions(rows), self.get_version_extras()
+        except LookupError:
+            return None
+
+    def conditional_response(self, handler, queryset, request, *args, **kwargs):
+        """
+        Return 304 (or 412) if the request's preconditions hold, else handler's response
+
+        Args:
+            handler: Builds the full response
+            queryset: Returns the rows that response renders, filtered but not
+                paginated; None for the object get_object() looks up
+        """
+        if any(header in request.META for header in CONDITIONAL_HEADERS):
+            try:
+                versions = self.current_row_versions(queryset)
+            except (TypeError, ValueError, ValidationError, LookupError):
+                # A malformed lookup, which get_object() answers with a 404
+                return handler(request, *args, **kwargs)
+            if self.detail and not versions[0]:
+                return handler(request, *args, **kwargs)
+
+            self.known_row_versions = versions
+            etag, last_modified = validators(request, *versions)
+            # A 304 copies its validators from the response it stands in for
+            unchanged = set_validators(HttpResponse(), etag, last_modified)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified, response=unchanged)
+            if response is not unchanged:
+                return response
+
+        response = handler(request, *args, **kwargs)
+        versions = self.rendered_row_versions() if response.status_code == 200 else None
+        if versions is not None:
+            set_validators(response, *validators(request, *versions))
+        return response
@@ -1,81 +1,87 @@
 """
-Celery tasks for asynchronous email sending
+Payment notification emails
+
+Views never talk to SMTP. dispatch_payment_email() queues a Celery task once
+the surrounding transaction commits, the task renders the email into the
+QueuedEmail outbox, and drain_email_outbox() delivers queued emails in
+batches over a single reused connection. The tasks live in listings.tasks.
 """
 import logging
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+from django.core.mail import EmailMultiAlternatives, get_connection, send_mail
+from django.db import transaction
+from django.utils import timezone
 from django.conf import settings
 
-logger = logging.getLogger(__name__)
+from .models import QueuedEmail
 
-# This will be used when Celery is configured
-# from celery import shared_task
+logger = logging.getLogger(__name__)
 
-# For now, we'll create a non-async version that can be easily converted to Celery
+EMAIL_KINDS = ('confirmation', 'failure')
 
 
-def send_payment_confirmation_email(booking_obj, payment_obj):
+def build_payment_confirmation_email(booking_obj, payment_obj):
     """
-    Send payment confirmation email to the guest
+    Render the payment confirmation email for a booking
     
     Args:
         booking_obj: Booking model instance
         payment_obj: Payment model instance
+
+    Returns:
+        tuple: (subject, plain_message, html_message)
     """
-    try:
-        subject = 'Payment Confirmation - Your Travel Booking'
-        
-        # Prepare email context
-        context = {
-            'guest_name': booking_obj.guest.first_name or booking_obj.guest.username,
-            'listing_title': booking_obj.listing.title,
-            'listing_location': booking_obj.listing.location,
-            'check_in_date': booking_obj.check_in_date,
-            'check_out_date': booking_obj.check_out_date,
-            'amount': payment_obj.amount,
-            'currency': payment_obj.currency,
-            'payment_id': payment_obj.payment_id,
-            'transaction_id': payment_obj.transaction_id,
-            'booking_id': booking_obj.booking_id,
-        }
-        
-        # Create plain text and HTML email
-        html_message = f"""
-        <html>
-            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                    <h2>Payment Confirmation</h2>
-                    <p>Dear {context['guest_name']},</p>
-                    
-                    <p>Your payment has been successfully processed. Here are your booking details:</p>
-                    
-                    <div style="background-color: #f5f5f5; padding: 15px; border-radius: 5px; margin: 20px 0;">
-                        <p><strong>Listing:</strong> {context['listing_title']}</p>
-                        <p><strong>Location:</strong> {context['listing_location']}</p>
-                        <p><strong>Check-in:</strong> {context['check_in_date']}</p>
-                        <p><strong>Check-out:</strong> {context['check_out_date']}</p>
-                        <p><strong>Amount Paid:</strong> {context['amount']} {context['currency']}</p>
-                        <p><strong>Booking Reference:</strong> {context['booking_id']}</p>
-                        <p><strong>Transaction ID:</strong> {context['transaction_id']}</p>
-                    </div>
-                    
-                    <p>Your booking is now confirmed. You can check your booking details in your account dashboard.</p>
-                    
-                    <p>If you have any questions, please contact the property host or our support team.</p>
-                    
-                    <p>Thank you for choosing our travel platform!</p>
-                    
-                    <hr style="margin-top: 30px; color: #ddd;">
-                    <p style="font-size: 12px; color: #999;">
-                        This is an automated email. Please do not reply directly to this email.
-                    </p>
+    subject = 'Payment Confirmation - Your Travel Booking'
+    
+    # Prepare email context
+    context = {
+        'guest_name': booking_obj.guest.first_name or booking_obj.guest.username,
+        'listing_title': booking_obj.listing.title,
+        'listing_location': booking_obj.listing.location,
+        'check_in_date': booking_obj.check_in_date,
+        'check_out_date': booking_obj.check_out_date,
+        'amount': payment_obj.amount,
+        'currency': payment_obj.currency,
+        'payment_id': payment_obj.payment_id,
+        'transaction_id': payment_obj.transaction_id,
+        'booking_id': booking_obj.booking_id,
+    }
+    
+    # Create plain text and HTML email
+    html_message = f"""
+    <html>
+        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+            <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
+                <h2>Payment Confirmation</h2>
+                <p>Dear {context['guest_name']},</p>
+                
+                <p>Your payment has been successfully processed. Here are your booking details:</p>
+                
+                <div style="background-color: #f5f5f5; padding: 15px; border-radius: 5px; margin: 20px 0;">
+                    <p><strong>Listing:</strong> {context['listing_title']}</p>
+                    <p><strong>Location:</strong> {context['listing_location']}</p>
+                    <p><strong>Check-in:</strong> {context['check_in_date']}</p>
+                    <p><strong>Check-out:</strong> {context['check_out_date']}</p>
+                    <p><strong>Amount Paid:</strong> {context['amount']} {context['currency']}</p>
+                    <p><strong>Booking Reference:</strong> {context['booking_id']}</p>
+                    <p><strong>Transaction ID:</strong> {context['transaction_id']}</p>
                 </div>
-            </body>
-        </html>
-        """
-        
-        plain_message = f"""
+                
+                <p>Your booking is now confirmed. You can check your booking details in your account dashboard.</p>
+                
+                <p>If you have any questions, please contact the property host or our support team.</p>
+                
+                <p>Thank you for choosing our travel platform!</p>
+                
+                <hr style="margin-top: 30px; color: #ddd;">
+                <p style="font-size: 12px; color: #999;">
+                    This is an automated email. Please do not reply directly to this email.
+                </p>
+            </div>
+        </body>
+    </html>
+    """
+    
+    plain_message = f"""
 Payment Confirmation
 
 Dear {context['guest_name']},
@@ -95,9 +101,88 @@ Your booking is now confirmed. You can check your booking details in your accoun
 If you have any questions, please contact the property host or our support team.
 
 Thank you for choosing our travel platform!
-        """
-        
-        # Send email
+    """
+    
+    return subject, plain_message, html_message
+
+
+def build_payment_failure_email(booking_obj, payment_obj, error_message):
+    """
+    Render the payment failure email for a booking
+    
+    Args:
+        booking_obj: Booking model instance
+        payment_obj: Payment model instance
+        error_message: Error message describing the failure
+
+    Returns:
+        tuple: (subject, plain_message, html_message)
+    """
+    subject = 'Payment Failed - Action Required'
+    
+    context = {
+        'guest_name': booking_obj.guest.first_name or booking_obj.guest.username,
+        'listing_title': booking_obj.listing.title,
+        'amount': payment_obj.amount,
+        'currency': payment_obj.currency,
+        'error_message': error_message,
+    }
+    
+    html_message = f"""
+    <html>
+        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+            <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
+                <h2 style="color: #d9534f;">Payment Failed</h2>
+                <p>Dear {context['guest_name']},</p>
+                
+                <p>Unfortunately, your payment could not be processed. Here are the details:</p>
+                
+                <div style="background-color: #fff3cd; padding: 15px; border-radius: 5px; margin: 20px 0; border-left: 4px solid #ffc107;">
+                    <p><strong>Listing:</strong> {context['listing_title']}</p>
+                    <p><strong>Amount:</strong> {context['amount']} {context['currency']}</p>
+                    <p><strong>Error:</strong> {context['error_message']}</p>
+                </div>
+                
+                <p>Please try again or contact your bank for more information. If the problem persists, please reach out to our support team.</p>
+                
+                <p>Thank you!</p>
+            </div>
+        </body>
+    </html>
+    """
+    
+    plain_message = f"""
+Payment Failed - Action Required
+
+Dear {context['guest_name']},
+
+Unfortunately, your payment could not be processed.
+
+Listing: {context['listing_title']}
+Amount: {context['amount']} {context['currency']}
+Error: {context['error_message']}
+
+Please try again or contact your bank for more information. 
+If the problem persists, please reach out to our support team.
+
+Thank you!
+    """
+    
+    return subject, plain_message, html_message
+
+
+def send_payment_confirmation_email(booking_obj, payment_obj):
+    """
+    Send payment confirmation email to the guest immediately
+    
+    Request handlers should use dispatch_payment_email() instead.
+
+    Args:
+        booking_obj: Booking model instance
+        payment_obj: Payment model instance
+    """
+    try:
+        subject, plain_message, html_message = build_payment_confirmation_email(booking_obj, payment_obj)
         send_mail(
             subject=subject,
             message=plain_message,
@@ -117,64 +202,19 @@ Thank you for choosing our travel platform!
 
 def send_payment_failure_email(booking_obj, payment_obj, error_message):
     """
-    Send payment failure notification email to the guest
+    Send payment failure notification email to the guest immediately
     
+    Request handlers should use dispatch_payment_email() instead.
+
     Args:
         booking_obj: Booking model instance
         payment_obj: Payment model instance
         error_message: Error message describing the failure
     """
     try:
-        subject = 'Payment Failed - Action Required'
-        
-        context = {
-            'guest_name': booking_obj.guest.first_name or booking_obj.guest.username,
-            'listing_title': booking_obj.listing.title,
-            'amount': payment_obj.amount,
-            'currency': payment_obj.currency,
-            'error_message': error_message,
-        }
-        
-        html_message = f"""
-        <html>
-            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                    <h2 style="color: #d9534f;">Payment Failed</h2>
-                    <p>Dear {context['guest_name']},</p>
-                    
-                    <p>Unfortunately, your payment could not be processed. Here are the details:</p>
-                    
-                    <div style="background-color: #fff3cd; padding: 15px; border-radius: 5px; margin: 20px 0; border-left: 4px solid #ffc107;">
-                        <p><strong>Listing:</strong> {context['listing_title']}</p>
-                        <p><strong>Amount:</strong> {context['amount']} {context['currency']}</p>
-                        <p><strong>Error:</strong> {context['error_message']}</p>
-                    </div>
-                    
-                    <p>Please try again or contact your bank for more information. If the problem persists, please reach out to our support team.</p>
-                    
-                    <p>Thank you!</p>
-                </div>
-            </body>
-        </html>
-        """
-        
-        plain_message = f"""
-Payment Failed - Action Required
-
-Dear {context['guest_name']},
-
-Unfortunately, your payment could not be processed.
-
-Listing: {context['listing_title']}
-Amount: {context['amount']} {context['currency']}
-Error: {context['error_message']}
-
-Please try again or contact your bank for more information. 
-If the problem persists, please reach out to our support team.
-
-Thank you!
-        """
-        
+        subject, plain_message, html_message = build_payment_failure_email(
+            booking_obj, payment_obj, error_message
+        )
         send_mail(
             subject=subject,
             message=plain_message,
@@ -191,3 +231,128 @@ Thank you!
         logger.error(f"Failed to send payment failure email: {str(e)}")
         return False
 
+
+def dispatch_payment_email(payment_obj, kind, error_message=None):
+    """
+    Queue a payment email to be sent once the current transaction commits
+
+    Only the payment ID crosses the broker; the task reloads everything else,
+    so a rolled-back payment never produces an email.
+
+    Args:
+        payment_obj: Payment model instance
+        kind: 'confirmation' or 'failure'
+        error_message: Error message for failure emails
+    """
+    from .tasks import send_payment_email
+
+    if kind not in EMAIL_KINDS:
+        raise ValueError(f"Unknown payment email kind: {kind}")
+
+    payment_id = str(payment_obj.payment_id)
+    transaction.on_commit(lambda: send_payment_email.delay(payment_id, kind, error_message))
+
+
+def queue_payment_email(payment_obj, kind, error_message=None):
+    """
+    Render a payment email into the outbox
+
+    Args:
+        payment_obj: Payment model instance with its booking loaded
+        kind: 'confirmation' or 'failure'
+        error_message: Error message for failure emails
+
+    Returns:
+        QueuedEmail: The queued email, or None if the guest has no address
+    """
+    booking_obj = payment_obj.booking
+    if not booking_obj.guest.email:
+        logger.warning(f"Guest of booking {booking_obj.booking_id} has no email address")
+        return None
+
+    if kind == 'confirmation':
+        subject, plain_message, html_message = build_payment_confirmation_email(booking_obj, payment_obj)
+    elif kind == 'failure':
+        subject, plain_message, html_message = build_payment_failure_email(
+            booking_obj, payment_obj, error_message
+        )
+    else:
+        raise ValueError(f"Unknown payment email kind: {kind}")
+
+    return QueuedEmail.objects.create(
+        to=booking_obj.guest.email,
+        subject=subject,
+        body=plain_message,
+        html_body=html_message,
+    )
+
+
+def build_message(email, connection):
+    """Turn a QueuedEmail into a message bound to an open connection"""
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=settings.EMAIL_HOST_USER,
+        to=[email.to],
+        connection=connection,
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def drain_email_outbox(batch_size=100, max_attempts=5):
+    """
+    Deliver queued emails in batches over one SMTP connection
+
+    Rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so several
+    workers can drain the outbox at once without sending an email twice.
+    An email that keeps failing is marked failed after max_attempts.
+
+    Args:
+        batch_size: Emails claimed per transaction
+        max_attempts: Delivery attempts before an email is given up on
+
+    Returns:
+        dict: Counts of 'sent' and 'failed' deliveries
+    """
+    counts = {'sent': 0, 'failed': 0}
+    connection = get_connection(fail_silently=False)
+    connection.open()
+    try:
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    QueuedEmail.objects.select_for_update(skip_locked=True)
+                    .filter(status='queued')
+                    .order_by('created_at')[:batch_size]
+                )
+                failures = 0
+                for email in batch:
+                    email.attempts += 1
+                    try:
+                        connection.send_messages([build_message(email, connection)])
+                    except Exception as e:
+                        failures += 1
+                        email.last_error = str(e)
+                        if email.attempts >= max_attempts:
+                            email.status = 'failed'
+                            counts['failed'] += 1
+                        logger.error(f"Failed to send queued email {email.pk}: {str(e)}")
+                    else:
+                        email.status = 'sent'
+                        email.sent_at = timezone.now()
+                        counts['sent'] += 1
+                QueuedEmail.objects.bulk_update(
+                    batch, ['status', 'attempts', 'last_error', 'sent_at']
+                )
+
+            # Stop on a short batch, or after failures so a broken server isn't hammered
+            if len(batch) < batch_size or failures:
+                break
+    finally:
+        connection.close()
+
+    if counts['sent'] or counts['failed']:
+        logger.info(f"Email outbox drained: {counts['sent']} sent, {counts['failed']} failed")
+    return counts
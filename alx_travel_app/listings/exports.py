@@ -0,0 +1,265 @@
+"""
+Streaming CSV and NDJSON exports of bookings and payments
+
+Rows are read in keyset batches on (created_at, pk) and written to the
+response as they are read, so an export of any length holds one batch in
+memory. A batch is its own query: MySQL's client library reads a whole
+result set into memory, so a single long .iterator() would only keep
+memory flat on PostgreSQL and SQLite, and it would hold a cursor open for
+the whole download.
+"""
+import csv
+import io
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+from .models import Booking, Listing, Payment
+
+# (column, lookup) pairs
+BOOKING_EXPORT_FIELDS = [
+    ('booking_id', 'booking_id'),
+    ('listing_id', 'listing_id'),
+    ('listing_title', 'listing__title'),
+    ('guest', 'guest__username'),
+    ('check_in_date', 'check_in_date'),
+    ('check_out_date', 'check_out_date'),
+    ('total_price', 'total_price'),
+    ('status', 'status'),
+    ('created_at', 'created_at'),
+]
+
+PAYMENT_EXPORT_FIELDS = [
+    ('payment_id', 'payment_id'),
+    ('booking_id', 'booking_id'),
+    ('listing_title', 'booking__listing__title'),
+    ('amount', 'amount'),
+    ('currency', 'currency'),
+    ('status', 'status'),
+    ('transaction_id', 'transaction_id'),
+    ('payment_method', 'payment_method'),
+    ('created_at', 'created_at'),
+    ('completed_at', 'completed_at'),
+]
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Rows written to the response per chunk; one chunk per row would cost a write per row
+ROWS_PER_CHUNK = 500
+
+PAYMENT_LOOKUP_BATCH = 500
+
+
+def parse_export_params(params, statuses):
+    """
+    Validate ?output=, ?role=, ?start=, ?end= and ?status= of an export request
+
+    Args:
+        params: Request query params
+        statuses: Status values the model accepts
+
+    Returns:
+        dict: output, role ('host' or 'guest'), start and end dates (or None),
+        and the status list (or None)
+    """
+    output = params.get('output', 'csv')
+    if output not in EXPORT_FORMATS:
+        raise ValidationError({'output': f"Choose one of: {', '.join(EXPORT_FORMATS)}."})
+    role = params.get('role', 'host')
+    if role not in ('host', 'guest'):
+        raise ValidationError({'role': 'Choose host or guest.'})
+
+    start, end = parse_date_range(params)
+
+    status = [value for value in params.get('status', '').split(',') if value] or None
+    unknown = sorted(set(status or ()) - set(statuses))
+    if unknown:
+        raise ValidationError({'status': f"Unknown status: {', '.join(unknown)}."})
+    return {'output': output, 'role': role, 'start': start, 'end': end, 'status': status}
+
+
+def parse_date_range(params):
+    """
+    Validate the optional ?start= and ?end= dates of a request
+
+    Returns:
+        tuple: (start, end), either None when left out
+    """
+    dates = {}
+    for name in ('start', 'end'):
+        value = params.get(name)
+        try:
+            dates[name] = parse_date(value) if value else None
+        except ValueError:
+            dates[name] = None
+        if value and dates[name] is None:
+            raise ValidationError({name: 'Use a date in YYYY-MM-DD format.'})
+    if dates['start'] and dates['end'] and dates['start'] > dates['end']:
+        raise ValidationError({'end': 'The end date must not be before the start date.'})
+    return dates['start'], dates['end']
+
+
+def filter_by_date(queryset, field, start, end):
+    """Keep rows whose date or datetime ``field`` falls within [start, end], both inclusive"""
+    if queryset.model._meta.get_field(field).get_internal_type() != 'DateTimeField':
+        if start:
+            queryset = queryset.filter(**{f'{field}__gte': start})
+        if end:
+            queryset = queryset.filter(**{f'{field}__lte': end})
+        return queryset
+
+    # Whole-day bounds keep the comparison on the bare column, where an index can serve it
+    if start:
+        queryset = queryset.filter(**{f'{field}__gte': timezone.make_aware(datetime.combine(start, time.min))})
+    if end:
+        next_day = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+        queryset = queryset.filter(**{f'{field}__lt': next_day})
+    return queryset
+
+
+def iterate_batches(queryset, lookups, chunk_size=2000):
+    """
+    Yield lists of values_list rows of a queryset in (created_at, pk) order
+
+    Each batch is one query resuming after the last row of the previous one.
+    The queryset's filter should be served by an index ending in
+    (created_at, pk), so a batch is a range read rather than a sort of every
+    matching row.
+
+    Args:
+        queryset: Rows to read
+        lookups: Field lookups to select; must include 'created_at' and the primary key
+        chunk_size: Rows read per query
+    """
+    created_index = lookups.index('created_at')
+    pk_index = lookups.index(queryset.model._meta.pk.name)
+    rows = queryset.order_by('created_at', 'pk').values_list(*lookups)
+
+    batch = list(rows[:chunk_size])
+    while batch:
+        yield batch
+        if len(batch) < chunk_size:
+            return
+        created_at, pk = batch[-1][created_index], batch[-1][pk_index]
+        # The bare created_at >= bound lets the index seek to the resume point;
+        # with only the OR, SQLite and MySQL scan from the listing's first row
+        after = Q(created_at__gte=created_at) & (Q(created_at__gt=created_at) | Q(pk__gt=pk))
+        batch = list(rows.filter(after)[:chunk_size])
+
+
+def booking_partitions(user, role, chunk_size=2000):
+    """
+    Yield querysets that together hold the bookings a user exports
+
+    A guest's bookings are read through the (guest, created_at) index in one
+    pass. A host's are read listing by listing through the (listing,
+    created_at) index: ordering all of a host's bookings by created_at
+    would sort every one of them again for each batch.
+    """
+    if role == 'guest':
+        yield Booking.objects.filter(guest=user)
+        return
+    for batch in iterate_batches(Listing.objects.filter(host=user), ['listing_id', 'created_at'], chunk_size):
+        for listing_id, _ in batch:
+            yield Booking.objects.filter(listing_id=listing_id)
+
+
+def export_bookings(user, options, chunk_size=2000):
+    """
+    Rows of a booking export
+
+    Returns:
+        tuple: (column names, iterator of rows)
+    """
+    lookups = [lookup for _, lookup in BOOKING_EXPORT_FIELDS]
+
+    def rows():
+        for bookings in booking_partitions(user, options['role'], chunk_size):
+            bookings = filter_by_date(bookings, 'check_in_date', options['start'], options['end'])
+            if options['status']:
+                bookings = bookings.filter(status__in=options['status'])
+            for batch in iterate_batches(bookings, lookups, chunk_size):
+                yield from batch
+
+    return [column for column, _ in BOOKING_EXPORT_FIELDS], rows()
+
+
+def export_payments(user, options, chunk_size=2000):
+    """
+    Rows of a payment export, grouped by booking in booking export order
+
+    Payments are looked up by booking id for each batch of bookings, so
+    every query stays on an index.
+
+    Returns:
+        tuple: (column names, iterator of rows)
+    """
+    lookups = [lookup for _, lookup in PAYMENT_EXPORT_FIELDS]
+    # Booking ids per payment query, below SQLite's 999 parameter limit
+    per_query = min(chunk_size, PAYMENT_LOOKUP_BATCH)
+
+    def rows():
+        for bookings in booking_partitions(user, options['role'], chunk_size):
+            for batch in iterate_batches(bookings, ['booking_id', 'created_at'], per_query):
+                payments = Payment.objects.filter(booking_id__in=[booking_id for booking_id, _ in batch])
+                payments = filter_by_date(payments, 'created_at', options['start'], options['end'])
+                if options['status']:
+                    payments = payments.filter(status__in=options['status'])
+                yield from payments.order_by(
+                    'booking__created_at', 'booking_id', 'created_at', 'pk'
+                ).values_list(*lookups)
+
+    return [column for column, _ in PAYMENT_EXPORT_FIELDS], rows()
+
+
+def csv_chunks(columns, rows):
+    """Yield CSV text, a header line then ROWS_PER_CHUNK rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(columns, rows):
+    """Yield one JSON object per line, ROWS_PER_CHUNK lines at a time"""
+    encoder = DjangoJSONEncoder()
+    lines = []
+    for row in rows:
+        lines.append(encoder.encode(dict(zip(columns, row))))
+        if len(lines) == ROWS_PER_CHUNK:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def export_response(columns, rows, output, filename):
+    """
+    Stream rows as a CSV or NDJSON attachment
+
+    Args:
+        columns: Column names
+        rows: Iterator of row tuples
+        output: 'csv' or 'ndjson'
+        filename: Download name without extension
+    """
+    chunks = csv_chunks(columns, rows) if output == 'csv' else ndjson_chunks(columns, rows)
+    response = StreamingHttpResponse(chunks, content_type=EXPORT_FORMATS[output])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{output}"'
+    return response
@@ -0,0 +1,178 @@
+"""
+Per-request SQL and outbound HTTP instrumentation
+
+A RequestProfile counts and times every statement sent through Django's
+database connections while it captures, remembers the slowest ones and
+groups them by fingerprint (the SQL with literal values and IN lists
+collapsed), so one query run once per row - an N+1 - shows up as a single
+fingerprint with a high count. Outbound calls wrapped in outbound_call()
+are timed per service.
+
+RequestProfilingMiddleware (listings.middleware) captures a profile for
+every request and reports it in a Server-Timing header and sampled logs.
+"""
+import heapq
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Profile of the request being handled, if profiling is on
+current_profile = ContextVar('current_profile', default=None)
+
+IN_LIST = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+STRING = re.compile(r"'(?:[^']|'')*'")
+
+
+def fingerprint(sql):
+    """
+    SQL with its varying parts collapsed
+
+    "... WHERE id IN (%s, %s, %s) LIMIT 21" -> "... WHERE id IN (...) LIMIT ?"
+    """
+    sql = IN_LIST.sub('(...)', sql)
+    sql = STRING.sub('?', sql)
+    return NUMBER.sub('?', sql)
+
+
+class RequestProfile:
+    """SQL and outbound HTTP time spent while capturing"""
+
+    def __init__(self, slowest=5):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.slowest_size = slowest
+        self.slowest = []
+        self.fingerprints = Counter()
+        self.http_time = Counter()
+        self.http_calls = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record_query(sql, time.perf_counter() - started)
+
+    def record_query(self, sql, duration):
+        self.query_count += 1
+        self.sql_time += duration
+        self.fingerprints[fingerprint(sql)] += 1
+        entry = (duration, self.query_count, sql)
+        if len(self.slowest) < self.slowest_size:
+            heapq.heappush(self.slowest, entry)
+        elif duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def record_http(self, service, duration):
+        self.http_time[service] += duration
+        self.http_calls[service] += 1
+
+    @contextmanager
+    def capture(self):
+        """Record the queries of every database connection, and outbound calls, in the block"""
+        token = current_profile.set(self)
+        # Under ASGI the ORM calls run on other threads, whose connections
+        # are hooked as they open; the context variable follows them there
+        connection_created.connect(hook_new_connection, dispatch_uid='listings.instrumentation')
+        hook_thread_connections()
+        try:
+            yield self
+        finally:
+            current_profile.reset(token)
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def slowest_queries(self):
+        """(seconds, sql) of the slowest statements, slowest first"""
+        return [(duration, sql) for duration, _, sql in sorted(self.slowest, reverse=True)]
+
+    def repeated_queries(self, min_count=2):
+        """(fingerprint, count) of statements run at least min_count times, most repeated first"""
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count >= min_count]
+
+    def server_timing(self, repeat_threshold=3):
+        """Server-Timing header value, durations in milliseconds"""
+        total = self.elapsed
+        outbound = sum(self.http_time.values())
+        repeated = len(self.repeated_queries(repeat_threshold))
+        queries = f'{self.query_count} quer{"ies" if self.query_count != 1 else "y"}'
+        if repeated:
+            queries += f', {repeated} repeated'
+        metrics = [f'db;dur={self.sql_time * 1000:.1f};desc="{queries}"']
+        for service, duration in sorted(self.http_time.items()):
+            calls = self.http_calls[service]
+            metrics.append(f'{service};dur={duration * 1000:.1f};desc="{calls} call{"s" if calls != 1 else ""}"')
+        metrics.append(f'app;dur={max(0.0, total - self.sql_time - outbound) * 1000:.1f}')
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def as_dict(self, repeat_threshold=3):
+        """Summary for structured logs, durations in milliseconds"""
+        return {
+            'total_ms': round(self.elapsed * 1000, 1),
+            'queries': self.query_count,
+            'sql_ms': round(self.sql_time * 1000, 1),
+            'slowest': [
+                {'ms': round(duration * 1000, 1), 'sql': sql[:500]} for duration, sql in self.slowest_queries()
+            ],
+            'repeated': [
+                {'count': count, 'sql': sql[:500]} for sql, count in self.repeated_queries(repeat_threshold)
+            ],
+            'http': {
+                service: {'calls': self.http_calls[service], 'ms': round(duration * 1000, 1)}
+                for service, duration in self.http_time.items()
+            },
+        }
+
+
+def profile_query(execute, sql, params, many, context):
+    """Execute wrapper handing each statement to the current profile, if any"""
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+def hook_connection(connection):
+    if profile_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profile_query)
+
+
+def hook_new_connection(sender, connection, **kwargs):
+    hook_connection(connection)
+
+
+def hook_thread_connections():
+    """
+    Hand the queries of this thread's connections to the current profile
+
+    For a thread that keeps its connections open across requests, and so
+    may have opened them before profiling started.
+    """
+    if current_profile.get() is None:
+        return
+    for connection in connections.all():
+        hook_connection(connection)
+
+
+@contextmanager
+def outbound_call(service):
+    """Time an outbound HTTP call against the current request's profile, if any"""
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.record_http(service, time.perf_counter() - started)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from listings.benchmarks import get_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Run a performance benchmark against the configured database'
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='benchmark', required=True)
+        for name, benchmark in get_benchmarks().items():
+            subparser = subparsers.add_parser(name, help=benchmark.help)
+            benchmark.add_arguments(subparser)
+
+    def handle(self, *args, **options):
+        benchmark = get_benchmarks()[options['benchmark']]
+        self.stdout.write(f"Running benchmark '{benchmark.name}'...")
+        benchmark.run(self.stdout, **options)
+        self.stdout.write(self.style.SUCCESS('Benchmark finished.'))
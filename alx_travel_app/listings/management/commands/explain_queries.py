@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from listings.query_plans import QUERY_SHAPES, check_query_plans
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the queries behind the main API requests and flag full scans and unindexed sorts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='Database to explain queries on',
+        )
+        parser.add_argument(
+            '--shape',
+            action='append',
+            choices=[shape.name for shape in QUERY_SHAPES],
+            help='Only check the named query shape (repeatable)',
+        )
+
+    def handle(self, *args, **options):
+        shapes = [shape for shape in QUERY_SHAPES if not options['shape'] or shape.name in options['shape']]
+        try:
+            results = check_query_plans(shapes, using=options['database'])
+        except NotImplementedError as exc:
+            raise CommandError(str(exc))
+
+        flagged = 0
+        for shape, explained in results:
+            problems = [problem for _, _, query_problems in explained for problem in query_problems]
+            if problems:
+                flagged += 1
+                self.stdout.write(self.style.WARNING(f'{shape.name}: {len(problems)} problem(s)'))
+            else:
+                self.stdout.write(f'{shape.name}: ok ({len(explained)} queries)')
+
+            for sql, plan, query_problems in explained:
+                if query_problems or options['verbosity'] > 1:
+                    self.stdout.write(f'  {sql}')
+                    for line in plan:
+                        self.stdout.write(f'    {line}')
+                    for problem in query_problems:
+                        self.stdout.write(self.style.WARNING(f'    ! {problem}'))
+
+        if flagged:
+            raise CommandError(f'{flagged} of {len(results)} query shapes need an index')
+        self.stdout.write(self.style.SUCCESS(f'All {len(results)} query shapes are served from indexes.'))
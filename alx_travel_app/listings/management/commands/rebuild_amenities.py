@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from listings.amenities import rebuild_amenity_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild listing amenity masks and the amenity index from the amenities text'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of listings parsed per batch',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding amenity index...')
+        indexed = rebuild_amenity_index(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Indexed {indexed} listing amenities.')
+        )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from listings.availability import rebuild_availability_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the listing availability index from existing bookings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of nights inserted per batch',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding availability index...')
+        indexed = rebuild_availability_index(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Indexed {indexed} booked nights.')
+        )
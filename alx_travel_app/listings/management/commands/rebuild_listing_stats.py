@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from listings.ratings import rebuild_listing_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the rating aggregates stored on listings from their reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of listings updated per batch',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding listing rating aggregates...')
+        reviewed = rebuild_listing_stats(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Updated aggregates for {reviewed} reviewed listings.')
+        )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from listings.revenue import rebuild_revenue_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily revenue rollups from payments and bookings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rollup rows inserted per batch',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding daily revenue rollups...')
+        rows = rebuild_revenue_rollups(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Wrote {rows} daily revenue rows.')
+        )
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from listings.search import get_search_backend, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the listing full-text search index from the listings table'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        self.stdout.write(f'Rebuilding the {backend.name} search index...')
+        indexed = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} listings.'))
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from listings.reconciliation import reconcile_pending_payments
+
+
+class Command(BaseCommand):
+    help = 'Verify pending payments with Chapa and record completed or failed ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=settings.PAYMENT_RECONCILE_CHUNK_SIZE,
+            help='Number of payments loaded and updated per chunk',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.PAYMENT_RECONCILE_WORKERS,
+            help='Number of concurrent verify requests',
+        )
+        parser.add_argument(
+            '--rate-limit',
+            type=float,
+            default=settings.PAYMENT_RECONCILE_RATE_LIMIT,
+            help='Verify requests per second across all workers (0 for no limit)',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=settings.PAYMENT_RECONCILE_MIN_AGE,
+            help='Skip payments created less than this many seconds ago',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Reconciling pending payments...')
+        stats = reconcile_pending_payments(
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            rate_limit=options['rate_limit'],
+            min_age=options['min_age'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {stats['processed']} payments in {stats['elapsed']:.2f}s "
+            f"({stats['rate']:.1f}/s): {stats['completed']} completed, "
+            f"{stats['failed']} failed, {stats['errors']} errors."
+        ))
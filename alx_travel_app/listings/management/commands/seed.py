@@ -1,16 +1,79 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth.models import User
+from django.db import connection
 from decimal import Decimal
 from datetime import date, timedelta
 import random
+import time
 
-from alx_travel_app.listings.models import Listing, Booking, Review
+from listings.models import Listing, Booking, Review
+from listings.synthetic import (
+    create_listing_chunk,
+    create_user_chunk,
+    finish_synthetic_data,
+    listing_chunks,
+    plan_synthetic_data,
+    run_chunks,
+    user_chunks,
+)
 
 
 class Command(BaseCommand):
-    help = 'Seed the database with sample listing data'
+    help = 'Seed the database with sample listing data, or with synthetic data at volume (--listings)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--listings',
+            type=int,
+            help='Generate this many synthetic listings, added to existing data, instead of the sample set',
+        )
+        parser.add_argument(
+            '--users',
+            type=int,
+            help='Number of synthetic users (default: a quarter of --listings)',
+        )
+        parser.add_argument(
+            '--bookings-per-listing',
+            type=int,
+            default=5,
+            help='Average number of bookings per synthetic listing',
+        )
+        parser.add_argument(
+            '--review-rate',
+            type=float,
+            default=0.6,
+            help='Share of completed stays that get a review',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed; the same seed generates the same rows',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of users or listings generated per unit of work',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows inserted per statement',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of worker processes generating chunks',
+        )
 
     def handle(self, *args, **options):
+        if options['listings'] is not None:
+            self.seed_synthetic(options)
+            return
+
         self.stdout.write('Starting database seeding...')
 
         # Clear existing data to prevent duplicates on re-run
@@ -146,3 +209,53 @@ class Command(BaseCommand):
             )
             if created:
                 self.stdout.write(f'Created review for {booking.listing.title}')
+
+    def seed_synthetic(self, options):
+        listings = options['listings']
+        users = options['users'] if options['users'] is not None else max(2, listings // 4)
+        if options['workers'] > 1 and connection.vendor == 'sqlite':
+            raise CommandError('SQLite allows one writer at a time; use --workers 1')
+        try:
+            plan = plan_synthetic_data(
+                users,
+                listings,
+                seed=options['seed'],
+                chunk_size=options['chunk_size'],
+                batch_size=options['batch_size'],
+                bookings_per_listing=options['bookings_per_listing'],
+                review_rate=options['review_rate'],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(
+            f"Generating {users} users and {listings} listings with seed {plan['seed']} "
+            f"on {options['workers']} worker(s)..."
+        )
+        started = time.perf_counter()
+        totals = {}
+        for phase, create_chunk, chunks in (
+            ('users', create_user_chunk, user_chunks(plan)),
+            ('listings', create_listing_chunk, listing_chunks(plan)),
+        ):
+            phase_started = time.perf_counter()
+            phase_rows = 0
+            for done, counts in enumerate(run_chunks(create_chunk, plan, chunks, options['workers']), 1):
+                for table, rows in counts.items():
+                    totals[table] = totals.get(table, 0) + rows
+                phase_rows += sum(counts.values())
+                elapsed = time.perf_counter() - phase_started
+                self.stdout.write(
+                    f'  {phase}: chunk {done}/{len(chunks)}, {phase_rows} rows, {phase_rows / elapsed:.0f} rows/s'
+                )
+
+        self.stdout.write('Rebuilding search index...')
+        finish_synthetic_data()
+
+        elapsed = time.perf_counter() - started
+        rows = sum(totals.values())
+        for table, count in totals.items():
+            self.stdout.write(f'  {table}: {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {rows} rows in {elapsed:.2f}s ({rows / elapsed:.0f} rows/s).'
+        ))
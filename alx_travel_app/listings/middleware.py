@@ -0,0 +1,66 @@
+import json
+import logging
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .instrumentation import RequestProfile
+
+logger = logging.getLogger(__name__)
+
+
+class RequestProfilingMiddleware:
+    """
+    Report each request's SQL and outbound HTTP time
+
+    Responses get a Server-Timing header (db, chapa, app and total). A
+    sample of requests, and every request slower than
+    REQUEST_PROFILING_SLOW_REQUEST_MS, is logged as JSON with the slowest
+    statements and the queries repeated REQUEST_PROFILING_REPEAT_THRESHOLD
+    times or more, the usual sign of an N+1.
+
+    With REQUEST_PROFILING_ENABLED off the middleware removes itself from
+    the chain when the server starts. It serves async requests natively, so
+    under ASGI it doesn't push the async views onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = settings.REQUEST_PROFILING_SAMPLE_RATE
+        self.slow_request = settings.REQUEST_PROFILING_SLOW_REQUEST_MS / 1000
+        self.repeat_threshold = settings.REQUEST_PROFILING_REPEAT_THRESHOLD
+        self.slowest = settings.REQUEST_PROFILING_SLOWEST_QUERIES
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = RequestProfile(slowest=self.slowest)
+        with profile.capture():
+            response = self.get_response(request)
+        return self.report(request, profile, response)
+
+    async def __acall__(self, request):
+        profile = RequestProfile(slowest=self.slowest)
+        with profile.capture():
+            response = await self.get_response(request)
+        return self.report(request, profile, response)
+
+    def report(self, request, profile, response):
+        """Add the Server-Timing header and log the profile if sampled or slow"""
+        response['Server-Timing'] = profile.server_timing(self.repeat_threshold)
+        if profile.elapsed >= self.slow_request or random.random() < self.sample_rate:
+            logger.info(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                **profile.as_dict(self.repeat_threshold),
+            }))
+        return response
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.7 on 2026-10-18 02:40
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_booked_nights(apps, schema_editor):
+    """Index the nights of bookings that already exist"""
+    Booking = apps.get_model('listings', 'Booking')
+    BookedNight = apps.get_model('listings', 'BookedNight')
+
+    batch = []
+    bookings = Booking.objects.filter(status__in=['pending', 'confirmed', 'completed'])
+    for booking in bookings.iterator(chunk_size=1000):
+        night = booking.check_in_date
+        while night < booking.check_out_date:
+            batch.append(BookedNight(listing_id=booking.listing_id, booking_id=booking.pk, night=night))
+            night += timedelta(days=1)
+        if len(batch) >= 5000:
+            BookedNight.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    BookedNight.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0002_payment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookedNight',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('night', models.DateField()),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='booked_nights', to='listings.booking')),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='booked_nights', to='listings.listing')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['night', 'listing'], name='bookednight_night_listing')],
+                'constraints': [models.UniqueConstraint(fields=('listing', 'night'), name='unique_listing_night')],
+            },
+        ),
+        migrations.RunPython(backfill_booked_nights, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.7 on 2026-10-18 02:46
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_rating_stats(apps, schema_editor):
+    """Compute the stored rating aggregates from existing reviews"""
+    Listing = apps.get_model('listings', 'Listing')
+    Review = apps.get_model('listings', 'Review')
+
+    aggregates = {'rating_sum': Sum('rating'), 'review_count': Count('pk')}
+    for star in range(1, 6):
+        aggregates[f'rating_{star}_count'] = Count('pk', filter=Q(rating=star))
+
+    rows = Review.objects.order_by().values('listing_id').annotate(**aggregates)
+    for row in rows:
+        Listing.objects.filter(pk=row.pop('listing_id')).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0003_bookednight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:12
+
+import sqlite3
+
+from django.db import migrations
+
+
+def sqlite_has_fts5():
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE fts5_probe USING fts5(body)')
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def create_search_index(apps, schema_editor):
+    """FULLTEXT index on MySQL, a populated FTS5 table on SQLite, nothing elsewhere"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute(
+            'CREATE FULLTEXT INDEX listing_fulltext ON listings_listing (title, description, location)'
+        )
+    elif vendor == 'sqlite' and sqlite_has_fts5():
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE listings_listing_fts USING fts5('
+            "listing_id, title, description, location, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        schema_editor.execute(
+            'INSERT INTO listings_listing_fts (listing_id, title, description, location) '
+            'SELECT listing_id, title, description, location FROM listings_listing'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute('DROP INDEX listing_fulltext ON listings_listing')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS listings_listing_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0006_paymentcallback'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
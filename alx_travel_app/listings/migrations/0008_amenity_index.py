@@ -0,0 +1,97 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:16
+
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils.text import slugify
+
+MASK_BITS = 63
+
+
+def parse_amenities(text):
+    amenities = {}
+    for name in (text or '').split(','):
+        name = ' '.join(name.split())
+        slug = slugify(name)[:100]
+        if slug and slug not in amenities:
+            amenities[slug] = name[:100]
+    return amenities
+
+
+def index_existing_amenities(apps, schema_editor):
+    """Parse every listing's amenities text; the most common amenities get mask bits"""
+    Listing = apps.get_model('listings', 'Listing')
+    Amenity = apps.get_model('listings', 'Amenity')
+    ListingAmenity = apps.get_model('listings', 'ListingAmenity')
+    db = schema_editor.connection.alias
+
+    parsed = {
+        pk: parse_amenities(text)
+        for pk, text in Listing.objects.using(db).values_list('pk', 'amenities').iterator()
+    }
+    names = {}
+    usage = Counter()
+    for amenities in parsed.values():
+        for slug, name in amenities.items():
+            names.setdefault(slug, name)
+        usage.update(amenities.keys())
+
+    Amenity.objects.using(db).bulk_create([
+        Amenity(slug=slug, name=names[slug], bit=rank if rank < MASK_BITS else None)
+        for rank, (slug, _) in enumerate(usage.most_common())
+    ])
+    found = {amenity.slug: amenity for amenity in Amenity.objects.using(db).all()}
+
+    links = []
+    listings = []
+    for pk, amenities in parsed.items():
+        mask = 0
+        for slug in amenities:
+            links.append(ListingAmenity(listing_id=pk, amenity_id=found[slug].pk))
+            if found[slug].bit is not None:
+                mask |= 1 << found[slug].bit
+        if mask:
+            listings.append(Listing(pk=pk, amenity_mask=mask))
+    ListingAmenity.objects.using(db).bulk_create(links, batch_size=1000)
+    Listing.objects.using(db).bulk_update(listings, ['amenity_mask'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0007_listing_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Amenity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(max_length=100, unique=True)),
+                ('name', models.CharField(max_length=100)),
+                ('bit', models.PositiveSmallIntegerField(blank=True, editable=False, null=True, unique=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Amenities',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='amenity_mask',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='ListingAmenity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amenity', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listing_links', to='listings.amenity')),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='amenity_links', to='listings.listing')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('amenity', 'listing'), name='unique_amenity_listing')],
+            },
+        ),
+        migrations.RunPython(index_existing_amenities, migrations.RunPython.noop),
+    ]
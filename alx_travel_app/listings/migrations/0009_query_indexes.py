@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0008_amenity_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['guest', 'created_at', 'booking_id'], name='booking_guest_created'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['listing', 'created_at', 'booking_id'], name='booking_listing_created'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['created_at', 'listing_id'], name='listing_created'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['host', 'created_at', 'listing_id'], name='listing_host_created'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['location', 'price_per_night', 'is_available'], name='listing_location_price'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['status', 'created_at', 'payment_id'], name='payment_status_created'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['listing', 'created_at', 'review_id'], name='review_listing_created'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:27
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_review_updated_at(apps, schema_editor):
+    """Existing reviews were last modified, as far as anyone knows, when created"""
+    Review = apps.get_model('listings', 'Review')
+    Review.objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0010_daily_revenue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_review_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['updated_at'], name='listing_updated'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['updated_at'], name='review_updated'),
+        ),
+    ]
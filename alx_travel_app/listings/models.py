@@ -2,6 +2,19 @@ import uuid
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+
+class ListingQuerySet(models.QuerySet):
+    def with_average_rating(self):
+        """Annotate average_rating from the stored rating totals (no join)"""
+        return self.annotate(
+            average_rating=Coalesce(
+                Cast('rating_sum', models.FloatField()) / NullIf('review_count', 0),
+                0.0,
+                output_field=models.FloatField(),
+            )
+        )
 
 
 class Listing(models.Model):
@@ -10,17 +23,52 @@ class Listing(models.Model):
     description = models.TextField()
     price_per_night = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     location = models.CharField(max_length=100)
+    # Display string; filtering goes through amenity_mask and ListingAmenity (see listings.amenities)
     amenities = models.TextField(help_text="Comma-separated list of amenities")
+    amenity_mask = models.BigIntegerField(default=0, editable=False)
     host = models.ForeignKey(User, on_delete=models.CASCADE, related_name='listings')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_available = models.BooleanField(default=True)
 
+    # Review aggregates, kept current by listings.ratings on every review write
+    rating_sum = models.PositiveIntegerField(default=0)
+    review_count = models.PositiveIntegerField(default=0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+
+    objects = ListingQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
+    @property
+    def rating_histogram(self):
+        """Number of reviews per star rating, keyed 1-5"""
+        return {star: getattr(self, f'rating_{star}_count') for star in range(1, 6)}
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pages order by (created_at, pk), so composites end with the pk
+            models.Index(fields=['created_at', 'listing_id'], name='listing_created'),
+            models.Index(fields=['host', 'created_at', 'listing_id'], name='listing_host_created'),
+            # Price before is_available: the range and ORDER BY price both use it, and
+            # is_available=True compiles to a bare column test that can't seek an index
+            models.Index(fields=['location', 'price_per_night', 'is_available'], name='listing_location_price'),
+            # Latest modification of unfiltered listing lists (see listings.conditional)
+            models.Index(fields=['updated_at'], name='listing_updated'),
+        ]
+
+
+class BookingQuerySet(models.QuerySet):
+    def with_payment(self):
+        """Prefetch each booking's latest payment for Booking.payment, in one query for all of them"""
+        latest = Payment.objects.order_by('-created_at')[:1]
+        return self.prefetch_related(models.Prefetch('payments', queryset=latest, to_attr='latest_payments'))
 
 
 class Booking(models.Model):
@@ -39,17 +87,92 @@ class Booking(models.Model):
     total_price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
+    cancelled_at = models.DateTimeField(null=True, blank=True)
+
+    objects = BookingQuerySet.as_manager()
 
     def __str__(self):
         return f"Booking for {self.listing.title} by {self.guest.username}"
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['guest', 'created_at', 'booking_id'], name='booking_guest_created'),
+            models.Index(fields=['listing', 'created_at', 'booking_id'], name='booking_listing_created'),
+        ]
 
     @property
     def payment(self):
-        """Return the first related payment if any (convenience for tests/usage)."""
-        return getattr(self, 'payments', None).first() if hasattr(self, 'payments') else None
+        """
+        The latest payment for this booking, or None
+
+        Free for bookings loaded with BookingQuerySet.with_payment(); one query otherwise.
+        """
+        if hasattr(self, 'latest_payments'):
+            return self.latest_payments[0] if self.latest_payments else None
+        return self.payments.order_by('-created_at').first()
+
+
+class BookedNight(models.Model):
+    """
+    One row per night held by an active booking.
+
+    Serves as the availability index: the listings that are free between two
+    dates are those with no row in that night range, which is answered from
+    the (night, listing) index without scanning bookings.
+    """
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='booked_nights')
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='booked_nights')
+    night = models.DateField()
+
+    def __str__(self):
+        return f"{self.listing_id} booked on {self.night}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['listing', 'night'], name='unique_listing_night'),
+        ]
+        indexes = [
+            models.Index(fields=['night', 'listing'], name='bookednight_night_listing'),
+        ]
+
+
+class Amenity(models.Model):
+    """
+    An amenity listings can offer, e.g. WiFi or Pool.
+
+    The first 63 amenities each own a bit of Listing.amenity_mask; later
+    ones are found through ListingAmenity only.
+    """
+    slug = models.SlugField(max_length=100, unique=True)
+    name = models.CharField(max_length=100)
+    bit = models.PositiveSmallIntegerField(null=True, blank=True, unique=True, editable=False)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        ordering = ['name']
+        verbose_name_plural = 'Amenities'
+
+
+class ListingAmenity(models.Model):
+    """
+    One row per amenity a listing offers.
+
+    Derived from Listing.amenities on save. Rare amenities are looked up
+    through the (amenity, listing) index instead of scanning every listing.
+    """
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='amenity_links')
+    amenity = models.ForeignKey(Amenity, on_delete=models.CASCADE, related_name='listing_links')
+
+    def __str__(self):
+        return f"{self.listing_id} has {self.amenity_id}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['amenity', 'listing'], name='unique_amenity_listing'),
+        ]
 
 
 class Review(models.Model):
@@ -59,6 +182,7 @@ class Review(models.Model):
     rating = models.IntegerField(validators=[MinValueValidator(1), MaxValueValidator(5)])
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Review for {self.listing.title} by {self.reviewer.username}"
@@ -66,6 +190,11 @@ class Review(models.Model):
     class Meta:
         ordering = ['-created_at']
         unique_together = ['listing', 'reviewer']  # One review per user per listing
+        indexes = [
+            models.Index(fields=['listing', 'created_at', 'review_id'], name='review_listing_created'),
+            # Latest modification of unfiltered review lists (see listings.conditional)
+            models.Index(fields=['updated_at'], name='review_updated'),
+        ]
 
 
 class Payment(models.Model):
@@ -96,4 +225,83 @@ class Payment(models.Model):
     class Meta:
         ordering = ['-created_at']
         verbose_name_plural = 'Payments'
+        indexes = [
+            models.Index(fields=['status', 'created_at', 'payment_id'], name='payment_status_created'),
+        ]
+
+
+class DailyRevenue(models.Model):
+    """
+    One listing's payments and cancellations on one day, in one currency.
+
+    Kept current by listings.revenue as payments complete and bookings are
+    cancelled; host analytics sum these rows instead of scanning payments.
+    """
+    host = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_revenue')
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='daily_revenue')
+    currency = models.CharField(max_length=3)
+    day = models.DateField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Completed payments, one per paid booking
+    bookings = models.PositiveIntegerField(default=0)
+    cancellations = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.listing_id} on {self.day}: {self.revenue} {self.currency}"
+
+    class Meta:
+        verbose_name_plural = 'Daily revenue'
+        constraints = [
+            models.UniqueConstraint(fields=['listing', 'currency', 'day'], name='unique_listing_currency_day'),
+        ]
+        indexes = [
+            models.Index(fields=['host', 'day'], name='dailyrevenue_host_day'),
+        ]
+
+
+class PaymentCallback(models.Model):
+    """
+    Dedup record of a Chapa callback.
+
+    Chapa retries callbacks; the unique tx_ref lets PaymentViewSet.verify
+    acknowledge a repeat with a single indexed lookup and no side effects.
+    """
+    tx_ref = models.CharField(max_length=255, unique=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
 
+    def __str__(self):
+        return f"Callback for {self.tx_ref}"
+
+
+class QueuedEmail(models.Model):
+    """
+    Outbox of emails waiting to be delivered.
+
+    Tasks render emails into this table and the sender drains it in batches
+    over a single SMTP connection (see listings.tasks.deliver_queued_emails).
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    to = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.subject} to {self.to} ({self.status})"
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='queuedemail_status_created'),
+        ]
@@ -0,0 +1,295 @@
+"""
+Pagination classes for the listings API
+
+Responses stay unpaginated unless the client asks for a page:
+- ?page_size=N / ?cursor=... - keyset pages ordered by (created_at, pk), no COUNT(*)
+- ?limit=N&offset=M - offset pages with an estimated total count
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on (created_at, pk).
+
+    Every page is a single indexed range scan: the cursor carries the
+    (created_at, pk) of the last row served, so page N costs the same as
+    page 1 no matter how large the table grows. No total count is computed.
+
+    For views with visibility branches (see listings.visibility) each branch
+    is its own range scan for a page of keys, and the page's rows are then
+    loaded by primary key.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request, queryset)
+
+        if reverse:
+            queryset = queryset.order_by('created_at', 'pk')
+        else:
+            queryset = queryset.order_by('-created_at', '-pk')
+
+        if position is not None:
+            created_at, pk = position
+            if reverse:
+                queryset = queryset.filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk)
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+                )
+
+        # Fetch one extra row to learn whether another page exists
+        branches = view.get_visibility_branches() if hasattr(view, 'get_visibility_branches') else None
+        if branches:
+            rows = self.fetch_branches(queryset, branches, self.page_size + 1, reverse)
+        else:
+            rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if reverse:
+            rows.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = rows
+        return rows
+
+    def reads_branches(self, request):
+        """Whether pages of views with visibility branches are read branch by branch"""
+        return True
+
+    def fetch_branches(self, queryset, branches, count, reverse):
+        """
+        The first count rows of an ordered queryset that fall in any branch
+
+        The (created_at, pk) keys of up to count rows are read from each
+        branch, the first count of all of them are kept, and only those rows
+        are loaded, with the queryset's related objects.
+        """
+        keys = set()
+        for branch in branches:
+            rows = queryset.filter(branch).prefetch_related(None)
+            keys.update(rows.values_list('created_at', 'pk')[:count])
+        keys = sorted(keys, reverse=not reverse)[:count]
+        # Already in order; the database needn't sort them again
+        rows = queryset.order_by().in_bulk([pk for _, pk in keys])
+        return [rows[pk] for _, pk in keys]
+
+    def get_page_size(self, request):
+        page_size = request.query_params.get(self.page_size_query_param)
+        try:
+            page_size = int(page_size)
+        except (TypeError, ValueError):
+            return api_settings.PAGE_SIZE or self.max_page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def decode_cursor(self, request, queryset):
+        """Return ((created_at, pk), reverse) from the cursor query param"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            created_at = parse_datetime(data['t'])
+            if created_at is None:
+                raise ValueError(data['t'])
+            pk = queryset.model._meta.pk.to_python(data['k'])
+            if pk is None:
+                raise ValueError(data['k'])
+            return (created_at, pk), bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, reverse):
+        data = {'t': row.created_at.isoformat(), 'k': str(row.pk)}
+        if reverse:
+            data['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(data).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+def estimate_count(queryset, cap=10000):
+    """
+    Return (count, is_estimate) for a queryset without an unbounded COUNT(*).
+
+    Unfiltered querysets use the database's table statistics where the
+    backend keeps them (MySQL, PostgreSQL). Anything else is counted up to
+    ``cap`` rows; hitting the cap reports ``cap`` as an estimate.
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+
+    if not queryset.query.where:
+        sql = None
+        if connection.vendor == 'mysql':
+            sql = (
+                'SELECT TABLE_ROWS FROM information_schema.TABLES '
+                'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s'
+            )
+        elif connection.vendor == 'postgresql':
+            sql = 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s'
+        if sql:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [table])
+                row = cursor.fetchone()
+            if row and row[0] is not None and row[0] >= 0:
+                return int(row[0]), True
+
+    count = queryset.order_by()[:cap + 1].count()
+    if count > cap:
+        return cap, True
+    return count, False
+
+
+class EstimatedCountPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination reporting an estimated total for admin-style UIs
+
+    The count is only reported, never trusted: a page reads limit + 1 rows,
+    and the extra row decides whether there is a next page. Offsets past a
+    capped or stale estimate still return their rows.
+    """
+    max_limit = 100
+    count_cap = 10000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.offset = self.get_offset(request)
+        rows = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(rows) > self.limit
+        page = rows[:self.limit]
+
+        self.count, self.count_is_estimate = estimate_count(queryset, cap=self.count_cap)
+        if self.count_is_estimate:
+            # Table statistics can lag behind; there are at least as many rows as were seen
+            self.count = max(self.count, self.offset + len(page) + self.has_next)
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+        return page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = replace_query_param(self.request.build_absolute_uri(), self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'count_is_estimate': self.count_is_estimate,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count_is_estimate'] = {'type': 'boolean'}
+        return response_schema
+
+
+class OptInPagination(BasePagination):
+    """
+    Dispatch to keyset or offset pagination based on the query params.
+
+    Requests without pagination params keep the original unpaginated list
+    responses, so existing clients are unaffected.
+    """
+    keyset_params = (KeysetPagination.cursor_query_param, KeysetPagination.page_size_query_param)
+    offset_params = (LimitOffsetPagination.limit_query_param, LimitOffsetPagination.offset_query_param)
+
+    def __init__(self):
+        self.paginator = None
+
+    def paginates(self, request):
+        """Whether the request asks for a page rather than the whole list"""
+        return any(param in request.query_params for param in self.keyset_params + self.offset_params)
+
+    def reads_branches(self, request):
+        """Whether the request gets a keyset page, which reads visibility branches itself"""
+        return any(param in request.query_params for param in self.keyset_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if any(param in params for param in self.keyset_params):
+            self.paginator = KeysetPagination()
+        elif any(param in params for param in self.offset_params):
+            self.paginator = EstimatedCountPagination()
+        else:
+            self.paginator = None
+            return None
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return KeysetPagination().get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': param,
+                'required': False,
+                'in': 'query',
+                'schema': {'type': 'string' if param == 'cursor' else 'integer'},
+            }
+            for param in self.keyset_params + self.offset_params
+        ]
@@ -0,0 +1,200 @@
+"""
+Steps of initiating and verifying a payment with Chapa
+
+Shared by the DRF viewset actions and the async views in
+listings.async_views. None of these call Chapa; the caller does, with the
+sync or the async client, and passes the result on. Each step returns the
+response body and status, for a DRF Response or a JsonResponse.
+"""
+import logging
+
+from django.db import transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .callbacks import TERMINAL_PAYMENT_STATUSES
+from .chapa_utils import create_payment_for_booking, update_payment_status
+from .email_tasks import dispatch_payment_email
+from .models import Payment
+
+logger = logging.getLogger(__name__)
+
+
+class ChapaUnavailable(APIException):
+    """Chapa is not being called right now; answered with 503 and Retry-After"""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The payment provider is temporarily unavailable. Please try again shortly.'
+    default_code = 'payment_provider_unavailable'
+
+    def __init__(self, wait=None):
+        super().__init__()
+        # DRF's exception handler sends this as Retry-After
+        self.wait = wait
+
+
+def raise_if_refused(result):
+    """
+    Raise ChapaUnavailable for a call the circuit breaker or bulkhead refused
+
+    The payment is left as it was: nothing reached Chapa.
+    """
+    if result.get('unavailable'):
+        raise ChapaUnavailable(wait=result.get('retry_after'))
+
+
+def payment_to_initiate(booking):
+    """
+    The booking's payment to send to Chapa, created on first use
+
+    Returns:
+        tuple: (payment, refusal), refusal being (body, status) when the
+        payment is no longer pending and None otherwise
+    """
+    payment = booking.payment or create_payment_for_booking(booking)
+
+    # Only pending payments can be initiated
+    if payment.status != 'pending':
+        return payment, (
+            {'detail': f'Cannot initiate payment for {payment.status} payment.'},
+            status.HTTP_400_BAD_REQUEST,
+        )
+    return payment, None
+
+
+def record_initiation(payment, result):
+    """
+    Store the outcome of a Chapa initialize call
+
+    Returns:
+        tuple: (body, status) of the response
+
+    Raises:
+        ChapaUnavailable: The call was refused without reaching Chapa
+    """
+    raise_if_refused(result)
+    if result['success']:
+        # Update payment reference
+        update_payment_status(
+            payment,
+            'pending',
+            chapa_reference=result.get('reference')
+        )
+
+        return {
+            'success': True,
+            'checkout_url': result.get('checkout_url'),
+            'payment_id': str(payment.payment_id),
+            'amount': str(payment.amount),
+            'currency': payment.currency,
+        }, status.HTTP_200_OK
+
+    error_msg = result.get('error', 'Unknown error')
+    update_payment_status(
+        payment,
+        'failed',
+        error_message=error_msg
+    )
+
+    return {
+        'success': False,
+        'error': error_msg,
+    }, status.HTTP_400_BAD_REQUEST
+
+
+def verification_refusal(payment):
+    """(body, status) when the payment cannot be verified yet, None otherwise"""
+    if not payment.chapa_reference:
+        return {'detail': 'Payment has not been initiated yet.'}, status.HTTP_400_BAD_REQUEST
+    return None
+
+
+def record_verification(payment, result):
+    """
+    Store the outcome of a Chapa verify call and queue the email it calls for
+
+    Returns:
+        tuple: (body, status) of the response
+
+    Raises:
+        ChapaUnavailable: The call was refused without reaching Chapa
+    """
+    raise_if_refused(result)
+    if not result['success']:
+        return {
+            'success': False,
+            'error': result.get('error', 'Failed to verify payment'),
+        }, status.HTTP_400_BAD_REQUEST
+
+    # Update payment status based on Chapa response
+    chapa_status = result.get('status', 'pending').lower()
+    if chapa_status not in ('success', 'failed'):
+        return {
+            'success': True,
+            'status': 'pending',
+            'message': 'Payment is still pending',
+        }, status.HTTP_200_OK
+
+    with transaction.atomic():
+        # Locked and re-checked: the callback worker or the reconciliation sweep
+        # may have settled it during the Chapa call, and must not be applied twice.
+        # Only the payment is locked; its booking and listing are read, not written.
+        settled = Payment.objects.select_for_update(of=('self',)).select_related('booking__listing').get(pk=payment.pk)
+        if settled.status in TERMINAL_PAYMENT_STATUSES:
+            return {
+                'success': settled.status == 'completed',
+                'status': settled.status,
+                'message': f'Payment already {settled.status}',
+            }, status.HTTP_200_OK if settled.status == 'completed' else status.HTTP_400_BAD_REQUEST
+
+        if chapa_status == 'success':
+            update_payment_status(
+                settled,
+                'completed',
+                transaction_id=result.get('reference'),
+                payment_method=result.get('method')
+            )
+
+            # Queue confirmation email; sent by a Celery worker after commit
+            dispatch_payment_email(settled, 'confirmation')
+
+            return {
+                'success': True,
+                'status': 'completed',
+                'message': 'Payment completed successfully',
+                'amount': str(result.get('amount')),
+                'received_amount': str(result.get('received_amount')),
+                'transaction_id': result.get('reference'),
+            }, status.HTTP_200_OK
+
+        update_payment_status(
+            settled,
+            'failed',
+            error_message='Payment failed on Chapa'
+        )
+
+        dispatch_payment_email(
+            settled,
+            'failure',
+            'Your payment failed. Please try again.'
+        )
+
+    return {
+        'success': False,
+        'status': 'failed',
+        'message': 'Payment failed',
+    }, status.HTTP_400_BAD_REQUEST
+
+
+def chapa_failure(exc, action):
+    """
+    (body, status) for an exception raised while calling Chapa
+
+    Args:
+        exc: The exception; a ValueError means Chapa is not configured
+        action: What was being done, for the log, e.g. 'payment initiation'
+    """
+    if isinstance(exc, ValueError):
+        logger.error(f"Configuration error: {str(exc)}")
+        return {'error': f'Configuration error: {str(exc)}'}, status.HTTP_500_INTERNAL_SERVER_ERROR
+    logger.error(f"Unexpected error during {action}: {str(exc)}")
+    return {'error': f'Unexpected error: {str(exc)}'}, status.HTTP_500_INTERNAL_SERVER_ERROR
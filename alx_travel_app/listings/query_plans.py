@@ -0,0 +1,224 @@
+"""
+EXPLAIN checks for the API's hot query shapes
+
+Each QueryShape is an API request. check_query_plans() sends it through the
+real viewset (filters, ordering and pagination included), captures the
+SELECTs it issues and asks the database for each one's plan. Plans that read
+a whole table or sort rows without an index are reported, so a dropped
+index or a queryset change that defeats one is caught before deploy.
+
+Plans depend on table statistics: run against a database holding
+production-like volumes, where the planner makes the choices it will make
+in production.
+"""
+import json
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test.utils import override_settings
+from django.urls import resolve
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .benchmarks import rolled_back
+from .models import Booking, Listing, Payment, Review
+
+
+class QueryShape:
+    """
+    An API request whose queries must be answered from indexes
+
+    ``path`` may reference the probe rows as {listing}, {booking},
+    {payment} and {review}; ``user`` is 'guest', 'host' or None.
+    ``headers`` are request META entries, e.g. HTTP_IF_NONE_MATCH.
+    """
+
+    def __init__(self, name, path, params=None, user=None, headers=None):
+        self.name = name
+        self.path = path
+        self.params = params or {}
+        self.user = user
+        self.headers = headers or {}
+
+
+STALE_ETAG = {'HTTP_IF_NONE_MATCH': '"stale"'}
+
+QUERY_SHAPES = [
+    QueryShape('listings newest first', '/api/listings/', {'page_size': 20}),
+    QueryShape('listings by location and price', '/api/listings/', {
+        'location': 'Mombasa', 'is_available': 'true', 'price_per_night__lte': 200, 'ordering': 'price_per_night',
+        'limit': 20,
+    }),
+    QueryShape('listing detail', '/api/listings/{listing}/'),
+    QueryShape('listing reviews', '/api/listings/{listing}/reviews/', {'page_size': 20}),
+    QueryShape('my listings', '/api/listings/my_listings/', {'page_size': 20}, user='host'),
+    QueryShape('my bookings', '/api/bookings/my_bookings/', {'page_size': 20}, user='guest'),
+    QueryShape('bookings', '/api/bookings/', {'page_size': 20}, user='guest'),
+    QueryShape('payments', '/api/payments/', {'page_size': 20}, user='guest'),
+    QueryShape('reviews of a listing', '/api/reviews/', {'listing': '{listing}', 'page_size': 20}),
+    # Revalidations with a stale ETag: the row versions are read, then the full response is built
+    QueryShape('listings revalidated', '/api/listings/', headers=STALE_ETAG),
+    QueryShape('listing page revalidated', '/api/listings/', {'page_size': 20}, headers=STALE_ETAG),
+    QueryShape('listing detail revalidated', '/api/listings/{listing}/', headers=STALE_ETAG),
+    QueryShape('listing reviews revalidated', '/api/listings/{listing}/reviews/', headers=STALE_ETAG),
+    QueryShape('reviews of a listing revalidated', '/api/reviews/', {'listing': '{listing}'}, headers=STALE_ETAG),
+]
+
+
+class QueryRecorder:
+    """Database execute wrapper collecting the SELECTs a request issues"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith('SELECT'):
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def explain_sqlite(cursor, sql, params):
+    tables = set(cursor.db.introspection.table_names(cursor))
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    plan = [row[3] for row in cursor.fetchall()]
+    problems = []
+    for detail in plan:
+        # "SCAN t USING INDEX i" walks an index in order; a bare "SCAN t" reads the table.
+        # Scans of subqueries read rows already produced by an indexed search.
+        words = detail.split()
+        if words[0] == 'SCAN' and words[1] in tables and ' USING ' not in detail:
+            problems.append(f'full scan: {detail}')
+        elif detail.startswith('USE TEMP B-TREE'):
+            problems.append(f'sort without index: {detail}')
+    return plan, problems
+
+
+def explain_mysql(cursor, sql, params):
+    cursor.execute('EXPLAIN ' + sql, params)
+    columns = [column[0] for column in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    plan = [
+        f"{row['table']}: type={row['type']} key={row['key']} rows={row['rows']} {row['Extra'] or ''}".strip()
+        for row in rows
+    ]
+    problems = []
+    for row in rows:
+        extra = row['Extra'] or ''
+        if row['type'] == 'ALL':
+            problems.append(f"full scan: {row['table']}")
+        if 'Using filesort' in extra:
+            problems.append(f"sort without index: {row['table']} ({extra})")
+        if 'Using temporary' in extra:
+            problems.append(f"temporary table: {row['table']} ({extra})")
+    return plan, problems
+
+
+def explain_postgresql(cursor, sql, params):
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+    result = cursor.fetchone()[0]
+    if isinstance(result, str):
+        result = json.loads(result)
+
+    plan = []
+    problems = []
+    nodes = [(result[0]['Plan'], 0)]
+    while nodes:
+        node, depth = nodes.pop()
+        node_type = node['Node Type']
+        plan.append('  ' * depth + f"{node_type} {node.get('Relation Name', '')}".strip())
+        if node_type == 'Seq Scan':
+            problems.append(f"full scan: {node['Relation Name']}")
+        elif node_type in ('Sort', 'Incremental Sort'):
+            problems.append(f"sort without index: {', '.join(node.get('Sort Key', []))}")
+        nodes.extend((child, depth + 1) for child in reversed(node.get('Plans', [])))
+    return plan, problems
+
+
+EXPLAINERS = {
+    'sqlite': explain_sqlite,
+    'mysql': explain_mysql,
+    'postgresql': explain_postgresql,
+}
+
+
+def explain_query(connection, sql, params):
+    """
+    Return (plan lines, problems) for a query on a connection
+
+    Raises:
+        NotImplementedError: The database vendor has no plan checker
+    """
+    explainer = EXPLAINERS.get(connection.vendor)
+    if explainer is None:
+        raise NotImplementedError(f"No query plan checks for {connection.vendor}")
+    with connection.cursor() as cursor:
+        return explainer(cursor, sql, params)
+
+
+def create_probe_data():
+    """Create one row of each kind for requests to resolve against"""
+    tag = uuid.uuid4().hex[:8]
+    host = User.objects.create(username=f'explain-host-{tag}')
+    guest = User.objects.create(username=f'explain-guest-{tag}')
+    listing = Listing.objects.create(
+        title='Query plan probe',
+        description='Query plan probe',
+        price_per_night=Decimal('100.00'),
+        location='Mombasa',
+        amenities='WiFi',
+        host=host,
+    )
+    start = date.today() + timedelta(days=365)
+    booking = Booking.objects.create(
+        listing=listing,
+        guest=guest,
+        check_in_date=start,
+        check_out_date=start + timedelta(days=1),
+        total_price=Decimal('100.00'),
+    )
+    payment = Payment.objects.create(booking=booking, amount=booking.total_price)
+    review = Review.objects.create(listing=listing, reviewer=guest, rating=5, comment='Query plan probe')
+    return {
+        'users': {'host': host, 'guest': guest},
+        'ids': {'listing': listing.pk, 'booking': booking.pk, 'payment': payment.pk, 'review': review.pk},
+    }
+
+
+def check_query_plans(shapes=None, using='default'):
+    """
+    Run each query shape and EXPLAIN the queries it issues
+
+    Probe rows are created in a transaction that is rolled back afterwards,
+    and the listing response cache is bypassed so every request reaches the
+    database. Requests are dispatched in-process as host 'testserver'.
+
+    Returns:
+        list: (shape, [(sql, plan lines, problems), ...]) per shape
+    """
+    connection = connections[using]
+    factory = APIRequestFactory()
+    results = []
+    with rolled_back(), override_settings(LISTING_CACHE_ENABLED=False, ALLOWED_HOSTS=['testserver']):
+        probe = create_probe_data()
+        for shape in shapes or QUERY_SHAPES:
+            path = shape.path.format(**probe['ids'])
+            params = {key: str(value).format(**probe['ids']) for key, value in shape.params.items()}
+            request = factory.get(path, params, **shape.headers)
+            if shape.user:
+                force_authenticate(request, user=probe['users'][shape.user])
+
+            match = resolve(path)
+            recorder = QueryRecorder()
+            with connection.execute_wrapper(recorder):
+                response = match.func(request, *match.args, **match.kwargs)
+            if response.status_code != 200:
+                raise RuntimeError(f"{shape.name}: GET {path} returned {response.status_code}")
+
+            explained = []
+            for sql, query_params in recorder.queries:
+                plan, problems = explain_query(connection, sql, query_params)
+                explained.append((sql, plan, problems))
+            results.append((shape, explained))
+    return results
@@ -0,0 +1,95 @@
+"""
+Denormalized rating aggregates on Listing
+
+Listing stores the sum of its review ratings, the review count and a per-star
+histogram. Review writes adjust them with F-expressions, so concurrent reviews
+never lose updates and listing reads never touch the reviews table.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from .models import Listing, Review
+
+logger = logging.getLogger(__name__)
+
+STARS = range(1, 6)
+
+
+def star_field(rating):
+    """Name of the histogram counter for a star rating"""
+    return f'rating_{rating}_count'
+
+
+def apply_review_delta(listing_id, added=None, removed=None):
+    """
+    Atomically adjust a listing's rating aggregates and touch its updated_at
+
+    Called on every review write: the listing renders its reviews, so even
+    an edit that leaves the rating alone changes the listing's ETag.
+
+    Args:
+        listing_id: Primary key of the reviewed listing
+        added: Rating that now counts towards the listing, if any
+        removed: Rating that no longer counts towards the listing, if any
+    """
+    updates = {'updated_at': timezone.now()}
+    if added != removed:
+        sum_delta = (added or 0) - (removed or 0)
+        count_delta = (added is not None) - (removed is not None)
+        if sum_delta:
+            updates['rating_sum'] = F('rating_sum') + sum_delta
+        if count_delta:
+            updates['review_count'] = F('review_count') + count_delta
+        if added is not None:
+            updates[star_field(added)] = F(star_field(added)) + 1
+        if removed is not None:
+            updates[star_field(removed)] = F(star_field(removed)) - 1
+
+    Listing.objects.filter(pk=listing_id).update(**updates)
+
+
+def aggregate_rating_stats(reviews):
+    """
+    Compute rating aggregates per listing from a Review queryset
+
+    Returns:
+        dict: listing_id -> {field name: value}
+    """
+    aggregates = {
+        'rating_sum': Sum('rating'),
+        'review_count': Count('pk'),
+    }
+    for star in STARS:
+        aggregates[star_field(star)] = Count('pk', filter=Q(rating=star))
+
+    rows = reviews.order_by().values('listing_id').annotate(**aggregates)
+    return {row.pop('listing_id'): row for row in rows}
+
+
+def rebuild_listing_stats(batch_size=1000):
+    """
+    Recompute every listing's rating aggregates from the reviews table
+
+    Returns:
+        int: Number of listings with at least one review
+    """
+    fields = ['rating_sum', 'review_count'] + [star_field(star) for star in STARS]
+
+    with transaction.atomic():
+        # Touch every listing, as any of them may render different aggregates afterwards
+        Listing.objects.update(updated_at=timezone.now(), **{field: 0 for field in fields})
+        stats = aggregate_rating_stats(Review.objects.all())
+
+        listings = []
+        for listing_id, values in stats.items():
+            listings.append(Listing(listing_id=listing_id, **values))
+            if len(listings) >= batch_size:
+                Listing.objects.bulk_update(listings, fields)
+                listings = []
+        Listing.objects.bulk_update(listings, fields)
+
+    logger.info(f"Rating aggregates rebuilt for {len(stats)} listings")
+    return len(stats)
@@ -0,0 +1,199 @@
+"""
+Bulk reconciliation of pending payments against Chapa
+
+A payment stays pending until its guest polls verify_status or Chapa calls
+back. reconcile_pending_payments() sweeps the rest: it streams pending
+payments in primary-key chunks, verifies each chunk concurrently under a
+global rate limit, and writes the outcomes back with a handful of bulk
+statements per chunk instead of one save per payment.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import invalidate_listings
+from .chapa_utils import get_chapa_client
+from .email_tasks import dispatch_payment_email
+from .models import Booking, Payment
+from .revenue import record_completed_payments
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every worker thread
+
+    Allows ``rate`` acquisitions per second on average, with bursts of up to
+    ``burst`` back-to-back calls.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a call is allowed"""
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def pending_payment_chunks(chunk_size, older_than=None):
+    """
+    Yield lists of (payment_id, chapa_reference) for pending payments
+
+    Keyset pagination on the primary key keeps each query cheap and stable
+    while earlier chunks are being updated.
+    """
+    payments = Payment.objects.filter(status='pending', chapa_reference__isnull=False)
+    if older_than is not None:
+        payments = payments.filter(created_at__lte=older_than)
+    payments = payments.order_by('payment_id').values_list('payment_id', 'chapa_reference')
+
+    last = None
+    while True:
+        chunk = payments if last is None else payments.filter(payment_id__gt=last)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1][0]
+        if len(chunk) < chunk_size:
+            return
+
+
+def apply_verifications(results):
+    """
+    Write a chunk of verification results back in bulk
+
+    Rows are re-read under a lock and only those still pending are touched,
+    so a callback that settled a payment mid-sweep is never overwritten.
+
+    Args:
+        results: dict of payment_id -> verify_payment() result
+
+    Returns:
+        dict: Number of payments 'completed' and 'failed'
+    """
+    # A missing, null or unknown status leaves the payment pending
+    outcomes = {
+        payment_id: (result.get('status') or '').lower()
+        for payment_id, result in results.items()
+        if result.get('success')
+    }
+    settled = [payment_id for payment_id, outcome in outcomes.items() if outcome in ('success', 'failed')]
+    counts = {'completed': 0, 'failed': 0}
+    if not settled:
+        return counts
+
+    now = timezone.now()
+    with transaction.atomic():
+        # Lock the payments only: the joined bookings, listings and users are read, not written
+        payments = list(
+            Payment.objects.select_for_update(of=('self',))
+            .filter(payment_id__in=settled, status='pending')
+            .select_related('booking__guest', 'booking__listing')
+        )
+
+        completed, failed = [], []
+        for payment in payments:
+            result = results[payment.payment_id]
+            payment.updated_at = now
+            if outcomes[payment.payment_id] == 'success':
+                payment.status = 'completed'
+                payment.completed_at = now
+                payment.transaction_id = result.get('reference') or payment.transaction_id
+                payment.payment_method = result.get('method') or payment.payment_method
+                completed.append(payment)
+            else:
+                payment.status = 'failed'
+                payment.error_message = 'Payment failed on Chapa'
+                failed.append(payment)
+
+        Payment.objects.bulk_update(
+            completed, ['status', 'completed_at', 'transaction_id', 'payment_method', 'updated_at']
+        )
+        Payment.objects.bulk_update(failed, ['status', 'error_message', 'updated_at'])
+        if completed:
+            # Bookings cancelled meanwhile stay cancelled: their nights were released
+            Booking.objects.filter(
+                booking_id__in=[payment.booking_id for payment in completed], status='pending'
+            ).update(status='confirmed')
+            # update() skips the Booking signals that normally do this
+            invalidate_listings()
+            record_completed_payments(completed)
+
+        for payment in completed:
+            dispatch_payment_email(payment, 'confirmation')
+        for payment in failed:
+            dispatch_payment_email(payment, 'failure', 'Your payment failed. Please try again.')
+
+    counts['completed'] = len(completed)
+    counts['failed'] = len(failed)
+    return counts
+
+
+def reconcile_pending_payments(chunk_size=200, workers=8, rate_limit=20.0, min_age=None, client=None):
+    """
+    Verify every pending payment with Chapa and record the outcomes
+
+    Args:
+        chunk_size: Payments loaded and written back per chunk
+        workers: Concurrent verify requests
+        rate_limit: Verify requests per second across all workers (0 for no limit)
+        min_age: Skip payments created less than this many seconds ago
+        client: ChapaAPIClient to use; defaults to the process-wide client
+
+    Returns:
+        dict: 'processed', 'completed', 'failed', 'errors', 'elapsed' and 'rate'
+    """
+    client = client or get_chapa_client()
+    limiter = RateLimiter(rate_limit, burst=workers)
+    older_than = timezone.now() - timedelta(seconds=min_age) if min_age else None
+
+    def verify(row):
+        payment_id, reference = row
+        limiter.acquire()
+        return payment_id, client.verify_payment(reference)
+
+    stats = {'processed': 0, 'completed': 0, 'failed': 0, 'errors': 0}
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for chunk in pending_payment_chunks(chunk_size, older_than):
+            results = dict(pool.map(verify, chunk))
+            counts = apply_verifications(results)
+            stats['processed'] += len(chunk)
+            stats['completed'] += counts['completed']
+            stats['failed'] += counts['failed']
+            stats['errors'] += sum(1 for result in results.values() if not result.get('success'))
+            if any(result.get('unavailable') for result in results.values()):
+                # The breaker opened; the rest stay pending for the next sweep
+                logger.warning("Chapa is unavailable, stopping the reconciliation sweep early")
+                break
+
+    stats['elapsed'] = time.perf_counter() - started
+    stats['rate'] = stats['processed'] / stats['elapsed'] if stats['elapsed'] else 0.0
+    logger.info(
+        f"Reconciled {stats['processed']} pending payments "
+        f"({stats['completed']} completed, {stats['failed']} failed, {stats['errors']} errors) "
+        f"at {stats['rate']:.1f}/s"
+    )
+    return stats
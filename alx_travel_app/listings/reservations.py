@@ -0,0 +1,186 @@
+"""
+Atomic reservation of listing nights
+
+Two guests asking for overlapping nights of the same listing must not both
+succeed. reserve_booking() locks the listing row, so only requests for the
+same listing wait on each other, and the unique (listing, night) constraint
+on BookedNight backs the check up on databases without row locks.
+
+reserve_bookings() does the same for many stays at once, with a fixed number
+of queries however many there are.
+"""
+import logging
+from functools import reduce
+from operator import or_
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .availability import booked_nights_for, iter_nights
+from .cache import invalidate_listings
+from .chapa_utils import build_payment_for_booking, create_payment_for_booking
+from .models import Booking, BookedNight, Listing, Payment
+
+logger = logging.getLogger(__name__)
+
+
+class BookingConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The listing is already booked for some of the requested nights.'
+    default_code = 'booking_conflict'
+
+
+def hold_nights_or_conflict(booking):
+    """
+    Insert a booking's nights, raising BookingConflict if any is already taken
+
+    Must run inside a transaction so the caller's writes roll back on conflict.
+    """
+    try:
+        with transaction.atomic():
+            BookedNight.objects.bulk_create(booked_nights_for(booking))
+    except IntegrityError:
+        raise BookingConflict()
+
+
+def reserve_booking(listing_id, guest, check_in, check_out, total_price=None):
+    """
+    Create a booking, its availability entries and its payment in one transaction
+
+    Args:
+        listing_id: Primary key of the listing to book
+        guest: User making the booking
+        check_in: First night of the stay
+        check_out: Departure date
+        total_price: Price to charge; computed from the nightly rate if omitted
+
+    Returns:
+        Booking: The created booking
+
+    Raises:
+        BookingConflict: Some of the nights are already booked
+        ValidationError: The listing does not exist
+    """
+    with transaction.atomic():
+        try:
+            # Row lock: concurrent requests for this listing queue here, others don't
+            listing = Listing.objects.select_for_update().get(pk=listing_id)
+        except Listing.DoesNotExist:
+            raise ValidationError({'listing_id': 'Listing not found.'})
+
+        taken = BookedNight.objects.filter(
+            listing_id=listing.pk,
+            night__gte=check_in,
+            night__lt=check_out,
+        ).exists()
+        if taken:
+            raise BookingConflict()
+
+        if not total_price:
+            total_price = listing.price_per_night * (check_out - check_in).days
+
+        booking = Booking.objects.create(
+            listing=listing,
+            guest=guest,
+            check_in_date=check_in,
+            check_out_date=check_out,
+            total_price=total_price,
+        )
+        hold_nights_or_conflict(booking)
+        create_payment_for_booking(booking)
+
+    logger.info(f"Booking {booking.booking_id} reserved for listing {listing.pk}")
+    return booking
+
+
+def reserve_bookings(guest, stays):
+    """
+    Reserve many stays for one guest in one transaction, each succeeding or failing on its own
+
+    All listings are locked in one query, in primary key order so that
+    batches sharing listings queue rather than deadlock. The nights already
+    taken are read in one query, stays are checked against them and against
+    earlier stays of the batch, and the bookings, their nights and their
+    payments are inserted with one bulk_create each.
+
+    Args:
+        guest: User making the bookings
+        stays: Dicts with listing_id, check_in_date, check_out_date and
+            optionally total_price, as validated by BookingSerializer
+
+    Returns:
+        list: For each stay in order, the created Booking, or the
+        ValidationError or BookingConflict it failed with
+
+    Raises:
+        BookingConflict: Every stay, when the unique (listing, night)
+            constraint catches a conflict the checks missed
+    """
+    results = []
+    with transaction.atomic():
+        listing_ids = sorted({stay['listing_id'] for stay in stays})
+        listings = {
+            listing.pk: listing
+            for listing in Listing.objects.select_for_update().filter(pk__in=listing_ids).order_by('pk')
+        }
+        taken = taken_nights(stays, listings)
+
+        bookings = []
+        for stay in stays:
+            listing = listings.get(stay['listing_id'])
+            if listing is None:
+                results.append(ValidationError({'listing_id': 'Listing not found.'}))
+                continue
+            nights = {(listing.pk, night) for night in iter_nights(stay['check_in_date'], stay['check_out_date'])}
+            if nights & taken:
+                results.append(BookingConflict())
+                continue
+            taken |= nights
+
+            total_price = stay.get('total_price')
+            if not total_price:
+                total_price = listing.price_per_night * (stay['check_out_date'] - stay['check_in_date']).days
+            booking = Booking(
+                listing=listing,
+                guest=guest,
+                check_in_date=stay['check_in_date'],
+                check_out_date=stay['check_out_date'],
+                total_price=total_price,
+            )
+            bookings.append(booking)
+            results.append(booking)
+
+        if bookings:
+            Booking.objects.bulk_create(bookings)
+            try:
+                with transaction.atomic():
+                    BookedNight.objects.bulk_create(
+                        [night for booking in bookings for night in booked_nights_for(booking)]
+                    )
+            except IntegrityError:
+                raise BookingConflict()
+            Payment.objects.bulk_create([build_payment_for_booking(booking) for booking in bookings])
+            # bulk_create sends no post_save, which would have done this per booking
+            invalidate_listings()
+
+    if bookings:
+        logger.info(f"{len(bookings)} of {len(stays)} bookings reserved in a batch for guest {guest.pk}")
+    return results
+
+
+def taken_nights(stays, listings):
+    """(listing_id, night) pairs already booked within the stays' date ranges, in one query"""
+    ranges = {}
+    for stay in stays:
+        if stay['listing_id'] not in listings:
+            continue
+        start, end = ranges.get(stay['listing_id'], (stay['check_in_date'], stay['check_out_date']))
+        ranges[stay['listing_id']] = (min(start, stay['check_in_date']), max(end, stay['check_out_date']))
+    if not ranges:
+        return set()
+    overlapping = reduce(or_, (
+        Q(listing_id=listing_id, night__gte=start, night__lt=end) for listing_id, (start, end) in ranges.items()
+    ))
+    return set(BookedNight.objects.filter(overlapping).values_list('listing_id', 'night'))
@@ -0,0 +1,252 @@
+"""
+Daily revenue rollups per host, listing and currency
+
+DailyRevenue holds one row per listing, currency and day: the amount of the
+payments completed that day, how many completed and how many bookings were
+cancelled. Completions and cancellations adjust the day's row with
+F-expressions as they happen, so a host's revenue over any date range is a
+sum over a few rollup rows instead of a scan of payments joined through
+bookings and listings.
+"""
+import logging
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .exports import parse_date_range
+from .models import Booking, DailyRevenue, Listing, Payment
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CURRENCY = Payment._meta.get_field('currency').default
+
+# Days reported when ?start= is left out
+DEFAULT_RANGE_DAYS = 30
+
+# Longest range one request may sum; rows per listing grow with it
+MAX_RANGE_DAYS = 3660
+
+TOTALS = {
+    'revenue': Sum('revenue'),
+    'bookings': Sum('bookings'),
+    'cancellations': Sum('cancellations'),
+}
+
+
+def apply_revenue_delta(listing_id, currency, day, revenue=Decimal('0'), bookings=0, cancellations=0,
+                        host_id=None):
+    """
+    Atomically add to a listing's rollup row for a day, creating the row if needed
+
+    Args:
+        listing_id: Primary key of the listing
+        currency: Currency of the amounts
+        day: Date the events happened on
+        revenue: Completed payment amount to add
+        bookings: Completed payments to add
+        cancellations: Cancelled bookings to add
+        host_id: The listing's host, if known; looked up when the row is created otherwise
+    """
+    deltas = {'revenue': revenue, 'bookings': bookings, 'cancellations': cancellations}
+    updates = {field: F(field) + value for field, value in deltas.items() if value}
+    if not updates:
+        return
+
+    rows = DailyRevenue.objects.filter(listing_id=listing_id, currency=currency, day=day)
+    if rows.update(**updates):
+        return
+    # First event of the day for this listing
+    if host_id is None:
+        host_id = Listing.objects.filter(pk=listing_id).values_list('host_id', flat=True).get()
+    try:
+        with transaction.atomic():
+            DailyRevenue.objects.create(listing_id=listing_id, host_id=host_id, currency=currency, day=day, **deltas)
+    except IntegrityError:
+        # A concurrent writer created the row first
+        rows.update(**updates)
+
+
+def cached_host_id(booking):
+    """The booking's host, if its listing is already loaded"""
+    return booking.listing.host_id if Booking.listing.is_cached(booking) else None
+
+
+def record_completed_payments(payments):
+    """
+    Add newly completed payments to the rollup of the day each completed on
+
+    Takes the same few queries however many listings and days the payments
+    span, so the reconciliation sweep can record a whole chunk: the rows
+    are locked, missing ones created, and all are written back at once.
+
+    Args:
+        payments: Payments with booking loaded, just marked completed
+    """
+    totals = {}
+    for payment in payments:
+        key = (payment.booking.listing_id, payment.currency, timezone.localdate(payment.completed_at))
+        entry = totals.setdefault(key, {'revenue': Decimal('0'), 'bookings': 0, 'host_id': None})
+        entry['revenue'] += payment.amount
+        entry['bookings'] += 1
+        entry['host_id'] = entry['host_id'] or cached_host_id(payment.booking)
+    if not totals:
+        return
+
+    def locked_rows():
+        rows = DailyRevenue.objects.select_for_update().filter(
+            listing_id__in={listing_id for listing_id, _, _ in totals},
+            day__in={day for _, _, day in totals},
+        )
+        return {
+            key: row for row in rows
+            if (key := (row.listing_id, row.currency, row.day)) in totals
+        }
+
+    # Locks need a transaction; callers' own blocks roll back with these writes
+    with transaction.atomic(savepoint=False):
+        rows = locked_rows()
+        missing = [key for key in totals if key not in rows]
+        if missing:
+            unknown = [key[0] for key in missing if totals[key]['host_id'] is None]
+            hosts = dict(Listing.objects.filter(pk__in=unknown).values_list('pk', 'host_id')) if unknown else {}
+            DailyRevenue.objects.bulk_create(
+                [
+                    DailyRevenue(
+                        listing_id=listing_id, currency=currency, day=day,
+                        host_id=totals[(listing_id, currency, day)]['host_id'] or hosts[listing_id],
+                    )
+                    for listing_id, currency, day in missing
+                ],
+                # A concurrent writer may create a row first; it is locked below either way
+                ignore_conflicts=True,
+            )
+            rows = locked_rows()
+
+        for key, entry in totals.items():
+            rows[key].revenue += entry['revenue']
+            rows[key].bookings += entry['bookings']
+        DailyRevenue.objects.bulk_update(rows.values(), ['revenue', 'bookings'])
+
+
+def record_cancellation(booking):
+    """Count a just-cancelled booking on the day of its cancelled_at"""
+    currency = booking.payments.values_list('currency', flat=True).first() or DEFAULT_CURRENCY
+    apply_revenue_delta(
+        booking.listing_id, currency, timezone.localdate(booking.cancelled_at), cancellations=1,
+        host_id=cached_host_id(booking),
+    )
+
+
+def rebuild_revenue_rollups(batch_size=1000):
+    """
+    Recompute every rollup row from payments and bookings
+
+    Bookings cancelled before cancelled_at was recorded count on the day
+    they were made.
+
+    Returns:
+        int: Number of rollup rows written
+    """
+    rollups = {}
+
+    def rollup(listing_id, host_id, currency, day):
+        key = (listing_id, currency, day)
+        if key not in rollups:
+            rollups[key] = DailyRevenue(listing_id=listing_id, host_id=host_id, currency=currency, day=day)
+        return rollups[key]
+
+    completed = (
+        Payment.objects.filter(status='completed').order_by()
+        .values(
+            'booking__listing_id', 'booking__listing__host_id', 'currency',
+            day=TruncDate(Coalesce('completed_at', 'updated_at')),
+        )
+        .annotate(revenue=Sum('amount'), bookings=Count('pk'))
+    )
+    latest_currency = Payment.objects.filter(booking=OuterRef('pk')).order_by('-created_at').values('currency')[:1]
+    cancelled = (
+        Booking.objects.filter(status='cancelled').order_by()
+        .values(
+            'listing_id', 'listing__host_id',
+            rollup_currency=Coalesce(Subquery(latest_currency), Value(DEFAULT_CURRENCY)),
+            day=TruncDate(Coalesce('cancelled_at', 'created_at')),
+        )
+        .annotate(cancellations=Count('pk'))
+    )
+
+    with transaction.atomic():
+        for row in completed:
+            entry = rollup(row['booking__listing_id'], row['booking__listing__host_id'], row['currency'], row['day'])
+            entry.revenue = row['revenue']
+            entry.bookings = row['bookings']
+        for row in cancelled:
+            entry = rollup(row['listing_id'], row['listing__host_id'], row['rollup_currency'], row['day'])
+            entry.cancellations = row['cancellations']
+
+        DailyRevenue.objects.all().delete()
+        DailyRevenue.objects.bulk_create(rollups.values(), batch_size=batch_size)
+
+    logger.info(f"Revenue rollups rebuilt: {len(rollups)} rows")
+    return len(rollups)
+
+
+def parse_revenue_params(params):
+    """
+    Validate ?start=, ?end=, ?listing= and ?currency= of a revenue request
+
+    The range defaults to the DEFAULT_RANGE_DAYS days ending today.
+
+    Returns:
+        dict: start and end dates, and the listing id and currency to keep (or None)
+    """
+    start, end = parse_date_range(params)
+    end = end or timezone.localdate()
+    start = start or end - timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    if start > end:
+        raise ValidationError({'start': 'The start date must not be after the end date.'})
+    if (end - start).days >= MAX_RANGE_DAYS:
+        raise ValidationError({'start': f'A range covers at most {MAX_RANGE_DAYS} days.'})
+    listing = params.get('listing') or None
+    if listing:
+        try:
+            listing = uuid.UUID(listing)
+        except ValueError:
+            raise ValidationError({'listing': 'Must be a valid UUID.'})
+    return {
+        'start': start,
+        'end': end,
+        'listing': listing,
+        'currency': params.get('currency') or None,
+    }
+
+
+def host_revenue(host, start, end, listing=None, currency=None):
+    """
+    A host's revenue between two dates, both inclusive, from the rollups
+
+    Returns:
+        dict: 'totals' per currency, and per 'listings' and 'days' breakdowns
+    """
+    rows = DailyRevenue.objects.filter(host=host, day__gte=start, day__lte=end).order_by()
+    if listing:
+        rows = rows.filter(listing_id=listing)
+    if currency:
+        rows = rows.filter(currency=currency)
+
+    return {
+        'start': start,
+        'end': end,
+        'totals': list(rows.values('currency').annotate(**TOTALS).order_by('currency')),
+        'listings': list(
+            rows.values('listing_id', 'currency', title=F('listing__title'))
+            .annotate(**TOTALS)
+            .order_by('-revenue', 'listing_id')
+        ),
+        'days': list(rows.values('day', 'currency').annotate(**TOTALS).order_by('day', 'currency')),
+    }
@@ -0,0 +1,221 @@
+"""
+Full-text search over listings
+
+?search= used to mean LIKE '%term%' on every text column, which scans the
+whole table. Searches now go through a full-text index picked per database:
+
+- MySQL: a FULLTEXT index on (title, description, location), kept current
+  by InnoDB itself
+- SQLite: an FTS5 table, kept current from Listing saves (see
+  listings.signals); run ``manage.py rebuild_search_index`` after bulk
+  writes that bypass save()
+- anything else: the LIKE scan, so search still works everywhere
+
+Every term matches as a prefix ("beach" finds "beachfront"), all terms must
+match, and results carry a ``search_rank`` relevance score. The search is
+an ordinary queryset filter, so it combines with the other listing filters.
+"""
+import logging
+import re
+import sqlite3
+from functools import lru_cache
+
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from rest_framework.filters import SearchFilter
+from rest_framework.settings import api_settings
+
+from .models import Listing
+
+logger = logging.getLogger(__name__)
+
+SEARCH_FIELDS = ('title', 'description', 'location')
+FTS_TABLE = 'listings_listing_fts'
+FULLTEXT_INDEX = 'listing_fulltext'
+MAX_TERMS = 10
+
+# Relevance weight of a match in each field (SQLite only; MySQL weights columns equally)
+FIELD_WEIGHTS = {'title': 10.0, 'description': 1.0, 'location': 5.0}
+
+
+def search_terms(query):
+    """Split a query into lowercase word terms, dropping punctuation and operators"""
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+class LikeSearchBackend:
+    """Substring search with LIKE; no index, no ranking"""
+    name = 'like'
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def search(self, queryset, terms):
+        condition = Q()
+        for term in terms:
+            term_condition = Q()
+            for field in SEARCH_FIELDS:
+                term_condition |= Q(**{f'{field}__icontains': term})
+            condition &= term_condition
+        return queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    def index(self, listings):
+        pass
+
+    def remove(self, listing_ids):
+        pass
+
+    def rebuild(self):
+        return 0
+
+
+class MySQLFullTextBackend(LikeSearchBackend):
+    """MATCH ... AGAINST over the FULLTEXT index; InnoDB keeps the index in sync"""
+    name = 'mysql'
+
+    def search(self, queryset, terms):
+        # Terms shorter than innodb_ft_min_token_size (3 by default) are not indexed
+        query = ' '.join(f'+{term}*' for term in terms)
+        columns = ', '.join(self.connection.ops.quote_name(field) for field in SEARCH_FIELDS)
+        match = f'MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)'
+        return queryset.extra(
+            select={'search_rank': match},
+            select_params=[query],
+            where=[match],
+            params=[query],
+        )
+
+
+class SQLiteFTS5Backend(LikeSearchBackend):
+    """
+    An FTS5 table joined to the listings table, ranked with bm25()
+
+    listing_id is indexed as a token so entries are found and deleted
+    through the FTS index; searches are restricted to the text columns.
+    """
+    name = 'sqlite'
+
+    def search(self, queryset, terms):
+        quote = self.connection.ops.quote_name
+        fts = quote(FTS_TABLE)
+        listing_table = quote(Listing._meta.db_table)
+        phrases = ' '.join(f'"{term}"*' for term in terms)
+        query = f"{{{' '.join(SEARCH_FIELDS)}}} : ({phrases})"
+        # bm25() takes one weight per column; listing_id comes first
+        weights = ', '.join(str(FIELD_WEIGHTS[field]) for field in SEARCH_FIELDS)
+        return queryset.extra(
+            select={'search_rank': f'-bm25({fts}, 0.0, {weights})'},
+            tables=[FTS_TABLE],
+            where=[f'{fts} MATCH %s', f'{fts}.listing_id = {listing_table}.listing_id'],
+            params=[query],
+        )
+
+    def index(self, listings):
+        listings = list(listings)
+        if not listings:
+            return
+        self.remove([listing.pk for listing in listings])
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (listing_id, title, description, location) VALUES (%s, %s, %s, %s)',
+                [(listing.pk.hex, listing.title, listing.description, listing.location) for listing in listings],
+            )
+
+    def remove(self, listing_ids):
+        if not listing_ids:
+            return
+        ids = ' OR '.join(f'"{listing_id.hex}"' for listing_id in listing_ids)
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [f'listing_id : ({ids})'])
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (listing_id, title, description, location) '
+                f'SELECT listing_id, title, description, location FROM {Listing._meta.db_table}'
+            )
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+            cursor.execute(f'SELECT COUNT(*) FROM {FTS_TABLE}')
+            return cursor.fetchone()[0]
+
+
+@lru_cache(maxsize=None)
+def sqlite_has_fts5():
+    """Whether the SQLite library was built with FTS5"""
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE fts5_probe USING fts5(body)')
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def get_search_backend(using='default'):
+    """Return the search backend for a database connection"""
+    connection = connections[using]
+    if connection.vendor == 'mysql':
+        return MySQLFullTextBackend(connection)
+    if connection.vendor == 'sqlite' and sqlite_has_fts5():
+        return SQLiteFTS5Backend(connection)
+    return LikeSearchBackend(connection)
+
+
+def search_listings(queryset, query, backend=None):
+    """
+    Filter a listing queryset down to matches for a search query
+
+    Args:
+        queryset: Listing queryset, possibly already filtered
+        query: Free-text search query
+        backend: Search backend to use; defaults to the database's own
+
+    Returns:
+        QuerySet: Matching listings annotated with search_rank (higher is
+        more relevant), or the queryset unchanged if the query has no terms
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset
+    backend = backend or get_search_backend(queryset.db)
+    return backend.search(queryset, terms)
+
+
+def index_listing(listing, using='default'):
+    """Bring a listing's search entry up to date"""
+    get_search_backend(using).index([listing])
+
+
+def unindex_listing(listing_id, using='default'):
+    """Drop a deleted listing's search entry"""
+    get_search_backend(using).remove([listing_id])
+
+
+def rebuild_search_index(using='default'):
+    """
+    Rebuild the search index from the listings table
+
+    Returns:
+        int: Number of listings indexed (0 where the database maintains the index)
+    """
+    indexed = get_search_backend(using).rebuild()
+    logger.info(f"Search index rebuilt with {indexed} listings")
+    return indexed
+
+
+class ListingSearchFilter(SearchFilter):
+    """
+    ?search= through the full-text backend
+
+    Results are ordered by relevance unless the client passes ?ordering=.
+    Keyset pages (?cursor/?page_size) always follow created_at order; use
+    ?limit/?offset to page through ranked results.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = ' '.join(self.get_search_terms(request))
+        results = search_listings(queryset, query)
+        if results is queryset:
+            return queryset
+        if not request.query_params.get(api_settings.ORDERING_PARAM):
+            results = results.order_by('-search_rank', '-created_at')
+        return results
@@ -1,30 +1,152 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db.models import Prefetch
 from .models import Listing, Booking, Review, Payment
 
 
-class UserSerializer(serializers.ModelSerializer):
+class FieldSelection:
+    """
+    Field paths requested through ?fields= and ?expand=
+
+    - ?fields=payment_id,status,booking.check_in_date renders only those fields;
+      selecting a nested object without sub-paths renders it whole.
+    - ?expand=booking,booking.listing renders only the listed nested objects in
+      full; every other nested object collapses to its primary key and nested
+      lists (e.g. reviews) are left out. An empty ?expand= collapses everything.
+
+    Without either parameter the full representation is returned.
+    """
+
+    def __init__(self, fields=None, expand=None):
+        self.fields = fields
+        self.expand = expand
+
+    @staticmethod
+    def parse(value):
+        if value is None:
+            return None
+        return {tuple(path.strip().split('.')) for path in value.split(',') if path.strip()}
+
+    @classmethod
+    def from_request(cls, request):
+        if request is None:
+            return cls()
+        params = request.query_params
+        return cls(fields=cls.parse(params.get('fields')), expand=cls.parse(params.get('expand')))
+
+    def includes(self, path):
+        """Whether the field at path is rendered at all"""
+        if self.fields is None:
+            return True
+        return any(path[:len(selected)] == selected or selected[:len(path)] == path for selected in self.fields)
+
+    def expands(self, path):
+        """Whether the nested object at path is rendered in full"""
+        if self.expand is None:
+            return True
+        requested = self.expand | {selected for selected in (self.fields or ()) if len(selected) > len(path)}
+        return any(selected[:len(path)] == path for selected in requested)
+
+
+class SelectableFieldsMixin:
+    """Prune a serializer's fields to the request's FieldSelection"""
+
+    def get_field_path(self):
+        """Field names leading from the root serializer to this one"""
+        path = []
+        node = self
+        while node.parent is not None:
+            if node.field_name:
+                path.append(node.field_name)
+            node = node.parent
+        return tuple(reversed(path))
+
+    def get_field_selection(self):
+        root = self.root
+        if not hasattr(root, '_field_selection'):
+            root._field_selection = FieldSelection.from_request(root.context.get('request'))
+        return root._field_selection
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selection = self.get_field_selection()
+        if selection.fields is None and selection.expand is None:
+            return fields
+
+        prefix = self.get_field_path()
+        for name, field in list(fields.items()):
+            if field.write_only:
+                continue
+            path = prefix + (name,)
+            if not selection.includes(path):
+                del fields[name]
+            elif isinstance(field, serializers.ListSerializer):
+                if not selection.expands(path):
+                    del fields[name]
+            elif isinstance(field, serializers.BaseSerializer):
+                if not selection.expands(path):
+                    fields[name] = serializers.PrimaryKeyRelatedField(read_only=True, source=field.source)
+        return fields
+
+
+def optimize_for_serializer(queryset, serializer):
+    """
+    Add the select_related/prefetch_related calls needed to render a queryset
+    with the given serializer, following only the nested fields it will render.
+    """
+    select, prefetch = collect_relations(serializer, '')
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+def collect_relations(serializer, prefix):
+    """Return (select_related paths, Prefetch objects) for a serializer's nested fields"""
+    select, prefetch = [], []
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        if isinstance(field, serializers.ListSerializer):
+            child_select, child_prefetch = collect_relations(field.child, '')
+            queryset = field.child.Meta.model._default_manager.select_related(*child_select)
+            if child_prefetch:
+                queryset = queryset.prefetch_related(*child_prefetch)
+            prefetch.append(Prefetch(prefix + field.source, queryset=queryset))
+        elif isinstance(field, serializers.BaseSerializer):
+            path = prefix + field.source
+            select.append(path)
+            child_select, child_prefetch = collect_relations(field, path + '__')
+            select += child_select
+            prefetch += child_prefetch
+    return select, prefetch
+
+
+class UserSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'first_name', 'last_name', 'email']
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ListingSummarySerializer(SelectableFieldsMixin, serializers.ModelSerializer):
+    """Basic listing info embedded in review responses"""
+
+    class Meta:
+        model = Listing
+        fields = ['listing_id', 'title']
+
+
+class ReviewSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
     reviewer = UserSerializer(read_only=True)
     listing_id = serializers.UUIDField(write_only=True, required=False)
-    listing = serializers.SerializerMethodField(read_only=True)
+    listing = ListingSummarySerializer(read_only=True)
 
     class Meta:
         model = Review
         fields = ['review_id', 'listing', 'listing_id', 'reviewer', 'rating', 'comment', 'created_at']
 
-    def get_listing(self, obj):
-        """Return basic listing info in read response"""
-        return {
-            'listing_id': obj.listing.listing_id,
-            'title': obj.listing.title
-        }
-
     def create(self, validated_data):
         """Create review with listing from write_only field"""
         listing_id = validated_data.pop('listing_id', None)
@@ -35,31 +157,29 @@ class ReviewSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class ListingSerializer(serializers.ModelSerializer):
+class ListingSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
     host = UserSerializer(read_only=True)
     reviews = ReviewSerializer(many=True, read_only=True)
     average_rating = serializers.SerializerMethodField()
-    review_count = serializers.SerializerMethodField()
+    rating_histogram = serializers.ReadOnlyField()
 
     class Meta:
         model = Listing
         fields = [
             'listing_id', 'title', 'description', 'price_per_night', 'location',
             'amenities', 'host', 'created_at', 'updated_at', 'is_available',
-            'reviews', 'average_rating', 'review_count'
+            'reviews', 'average_rating', 'review_count', 'rating_histogram'
         ]
+        read_only_fields = ['review_count']
 
     def get_average_rating(self, obj):
-        reviews = obj.reviews.all()
-        if reviews:
-            return sum(review.rating for review in reviews) / len(reviews)
+        # Computed from the aggregates stored on the listing, no review queries
+        if obj.review_count:
+            return obj.rating_sum / obj.review_count
         return 0
 
-    def get_review_count(self, obj):
-        return obj.reviews.count()
-
 
-class BookingSerializer(serializers.ModelSerializer):
+class BookingSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
     listing = ListingSerializer(read_only=True)
     guest = UserSerializer(read_only=True)
     listing_id = serializers.UUIDField(write_only=True)
@@ -70,6 +190,8 @@ class BookingSerializer(serializers.ModelSerializer):
             'booking_id', 'listing', 'listing_id', 'guest', 'check_in_date',
             'check_out_date', 'total_price', 'status', 'created_at'
         ]
+        # Computed from the nightly rate when the client leaves it out
+        extra_kwargs = {'total_price': {'required': False}}
 
     def validate(self, data):
         if data['check_in_date'] >= data['check_out_date']:
@@ -77,7 +199,19 @@ class BookingSerializer(serializers.ModelSerializer):
         return data
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class BookingBatchSerializer(serializers.Serializer):
+    """The stays of one batch request; each is validated by BookingSerializer on its own"""
+    bookings = serializers.ListField(child=serializers.DictField(), allow_empty=False)
+
+    def validate_bookings(self, value):
+        if len(value) > settings.BOOKING_BATCH_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"A batch holds at most {settings.BOOKING_BATCH_MAX_SIZE} bookings."
+            )
+        return value
+
+
+class PaymentSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
     booking = BookingSerializer(read_only=True)
     booking_id = serializers.UUIDField(write_only=True, required=False)
 
@@ -90,3 +224,29 @@ class PaymentSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['payment_id', 'transaction_id', 'chapa_reference', 'created_at', 'updated_at', 'completed_at']
 
+
+
+class RevenueSerializer(serializers.Serializer):
+    """Summed daily revenue rollups in one currency"""
+    currency = serializers.CharField()
+    revenue = serializers.DecimalField(max_digits=16, decimal_places=2)
+    bookings = serializers.IntegerField()
+    cancellations = serializers.IntegerField()
+
+
+class ListingRevenueSerializer(RevenueSerializer):
+    listing_id = serializers.UUIDField()
+    title = serializers.CharField()
+
+
+class DayRevenueSerializer(RevenueSerializer):
+    day = serializers.DateField()
+
+
+class HostRevenueSerializer(serializers.Serializer):
+    """A host's revenue over a date range, as returned by listings.revenue.host_revenue"""
+    start = serializers.DateField()
+    end = serializers.DateField()
+    totals = RevenueSerializer(many=True)
+    listings = ListingRevenueSerializer(many=True)
+    days = DayRevenueSerializer(many=True)
@@ -0,0 +1,49 @@
+"""
+Signal handlers for the listings app
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .amenities import sync_listing_amenities
+from .cache import invalidate_listing, invalidate_listings
+from .models import Booking, Listing, Review
+from .search import SEARCH_FIELDS, index_listing, unindex_listing
+
+
+@receiver([post_save, post_delete], sender=Listing)
+def listing_changed(sender, instance, **kwargs):
+    """A listing's own fields changed"""
+    invalidate_listing(instance.pk)
+
+
+@receiver(post_save, sender=Listing)
+def listing_saved(sender, instance, using, update_fields=None, **kwargs):
+    """Keep the listing's search entry in step with its text"""
+    if update_fields is not None and not set(update_fields) & set(SEARCH_FIELDS):
+        return
+    index_listing(instance, using=using)
+
+
+@receiver(post_save, sender=Listing)
+def listing_amenities_saved(sender, instance, update_fields=None, **kwargs):
+    """Keep the amenity mask and index in step with the amenities text"""
+    if update_fields is not None and 'amenities' not in update_fields:
+        return
+    sync_listing_amenities(instance)
+
+
+@receiver(post_delete, sender=Listing)
+def listing_deleted(sender, instance, using, **kwargs):
+    unindex_listing(instance.pk, using=using)
+
+
+@receiver([post_save, post_delete], sender=Review)
+def review_changed(sender, instance, **kwargs):
+    """Reviews and rating aggregates are rendered with the listing"""
+    invalidate_listing(instance.listing_id)
+
+
+@receiver([post_save, post_delete], sender=Booking)
+def booking_changed(sender, instance, **kwargs):
+    """Bookings change which listings match availability searches"""
+    invalidate_listings()
@@ -0,0 +1,320 @@
+"""
+Synthetic data at production scale
+
+Generates users, listings, bookings, reviews and payments for load tests and
+benchmarks (``manage.py seed --listings N``). Work is split into chunks and
+every chunk draws from its own RNG, seeded from the run's seed and the chunk
+number, so a seed always produces the same rows however many worker
+processes share the chunks. Each chunk owns a disjoint key range:
+
+- users get explicit ids from a block reserved above the current maximum
+- a listing chunk creates its listings together with their bookings,
+  booked nights, reviews and payments, and never reads another chunk's rows
+
+The data keeps the model invariants: a listing's bookings never overlap,
+check-out is after check-in, a guest reviews a listing at most once and only
+after a completed stay, and hosts don't book their own listings. Rows are
+written with bulk_create, which skips save() and its signals, so the derived
+data maintained there (availability nights, amenity index, rating totals) is
+written directly and the search index and revenue rollups are rebuilt at the
+end.
+"""
+import random
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .amenities import amenity_mask, get_or_create_amenities, parse_amenities
+from .availability import HOLDING_STATUSES, booked_nights_for
+from .cache import invalidate_listings
+from .models import BookedNight, Booking, Listing, ListingAmenity, Payment, Review
+from .revenue import rebuild_revenue_rollups
+from .search import rebuild_search_index
+
+FIRST_NAMES = ('Abebe', 'Amina', 'Bekele', 'Chipo', 'Dawit', 'Fatuma', 'Hana', 'Juma', 'Kofi', 'Lulu', 'Meron', 'Tendai')
+LOCATIONS = (
+    'Addis Ababa', 'Mombasa', 'Nairobi', 'Zanzibar', 'Kigali', 'Lalibela', 'Gondar', 'Arusha', 'Cape Town', 'Accra',
+)
+PLACE_KINDS = ('Villa', 'Cabin', 'Loft', 'Apartment', 'Bungalow', 'Guesthouse', 'Cottage', 'Studio', 'Lodge', 'Suite')
+PLACE_TRAITS = ('Cozy', 'Sunny', 'Quiet', 'Modern', 'Rustic', 'Spacious', 'Charming', 'Bright', 'Hidden', 'Grand')
+SIGHTS = ('the ocean', 'the old town', 'the market', 'the lake', 'the hills', 'the park', 'the harbour', 'the museum')
+COMMENTS = (
+    'Great place to stay! Highly recommended.',
+    'Beautiful location and excellent amenities.',
+    'Host was very responsive and helpful.',
+    'Clean and comfortable accommodation.',
+    'Amazing views and peaceful environment.',
+    'Decent stay, but the photos flatter it.',
+    'Noisy at night and the WiFi kept dropping.',
+)
+
+# (name, share of listings offering it)
+AMENITIES = (
+    ('WiFi', 0.9), ('Kitchen', 0.7), ('Parking', 0.5), ('Air Conditioning', 0.4), ('Washer', 0.35),
+    ('Workspace', 0.25), ('Pet Friendly', 0.2), ('Pool', 0.15), ('Gym', 0.1), ('Hot Tub', 0.08),
+    ('Fireplace', 0.07), ('Beach Access', 0.06), ('Pool Table', 0.05), ('EV Charger', 0.03), ('Sauna', 0.02),
+)
+
+# Star ratings skew positive, as they do on real listings
+RATING_WEIGHTS = (3, 5, 12, 35, 45)
+
+# Bookings start up to this many days in the past and run into the future
+HISTORY_DAYS = 730
+
+
+def chunk_rng(seed, kind, index):
+    """RNG for one chunk; string seeds hash the same way in every process"""
+    return random.Random(f'{seed}:{kind}:{index}')
+
+
+def random_uuid(rng):
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def chunk_range(index, chunk_size, total):
+    """Offsets [first, last) covered by a chunk"""
+    first = index * chunk_size
+    return first, min(first + chunk_size, total)
+
+
+def plan_synthetic_data(users, listings, seed=42, chunk_size=1000, batch_size=1000,
+                        bookings_per_listing=5, review_rate=0.6):
+    """
+    Reserve the user id block and amenity vocabulary for a run
+
+    The returned plan is a plain dict so it can be sent to worker processes.
+
+    Returns:
+        dict: Parameters shared by every chunk of the run
+    """
+    if users < 2:
+        raise ValueError("At least two users are needed so hosts don't book their own listings")
+    vocabulary = {}
+    for name, _ in AMENITIES:
+        vocabulary.update(parse_amenities(name))
+    amenities = get_or_create_amenities(vocabulary)
+    return {
+        'seed': seed,
+        'users': users,
+        'listings': listings,
+        'chunk_size': chunk_size,
+        'batch_size': batch_size,
+        'bookings_per_listing': bookings_per_listing,
+        'review_rate': review_rate,
+        'first_user_id': (User.objects.aggregate(last=Max('id'))['last'] or 0) + 1,
+        # The same password for every user; hashing millions of them would dominate the run
+        'password': make_password('password123'),
+        'amenities': {name: amenities[slug] for name, _ in AMENITIES for slug in parse_amenities(name)},
+        'today': date.today().toordinal(),
+        'now': timezone.now().isoformat(),
+    }
+
+
+def user_chunks(plan):
+    return range((plan['users'] + plan['chunk_size'] - 1) // plan['chunk_size'])
+
+
+def listing_chunks(plan):
+    return range((plan['listings'] + plan['chunk_size'] - 1) // plan['chunk_size'])
+
+
+def create_user_chunk(plan, index):
+    """
+    Create one chunk of users
+
+    Returns:
+        dict: Rows written per table
+    """
+    rng = chunk_rng(plan['seed'], 'users', index)
+    first, last = chunk_range(index, plan['chunk_size'], plan['users'])
+    users = []
+    for offset in range(first, last):
+        user_id = plan['first_user_id'] + offset
+        users.append(User(
+            id=user_id,
+            username=f'loadtest_{user_id}',
+            email=f'loadtest_{user_id}@example.com',
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=rng.choice(FIRST_NAMES),
+            password=plan['password'],
+        ))
+    User.objects.bulk_create(users, batch_size=plan['batch_size'])
+    return {'users': len(users)}
+
+
+def create_listing_chunk(plan, index):
+    """
+    Create one chunk of listings with their bookings, reviews and payments
+
+    Returns:
+        dict: Rows written per table
+    """
+    rng = chunk_rng(plan['seed'], 'listings', index)
+    first, last = chunk_range(index, plan['chunk_size'], plan['listings'])
+    first_user = plan['first_user_id']
+    last_user = first_user + plan['users'] - 1
+    today = date.fromordinal(plan['today'])
+    now = datetime.fromisoformat(plan['now'])
+
+    listings, links, bookings, nights, reviews, payments = [], [], [], [], [], []
+    for _ in range(first, last):
+        offered = [name for name, share in AMENITIES if rng.random() < share]
+        listing = Listing(
+            listing_id=random_uuid(rng),
+            title=f'{rng.choice(PLACE_TRAITS)} {rng.choice(PLACE_KINDS)} in {rng.choice(LOCATIONS)}',
+            description=f'{rng.randint(1, 6)} bedrooms, {rng.randint(1, 30)} minutes from {rng.choice(SIGHTS)}',
+            price_per_night=Decimal(rng.randint(20, 500)),
+            location=rng.choice(LOCATIONS),
+            amenities=', '.join(offered),
+            amenity_mask=amenity_mask(plan['amenities'][name][1] for name in offered),
+            host_id=rng.randint(first_user, last_user),
+            is_available=rng.random() < 0.9,
+        )
+        listings.append(listing)
+        links += [ListingAmenity(listing_id=listing.pk, amenity_id=plan['amenities'][name][0]) for name in offered]
+
+        # Stays follow each other with gaps, so a listing's bookings never overlap
+        reviewers = set()
+        day = today - timedelta(days=rng.randint(0, HISTORY_DAYS))
+        for _ in range(rng.randint(0, 2 * plan['bookings_per_listing'])):
+            check_in = day + timedelta(days=rng.randint(0, 30))
+            check_out = check_in + timedelta(days=rng.randint(1, 14))
+            day = check_out
+            guest_id = rng.randint(first_user, last_user)
+            while guest_id == listing.host_id:
+                guest_id = rng.randint(first_user, last_user)
+
+            if check_out <= today:
+                status = 'completed' if rng.random() < 0.85 else 'cancelled'
+            elif check_in <= today:
+                status = 'confirmed'
+            else:
+                status = rng.choices(('confirmed', 'pending', 'cancelled'), weights=(70, 20, 10))[0]
+
+            booking = Booking(
+                booking_id=random_uuid(rng),
+                listing_id=listing.pk,
+                guest_id=guest_id,
+                check_in_date=check_in,
+                check_out_date=check_out,
+                total_price=listing.price_per_night * (check_out - check_in).days,
+                status=status,
+            )
+            bookings.append(booking)
+            if status in HOLDING_STATUSES:
+                nights += booked_nights_for(booking)
+
+            payment = synthetic_payment(rng, booking, now)
+            if payment is not None:
+                payments.append(payment)
+
+            if status == 'completed' and guest_id not in reviewers and rng.random() < plan['review_rate']:
+                reviewers.add(guest_id)
+                rating = rng.choices(range(1, 6), weights=RATING_WEIGHTS)[0]
+                reviews.append(Review(
+                    review_id=random_uuid(rng),
+                    listing_id=listing.pk,
+                    reviewer_id=guest_id,
+                    rating=rating,
+                    comment=rng.choice(COMMENTS),
+                ))
+                listing.rating_sum += rating
+                listing.review_count += 1
+                star = f'rating_{rating}_count'
+                setattr(listing, star, getattr(listing, star) + 1)
+
+    batch_size = plan['batch_size']
+    with transaction.atomic():
+        Listing.objects.bulk_create(listings, batch_size=batch_size)
+        ListingAmenity.objects.bulk_create(links, batch_size=batch_size)
+        Booking.objects.bulk_create(bookings, batch_size=batch_size)
+        BookedNight.objects.bulk_create(nights, batch_size=batch_size)
+        Review.objects.bulk_create(reviews, batch_size=batch_size)
+        Payment.objects.bulk_create(payments, batch_size=batch_size)
+    return {
+        'listings': len(listings),
+        'amenity links': len(links),
+        'bookings': len(bookings),
+        'booked nights': len(nights),
+        'reviews': len(reviews),
+        'payments': len(payments),
+    }
+
+
+def synthetic_payment(rng, booking, now):
+    """
+    The payment a booking would have by now, if any
+
+    Pending payments get no Chapa reference, so payment reconciliation
+    leaves them alone instead of querying Chapa for every one.
+    """
+    if booking.status == 'pending':
+        if rng.random() < 0.5:
+            return None
+        status = 'pending'
+    elif booking.status == 'cancelled':
+        status = rng.choice(('failed', 'cancelled'))
+    else:
+        status = 'completed'
+
+    payment_id = random_uuid(rng)
+    settled = status != 'pending'
+    return Payment(
+        payment_id=payment_id,
+        booking_id=booking.pk,
+        amount=booking.total_price,
+        status=status,
+        transaction_id=f'synthetic-{payment_id.hex}' if status == 'completed' else None,
+        chapa_reference=str(payment_id) if settled else None,
+        payment_method='chapa' if settled else None,
+        completed_at=now if status == 'completed' else None,
+        error_message='Payment declined' if status == 'failed' else None,
+    )
+
+
+def run_chunks(create_chunk, plan, chunks, workers=1):
+    """
+    Create chunks in this process or across worker processes
+
+    Workers open their own database connections, so the parent's are closed
+    before they start rather than shared with them.
+
+    Yields:
+        dict: Rows written per table, for each chunk as it finishes
+    """
+    if workers <= 1:
+        for index in chunks:
+            yield create_chunk(plan, index)
+        return
+
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+        futures = [pool.submit(create_chunk, plan, index) for index in chunks]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def finish_synthetic_data():
+    """
+    Bring shared state in line after the chunks are written
+
+    Returns:
+        int: Listings in the search index
+    """
+    # Explicit ids leave PostgreSQL's sequence behind; other backends return no SQL
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [User]):
+            cursor.execute(sql)
+    invalidate_listings()
+    # Payments were bulk-created, so no rollup saw them complete
+    rebuild_revenue_rollups()
+    return rebuild_search_index()
@@ -0,0 +1,78 @@
+"""
+Celery tasks for payment emails, callbacks and reconciliation
+
+Tasks carry IDs only and reload their data from the database, so a task
+message never holds stale model state.
+"""
+import logging
+
+from celery import shared_task
+from django.conf import settings
+
+from .callbacks import VerificationUnavailable, process_callback
+from .email_tasks import drain_email_outbox, queue_payment_email
+from .models import Payment
+from .reconciliation import reconcile_pending_payments
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def send_payment_email(payment_id, kind, error_message=None):
+    """
+    Render a payment email into the outbox and schedule its delivery
+
+    Args:
+        payment_id: Primary key of the payment
+        kind: 'confirmation' or 'failure'
+        error_message: Error message for failure emails
+    """
+    try:
+        payment = Payment.objects.select_related(
+            'booking__guest', 'booking__listing'
+        ).get(payment_id=payment_id)
+    except Payment.DoesNotExist:
+        logger.warning(f"Payment {payment_id} no longer exists, skipping {kind} email")
+        return
+
+    if queue_payment_email(payment, kind, error_message) is None:
+        return
+
+    # Delay delivery slightly so emails queued close together go out in one batch
+    deliver_queued_emails.apply_async(countdown=settings.EMAIL_OUTBOX_FLUSH_DELAY)
+
+
+@shared_task
+def deliver_queued_emails():
+    """Deliver every queued email over a single SMTP connection"""
+    return drain_email_outbox(
+        batch_size=settings.EMAIL_OUTBOX_BATCH_SIZE,
+        max_attempts=settings.EMAIL_OUTBOX_MAX_ATTEMPTS,
+    )
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=30)
+def process_payment_callback(self, tx_ref):
+    """
+    Verify the payment behind a Chapa callback
+
+    Retried with a delay while Chapa is unreachable; payments still pending
+    after that are settled by reconcile_payments.
+    """
+    try:
+        return process_callback(tx_ref)
+    except VerificationUnavailable as e:
+        logger.warning(f"Verification of payment {tx_ref} failed, retrying: {str(e)}")
+        raise self.retry(exc=e)
+
+
+@shared_task
+def reconcile_payments():
+    """Verify pending payments with Chapa in bulk"""
+    stats = reconcile_pending_payments(
+        chunk_size=settings.PAYMENT_RECONCILE_CHUNK_SIZE,
+        workers=settings.PAYMENT_RECONCILE_WORKERS,
+        rate_limit=settings.PAYMENT_RECONCILE_RATE_LIMIT,
+        min_age=settings.PAYMENT_RECONCILE_MIN_AGE,
+    )
+    return {key: stats[key] for key in ('processed', 'completed', 'failed', 'errors')}
@@ -0,0 +1,33 @@
+"""
+Test helpers for the listings app
+"""
+from contextlib import contextmanager
+
+from .instrumentation import RequestProfile
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin asserting how many queries a block may issue
+
+    Unlike assertNumQueries the budget is an upper bound, so a view can get
+    cheaper without its test changing, and it can also cap how often any
+    one query repeats, which catches an N+1 whatever the page size::
+
+        with self.assertQueryBudget(4, max_repeats=1):
+            self.client.get('/api/listings/')
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, max_queries, max_repeats=None):
+        profile = RequestProfile()
+        with profile.capture():
+            yield profile
+
+        statements = '\n'.join(f'  {count}x {sql}' for sql, count in profile.fingerprints.most_common())
+        if profile.query_count > max_queries:
+            self.fail(f'{profile.query_count} queries over a budget of {max_queries}:\n{statements}')
+        if max_repeats is not None:
+            repeated = profile.repeated_queries(max_repeats + 1)
+            if repeated:
+                self.fail(f'A query ran {repeated[0][1]} times, more than {max_repeats}:\n{statements}')
@@ -1,3 +1,1480 @@
-from django.test import TestCase
+"""
+Unit tests for listing endpoints
+"""
+import base64
+import json
+import os
+import tempfile
+import tracemalloc
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from decimal import Decimal
+from datetime import date, timedelta
+
+from . import amenities
+from .amenities import filter_amenities, rebuild_amenity_index
+from .availability import rebuild_availability_index, sync_booking_nights
+from .benchmarks.api import ROUTES, ApiBenchmark, find_regressions, registered_routes
+from .benchmarks.chapa import StubChapaServer
+from .cache import cache_stats
+from .chapa_utils import ChapaAPIClient
+from .instrumentation import RequestProfile, fingerprint
+from .models import Amenity, BookedNight, Booking, Listing, ListingAmenity, Payment, Review
+from .pagination import estimate_count
+from .query_plans import QUERY_SHAPES, QueryShape, check_query_plans
+from .ratings import apply_review_delta, rebuild_listing_stats
+from .search import LikeSearchBackend, get_search_backend, rebuild_search_index, search_listings
+from .synthetic import create_listing_chunk, create_user_chunk, plan_synthetic_data
+from .testing import QueryBudgetMixin
+from .views import ReviewViewSet
+
+
+class ListingQueryCountTestCase(TestCase):
+    """Listing reads must cost a fixed number of queries per page"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.host_user = User.objects.create(username='host', email='host@test.com')
+        self.host_token = Token.objects.create(user=self.host_user)
+        self.client = APIClient()
+
+    def create_listings(self, count, reviews_per_listing):
+        """Create listings, each with its own set of reviewers and reviews"""
+        start = Listing.objects.count()
+        for i in range(start, start + count):
+            listing = Listing.objects.create(
+                title=f'Listing {i}',
+                description='A test property',
+                price_per_night=Decimal('100.00'),
+                location='Addis Ababa',
+                amenities='WiFi',
+                host=self.host_user,
+            )
+            for j in range(reviews_per_listing):
+                reviewer = User.objects.create(username=f'reviewer-{i}-{j}')
+                Review.objects.create(
+                    listing=listing,
+                    reviewer=reviewer,
+                    rating=(j % 5) + 1,
+                    comment='Nice stay',
+                )
+        # Reviews created through the ORM bypass the viewset's aggregate updates
+        rebuild_listing_stats()
+
+    def test_list_query_count_is_constant(self):
+        """Listing list issues the same number of queries for any data size"""
+        self.create_listings(2, 1)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/listings/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+
+        self.create_listings(8, 4)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/listings/')
+        self.assertEqual(len(response.json()), 10)
+
+    def test_sparse_fields_skip_unused_relations(self):
+        """Listings without nested fields requested are served in one query"""
+        self.create_listings(3, 2)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/listings/?fields=listing_id,title,average_rating,host&expand=')
+        data = response.json()[0]
+        self.assertEqual(set(data), {'listing_id', 'title', 'average_rating', 'host'})
+        self.assertEqual(data['host'], self.host_user.pk)
+
+    def test_retrieve_query_count(self):
+        """Listing detail is served in a fixed number of queries"""
+        self.create_listings(1, 5)
+        listing = Listing.objects.get()
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/listings/{listing.listing_id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['review_count'], 5)
+
+    def test_my_listings_and_available_query_count(self):
+        """Custom listing actions reuse the annotated queryset"""
+        self.create_listings(3, 3)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.host_token.key}')
+
+        # One extra query resolves the auth token
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/listings/my_listings/')
+        self.assertEqual(len(response.json()), 3)
+
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/listings/available/')
+        self.assertEqual(len(response.json()), 3)
+
+    def test_rebuilt_stats_match_reviews(self):
+        """Rebuilt aggregates render the same values as the reviews"""
+        self.create_listings(1, 4)
+        self.assertEqual(rebuild_listing_stats(), 1)
+        self.assertEqual(Listing.objects.get().review_count, 4)
+        data = self.client.get('/api/listings/').json()[0]
+        self.assertEqual(data['review_count'], 4)
+        self.assertEqual(data['average_rating'], 2.5)
+        self.assertEqual(data['rating_histogram'], {'1': 1, '2': 1, '3': 1, '4': 1, '5': 0})
+        self.assertEqual(len(data['reviews']), 4)
+
+
+class ListingRatingStatsTestCase(TestCase):
+    """Rating aggregates stored on Listing follow review writes"""
+
+    def setUp(self):
+        """Set up a listing and two reviewers"""
+        self.host_user = User.objects.create(username='host', email='host@test.com')
+        self.listing = Listing.objects.create(
+            title='Beach House',
+            description='A test property',
+            price_per_night=Decimal('100.00'),
+            location='Addis Ababa',
+            amenities='WiFi',
+            host=self.host_user,
+        )
+        self.tokens = [
+            Token.objects.create(user=User.objects.create(username=f'reviewer-{i}'))
+            for i in range(2)
+        ]
+        self.client = APIClient()
+
+    def review(self, token, rating):
+        """Post a review as the token's user"""
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        response = self.client.post('/api/reviews/', {
+            'listing_id': str(self.listing.listing_id),
+            'rating': rating,
+            'comment': 'Nice stay',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['review_id']
+
+    def assert_stats(self, rating_sum, review_count, histogram):
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.rating_sum, rating_sum)
+        self.assertEqual(self.listing.review_count, review_count)
+        self.assertEqual(self.listing.rating_histogram, histogram)
+
+    def test_create_update_delete(self):
+        """Creating, editing and deleting reviews adjusts the aggregates"""
+        first = self.review(self.tokens[0], 5)
+        self.review(self.tokens[1], 3)
+        self.assert_stats(8, 2, {1: 0, 2: 0, 3: 1, 4: 0, 5: 1})
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.tokens[0].key}')
+        response = self.client.patch(f'/api/reviews/{first}/', {'rating': 2}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_stats(5, 2, {1: 0, 2: 1, 3: 1, 4: 0, 5: 0})
+
+        response = self.client.delete(f'/api/reviews/{first}/')
+        self.assertEqual(response.status_code, 204)
+        self.assert_stats(3, 1, {1: 0, 2: 0, 3: 1, 4: 0, 5: 0})
+
+    def test_moving_a_review_moves_its_rating(self):
+        """A review moved to another listing stops counting towards the old one"""
+        other = Listing.objects.create(
+            title='Cabin',
+            description='A test property',
+            price_per_night=Decimal('80.00'),
+            location='Addis Ababa',
+            amenities='WiFi',
+            host=self.host_user,
+        )
+        review_id = self.review(self.tokens[0], 3)
+        response = self.client.put(f'/api/reviews/{review_id}/', {
+            'listing_id': str(other.listing_id),
+            'rating': 4,
+            'comment': 'Nicer stay',
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_stats(0, 0, {1: 0, 2: 0, 3: 0, 4: 0, 5: 0})
+        other.refresh_from_db()
+        self.assertEqual((other.rating_sum, other.review_count), (4, 1))
+        self.assertEqual(other.rating_histogram, {1: 0, 2: 0, 3: 0, 4: 1, 5: 0})
+
+    def test_update_takes_back_the_stored_rating(self):
+        """An edit takes back the rating stored, not the one its request loaded"""
+        review_id = self.review(self.tokens[0], 5)
+        # Another edit commits after this request loaded the review
+        original_get_object = ReviewViewSet.get_object
+
+        def get_object_then_concurrent_edit(view):
+            review = original_get_object(view)
+            Review.objects.filter(pk=review_id).update(rating=2)
+            apply_review_delta(self.listing.pk, added=2, removed=5)
+            return review
+
+        with mock.patch.object(ReviewViewSet, 'get_object', get_object_then_concurrent_edit):
+            response = self.client.patch(f'/api/reviews/{review_id}/', {'rating': 4}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_stats(4, 1, {1: 0, 2: 0, 3: 0, 4: 1, 5: 0})
+
+    def test_concurrent_deletes_take_the_rating_back_once(self):
+        """A delete racing another of the same review leaves the aggregates alone"""
+        self.review(self.tokens[1], 4)
+        review_id = self.review(self.tokens[0], 5)
+        # Another delete commits after this request loaded the review
+        original_get_object = ReviewViewSet.get_object
+
+        def get_object_then_concurrent_delete(view):
+            review = original_get_object(view)
+            Review.objects.filter(pk=review_id).delete()
+            apply_review_delta(self.listing.pk, removed=5)
+            return review
+
+        with mock.patch.object(ReviewViewSet, 'get_object', get_object_then_concurrent_delete):
+            response = self.client.delete(f'/api/reviews/{review_id}/')
+        self.assertEqual(response.status_code, 204)
+        self.assert_stats(4, 1, {1: 0, 2: 0, 3: 0, 4: 1, 5: 0})
+
+    def test_order_by_rating(self):
+        """Listings can be ordered by their stored average rating"""
+        other = Listing.objects.create(
+            title='Cabin',
+            description='A test property',
+            price_per_night=Decimal('80.00'),
+            location='Addis Ababa',
+            amenities='WiFi',
+            host=self.host_user,
+        )
+        self.review(self.tokens[0], 4)
+        self.client.credentials()
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/listings/?ordering=-average_rating')
+        self.assertEqual([item['title'] for item in response.json()], ['Beach House', 'Cabin'])
+
+        response = self.client.get('/api/listings/?ordering=average_rating')
+        self.assertEqual([item['listing_id'] for item in response.json()][0], str(other.listing_id))
+
+
+class ListingPaginationTestCase(TestCase):
+    """Keyset and offset pagination over listings"""
+
+    def setUp(self):
+        """Create listings sharing created_at values so the pk tiebreaker matters"""
+        self.host_user = User.objects.create(username='host', email='host@test.com')
+        for i in range(25):
+            Listing.objects.create(
+                title=f'Listing {i}',
+                description='A test property',
+                price_per_night=Decimal('100.00'),
+                location='Addis Ababa',
+                amenities='WiFi',
+                host=self.host_user,
+            )
+        listing_ids = list(Listing.objects.values_list('pk', flat=True))
+        shared = timezone.now()
+        Listing.objects.filter(pk__in=listing_ids[:10]).update(created_at=shared)
+        self.client = APIClient()
+
+    def test_unpaginated_by_default(self):
+        """Without pagination params the list response is a plain list"""
+        response = self.client.get('/api/listings/')
+        self.assertIsInstance(response.json(), list)
+        self.assertEqual(len(response.json()), 25)
+
+    def test_keyset_pages_cover_every_row_once(self):
+        """Following next links visits every listing exactly once"""
+        seen = []
+        url = '/api/listings/?page_size=7'
+        pages = 0
+        with CaptureQueriesContext(connection) as queries:
+            while url:
+                data = self.client.get(url).json()
+                self.assertNotIn('count', data)
+                seen.extend(item['listing_id'] for item in data['results'])
+                url = data['next']
+                pages += 1
+        self.assertEqual(pages, 4)
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(len(set(seen)), 25)
+        self.assertFalse(any('COUNT(*)' in query['sql'] for query in queries.captured_queries))
+
+        expected = [
+            str(pk) for pk in Listing.objects.order_by('-created_at', '-pk').values_list('pk', flat=True)
+        ]
+        self.assertEqual(seen, expected)
+
+    def test_keyset_previous_link(self):
+        """The previous link returns the page before the current one"""
+        first = self.client.get('/api/listings/?page_size=10').json()
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(
+            [item['listing_id'] for item in back['results']],
+            [item['listing_id'] for item in first['results']],
+        )
+
+    def test_invalid_cursor(self):
+        """A malformed cursor is rejected with 404"""
+        response = self.client.get('/api/listings/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+        # Well-formed, but tampered with so its key isn't one
+        for key in ('not-a-uuid', None, ['x']):
+            tampered = base64.urlsafe_b64encode(json.dumps({'t': timezone.now().isoformat(), 'k': key}).encode())
+            response = self.client.get(f'/api/listings/?cursor={tampered.decode()}')
+            self.assertEqual(response.status_code, 404, key)
+
+    def test_offset_pagination_reports_count(self):
+        """Offset mode returns a count and flags whether it is an estimate"""
+        data = self.client.get('/api/listings/?limit=5&offset=20').json()
+        self.assertEqual(len(data['results']), 5)
+        self.assertEqual(data['count'], 25)
+        self.assertFalse(data['count_is_estimate'])
+        self.assertIsNone(data['next'])
+
+    def test_offset_pages_past_the_count_cap(self):
+        """Pages past a capped count still return their rows and link onwards"""
+        with mock.patch('listings.pagination.EstimatedCountPagination.count_cap', 10):
+            data = self.client.get('/api/listings/?limit=5&offset=15').json()
+            self.assertEqual(len(data['results']), 5)
+            self.assertTrue(data['count_is_estimate'])
+            self.assertGreaterEqual(data['count'], 21)
+            self.assertIsNotNone(data['next'])
+
+            last = self.client.get(data['next']).json()
+        self.assertEqual(len(last['results']), 5)
+        self.assertIsNone(last['next'])
+        seen = {item['listing_id'] for item in data['results'] + last['results']}
+        self.assertEqual(len(seen), 10)
+
+    def test_estimate_count_caps_filtered_queries(self):
+        """Filtered counts stop at the cap instead of scanning the table"""
+        queryset = Listing.objects.filter(is_available=True)
+        self.assertEqual(estimate_count(queryset, cap=10), (10, True))
+        self.assertEqual(estimate_count(queryset, cap=100), (25, False))
+
+
+class ListingAvailabilityTestCase(TestCase):
+    """Date-range availability search backed by the booked-night index"""
+
+    def setUp(self):
+        """Set up two listings and a guest"""
+        self.host_user = User.objects.create(username='host', email='host@test.com')
+        self.guest_user = User.objects.create(username='guest', email='guest@test.com')
+        self.guest_token = Token.objects.create(user=self.guest_user)
+        self.beach = Listing.objects.create(
+            title='Beach House',
+            description='A test property',
+            price_per_night=Decimal('100.00'),
+            location='Addis Ababa',
+            amenities='WiFi',
+            host=self.host_user,
+        )
+        self.cabin = Listing.objects.create(
+            title='Cabin',
+            description='A test property',
+            price_per_night=Decimal('80.00'),
+            location='Addis Ababa',
+            amenities='WiFi',
+            host=self.host_user,
+        )
+        self.check_in = date.today() + timedelta(days=10)
+        self.client = APIClient()
+
+    def book(self, listing, check_in, nights):
+        """Create a booking through the API as the guest"""
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.guest_token.key}')
+        response = self.client.post('/api/bookings/', {
+            'listing_id': str(listing.listing_id),
+            'check_in_date': check_in.isoformat(),
+            'check_out_date': (check_in + timedelta(days=nights)).isoformat(),
+            'total_price': str(listing.price_per_night * nights),
+        }, format='json')
+        self.client.credentials()
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def search(self, check_in, check_out):
+        """Return the titles of listings free for the given stay"""
+        response = self.client.get('/api/listings/', {
+            'check_in': check_in.isoformat(),
+            'check_out': check_out.isoformat(),
+        })
+        self.assertEqual(response.status_code, 200)
+        return sorted(item['title'] for item in response.json())
+
+    def test_booking_holds_its_nights(self):
+        """A booked listing is excluded only for overlapping stays"""
+        self.book(self.beach, self.check_in, 3)
+        self.assertEqual(BookedNight.objects.filter(listing=self.beach).count(), 3)
+
+        overlapping = self.search(self.check_in + timedelta(days=2), self.check_in + timedelta(days=5))
+        self.assertEqual(overlapping, ['Cabin'])
+
+        # Check-out day is free for the next guest
+        after = self.search(self.check_in + timedelta(days=3), self.check_in + timedelta(days=5))
+        self.assertEqual(after, ['Beach House', 'Cabin'])
+
+        before = self.search(self.check_in - timedelta(days=2), self.check_in)
+        self.assertEqual(before, ['Beach House', 'Cabin'])
+
+    def test_cancel_releases_nights(self):
+        """Cancelling a booking frees its nights again"""
+        booking = self.book(self.beach, self.check_in, 2)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.guest_token.key}')
+        response = self.client.patch(f"/api/bookings/{booking['booking_id']}/cancel/")
+        self.client.credentials()
+        self.assertEqual(response.status_code, 200)
+
+        self.assertFalse(BookedNight.objects.exists())
+        self.assertEqual(
+            self.search(self.check_in, self.check_in + timedelta(days=2)),
+            ['Beach House', 'Cabin'],
+        )
+
+    def test_invalid_stay_params(self):
+        """Incomplete or malformed stay params are rejected"""
+        response = self.client.get('/api/listings/', {'check_in': '2030-01-05'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/listings/', {'check_in': 'soon', 'check_out': 'later'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/listings/', {'check_in': '2030-01-05', 'check_out': '2030-01-05'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_rebuild_availability_index(self):
+        """The index can be rebuilt from the bookings table"""
+        self.book(self.beach, self.check_in, 4)
+        self.book(self.cabin, self.check_in, 2)
+        BookedNight.objects.all().delete()
+
+        self.assertEqual(rebuild_availability_index(), 6)
+        self.assertEqual(self.search(self.check_in, self.check_in + timedelta(days=1)), [])
+
+
+@override_settings(LISTING_CACHE_ENABLED=True)
+class ListingResponseCacheTestCase(TestCase):
+    """Versioned response cache for listing reads"""
+
+    def setUp(self):
+        """Start from an empty cache with one listing"""
+        cache.clear()
+        self.host_user = User.objects.create(username='host', email='host@test.com')
+        self.host_token = Token.objects.create(user=self.host_user)
+        self.reviewer_token = Token.objects.create(user=User.objects.create(username='reviewer'))
+        self.listing = Listing.objects.create(
+            title='Beach House',
+            description='A test property',
+            price_per_night=Decimal('100.00'),
+            location='Addis Ababa',
+            amenities='WiFi',
+            host=self.host_user,
+        )
+        self.detail_url = f'/api/listings/{self.listing.listing_id}/'
+        self.client = APIClient()
+
+    def test_repeat_reads_hit_the_cache(self):
+        """The second identical read is served without touching the database"""
+        self.assertEqual(self.client.get('/api/listings/')['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/listings/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(len(response.json()), 1)
+
+        self.assertEqual(self.client.get(self.detail_url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(self.detail_url)['X-Cache'], 'HIT')
+        self.assertEqual(cache_stats()['hits'], 2)
+        self.assertEqual(cache_stats()['misses'], 2)
+
+    def test_query_params_are_normalized(self):
+        """Parameter order does not change the cache key"""
+        self.client.get('/api/listings/?location=Addis+Ababa&is_available=true')
+        response = self.client.get('/api/listings/?is_available=true&location=Addis+Ababa')
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    def test_listing_update_invalidates(self):
+        """Editing a listing bumps its version and the global one"""
+        self.client.get('/api/listings/')
+        self.client.get(self.detail_url)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.host_token.key}')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.detail_url, {'title': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.client.credentials()
+
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['title'], 'Renamed')
+        response = self.client.get('/api/listings/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()[0]['title'], 'Renamed')
+
+    def test_moved_review_invalidates_both_listings(self):
+        """A review moved to another listing drops out of the old listing's cached detail"""
+        other = Listing.objects.create(
+            title='Cabin',
+            description='A test property',
+            price_per_night=Decimal('80.00'),
+            location='Addis Ababa',
+            amenities='WiFi',
+            host=self.host_user,
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.reviewer_token.key}')
+        with self.captureOnCommitCallbacks(execute=True):
+            review_id = self.client.post('/api/reviews/', {
+                'listing_id': str(self.listing.listing_id),
+                'rating': 4,
+                'comment': 'Nice stay',
+            }, format='json').json()['review_id']
+        self.assertEqual(self.client.get(self.detail_url).json()['review_count'], 1)
+        self.assertEqual(self.client.get(self.detail_url)['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/reviews/{review_id}/', {
+                'listing_id': str(other.listing_id),
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual((response.json()['review_count'], response.json()['reviews']), (0, []))
+        self.assertEqual(self.client.get(f'/api/listings/{other.listing_id}/').json()['review_count'], 1)
+
+    def test_review_invalidates_its_listing(self):
+        """A new review shows up in the cached listing detail"""
+        other = Listing.objects.create(
+            title='Cabin',
+            description='A test property',
+            price_per_night=Decimal('80.00'),
+            location='Addis Ababa',
+            amenities='WiFi',
+            host=self.host_user,
+        )
+        other_url = f'/api/listings/{other.listing_id}/'
+        self.client.get(self.detail_url)
+        self.client.get(other_url)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.reviewer_token.key}')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/reviews/', {
+                'listing_id': str(self.listing.listing_id),
+                'rating': 4,
+                'comment': 'Nice stay',
+            }, format='json')
+        self.client.credentials()
+
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['review_count'], 1)
+        self.assertEqual(self.client.get(other_url)['X-Cache'], 'HIT')
+
+    def test_cache_stats_requires_admin(self):
+        """Cache counters are only exposed to staff users"""
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.host_token.key}')
+        self.assertEqual(self.client.get('/api/listings/cache_stats/').status_code, 403)
+
+        self.host_user.is_staff = True
+        self.host_user.save()
+        response = self.client.get('/api/listings/cache_stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('hit_rate', response.json())
+
+
+class ConditionalGetTestCase(TestCase):
+    """ETag and Last-Modified on listing and review reads, answered with 304 while unchanged"""
+
+    def setUp(self):
+        """Set up two listings and a reviewer"""
+        self.host_user = User.objects.create(username='host', email='host@test.com')
+        self.host_token = Token.objects.create(user=self.host_user)
+        self.reviewer_token = Token.objects.create(user=User.objects.create(username='reviewer'))
+        self.listings = [
+            Listing.objects.create(
+                title=f'Listing {i}',
+                description='A test property',
+                price_per_night=Decimal('100.00'),
+                location='Addis Ababa',
+                amenities='WiFi',
+                host=self.host_user,
+            )
+            for i in range(3)
+        ]
+        self.listing = self.listings[0]
+        self.detail_url = f'/api/listings/{self.listing.listing_id}/'
+        self.client = APIClient()
+
+    def revalidate(self, url, etag, queries=1):
+        """GET with If-None-Match, asserting the query count, and return the response"""
+        with self.assertNumQueries(queries):
+            return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def write_as(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_detail_is_not_modified(self):
+        """A matching ETag gets an empty 304 from one query"""
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertRegex(etag, r'^"[0-9a-f]{40}"$')
+        # The host is rendered, and users have no timestamp to derive it from
+        self.assertNotIn('Last-Modified', response)
+
+        # The row versions, then the related rows'
+        response = self.revalidate(self.detail_url, etag, queries=2)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        self.write_as(self.host_token)
+        self.client.patch(self.detail_url, {'title': 'Renamed'}, format='json')
+        self.client.credentials()
+        # The versions, then the listing and its reviews
+        response = self.revalidate(self.detail_url, etag, queries=4)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'Renamed')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_follows_inserts_and_deletes(self):
+        """A new or deleted listing changes the list's ETag, even without a newer timestamp"""
+        etag = self.client.get('/api/listings/')['ETag']
+        self.assertEqual(self.revalidate('/api/listings/', etag, queries=2).status_code, 304)
+
+        self.listings[1].delete()
+        response = self.client.get('/api/listings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_keyset_pages_are_versioned_on_their_rows(self):
+        """Revalidating a keyset page runs the page query only, never a COUNT(*)"""
+        url = '/api/listings/?page_size=2'
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.revalidate(url, etag, queries=2).status_code, 304)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+        # The oldest listing is on the next page
+        Listing.objects.filter(pk=self.listing.pk).update(title='Renamed', updated_at=timezone.now())
+        self.assertEqual(self.revalidate(url, etag, queries=2).status_code, 304)
+        # The newest is on this one
+        Listing.objects.filter(pk=self.listings[2].pk).update(title='Renamed', updated_at=timezone.now())
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_review_writes_change_listing_etags(self):
+        """Reviews are rendered with their listing, so every review write touches it"""
+        urls = [self.detail_url, f'{self.detail_url}reviews/', '/api/listings/']
+        etags = [self.client.get(url)['ETag'] for url in urls]
+
+        self.write_as(self.reviewer_token)
+        review_id = self.client.post('/api/reviews/', {
+            'listing_id': str(self.listing.listing_id), 'rating': 4, 'comment': 'Nice stay',
+        }, format='json').json()['review_id']
+        self.client.credentials()
+        for url, etag in zip(urls, etags):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200, url)
+
+        # An edit keeping the rating still changes what the listing renders
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        self.write_as(self.reviewer_token)
+        self.client.patch(f'/api/reviews/{review_id}/', {'comment': 'Great stay'}, format='json')
+        self.client.credentials()
+        for url, etag in zip(urls, etags):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200, url)
+
+    def test_reviews_follow_their_listing_title(self):
+        """Review responses render the listing's title, so renaming it changes their ETag"""
+        Review.objects.create(listing=self.listing, reviewer=self.reviewer_token.user, rating=5, comment='Nice')
+        url = f'/api/reviews/?listing={self.listing.listing_id}'
+        etag = self.client.get(url)['ETag']
+        # One query validates the listing filter, one reads the versions, one the related rows'
+        self.assertEqual(self.revalidate(url, etag, queries=3).status_code, 304)
+
+        self.write_as(self.host_token)
+        self.client.patch(self.detail_url, {'title': 'Renamed'}, format='json')
+        self.client.credentials()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_if_modified_since(self):
+        """Last-Modified works as a validator for clients without ETags, on responses rendering no users"""
+        url = f'{self.detail_url}?fields=title'
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE='Mon, 01 Jan 2024 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+        # Rendering the host, it can't be answered from a date
+        last_modified = self.client.get(f'{self.detail_url}?fields=title,updated_at')['Last-Modified']
+        response = self.client.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+    def test_related_rows_change_etags(self):
+        """Renamed users and reviews removed without touching their listing change the ETags rendering them"""
+        review = Review.objects.create(listing=self.listing, reviewer=self.reviewer_token.user, rating=5, comment='Nice')
+        urls = [self.detail_url, f'{self.detail_url}reviews/', '/api/listings/', '/api/listings/?page_size=3',
+                f'/api/reviews/?listing={self.listing.listing_id}']
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        for url, etag in zip(urls, etags):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304, url)
+
+        User.objects.filter(pk=self.reviewer_token.user.pk).update(first_name='Renamed')
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(response['ETag'], self.client.get(url)['ETag'], url)
+
+        # Deleted and written again in bulk, at the same count and listing timestamp
+        etags = [self.client.get(url)['ETag'] for url in urls[:4]]
+        Review.objects.filter(pk=review.pk).delete()
+        Review.objects.bulk_create([Review(listing=self.listing, reviewer=self.host_user, rating=5, comment='Nice')])
+        for url, etag in zip(urls, etags):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200, url)
+
+        # Fields the response leaves out don't change its ETag
+        url = f'{self.detail_url}?fields=title'
+        etag = self.client.get(url)['ETag']
+        User.objects.filter(pk=self.host_user.pk).update(first_name='Renamed')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_validators_cover_the_representation(self):
+        """Different fields or media types of the same rows get different ETags"""
+        full = self.client.get(self.detail_url)['ETag']
+        sparse = self.client.get(f'{self.detail_url}?fields=title')['ETag']
+        api = self.client.get(self.detail_url, HTTP_ACCEPT='text/html')['ETag']
+        self.assertEqual(len({full, sparse, api}), 3)
+        response = self.client.get(f'{self.detail_url}?fields=title', HTTP_IF_NONE_MATCH=full)
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_filters_once(self):
+        """Revalidating a list runs the filter backends once for the versions and the response"""
+        with mock.patch.object(DjangoFilterBackend, 'filter_queryset', autospec=True,
+                               side_effect=DjangoFilterBackend.filter_queryset) as filter_queryset:
+            response = self.client.get('/api/listings/?location=Addis+Ababa', HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(filter_queryset.call_count, 1)
+
+    def test_availability_lists_follow_bookings(self):
+        """A booking swapping which listings are free changes the ETag, at the same count and timestamps"""
+        check_in = date.today() + timedelta(days=10)
+        url = f'/api/listings/?check_in={check_in}&check_out={check_in + timedelta(days=2)}'
+
+        def book(listing):
+            booking = Booking.objects.create(
+                listing=listing, guest=self.host_user, check_in_date=check_in,
+                check_out_date=check_in + timedelta(days=2), total_price=Decimal('200.00'),
+            )
+            sync_booking_nights(booking)
+            return booking
+
+        # The newest listing stays free throughout, so the latest updated_at doesn't move
+        first = book(self.listings[0])
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        first.status = 'cancelled'
+        sync_booking_nights(first)
+        book(self.listings[1])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['title'] for item in response.json()], ['Listing 2', 'Listing 0'])
+
+    def test_missing_rows_are_never_not_modified(self):
+        """If-None-Match: * doesn't turn a 404 into a 304"""
+        url = '/api/listings/00000000-0000-0000-0000-000000000000/'
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='*').status_code, 404)
+        self.assertEqual(self.client.get('/api/listings/not-a-uuid/', HTTP_IF_NONE_MATCH='*').status_code, 404)
+
+    @override_settings(LISTING_CACHE_ENABLED=True)
+    def test_cache_hits_carry_validators(self):
+        """Responses served from the response cache keep their ETag, still with no queries"""
+        cache.clear()
+        etag = self.client.get('/api/listings/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/listings/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.revalidate('/api/listings/', etag, queries=2).status_code, 304)
+
+
+class ListingSearchTestCase(TestCase):
+    """Full-text listing search with ranking and filters"""
+
+    def setUp(self):
+        """Set up listings with distinctive text"""
+        self.host_user = User.objects.create(username='host', email='host@test.com')
+        self.host_token = Token.objects.create(user=self.host_user)
+        self.client = APIClient()
+        self.beachfront = self.create_listing('Beachfront Villa', 'Sea views from every room', 'Mombasa', '250.00')
+        self.cabin = self.create_listing('Mountain Cabin', 'Short walk to the beach', 'Mombasa', '90.00')
+        self.loft = self.create_listing('City Loft', 'Close to the museums', 'Addis Ababa', '120.00')
+
+    def create_listing(self, title, description, location, price, **kwargs):
+        return Listing.objects.create(
+            title=title,
+            description=description,
+            price_per_night=Decimal(price),
+            location=location,
+            amenities='WiFi',
+            host=self.host_user,
+            **kwargs,
+        )
+
+    def search(self, query_string):
+        response = self.client.get(f'/api/listings/?{query_string}')
+        self.assertEqual(response.status_code, 200)
+        return [item['title'] for item in response.json()]
+
+    def test_uses_the_full_text_index(self):
+        """SQLite searches go through FTS5 rather than LIKE"""
+        self.assertEqual(get_search_backend().name, 'sqlite')
+        with CaptureQueriesContext(connection) as queries:
+            self.search('search=beach')
+        sql = ' '.join(query['sql'] for query in queries)
+        self.assertIn('MATCH', sql)
+        self.assertNotIn('LIKE', sql)
+
+    def test_prefix_match_ranked_by_relevance(self):
+        """Terms match as prefixes and title matches outrank description matches"""
+        self.assertEqual(self.search('search=beach'), ['Beachfront Villa', 'Mountain Cabin'])
+
+    def test_all_terms_must_match(self):
+        """Every term must appear somewhere in the listing"""
+        self.assertEqual(self.search('search=beach+walk'), ['Mountain Cabin'])
+        self.assertEqual(self.search('search=beach+museum'), [])
+
+    def test_punctuation_is_not_query_syntax(self):
+        """Quotes and operators in the query can't break the MATCH expression"""
+        self.assertEqual(self.search('search=%22beach%22+OR+*'), [])
+        self.assertEqual(self.search('search=%22'), ['City Loft', 'Mountain Cabin', 'Beachfront Villa'])
+
+    def test_combines_with_filters(self):
+        """Search narrows location, availability and price filters"""
+        self.create_listing('Beach Hut', 'Basic but on the sand', 'Mombasa', '40.00', is_available=False)
+        self.assertEqual(self.search('search=beach&price_per_night__lte=100'), ['Beach Hut', 'Mountain Cabin'])
+        self.assertEqual(
+            self.search('search=beach&is_available=true&price_per_night__gte=100'),
+            ['Beachfront Villa'],
+        )
+        self.assertEqual(self.search('search=beach&location=Addis+Ababa'), [])
+
+    def test_explicit_ordering_wins(self):
+        """?ordering= replaces relevance order"""
+        self.assertEqual(self.search('search=beach&ordering=price_per_night'), ['Mountain Cabin', 'Beachfront Villa'])
+
+    def test_index_follows_saves_and_deletes(self):
+        """Edits and deletes through the ORM keep the index current"""
+        self.loft.description = 'Rooftop beach bar'
+        self.loft.save()
+        self.assertIn('City Loft', self.search('search=beach'))
+
+        self.loft.delete()
+        self.assertNotIn('City Loft', self.search('search=beach'))
+        self.assertEqual(self.search('search=museum'), [])
+
+    def test_rebuild_picks_up_bulk_writes(self):
+        """Bulk writes bypass save(); a rebuild indexes them"""
+        Listing.objects.filter(pk=self.loft.pk).update(title='Harbour Loft')
+        self.assertEqual(self.search('search=harbour'), [])
+        self.assertEqual(rebuild_search_index(), 3)
+        self.assertEqual(self.search('search=harbour'), ['Harbour Loft'])
+
+    def test_like_fallback_matches_index(self):
+        """The LIKE backend used on other databases finds the same listings"""
+        queryset = Listing.objects.all()
+        fts = set(search_listings(queryset, 'beach').values_list('title', flat=True))
+        like = set(search_listings(queryset, 'beach', LikeSearchBackend(connection)).values_list('title', flat=True))
+        self.assertEqual(fts, like)
+
+
+class ListingAmenityTestCase(TestCase):
+    """?amenities= filtering through the amenity mask and index"""
+
+    def setUp(self):
+        """Set up listings with overlapping amenities"""
+        self.host_user = User.objects.create(username='host', email='host@test.com')
+        self.host_token = Token.objects.create(user=self.host_user)
+        self.client = APIClient()
+        self.villa = self.create_listing('Villa', 'WiFi, Pool, Parking')
+        self.lodge = self.create_listing('Lodge', 'wifi,  Pool Table')
+        self.cabin = self.create_listing('Cabin', 'Sauna, Hot Tub, WiFi')
+        self.tent = self.create_listing('Tent', '')
+
+    def create_listing(self, title, amenities):
+        return Listing.objects.create(
+            title=title,
+            description='Somewhere to stay',
+            price_per_night=Decimal('100.00'),
+            location='Mombasa',
+            amenities=amenities,
+            host=self.host_user,
+        )
+
+    def filter(self, value):
+        response = self.client.get('/api/listings/', {'amenities': value, 'ordering': 'title'})
+        self.assertEqual(response.status_code, 200)
+        return [item['title'] for item in response.json()]
+
+    def test_every_amenity_must_match(self):
+        """Listings must offer all requested amenities"""
+        self.assertEqual(self.filter('wifi'), ['Cabin', 'Lodge', 'Villa'])
+        self.assertEqual(self.filter('wifi,parking'), ['Villa'])
+        self.assertEqual(self.filter('sauna,hot-tub'), ['Cabin'])
+        self.assertEqual(self.filter('sauna,parking'), [])
+
+    def test_whole_amenities_only(self):
+        """Pool doesn't match Pool Table the way a substring search would"""
+        self.assertEqual(self.filter('pool'), ['Villa'])
+        self.assertEqual(self.filter('pool-table'), ['Lodge'])
+
+    def test_names_and_unknown_amenities(self):
+        """Display names are accepted and an unknown amenity matches nothing"""
+        self.assertEqual(self.filter('Hot Tub, WIFI'), ['Cabin'])
+        self.assertEqual(self.filter('wifi,helipad'), [])
+        self.assertEqual(self.filter(''), ['Cabin', 'Lodge', 'Tent', 'Villa'])
+
+    def test_scan_and_index_paths_agree(self):
+        """Results are the same whether the query scans the mask or starts from the index"""
+        for share in (0, 1):
+            with mock.patch.object(amenities, 'SELECTIVE_SHARE', share):
+                self.assertEqual(self.filter('wifi,pool'), ['Villa'])
+                self.assertEqual(self.filter('hot-tub'), ['Cabin'])
+
+    def test_counts_are_cached(self):
+        """Repeated ?amenities= requests don't count listings or index entries again"""
+        cache.clear()
+        self.assertEqual(self.filter('wifi,pool'), ['Villa'])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.filter('wifi,pool'), ['Villa'])
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+    def test_amenities_without_a_mask_bit(self):
+        """Amenities past the mask's capacity are matched through the index"""
+        with mock.patch.object(amenities, 'MASK_BITS', Amenity.objects.count()):
+            listing = self.create_listing('Chalet', 'WiFi, Ski Storage')
+        self.assertIsNone(Amenity.objects.get(slug='ski-storage').bit)
+        with mock.patch.object(amenities, 'SELECTIVE_SHARE', 0):
+            self.assertEqual(self.filter('ski-storage,wifi'), ['Chalet'])
+        self.assertEqual(
+            list(filter_amenities(Listing.objects.all(), ['ski-storage']).values_list('pk', flat=True)),
+            [listing.pk],
+        )
+
+    def test_serialized_amenities_unchanged(self):
+        """Clients still send and receive the amenities text as written"""
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.host_token.key}')
+        response = self.client.post('/api/listings/', {
+            'title': 'Bungalow',
+            'description': 'Near the beach',
+            'price_per_night': '80.00',
+            'location': 'Mombasa',
+            'amenities': 'Pool,  Beach Access',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['amenities'], 'Pool,  Beach Access')
+        self.assertNotIn('amenity_mask', response.json())
+        self.assertEqual(self.filter('pool'), ['Bungalow', 'Villa'])
+
+    def test_index_follows_saves(self):
+        """Editing the amenities text updates the mask and index rows"""
+        self.villa.amenities = 'WiFi, Sauna'
+        self.villa.save()
+        self.assertEqual(self.filter('pool'), [])
+        self.assertEqual(self.filter('sauna'), ['Cabin', 'Villa'])
+        self.assertEqual(ListingAmenity.objects.filter(listing=self.villa).count(), 2)
+
+    def test_rebuild_picks_up_bulk_writes(self):
+        """Bulk writes bypass save(); a rebuild indexes them"""
+        Listing.objects.filter(pk=self.tent.pk).update(amenities='Parking')
+        self.assertEqual(self.filter('parking'), ['Villa'])
+        self.assertEqual(rebuild_amenity_index(), 9)
+        self.assertEqual(self.filter('parking'), ['Tent', 'Villa'])
+
+
+class BookingVisibilityTestCase(TestCase):
+    """Bookings lists combine the guest and host branches without duplicates or leaks"""
+
+    def setUp(self):
+        """A host with two listings, one booked by the host, and a stranger's booking"""
+        self.host = User.objects.create(username='host')
+        self.guest = User.objects.create(username='guest')
+        stranger = User.objects.create(username='stranger')
+        listings = [
+            Listing.objects.create(
+                title=f'Listing {i}',
+                description='A test property',
+                price_per_night=Decimal('100.00'),
+                location='Addis Ababa',
+                amenities='WiFi',
+                host=host,
+            )
+            for i, host in enumerate([self.host, self.host, self.guest, stranger])
+        ]
+        shared = timezone.now()
+        start = date.today()
+        for i in range(12):
+            guest = self.host if i == 0 else self.guest
+            booking = Booking.objects.create(
+                listing=listings[i % 3],
+                guest=guest,
+                check_in_date=start + timedelta(days=i),
+                check_out_date=start + timedelta(days=i + 1),
+                total_price=Decimal('100.00'),
+                status='confirmed' if i % 2 else 'pending',
+            )
+            if i < 4:
+                # Shared created_at values leave the order to the pk tiebreaker
+                Booking.objects.filter(pk=booking.pk).update(created_at=shared)
+        Booking.objects.create(
+            listing=listings[3], guest=stranger, check_in_date=start, check_out_date=start + timedelta(days=1),
+            total_price=Decimal('100.00'),
+        )
+        self.client = APIClient()
+
+    def expected(self, user, **filters):
+        bookings = Booking.objects.filter(Q(guest=user) | Q(listing__host=user), **filters)
+        return [str(pk) for pk in bookings.order_by('-created_at', '-pk').values_list('pk', flat=True)]
+
+    def pages(self, url):
+        seen = []
+        while url:
+            data = self.client.get(url).json()
+            seen.extend(item['booking_id'] for item in data['results'])
+            url = data['next']
+        return seen
+
+    def test_lists_match_the_or_filter(self):
+        """Guests and hosts see their bookings once each, listed whole or page by page"""
+        for user in (self.host, self.guest):
+            self.client.force_authenticate(user)
+            expected = self.expected(user)
+            # Only keyset pages break created_at ties on the pk
+            self.assertEqual(self.pages('/api/bookings/?page_size=3'), expected)
+            listed = [item['booking_id'] for item in self.client.get('/api/bookings/').json()]
+            self.assertCountEqual(listed, expected)
+            offset = []
+            for start in range(0, len(expected), 5):
+                data = self.client.get(f'/api/bookings/?limit=5&offset={start}').json()
+                offset.extend(item['booking_id'] for item in data['results'])
+                self.assertEqual(data['count'], len(expected))
+            self.assertCountEqual(offset, expected)
+
+    def test_filters_apply_to_every_branch(self):
+        """Request filters narrow both branches"""
+        self.client.force_authenticate(self.host)
+        expected = self.expected(self.host, status='confirmed')
+        self.assertEqual(self.pages('/api/bookings/?status=confirmed&page_size=2'), expected)
+        listed = self.client.get('/api/bookings/?status=confirmed').json()
+        self.assertCountEqual([item['booking_id'] for item in listed], expected)
+
+    def test_previous_pages(self):
+        """Previous links lead back through branch-read pages"""
+        self.client.force_authenticate(self.guest)
+        first = self.client.get('/api/bookings/?page_size=4').json()
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+
+    def test_long_lists_fall_back_to_one_filter(self):
+        """Past VISIBLE_IDS_LIMIT ids lists filter with the OR instead"""
+        self.client.force_authenticate(self.guest)
+        with mock.patch('listings.visibility.VISIBLE_IDS_LIMIT', 3), CaptureQueriesContext(connection) as queries:
+            listed = self.client.get('/api/bookings/').json()
+        self.assertNotIn('"listings_booking"."booking_id" IN', queries.captured_queries[-2]['sql'])
+        self.assertCountEqual([item['booking_id'] for item in listed], self.expected(self.guest))
+
+    def test_pages_read_a_page_per_branch(self):
+        """A page costs the same queries however many bookings the host has"""
+        self.client.force_authenticate(self.host)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/bookings/?page_size=2')
+        # Keys from each branch, the page's rows, their listings' reviews
+        self.assertEqual(len(queries), 4)
+        self.assertTrue(all('DISTINCT' not in query['sql'] for query in queries.captured_queries))
+        self.assertIn('LIMIT 3', queries.captured_queries[0]['sql'])
+
+
+class QueryPlanTestCase(TestCase):
+    """EXPLAIN checks over the API's hot query shapes"""
+
+    # Visibility branches are indexed but sort the user's rows: a host's bookings span
+    # listings, and payments are ordered by a column of their own, not of the booking
+    USER_SORTED_SHAPES = {'bookings', 'payments'}
+
+    def problems(self, shapes):
+        return {
+            shape.name: [problem for _, _, problems in explained for problem in problems]
+            for shape, explained in check_query_plans(shapes)
+        }
+
+    def test_hot_shapes_use_indexes(self):
+        """Every query behind the indexed shapes avoids full scans and sorts"""
+        shapes = [shape for shape in QUERY_SHAPES if shape.name not in self.USER_SORTED_SHAPES]
+        for name, problems in self.problems(shapes).items():
+            self.assertEqual(problems, [], name)
+
+    def test_visibility_branches_never_scan(self):
+        """Bookings and payments are read on an index per branch instead of an OR across a join"""
+        shapes = [shape for shape in QUERY_SHAPES if shape.name in self.USER_SORTED_SHAPES]
+        for name, problems in self.problems(shapes).items():
+            self.assertTrue(problems, name)
+            for problem in problems:
+                self.assertTrue(problem.startswith('sort without index'), f'{name}: {problem}')
+
+    def test_flags_scans_and_sorts(self):
+        """Sorting on an unindexed column and filtering on an unindexed one are reported"""
+        problems = self.problems([
+            QueryShape('listings by title', '/api/listings/', {'ordering': 'title'}),
+            QueryShape('reviews by rating', '/api/reviews/', {'rating': 5}),
+        ])
+        self.assertIn('sort without index: USE TEMP B-TREE FOR ORDER BY', problems['listings by title'])
+        self.assertTrue(any(problem.startswith('full scan') for problem in problems['reviews by rating']))
+
+    def test_command_fails_on_flagged_plans(self):
+        """explain_queries exits with an error when a shape needs an index"""
+        call_command('explain_queries', shape=['listing detail'], stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('explain_queries', shape=['payments'], stdout=StringIO())
+
+
+class SyntheticSeedTestCase(TestCase):
+    """Generated load-test data keeps the model invariants"""
+
+    def seed(self, **options):
+        call_command('seed', listings=60, users=20, chunk_size=25, batch_size=50, stdout=StringIO(), **options)
+
+    def test_bookings_are_consistent(self):
+        """Stays never overlap, end after they start and aren't booked by the host"""
+        self.seed()
+        self.assertEqual(Listing.objects.count(), 60)
+        self.assertEqual(User.objects.count(), 20)
+        self.assertTrue(Booking.objects.exists())
+
+        last_check_out = {}
+        for booking in Booking.objects.select_related('listing').order_by('listing_id', 'check_in_date'):
+            self.assertGreater(booking.check_out_date, booking.check_in_date)
+            self.assertNotEqual(booking.guest_id, booking.listing.host_id)
+            previous = last_check_out.get(booking.listing_id)
+            if previous is not None:
+                self.assertGreaterEqual(booking.check_in_date, previous)
+            last_check_out[booking.listing_id] = booking.check_out_date
+
+        self.assertEqual(BookedNight.objects.count(), rebuild_availability_index())
+        self.assertFalse(Payment.objects.filter(status='pending').exclude(chapa_reference=None).exists())
+
+    def test_reviews_follow_completed_stays(self):
+        """Each review belongs to a completed stay, one per guest and listing"""
+        self.seed()
+        self.assertTrue(Review.objects.exists())
+        stays = set(Booking.objects.filter(status='completed').values_list('listing_id', 'guest_id'))
+        for review in Review.objects.all():
+            self.assertIn((review.listing_id, review.reviewer_id), stays)
+
+    def test_derived_data_matches_rebuilds(self):
+        """Rating totals and the amenity index are written as save() would write them"""
+        self.seed()
+        fields = ('pk', 'rating_sum', 'review_count', 'rating_5_count', 'amenity_mask')
+        stats = list(Listing.objects.order_by('pk').values_list(*fields))
+        links = ListingAmenity.objects.count()
+
+        rebuild_listing_stats()
+        self.assertEqual(rebuild_amenity_index(), links)
+        self.assertEqual(list(Listing.objects.order_by('pk').values_list(*fields)), stats)
+        self.assertEqual(
+            filter_amenities(Listing.objects.all(), ['wifi']).count(),
+            Listing.objects.filter(amenities__contains='WiFi').count(),
+        )
+
+    def test_same_seed_same_rows(self):
+        """A seed regenerates identical rows; another seed doesn't"""
+        def generate(seed):
+            with transaction.atomic():
+                plan = plan_synthetic_data(20, 30, seed=seed, chunk_size=10)
+                for index in range(2):
+                    create_user_chunk(plan, index)
+                for index in range(3):
+                    create_listing_chunk(plan, index)
+                rows = (
+                    list(Listing.objects.order_by('pk').values_list('pk', 'title', 'host_id', 'amenities')),
+                    list(Booking.objects.order_by('pk').values_list('pk', 'guest_id', 'check_in_date', 'status')),
+                    list(Review.objects.order_by('pk').values_list('pk', 'reviewer_id', 'rating')),
+                )
+                transaction.set_rollback(True)
+            return rows
+
+        first = generate(7)
+        self.assertEqual(len(first[0]), 30)
+        self.assertEqual(generate(7), first)
+        self.assertNotEqual(generate(8), first)
+
+    def test_workers_need_a_concurrent_database(self):
+        """SQLite can't take writes from several processes"""
+        with self.assertRaises(CommandError):
+            self.seed(workers=2)
+
+
+class ApiBenchmarkTestCase(TestCase):
+    """The API benchmark covers every route and enforces the baseline"""
+
+    def run_benchmark(self, **options):
+        options = {
+            'sizes': [20], 'repeat': 1, 'route': ['GET listing-detail', 'PATCH booking-cancel'], 'seed': 42,
+            'threshold': 0.5, 'update_baseline': False, **options,
+        }
+        out = StringIO()
+        ApiBenchmark().run(out, **options)
+        return out.getvalue()
+
+    def test_covers_every_route(self):
+        """Each method of each URL in listings.urls has a benchmark route"""
+        self.assertEqual({(route.url_name, route.method) for route in ROUTES}, registered_routes())
+
+    def test_fails_on_regression(self):
+        """A recorded baseline passes; a tighter query budget fails"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'baseline.json')
+        self.run_benchmark(baseline=path, update_baseline=True)
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)
+        self.assertEqual(set(baseline['20']), {'GET listing-detail', 'PATCH booking-cancel'})
+
+        self.assertIn('GET listing-detail', self.run_benchmark(baseline=path, threshold=1000))
+        baseline['20']['PATCH booking-cancel']['queries'] -= 1
+        with open(path, 'w') as baseline_file:
+            json.dump(baseline, baseline_file)
+        with self.assertRaisesMessage(CommandError, 'PATCH booking-cancel at 20 listings'):
+            self.run_benchmark(baseline=path, threshold=1000)
+
+    def test_regression_budgets(self):
+        """Queries may not grow at all; latency and size within the threshold"""
+        baseline = {'p50_ms': 10.0, 'p95_ms': 12.0, 'queries': 4, 'bytes': 1000}
+        self.assertEqual(find_regressions(dict(baseline, p50_ms=15.5, bytes=1500), baseline, 0.5), [])
+        self.assertEqual(
+            find_regressions(dict(baseline, p50_ms=16.5, queries=5, bytes=1501), baseline, 0.5),
+            ['queries 4 -> 5', 'p50 10.00ms -> 16.50ms', 'bytes 1000 -> 1501'],
+        )
+
+
+class RequestProfilingTestCase(QueryBudgetMixin, TestCase):
+    """Per-request SQL and Chapa timings"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.host_user = User.objects.create(username='host', email='host@test.com')
+        for i in range(4):
+            Listing.objects.create(
+                title=f'Listing {i}',
+                description='A test property',
+                price_per_night=Decimal('100.00'),
+                location='Addis Ababa',
+                amenities='WiFi',
+                host=self.host_user,
+            )
+
+    def test_server_timing_header(self):
+        """Profiled responses report SQL, app and total time"""
+        with override_settings(REQUEST_PROFILING_ENABLED=True, REQUEST_PROFILING_SAMPLE_RATE=0):
+            response = APIClient().get('/api/listings/')
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="2 queries", app;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_disabled_by_default(self):
+        """Without the setting the middleware is left out of the chain"""
+        response = APIClient().get('/api/listings/')
+        self.assertNotIn('Server-Timing', response)
+
+    def test_sampled_log(self):
+        """Sampled requests are logged as JSON with their repeated queries"""
+        with override_settings(REQUEST_PROFILING_ENABLED=True, REQUEST_PROFILING_SAMPLE_RATE=1):
+            with self.assertLogs('listings.middleware', 'INFO') as logs:
+                APIClient().get('/api/listings/', {'fields': 'title'})
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['path'], '/api/listings/')
+        self.assertEqual(entry['status'], 200)
+        self.assertEqual(entry['queries'], 1)
+        self.assertEqual(len(entry['slowest']), 1)
+        self.assertEqual(entry['repeated'], [])
+
+    def test_detects_repeated_queries(self):
+        """A query per row shows up as one fingerprint run once per row"""
+        profile = RequestProfile()
+        with profile.capture():
+            for listing in Listing.objects.all():
+                listing.host.username
+        self.assertEqual(profile.query_count, 5)
+        (sql, count), = profile.repeated_queries()
+        self.assertEqual(count, 4)
+        self.assertIn('auth_user', sql)
+
+    def test_fingerprint_collapses_values(self):
+        """IN lists and literals don't split a query into several fingerprints"""
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND kind = 'a' LIMIT 21"),
+            fingerprint("SELECT * FROM t WHERE id IN (%s) AND kind = 'b' LIMIT 5"),
+        )
+
+    def test_times_chapa_calls(self):
+        """Chapa requests made while profiling are timed separately from SQL"""
+        profile = RequestProfile()
+        with StubChapaServer() as server, mock.patch.dict(os.environ, {
+            'CHAPA_SECRET_KEY': 'CHASECK_TEST-profile', 'CHAPA_API_URL': server.url,
+        }):
+            client = ChapaAPIClient()
+            with profile.capture():
+                client.verify_payment('tx-1')
+                client.verify_payment('tx-2')
+            client.close()
+        self.assertEqual(profile.http_calls['chapa'], 2)
+        self.assertGreater(profile.http_time['chapa'], 0)
+        self.assertIn('chapa;dur=', profile.server_timing())
+
+    def test_query_budget(self):
+        """The budget allows cheaper views and fails on extra or repeated queries"""
+        client = APIClient()
+        with self.assertQueryBudget(3, max_repeats=1):
+            client.get('/api/listings/')
+
+        with self.assertRaisesMessage(AssertionError, '2 queries over a budget of 1'):
+            with self.assertQueryBudget(1):
+                client.get('/api/listings/')
+        with self.assertRaisesMessage(AssertionError, 'A query ran 4 times'):
+            with self.assertQueryBudget(10, max_repeats=1):
+                [listing.host.username for listing in Listing.objects.all()]
+
+
+class ExportTestCase(TestCase):
+    """Streaming booking and payment exports"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.host_user = User.objects.create(username='host', email='host@test.com')
+        self.guest_user = User.objects.create(username='guest', email='guest@test.com')
+        other_host = User.objects.create(username='other-host')
+        self.villa, self.cabin, other = [
+            Listing.objects.create(
+                title=title,
+                description='A test property',
+                price_per_night=Decimal('100.00'),
+                location='Addis Ababa',
+                amenities='WiFi',
+                host=host,
+            )
+            for title, host in (('Villa', self.host_user), ('Cabin', self.host_user), ('Other', other_host))
+        ]
+        start = date(2026, 1, 1)
+        self.bookings = [
+            Booking.objects.create(
+                listing=listing,
+                guest=self.guest_user,
+                check_in_date=start + timedelta(days=offset),
+                check_out_date=start + timedelta(days=offset + 2),
+                total_price=Decimal('200.00'),
+                status=status,
+            )
+            for listing, offset, status in (
+                (self.villa, 0, 'completed'),
+                (self.cabin, 10, 'confirmed'),
+                (self.villa, 20, 'cancelled'),
+                (other, 30, 'completed'),
+            )
+        ]
+        for booking in self.bookings:
+            Payment.objects.create(
+                booking=booking,
+                amount=booking.total_price,
+                status='cancelled' if booking.status == 'cancelled' else 'completed',
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.host_user)
+
+    def export(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_host_booking_csv(self):
+        """Hosts get every booking of their listings, listing by listing, as CSV"""
+        lines = self.export('/api/bookings/export/').splitlines()
+        self.assertEqual(lines[0].split(',')[:4], ['booking_id', 'listing_id', 'listing_title', 'guest'])
+        self.assertEqual(
+            [line.split(',')[0] for line in lines[1:]],
+            [str(booking.pk) for booking in (self.bookings[0], self.bookings[2], self.bookings[1])],
+        )
+        self.assertEqual(lines[1].split(',')[2:8], ['Villa', 'guest', '2026-01-01', '2026-01-03', '200.00', 'completed'])
+
+    def test_filters_and_ndjson(self):
+        """Role, status and check-in range filters apply; NDJSON has one object per line"""
+        self.client.force_authenticate(user=self.guest_user)
+        text = self.export(
+            '/api/bookings/export/', role='guest', status='completed,confirmed',
+            start='2026-01-05', end='2026-01-31', output='ndjson',
+        )
+        rows = [json.loads(line) for line in text.splitlines()]
+        self.assertEqual([row['listing_title'] for row in rows], ['Cabin', 'Other'])
+        self.assertEqual(rows[0]['check_in_date'], '2026-01-11')
+
+    def test_host_payment_export(self):
+        """Payments follow their bookings and can be filtered by status"""
+        lines = self.export('/api/payments/export/', status='completed').splitlines()
+        self.assertEqual(
+            [line.split(',')[1] for line in lines[1:]],
+            [str(self.bookings[0].pk), str(self.bookings[1].pk)],
+        )
+        self.assertEqual(
+            self.client.get('/api/payments/export/')['Content-Disposition'], 'attachment; filename="payments.csv"'
+        )
+
+    def test_invalid_params(self):
+        """Unknown formats, statuses and malformed dates are rejected before streaming"""
+        for params in ({'output': 'xml'}, {'status': 'lost'}, {'start': '2026-13-01'}, {'role': 'admin'},
+                       {'start': '2026-02-01', 'end': '2026-01-01'}):
+            self.assertEqual(self.client.get('/api/bookings/export/', params).status_code, 400, params)
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_reads_in_batches(self):
+        """Each batch is one query; a partial batch ends a listing's rows"""
+        response = self.client.get('/api/bookings/export/')
+        # Host listings and Villa: a full batch and an empty one each (4), Cabin (1)
+        with self.assertNumQueries(5):
+            self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 4)
+
+    @override_settings(EXPORT_CHUNK_SIZE=500)
+    def test_memory_does_not_grow_with_rows(self):
+        """Streaming ten times the rows takes no more memory"""
+        def peak_memory():
+            response = self.client.get('/api/bookings/export/', {'output': 'ndjson'})
+            tracemalloc.start()
+            try:
+                lines = sum(chunk.count(b'\n') for chunk in response.streaming_content)
+                return lines, tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        def add_bookings(count):
+            start = date(2030, 1, 1) + timedelta(days=Booking.objects.count())
+            Booking.objects.bulk_create([
+                Booking(
+                    listing=self.cabin,
+                    guest=self.guest_user,
+                    check_in_date=start + timedelta(days=i),
+                    check_out_date=start + timedelta(days=i + 1),
+                    total_price=Decimal('100.00'),
+                )
+                for i in range(count)
+            ])
+
+        add_bookings(1000)
+        small_rows, small_peak = peak_memory()
+        add_bookings(9000)
+        large_rows, large_peak = peak_memory()
+        self.assertEqual(large_rows - small_rows, 9000)
+        self.assertLess(large_peak, small_peak * 1.25)
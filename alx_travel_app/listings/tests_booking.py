@@ -0,0 +1,269 @@
+"""
+Concurrency tests for the reservation path
+"""
+
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .models import Listing, Booking, BookedNight, Payment
+from .reservations import BookingConflict, reserve_booking
+
+
+def reserve_with_retry(**kwargs):
+    """
+    Call reserve_booking, retrying while the database reports a lock
+
+    SQLite rejects concurrent writers with 'database is locked' instead of
+    queueing them behind a row lock; other backends never hit the retry.
+    """
+    while True:
+        try:
+            return reserve_booking(**kwargs)
+        except OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+
+
+class ReservationAPITestCase(TestCase):
+    """Booking creation through the API"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.host_user = User.objects.create(username='host', email='host@test.com')
+        self.guest_user = User.objects.create(username='guest', email='guest@test.com')
+        self.guest_token = Token.objects.create(user=self.guest_user)
+        self.listing = Listing.objects.create(
+            title='Test Property',
+            description='A test property',
+            price_per_night=Decimal('500.00'),
+            location='Addis Ababa',
+            amenities='WiFi',
+            host=self.host_user,
+        )
+        self.check_in = date.today() + timedelta(days=1)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.guest_token.key}')
+
+    def post_booking(self, check_in, nights):
+        return self.client.post('/api/bookings/', {
+            'listing_id': str(self.listing.listing_id),
+            'check_in_date': check_in.isoformat(),
+            'check_out_date': (check_in + timedelta(days=nights)).isoformat(),
+        }, format='json')
+
+    def test_booking_creates_payment_and_computes_price(self):
+        """A booking gets its price from the nightly rate and a pending payment"""
+        response = self.post_booking(self.check_in, 3)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['total_price'], '1500.00')
+
+        booking = Booking.objects.get()
+        self.assertEqual(booking.guest, self.guest_user)
+        payment = Payment.objects.get(booking=booking)
+        self.assertEqual(payment.amount, Decimal('1500.00'))
+        self.assertEqual(payment.status, 'pending')
+
+    def test_overlapping_booking_conflicts(self):
+        """Overlapping nights are rejected with 409 and nothing is written"""
+        self.assertEqual(self.post_booking(self.check_in, 3).status_code, 201)
+
+        response = self.post_booking(self.check_in + timedelta(days=2), 2)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Booking.objects.count(), 1)
+        self.assertEqual(Payment.objects.count(), 1)
+
+        # Back-to-back stays do not overlap
+        self.assertEqual(self.post_booking(self.check_in + timedelta(days=3), 2).status_code, 201)
+
+    def test_unknown_listing(self):
+        """Booking a listing that does not exist is a validation error"""
+        response = self.client.post('/api/bookings/', {
+            'listing_id': '00000000-0000-0000-0000-000000000000',
+            'check_in_date': self.check_in.isoformat(),
+            'check_out_date': (self.check_in + timedelta(days=1)).isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class BatchReservationAPITestCase(TestCase):
+    """Many bookings in one POST /api/bookings/batch/"""
+
+    def setUp(self):
+        self.host_user = User.objects.create(username='host', email='host@test.com')
+        self.guest_user = User.objects.create(username='guest', email='guest@test.com')
+        self.listings = [
+            Listing.objects.create(
+                title=f'Test Property {i}',
+                description='A test property',
+                price_per_night=Decimal('500.00'),
+                location='Addis Ababa',
+                amenities='WiFi',
+                host=self.host_user,
+            )
+            for i in range(2)
+        ]
+        self.check_in = date.today() + timedelta(days=1)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.guest_user)
+
+    def stay(self, listing, offset, nights):
+        check_in = self.check_in + timedelta(days=offset)
+        return {
+            'listing_id': str(listing.listing_id),
+            'check_in_date': check_in.isoformat(),
+            'check_out_date': (check_in + timedelta(days=nights)).isoformat(),
+        }
+
+    def post_batch(self, stays):
+        return self.client.post('/api/bookings/batch/', {'bookings': stays}, format='json')
+
+    def test_batch_creates_bookings_nights_and_payments(self):
+        """Every stay gets its booking, its nights and a pending payment, in request order"""
+        first, second = self.listings
+        response = self.post_batch([
+            self.stay(first, 0, 3),
+            self.stay(second, 0, 2),
+            {**self.stay(first, 3, 1), 'total_price': '450.00'},
+        ])
+        self.assertEqual(response.status_code, 201)
+
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], [201, 201, 201])
+        self.assertEqual([result['booking']['total_price'] for result in results], ['1500.00', '1000.00', '450.00'])
+        self.assertEqual(results[1]['booking']['listing']['listing_id'], str(second.listing_id))
+        self.assertEqual(results[0]['booking']['guest']['username'], 'guest')
+
+        self.assertEqual(Booking.objects.filter(guest=self.guest_user).count(), 3)
+        self.assertEqual(BookedNight.objects.count(), 6)
+        payments = Payment.objects.order_by('amount')
+        self.assertEqual([payment.amount for payment in payments], [Decimal('450.00'), Decimal('1000.00'), Decimal('1500.00')])
+        self.assertEqual({payment.status for payment in payments}, {'pending'})
+
+    def test_items_fail_on_their_own(self):
+        """Invalid and conflicting stays are reported per item while the others are booked"""
+        first, second = self.listings
+        reserve_booking(
+            listing_id=second.pk,
+            guest=self.host_user,
+            check_in=self.check_in,
+            check_out=self.check_in + timedelta(days=5),
+        )
+        response = self.post_batch([
+            self.stay(first, 0, 3),
+            {**self.stay(first, 10, 1), 'check_out_date': self.check_in.isoformat()},
+            {**self.stay(first, 10, 1), 'listing_id': '00000000-0000-0000-0000-000000000000'},
+            self.stay(second, 4, 2),
+            self.stay(first, 2, 2),
+            self.stay(first, 3, 2),
+        ])
+        self.assertEqual(response.status_code, 207)
+
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], [201, 400, 400, 409, 409, 201])
+        self.assertIn('non_field_errors', results[1]['errors'])
+        self.assertEqual(results[2]['errors'], {'listing_id': ['Listing not found.']})
+        self.assertIn('detail', results[3]['errors'])
+        # Only the two valid stays were written
+        self.assertEqual(Booking.objects.filter(guest=self.guest_user).count(), 2)
+        self.assertEqual(Payment.objects.filter(booking__guest=self.guest_user).count(), 2)
+        self.assertEqual(BookedNight.objects.filter(listing=first).count(), 5)
+
+    @override_settings(BOOKING_BATCH_MAX_SIZE=2)
+    def test_malformed_batches_are_rejected(self):
+        """An empty, oversized or non-list batch is a 400 and writes nothing"""
+        stays = [self.stay(self.listings[0], offset, 1) for offset in range(3)]
+        for data in ({'bookings': []}, {'bookings': stays}, {'bookings': 'all of them'}, {}):
+            response = self.client.post('/api/bookings/batch/', data, format='json')
+            self.assertEqual(response.status_code, 400, data)
+            self.assertIn('bookings', response.json())
+        self.assertFalse(Booking.objects.exists())
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        """A batch takes the same queries whether it holds 2 stays or 20"""
+        def count(offset, size):
+            stays = [self.stay(self.listings[i % 2], offset + i, 1) for i in range(size)]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post_batch(stays)
+            self.assertEqual(response.status_code, 201)
+            return len(queries)
+
+        self.assertEqual(count(0, 2), count(100, 20))
+
+
+class ReservationStressTestCase(TransactionTestCase):
+    """Concurrent reservations never double-book a night"""
+
+    def setUp(self):
+        """Set up listings and guests"""
+        self.host_user = User.objects.create(username='host')
+        self.guests = [User.objects.create(username=f'guest-{i}') for i in range(8)]
+        self.listings = [
+            Listing.objects.create(
+                title=f'Listing {i}',
+                description='A test property',
+                price_per_night=Decimal('100.00'),
+                location='Addis Ababa',
+                amenities='WiFi',
+                host=self.host_user,
+            )
+            for i in range(2)
+        ]
+        self.check_in = date.today() + timedelta(days=1)
+
+    def run_clients(self, attempts):
+        """Run each (listing, guest, check_in, nights) attempt on its own thread"""
+        results = []
+        barrier = threading.Barrier(len(attempts))
+
+        def client(listing, guest, check_in, nights):
+            barrier.wait()
+            try:
+                reserve_with_retry(
+                    listing_id=listing.pk,
+                    guest=guest,
+                    check_in=check_in,
+                    check_out=check_in + timedelta(days=nights),
+                )
+                results.append('created')
+            except BookingConflict:
+                results.append('conflict')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client, args=attempt) for attempt in attempts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_same_nights_only_one_wins(self):
+        """Eight guests racing for the same nights: exactly one succeeds"""
+        attempts = [(self.listings[0], guest, self.check_in, 3) for guest in self.guests]
+        results = self.run_clients(attempts)
+
+        self.assertEqual(results.count('created'), 1)
+        self.assertEqual(results.count('conflict'), 7)
+        self.assertEqual(Booking.objects.count(), 1)
+        self.assertEqual(BookedNight.objects.count(), 3)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_non_conflicting_bookings_all_succeed(self):
+        """Disjoint stays on different listings and nights all go through"""
+        attempts = [
+            (self.listings[i % 2], guest, self.check_in + timedelta(days=(i // 2) * 3), 3)
+            for i, guest in enumerate(self.guests)
+        ]
+        results = self.run_clients(attempts)
+
+        self.assertEqual(results.count('created'), 8)
+        self.assertEqual(Booking.objects.count(), 8)
+        self.assertEqual(BookedNight.objects.count(), 24)
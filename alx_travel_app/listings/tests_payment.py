@@ -2,15 +2,38 @@
 Unit tests for payment integration
 """
 
-from django.test import TestCase, Client
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, Client
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 from decimal import Decimal
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
+import asyncio
 import json
+import time
+from unittest import mock
 
-from .models import Listing, Booking, Payment, Review
+from asgiref.sync import async_to_sync
+
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from .benchmarks.chapa import StubChapaServer
+from .chapa_async import reset_async_chapa_clients
+from .chapa_utils import ChapaAPIClient, get_chapa_client, reset_chapa_client, update_payment_status
+from .circuit_breaker import SHARED_OPEN_KEY, Bulkhead, CallRefused, CircuitBreaker, get_chapa_breaker
+from .email_tasks import dispatch_payment_email, drain_email_outbox
+from .models import Listing, Booking, DailyRevenue, Payment, PaymentCallback, Review, QueuedEmail
+from .payment_actions import ChapaUnavailable
+from .reconciliation import RateLimiter, apply_verifications, reconcile_pending_payments
+from .revenue import rebuild_revenue_rollups
+from .testing import QueryBudgetMixin
+from .views import PaymentViewSet
 
 
 class PaymentIntegrationTestCase(TestCase):
@@ -254,6 +277,1112 @@ class PaymentAPITestCase(TestCase):
         self.assertEqual(response.status_code, 401)
 
 
+
+@override_settings(CHAPA_RETRY_BACKOFF=0)
+class PaymentQueryCountTestCase(QueryBudgetMixin, TestCase):
+    """Payment endpoints run a fixed number of queries, however many payments a booking has"""
+
+    def setUp(self):
+        """Set up a host, a guest with two bookings and a stub Chapa server"""
+        self.server = StubChapaServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        env = mock.patch.dict('os.environ', {
+            'CHAPA_SECRET_KEY': 'CHASECK_TEST-key',
+            'CHAPA_API_URL': self.server.url,
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        self.addCleanup(reset_chapa_client)
+        reset_chapa_client()
+
+        self.host = User.objects.create(username='host', email='host@test.com')
+        self.guest = User.objects.create(username='guest', email='guest@test.com')
+        self.listing = Listing.objects.create(
+            title='Test Property',
+            description='A test property',
+            price_per_night=Decimal('500.00'),
+            location='Addis Ababa',
+            amenities='WiFi',
+            host=self.host,
+        )
+        self.bookings = [
+            Booking.objects.create(
+                listing=self.listing,
+                guest=self.guest,
+                check_in_date=date.today() + timedelta(days=offset),
+                check_out_date=date.today() + timedelta(days=offset + 2),
+                total_price=Decimal('1000.00'),
+            )
+            for offset in (1, 10)
+        ]
+        self.api = APIClient()
+        self.api.force_authenticate(self.guest)
+
+    def add_payments(self, booking, count):
+        """Create count payments for booking, a second apart, and return the latest"""
+        payments = [Payment.objects.create(booking=booking, amount=booking.total_price) for _ in range(count)]
+        for seconds, payment in enumerate(payments):
+            Payment.objects.filter(pk=payment.pk).update(created_at=timezone.now() + timedelta(seconds=seconds))
+        return payments[-1]
+
+    def test_prefetched_payment(self):
+        """with_payment() loads the latest payment of every booking in one query"""
+        latest = self.add_payments(self.bookings[0], 3)
+        with self.assertNumQueries(2):
+            bookings = {booking.pk: booking for booking in Booking.objects.with_payment()}
+            self.assertEqual(bookings[self.bookings[0].pk].payment, latest)
+            self.assertIsNone(bookings[self.bookings[1].pk].payment)
+        booking = Booking.objects.get(pk=self.bookings[0].pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(booking.payment, latest)
+
+    def test_initiate_payment(self):
+        """The booking and its latest payment take two queries, then the payment is created or updated"""
+        with self.assertNumQueries(4):
+            response = self.api.post(f'/api/bookings/{self.bookings[0].pk}/initiate_payment/')
+        self.assertEqual(response.status_code, 200)
+
+        latest = self.add_payments(self.bookings[1], 3)
+        with self.assertNumQueries(3):
+            response = self.api.post(f'/api/bookings/{self.bookings[1].pk}/initiate_payment/')
+        self.assertEqual(response.json()['payment_id'], str(latest.pk))
+
+    def test_verify_status(self):
+        """Verifying reads the payment, booking and listing in one query, again under a lock, and no users"""
+        payment = self.add_payments(self.bookings[0], 1)
+        Payment.objects.filter(pk=payment.pk).update(chapa_reference=str(payment.pk))
+        # Two of them are the savepoint the locked re-read runs in
+        with self.assertQueryBudget(10) as profile:
+            response = self.api.post(f'/api/payments/{payment.pk}/verify_status/')
+        self.assertEqual(response.json()['status'], 'completed')
+        reads = [sql for sql in profile.fingerprints if 'listings_payment' in sql and sql.startswith('SELECT')]
+        self.assertEqual(len(reads), 2)
+        self.assertTrue(all('listings_listing' in sql for sql in reads))
+        self.assertFalse(any('auth_user' in sql for sql in profile.fingerprints))
+
+    def test_ownership_checks_do_not_load_users(self):
+        """Only the host can confirm, only the guest can pay, and neither check loads a user"""
+        booking = self.bookings[0]
+        with self.assertNumQueries(2):
+            response = self.api.patch(f'/api/bookings/{booking.pk}/confirm/')
+        self.assertEqual(response.status_code, 403)
+
+        host = APIClient()
+        host.force_authenticate(self.host)
+        with self.assertNumQueries(2):
+            response = host.post(f'/api/bookings/{booking.pk}/initiate_payment/')
+        self.assertEqual(response.status_code, 403)
+
+    def test_payment_list(self):
+        """Listing payments doesn't grow with the number of payments"""
+        for booking in self.bookings:
+            self.add_payments(booking, 3)
+        with self.assertQueryBudget(4, max_repeats=1):
+            response = self.api.get('/api/payments/')
+        self.assertEqual(len(response.json()), 6)
+
+
+class PaymentFieldSelectionTestCase(TestCase):
+    """Sparse fieldsets and bounded nesting on /api/payments/"""
+
+    def setUp(self):
+        """Set up a payment whose listing has a long review history"""
+        self.host_user = User.objects.create(username='host', email='host@test.com')
+        self.guest_user = User.objects.create(username='guest', email='guest@test.com')
+        self.guest_token = Token.objects.create(user=self.guest_user)
+        self.listing = Listing.objects.create(
+            title='Test Property',
+            description='A test property with a long description. ' * 5,
+            price_per_night=Decimal('500.00'),
+            location='Addis Ababa',
+            amenities='WiFi',
+            host=self.host_user,
+        )
+        for i in range(15):
+            Review.objects.create(
+                listing=self.listing,
+                reviewer=User.objects.create(username=f'reviewer-{i}'),
+                rating=5,
+                comment='Wonderful stay, would book again. ' * 3,
+            )
+        today = date.today()
+        self.booking = Booking.objects.create(
+            listing=self.listing,
+            guest=self.guest_user,
+            check_in_date=today + timedelta(days=1),
+            check_out_date=today + timedelta(days=3),
+            total_price=Decimal('1000.00'),
+        )
+        self.payment = Payment.objects.create(booking=self.booking, amount=Decimal('1000.00'))
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.guest_token.key}')
+
+    def test_default_representation_is_unchanged(self):
+        """Without params the payment embeds the full booking and listing"""
+        # Token, the visible payment ids of each branch, payments, reviews
+        with self.assertNumQueries(5):
+            data = self.client.get('/api/payments/').json()[0]
+        self.assertEqual(data['booking']['listing']['title'], 'Test Property')
+        self.assertEqual(len(data['booking']['listing']['reviews']), 15)
+
+    def test_mobile_view_is_an_order_of_magnitude_smaller(self):
+        """Selecting fields and collapsing nesting cuts payload and queries"""
+        full = self.client.get('/api/payments/')
+        with self.assertNumQueries(4):
+            sparse = self.client.get('/api/payments/?fields=payment_id,amount,currency,status,booking&expand=')
+
+        data = sparse.json()[0]
+        self.assertEqual(set(data), {'payment_id', 'amount', 'currency', 'status', 'booking'})
+        self.assertEqual(data['booking'], str(self.booking.booking_id))
+        self.assertLess(len(sparse.content) * 10, len(full.content))
+
+    def test_expand_one_level(self):
+        """Expanded relations render in full while deeper ones collapse to ids"""
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/payments/?expand=booking')
+        booking = response.json()[0]['booking']
+        self.assertEqual(booking['listing'], str(self.listing.listing_id))
+        self.assertEqual(booking['guest'], self.guest_user.pk)
+        self.assertEqual(booking['total_price'], '1000.00')
+
+    def test_nested_field_paths(self):
+        """Dotted field paths select fields inside nested objects"""
+        response = self.client.get('/api/payments/?fields=status,booking.listing.title')
+        data = response.json()[0]
+        self.assertEqual(data, {'status': 'pending', 'booking': {'listing': {'title': 'Test Property'}}})
+
+
+class PaymentEmailQueueTestCase(TestCase):
+    """Payment emails are queued after commit and delivered in batches"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.host_user = User.objects.create(username='host', email='host@test.com')
+        self.guest_user = User.objects.create(username='guest', email='guest@test.com')
+        self.listing = Listing.objects.create(
+            title='Test Property',
+            description='A test property',
+            price_per_night=Decimal('500.00'),
+            location='Addis Ababa',
+            amenities='WiFi',
+            host=self.host_user,
+        )
+        today = date.today()
+        self.booking = Booking.objects.create(
+            listing=self.listing,
+            guest=self.guest_user,
+            check_in_date=today + timedelta(days=1),
+            check_out_date=today + timedelta(days=3),
+            total_price=Decimal('1000.00'),
+        )
+        self.payment = Payment.objects.create(booking=self.booking, amount=Decimal('1000.00'))
+
+    def test_email_is_sent_only_after_commit(self):
+        """Nothing is queued or sent until the transaction commits"""
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            dispatch_payment_email(self.payment, 'confirmation')
+        self.assertEqual(QueuedEmail.objects.count(), 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['guest@test.com'])
+        self.assertEqual(mail.outbox[0].subject, 'Payment Confirmation - Your Travel Booking')
+        self.assertEqual(QueuedEmail.objects.get().status, 'sent')
+
+    def test_failure_email_carries_error_message(self):
+        """Failure emails render the error message"""
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch_payment_email(self.payment, 'failure', 'Card declined')
+        self.assertEqual(mail.outbox[0].subject, 'Payment Failed - Action Required')
+        self.assertIn('Card declined', mail.outbox[0].body)
+
+    def test_guest_without_email_is_skipped(self):
+        """No email is queued for a guest without an address"""
+        User.objects.filter(pk=self.guest_user.pk).update(email='')
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch_payment_email(self.payment, 'confirmation')
+        self.assertEqual(QueuedEmail.objects.count(), 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_outbox_is_drained_over_one_connection(self):
+        """A batch of emails shares a single connection"""
+        for i in range(25):
+            QueuedEmail.objects.create(to=f'guest{i}@test.com', subject='Hello', body='Body')
+
+        with mock.patch('listings.email_tasks.get_connection', wraps=mail.get_connection) as get_connection:
+            counts = drain_email_outbox(batch_size=10)
+
+        self.assertEqual(get_connection.call_count, 1)
+        self.assertEqual(counts, {'sent': 25, 'failed': 0})
+        self.assertEqual(len(mail.outbox), 25)
+        self.assertFalse(QueuedEmail.objects.filter(status='queued').exists())
+
+    def test_failed_delivery_is_retried_then_given_up(self):
+        """Failing emails stay queued until they run out of attempts"""
+        email = QueuedEmail.objects.create(to='guest@test.com', subject='Hello', body='Body')
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            drain_email_outbox(max_attempts=2)
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts), ('queued', 1))
+
+            drain_email_outbox(max_attempts=2)
+            email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('failed', 2))
+        self.assertEqual(email.last_error, 'down')
+
+
+@override_settings(CHAPA_RETRY_BACKOFF=0)
+class ChapaTransportTestCase(TestCase):
+    """The Chapa client keeps connections alive and retries only safe calls"""
+
+    def setUp(self):
+        """Start a stub Chapa server"""
+        self.server = StubChapaServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        env = mock.patch.dict('os.environ', {
+            'CHAPA_SECRET_KEY': 'CHASECK_TEST-key',
+            'CHAPA_API_URL': self.server.url,
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        self.addCleanup(reset_chapa_client)
+        reset_chapa_client()
+
+    def make_payment(self):
+        host = User.objects.create(username='host', email='host@test.com')
+        guest = User.objects.create(username='guest', email='guest@test.com')
+        listing = Listing.objects.create(
+            title='Test Property',
+            description='A test property',
+            price_per_night=Decimal('500.00'),
+            location='Addis Ababa',
+            amenities='WiFi',
+            host=host,
+        )
+        booking = Booking.objects.create(
+            listing=listing,
+            guest=guest,
+            check_in_date=date.today() + timedelta(days=1),
+            check_out_date=date.today() + timedelta(days=3),
+            total_price=Decimal('1000.00'),
+        )
+        return Payment.objects.create(booking=booking, amount=Decimal('1000.00'))
+
+    def test_calls_reuse_one_connection(self):
+        """Sequential calls share a kept-alive connection"""
+        client = get_chapa_client()
+        for i in range(5):
+            self.assertTrue(client.verify_payment(f'ref-{i}')['success'])
+        self.assertEqual(self.server.requests, 5)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_verify_is_retried_on_server_errors(self):
+        """Verification is idempotent and retried on 5xx responses"""
+        self.server.fail_statuses = [503, 502]
+        result = get_chapa_client().verify_payment('ref-1')
+        self.assertTrue(result['success'])
+        self.assertEqual(self.server.requests, 3)
+
+    def test_initialize_is_not_retried(self):
+        """Initializing a payment is never replayed"""
+        payment = self.make_payment()
+        self.server.fail_statuses = [503]
+        result = get_chapa_client().initiate_payment(payment, payment.booking)
+        self.assertFalse(result['success'])
+        self.assertEqual(self.server.requests, 1)
+
+    def test_client_is_shared_within_a_process(self):
+        """One client per process, rebuilt in a forked child"""
+        client = get_chapa_client()
+        self.assertIs(get_chapa_client(), client)
+        with mock.patch('listings.chapa_utils.os.getpid', return_value=-1):
+            self.assertIsNot(get_chapa_client(), client)
+
+    def test_missing_secret_key_is_not_cached(self):
+        """A misconfigured process keeps failing loudly rather than caching None"""
+        with mock.patch.dict('os.environ', {'CHAPA_SECRET_KEY': ''}):
+            with self.assertRaises(ValueError):
+                get_chapa_client()
+        self.assertIsInstance(get_chapa_client(), ChapaAPIClient)
+
+
+class CircuitBreakerTestCase(SimpleTestCase):
+    """The breaker trips on failure and slow-call rates and recovers through probes"""
+
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = CircuitBreaker(
+            window=4, minimum_calls=4, failure_rate=0.5, slow_call_seconds=1.0,
+            slow_call_rate=0.75, open_seconds=30, half_open_probes=2, clock=lambda: self.now,
+        )
+
+    def call(self, failed=False, duration=0.1):
+        probe = self.breaker.acquire()
+        self.breaker.record(probe, failed, duration)
+        return probe
+
+    def test_trips_on_failure_rate(self):
+        """Half the window failing opens it, but not before minimum_calls"""
+        self.call(failed=True)
+        self.call(failed=True)
+        self.call()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.call()
+        self.assertEqual(self.breaker.state, 'open')
+
+        self.now = 10
+        with self.assertRaises(CallRefused) as refused:
+            self.breaker.acquire()
+        self.assertEqual((refused.exception.reason, refused.exception.retry_after), ('circuit_open', 20))
+        stats = self.breaker.stats()
+        self.assertEqual((stats['calls'], stats['failures'], stats['refused'], stats['trips']), (4, 2, 1, 1))
+
+    def test_trips_on_slow_calls(self):
+        """Calls that succeed too slowly open it too"""
+        for _ in range(3):
+            self.call(duration=2.0)
+        self.call()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertEqual(self.breaker.stats()['slow_calls'], 3)
+
+    def test_abandoned_calls_are_not_counted(self):
+        """A call cut short by something other than Chapa says nothing about Chapa"""
+        for _ in range(4):
+            self.breaker.record(self.breaker.acquire(), None, 0.1)
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertEqual(self.breaker.stats()['calls'], 0)
+
+    def test_half_open_probes_close_it(self):
+        """After open_seconds only the probes are let through, and their success closes it"""
+        with self.breaker.lock:
+            self.breaker.trip()
+        self.now = 30
+        self.assertTrue(self.breaker.acquire())
+        self.assertTrue(self.breaker.acquire())
+        with self.assertRaises(CallRefused):
+            self.breaker.acquire()
+        self.breaker.record(True, False, 0.1)
+        self.breaker.record(True, False, 0.1)
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertFalse(self.call())
+
+    def test_failed_probe_reopens_it(self):
+        """One failed or slow probe opens it for another open_seconds"""
+        with self.breaker.lock:
+            self.breaker.trip()
+        self.now = 30
+        self.call(duration=2.0)
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertEqual(self.breaker.stats()['retry_after'], 30)
+        self.assertEqual(self.breaker.stats()['trips'], 2)
+
+    def test_shared_state_opens_other_processes(self):
+        """With shared on, a breaker tripped elsewhere is seen through the cache"""
+        self.addCleanup(cache.delete, SHARED_OPEN_KEY)
+        first = CircuitBreaker(window=2, minimum_calls=2, open_seconds=30, shared=True)
+        second = CircuitBreaker(shared=True)
+        for _ in range(2):
+            first.record(first.acquire(), True, 0.1)
+
+        with self.assertRaises(CallRefused) as refused:
+            second.acquire()
+        self.assertGreater(refused.exception.retry_after, 0)
+        self.assertFalse(CircuitBreaker(shared=False).acquire())
+
+    def test_shared_state_off_the_event_loop(self):
+        """The async path reads and writes the shared state without blocking the loop on the cache"""
+        self.addCleanup(cache.delete, SHARED_OPEN_KEY)
+        on_loop = []
+
+        def watched(name):
+            method = getattr(cache, name)
+
+            def call(*args, **kwargs):
+                try:
+                    asyncio.get_running_loop()
+                    on_loop.append(name)
+                except RuntimeError:
+                    pass
+                return method(*args, **kwargs)
+            return mock.patch.object(cache, name, call)
+
+        first = CircuitBreaker(window=2, minimum_calls=2, open_seconds=30, shared=True)
+        second = CircuitBreaker(shared=True)
+
+        async def calls():
+            for _ in range(2):
+                await first.arecord(await first.aacquire(), True, 0.1)
+            await second.aacquire()
+
+        with watched('get'), watched('set'), self.assertRaises(CallRefused):
+            async_to_sync(calls)()
+        self.assertEqual(on_loop, [])
+        self.assertEqual(second.state, 'open')
+
+    def test_bulkhead_refuses_over_its_cap(self):
+        """Calls over max_in_flight are refused rather than queued"""
+        bulkhead = Bulkhead(max_in_flight=2)
+        bulkhead.acquire()
+        bulkhead.acquire()
+        with self.assertRaises(CallRefused) as refused:
+            bulkhead.acquire()
+        self.assertEqual(refused.exception.reason, 'bulkhead_full')
+        bulkhead.release()
+        bulkhead.acquire()
+        self.assertEqual(bulkhead.stats(), {'max_in_flight': 2, 'in_flight': 2, 'refused': 1})
+
+
+@override_settings(
+    CHAPA_RETRY_BACKOFF=0,
+    CHAPA_VERIFY_RETRIES=0,
+    CHAPA_BREAKER_WINDOW=4,
+    CHAPA_BREAKER_MIN_CALLS=4,
+    CHAPA_BREAKER_OPEN_SECONDS=60,
+    CHAPA_BREAKER_HALF_OPEN_PROBES=1,
+)
+class ChapaCircuitBreakerTestCase(TestCase):
+    """Payment endpoints fail fast with 503 while Chapa is down, without touching payments"""
+
+    def setUp(self):
+        """Set up an initiated payment and a stub Chapa server"""
+        self.server = StubChapaServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        env = mock.patch.dict('os.environ', {
+            'CHAPA_SECRET_KEY': 'CHASECK_TEST-key',
+            'CHAPA_API_URL': self.server.url,
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        self.addCleanup(reset_chapa_client)
+        reset_chapa_client()
+        self.now = 0.0
+        get_chapa_breaker()[0].clock = lambda: self.now
+
+        host = User.objects.create(username='host', email='host@test.com')
+        self.guest = User.objects.create(username='guest', email='guest@test.com')
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        listing = Listing.objects.create(
+            title='Test Property',
+            description='A test property',
+            price_per_night=Decimal('500.00'),
+            location='Addis Ababa',
+            amenities='WiFi',
+            host=host,
+        )
+        self.booking = Booking.objects.create(
+            listing=listing,
+            guest=self.guest,
+            check_in_date=date.today() + timedelta(days=1),
+            check_out_date=date.today() + timedelta(days=3),
+            total_price=Decimal('1000.00'),
+        )
+        self.payment = Payment.objects.create(booking=self.booking, amount=Decimal('1000.00'))
+        Payment.objects.filter(pk=self.payment.pk).update(chapa_reference=str(self.payment.pk))
+        self.verify_url = f'/api/payments/{self.payment.pk}/verify_status/'
+        self.api = APIClient()
+        self.api.force_authenticate(self.guest)
+
+    def test_outage_fails_fast_then_recovers(self):
+        """Failures open the breaker, refusals are 503s with Retry-After, and a probe closes it"""
+        self.server.fault_status = 503
+        for _ in range(4):
+            self.assertEqual(self.api.post(self.verify_url).status_code, 400)
+        self.assertEqual(self.server.requests, 4)
+
+        response = self.api.post(self.verify_url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertEqual(response.json()['detail'], ChapaUnavailable.default_detail)
+        response = self.api.post(f'/api/bookings/{self.booking.pk}/initiate_payment/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.server.requests, 4)
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.error_message), ('pending', None))
+
+        self.assertEqual(self.api.get('/api/payments/chapa_breaker/').status_code, 403)
+        admin = APIClient()
+        admin.force_authenticate(self.admin)
+        stats = admin.get('/api/payments/chapa_breaker/').json()
+        self.assertEqual(stats['state'], 'open')
+        self.assertEqual((stats['failures'], stats['refused'], stats['trips']), (4, 2, 1))
+
+        self.server.fault_status = None
+        self.now = 60
+        response = self.api.post(self.verify_url)
+        self.assertEqual(response.json()['status'], 'completed')
+        self.assertEqual(admin.get('/api/payments/chapa_breaker/').json()['state'], 'closed')
+
+    def test_dropped_connections_open_it(self):
+        """Chapa closing connections unanswered counts as failing"""
+        self.server.drop_connections = True
+        client = get_chapa_client()
+        for _ in range(4):
+            self.assertFalse(client.verify_payment('ref')['success'])
+        self.assertTrue(client.verify_payment('ref')['unavailable'])
+
+    def test_client_errors_do_not_open_it(self):
+        """A 4xx is Chapa answering, so it counts as a success"""
+        self.server.fault_status = 400
+        client = get_chapa_client()
+        for _ in range(5):
+            self.assertNotIn('unavailable', client.verify_payment('ref'))
+        self.assertEqual(get_chapa_breaker()[0].state, 'closed')
+
+    def test_bulkhead_refusal(self):
+        """Calls over CHAPA_MAX_IN_FLIGHT are refused without waiting"""
+        with override_settings(CHAPA_MAX_IN_FLIGHT=1):
+            reset_chapa_client()
+            _, bulkhead = get_chapa_breaker()
+            bulkhead.acquire()
+            response = self.api.post(self.verify_url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(self.server.requests, 0)
+
+
+@override_settings(CHAPA_RETRY_BACKOFF=0)
+class PaymentReconciliationTestCase(TestCase):
+    """Pending payments are verified concurrently and settled in bulk"""
+
+    def setUp(self):
+        """Set up pending payments and a stub Chapa server"""
+        self.server = StubChapaServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        env = mock.patch.dict('os.environ', {
+            'CHAPA_SECRET_KEY': 'CHASECK_TEST-key',
+            'CHAPA_API_URL': self.server.url,
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        self.client_api = ChapaAPIClient()
+        self.addCleanup(self.client_api.close)
+
+        host = User.objects.create(username='host', email='host@test.com')
+        self.guest = User.objects.create(username='guest', email='guest@test.com')
+        self.listing = Listing.objects.create(
+            title='Test Property',
+            description='A test property',
+            price_per_night=Decimal('500.00'),
+            location='Addis Ababa',
+            amenities='WiFi',
+            host=host,
+        )
+        self.payments = [self.make_payment(i) for i in range(12)]
+
+    def make_payment(self, i):
+        check_in = date.today() + timedelta(days=2 * i + 1)
+        booking = Booking.objects.create(
+            listing=self.listing,
+            guest=self.guest,
+            check_in_date=check_in,
+            check_out_date=check_in + timedelta(days=1),
+            total_price=Decimal('500.00'),
+        )
+        payment = Payment.objects.create(booking=booking, amount=Decimal('500.00'))
+        Payment.objects.filter(pk=payment.pk).update(chapa_reference=str(payment.pk))
+        payment.refresh_from_db()
+        return payment
+
+    def reconcile(self, **kwargs):
+        options = {'chunk_size': 5, 'workers': 4, 'rate_limit': 0, 'client': self.client_api}
+        options.update(kwargs)
+        return reconcile_pending_payments(**options)
+
+    def test_cancelled_bookings_stay_cancelled(self):
+        """A payment completing after its booking was cancelled does not confirm the booking again"""
+        polled, swept = self.payments[0], self.payments[1]
+        for payment in (polled, swept):
+            Booking.objects.filter(pk=payment.booking_id).update(status='cancelled')
+
+        update_payment_status(polled, 'completed', transaction_id='tx-poll')
+        apply_verifications({swept.pk: {'success': True, 'status': 'success'}})
+
+        statuses = Booking.objects.filter(pk__in=[polled.booking_id, swept.booking_id]).values_list('status', flat=True)
+        self.assertEqual(list(statuses), ['cancelled', 'cancelled'])
+        self.assertEqual(Payment.objects.get(pk=swept.pk).status, 'completed')
+        self.assertEqual(Booking.objects.get(pk=self.payments[2].booking_id).status, 'pending')
+
+    def test_outcomes_are_applied(self):
+        """Successful payments complete and confirm their booking, failures are recorded"""
+        failed, pending = self.payments[0], self.payments[1]
+        self.server.verify_statuses = {failed.chapa_reference: 'failed', pending.chapa_reference: 'pending'}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = self.reconcile()
+
+        self.assertEqual(stats['processed'], 12)
+        self.assertEqual((stats['completed'], stats['failed'], stats['errors']), (10, 1, 0))
+        self.assertGreater(stats['rate'], 0)
+
+        failed.refresh_from_db()
+        pending.refresh_from_db()
+        self.assertEqual(failed.status, 'failed')
+        self.assertEqual(pending.status, 'pending')
+        completed = Payment.objects.get(pk=self.payments[2].pk)
+        self.assertEqual(completed.status, 'completed')
+        self.assertEqual(completed.transaction_id, f'CHAPA-{completed.chapa_reference}')
+        self.assertIsNotNone(completed.completed_at)
+        self.assertEqual(completed.booking.status, 'confirmed')
+        self.assertEqual(len(mail.outbox), 11)
+
+    def test_writes_are_batched_per_chunk(self):
+        """Query count grows with the number of chunks, not payments"""
+        with CaptureQueriesContext(connection) as queries:
+            self.reconcile(chunk_size=100)
+        self.assertEqual(Payment.objects.filter(status='completed').count(), 12)
+        # Including the revenue rollup's lock, insert and update
+        self.assertLessEqual(len(queries), 10)
+
+    def test_payment_settled_mid_sweep_is_not_overwritten(self):
+        """Only payments still pending under the row lock are updated"""
+        payment = self.payments[0]
+        Payment.objects.filter(pk=payment.pk).update(status='completed')
+        counts = apply_verifications({payment.pk: {'success': True, 'status': 'failed'}})
+        self.assertEqual(counts, {'completed': 0, 'failed': 0})
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'completed')
+
+    def test_unknown_statuses_stay_pending(self):
+        """A null, missing or unknown status leaves its payment pending without stopping the others"""
+        results = {
+            payment.pk: {'success': True, 'status': status}
+            for payment, status in zip(self.payments, [None, 'refunded', 'success'])
+        }
+        results[self.payments[3].pk] = {'success': True}
+        counts = apply_verifications(results)
+        self.assertEqual(counts, {'completed': 1, 'failed': 0})
+        statuses = [Payment.objects.get(pk=payment.pk).status for payment in self.payments[:4]]
+        self.assertEqual(statuses, ['pending', 'pending', 'completed', 'pending'])
+
+    def test_only_payments_are_locked(self):
+        """The joined bookings, listings and users aren't locked along with the payments"""
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True,
+                               side_effect=QuerySet.select_for_update) as select_for_update:
+            apply_verifications({self.payments[0].pk: {'success': True, 'status': 'success'}})
+        locks = [call.kwargs for call in select_for_update.call_args_list if call.args[0].model is Payment]
+        self.assertEqual(locks, [{'of': ('self',)}])
+
+    def test_recent_payments_are_skipped(self):
+        """Payments younger than min_age are left for the checkout flow"""
+        stats = self.reconcile(min_age=3600)
+        self.assertEqual(stats['processed'], 0)
+        self.assertEqual(self.server.requests, 0)
+
+    def test_rate_limit_is_global(self):
+        """The limiter caps calls per second across all workers"""
+        limiter = RateLimiter(rate=100, burst=1)
+        started = time.monotonic()
+        for _ in range(11):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    def test_sweep_stops_when_chapa_is_unavailable(self):
+        """An open breaker ends the sweep after the chunk it refused, leaving payments pending"""
+        self.addCleanup(reset_chapa_client)
+        reset_chapa_client()
+        breaker, _ = get_chapa_breaker()
+        with breaker.lock:
+            breaker.trip()
+
+        stats = self.reconcile()
+        self.assertEqual((stats['processed'], stats['errors']), (5, 5))
+        self.assertEqual(self.server.requests, 0)
+        self.assertEqual(Payment.objects.filter(status='pending').count(), 12)
+
+
+@override_settings(CHAPA_RETRY_BACKOFF=0)
+class PaymentCallbackTestCase(TestCase):
+    """Chapa callbacks are acknowledged at once and processed exactly once"""
+
+    def setUp(self):
+        """Set up a pending payment and a stub Chapa server"""
+        self.server = StubChapaServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        env = mock.patch.dict('os.environ', {
+            'CHAPA_SECRET_KEY': 'CHASECK_TEST-key',
+            'CHAPA_API_URL': self.server.url,
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        self.addCleanup(reset_chapa_client)
+        reset_chapa_client()
+
+        host = User.objects.create(username='host', email='host@test.com')
+        guest = User.objects.create(username='guest', email='guest@test.com')
+        listing = Listing.objects.create(
+            title='Test Property',
+            description='A test property',
+            price_per_night=Decimal('500.00'),
+            location='Addis Ababa',
+            amenities='WiFi',
+            host=host,
+        )
+        self.booking = Booking.objects.create(
+            listing=listing,
+            guest=guest,
+            check_in_date=date.today() + timedelta(days=1),
+            check_out_date=date.today() + timedelta(days=3),
+            total_price=Decimal('1000.00'),
+        )
+        self.payment = Payment.objects.create(booking=self.booking, amount=Decimal('1000.00'))
+        self.tx_ref = str(self.payment.payment_id)
+        self.client = APIClient()
+
+    def post_callback(self, tx_ref=None):
+        return self.client.post('/api/payments/verify/', {'tx_ref': tx_ref or self.tx_ref}, format='json')
+
+    def test_callback_is_acknowledged_before_verification(self):
+        """The response doesn't wait for Chapa; the worker settles the payment after commit"""
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = self.post_callback()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'accepted')
+        self.assertEqual(self.server.requests, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for callback in callbacks:
+                callback()
+        self.payment.refresh_from_db()
+        self.booking.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+        self.assertEqual(self.booking.status, 'confirmed')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIsNotNone(PaymentCallback.objects.get(tx_ref=self.tx_ref).processed_at)
+
+    def test_failed_payment_sends_failure_email(self):
+        """A payment Chapa reports failed gets the same failure email verify_status sends"""
+        self.server.verify_statuses = {self.tx_ref: 'failed'}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_callback()
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'failed')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('failed', mail.outbox[0].subject.lower())
+
+    def test_duplicate_callback_is_one_lookup(self):
+        """A retried callback costs one indexed query and has no side effects"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_callback()
+        requests_made = self.server.requests
+
+        with self.assertNumQueries(1):
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                response = self.post_callback()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'duplicate')
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.server.requests, requests_made)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_settled_payment_is_skipped(self):
+        """The worker doesn't call Chapa for a payment that is already settled"""
+        Payment.objects.filter(pk=self.payment.pk).update(status='completed')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_callback()
+        self.assertEqual(self.server.requests, 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_unknown_payment(self):
+        """Callbacks for unknown or malformed references are rejected and not recorded"""
+        self.assertEqual(self.post_callback('00000000-0000-0000-0000-000000000000').status_code, 404)
+        self.assertEqual(self.post_callback('not-a-uuid').status_code, 404)
+        self.assertFalse(PaymentCallback.objects.exists())
+
+    def test_missing_tx_ref(self):
+        """tx_ref is required"""
+        response = self.client.post('/api/payments/verify/', {}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
 if __name__ == '__main__':
     import unittest
     unittest.main()
+
+
+class RevenueRollupTestCase(TestCase):
+    """Daily revenue rollups and the host analytics endpoint"""
+
+    def setUp(self):
+        """Set up test data"""
+        self.host_user = User.objects.create(username='host', email='host@test.com')
+        self.guest_user = User.objects.create(username='guest', email='guest@test.com')
+        self.villa, self.cabin = [
+            Listing.objects.create(
+                title=title,
+                description='A test property',
+                price_per_night=Decimal('100.00'),
+                location='Addis Ababa',
+                amenities='WiFi',
+                host=self.host_user,
+            )
+            for title in ('Villa', 'Cabin')
+        ]
+        self.client = APIClient()
+
+    def book(self, listing, offset, amount='200.00', currency='ETB'):
+        booking = Booking.objects.create(
+            listing=listing,
+            guest=self.guest_user,
+            check_in_date=date(2026, 3, 1) + timedelta(days=offset),
+            check_out_date=date(2026, 3, 3) + timedelta(days=offset),
+            total_price=Decimal(amount),
+        )
+        payment = Payment.objects.create(booking=booking, amount=Decimal(amount), currency=currency)
+        return booking, payment
+
+    def complete(self, payment, when):
+        with mock.patch('django.utils.timezone.now', return_value=when):
+            update_payment_status(payment, 'completed', transaction_id=f'tx-{payment.pk}')
+
+    def rollups(self):
+        return sorted(
+            DailyRevenue.objects.values_list('listing__title', 'currency', 'day', 'revenue', 'bookings', 'cancellations')
+        )
+
+    def test_completions_and_cancellations_update_rollups(self):
+        """Completed payments and cancelled bookings land in their day's row, once"""
+        day = timezone.make_aware(datetime(2026, 3, 1, 12))
+        _, first = self.book(self.villa, 0)
+        _, second = self.book(self.villa, 5, amount='300.00')
+        cancelled, _ = self.book(self.cabin, 0, currency='USD')
+        self.complete(first, day)
+        self.complete(second, day)
+        # Repeated completion, e.g. a second status poll
+        self.complete(second, day)
+
+        self.client.force_authenticate(user=self.guest_user)
+        with mock.patch('django.utils.timezone.now', return_value=day + timedelta(days=1)):
+            response = self.client.patch(f'/api/bookings/{cancelled.pk}/cancel/')
+        self.assertEqual(response.status_code, 200)
+
+        expected = [
+            ('Cabin', 'USD', date(2026, 3, 2), Decimal('0.00'), 0, 1),
+            ('Villa', 'ETB', date(2026, 3, 1), Decimal('500.00'), 2, 0),
+        ]
+        self.assertEqual(self.rollups(), expected)
+        self.assertEqual(rebuild_revenue_rollups(), 2)
+        self.assertEqual(self.rollups(), expected)
+
+    def test_reconciliation_updates_rollups(self):
+        """Payments settled by the bulk sweep are counted in a fixed number of queries"""
+        payments = [self.book(listing, offset)[1] for listing in (self.villa, self.cabin) for offset in (0, 5)]
+        results = {payment.pk: {'success': True, 'status': 'success'} for payment in payments}
+        # Payment lock and updates (3), rollup lock, insert, re-lock and update (4), savepoint (2)
+        with self.assertNumQueries(9):
+            apply_verifications(results)
+        today = timezone.localdate()
+        self.assertEqual(self.rollups(), [
+            ('Cabin', 'ETB', today, Decimal('400.00'), 2, 0),
+            ('Villa', 'ETB', today, Decimal('400.00'), 2, 0),
+        ])
+
+    def test_verify_status_racing_a_settled_payment_counts_it_once(self):
+        """A payment settled between verify_status loading it and recording Chapa's answer is left alone"""
+        _, payment = self.book(self.villa, 0)
+        Payment.objects.filter(pk=payment.pk).update(chapa_reference=str(payment.pk))
+        client = mock.Mock()
+        client.verify_payment.return_value = {'success': True, 'status': 'success', 'reference': 'tx-poll'}
+        original_get_object = PaymentViewSet.get_object
+
+        def get_object_then_callback(view):
+            loaded = original_get_object(view)
+            # The callback worker completes it while the poll waits on Chapa
+            update_payment_status(Payment.objects.get(pk=payment.pk), 'completed', transaction_id='tx-callback')
+            return loaded
+
+        self.client.force_authenticate(user=self.guest_user)
+        with mock.patch.object(PaymentViewSet, 'get_object', get_object_then_callback), \
+                mock.patch('listings.views.get_chapa_client', return_value=client), \
+                mock.patch('listings.payment_actions.dispatch_payment_email') as dispatch, \
+                mock.patch.object(QuerySet, 'select_for_update', autospec=True,
+                                  side_effect=QuerySet.select_for_update) as select_for_update:
+            response = self.client.post(f'/api/payments/{payment.pk}/verify_status/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'completed')
+        dispatch.assert_not_called()
+        # Its booking and listing are joined but not locked
+        self.assertIn(mock.call(mock.ANY, of=('self',)), select_for_update.call_args_list)
+        self.assertEqual(Payment.objects.get(pk=payment.pk).transaction_id, 'tx-callback')
+        self.assertEqual([row[3:5] for row in self.rollups()], [(Decimal('200.00'), 1)])
+
+    def test_host_endpoint_sums_rollups(self):
+        """The endpoint sums the host's rollup rows within the range in one query per breakdown"""
+        for listing, day, revenue, bookings in (
+            (self.villa, date(2026, 3, 1), '200.00', 1),
+            (self.villa, date(2026, 3, 2), '300.00', 2),
+            (self.cabin, date(2026, 3, 2), '100.00', 1),
+            (self.cabin, date(2026, 4, 1), '900.00', 3),
+        ):
+            DailyRevenue.objects.create(
+                host=self.host_user, listing=listing, currency='ETB', day=day,
+                revenue=Decimal(revenue), bookings=bookings,
+            )
+        self.client.force_authenticate(user=self.host_user)
+
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/analytics/host/', {'start': '2026-03-01', 'end': '2026-03-31'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data['totals'],
+            [{'currency': 'ETB', 'revenue': '600.00', 'bookings': 4, 'cancellations': 0}],
+        )
+        self.assertEqual([row['title'] for row in response.data['listings']], ['Villa', 'Cabin'])
+        self.assertEqual(
+            [(row['day'], row['revenue']) for row in response.data['days']],
+            [('2026-03-01', '200.00'), ('2026-03-02', '400.00')],
+        )
+
+        response = self.client.get('/api/analytics/host/', {'end': '2026-04-30', 'listing': str(self.cabin.pk)})
+        self.assertEqual(response.data['start'], '2026-04-01')
+        self.assertEqual(response.data['totals'][0]['revenue'], '900.00')
+
+        # Other users see nothing of this host's revenue
+        self.client.force_authenticate(user=self.guest_user)
+        response = self.client.get('/api/analytics/host/', {'start': '2026-03-01', 'end': '2026-04-30'})
+        self.assertEqual(response.data['totals'], [])
+
+    def test_host_endpoint_validation(self):
+        """Bad dates and listing ids are rejected; anonymous users get 401"""
+        self.assertEqual(self.client.get('/api/analytics/host/').status_code, 401)
+        self.client.force_authenticate(user=self.host_user)
+        for params in ({'start': '2026-02-30'}, {'start': '2026-03-02', 'end': '2026-03-01'},
+                       {'listing': 'not-a-uuid'}, {'start': '2000-01-01', 'end': '2026-01-01'}):
+            self.assertEqual(self.client.get('/api/analytics/host/', params).status_code, 400, params)
+
+
+@override_settings(CHAPA_RETRY_BACKOFF=0)
+class AsyncPaymentViewTestCase(TransactionTestCase):
+    """
+    The async payment views answer like the DRF actions
+
+    Their database steps run on other threads, which only see committed
+    rows, hence TransactionTestCase.
+    """
+
+    def setUp(self):
+        """Set up a booking and a stub Chapa server"""
+        self.server = StubChapaServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        env = mock.patch.dict('os.environ', {
+            'CHAPA_SECRET_KEY': 'CHASECK_TEST-key',
+            'CHAPA_API_URL': self.server.url,
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        self.addCleanup(reset_chapa_client)
+        self.addCleanup(reset_async_chapa_clients)
+
+        self.host_user = User.objects.create(username='host', email='host@test.com')
+        self.guest_user = User.objects.create(username='guest', email='guest@test.com')
+        self.guest_token = Token.objects.create(user=self.guest_user).key
+        self.host_token = Token.objects.create(user=self.host_user).key
+        listing = Listing.objects.create(
+            title='Test Property',
+            description='A test property',
+            price_per_night=Decimal('500.00'),
+            location='Addis Ababa',
+            amenities='WiFi',
+            host=self.host_user,
+        )
+        self.booking = Booking.objects.create(
+            listing=listing,
+            guest=self.guest_user,
+            check_in_date=date.today() + timedelta(days=1),
+            check_out_date=date.today() + timedelta(days=3),
+            total_price=Decimal('1000.00'),
+        )
+        self.initiate_url = f'/api/async/bookings/{self.booking.pk}/initiate_payment/'
+
+    def post(self, path, token=None):
+        headers = {'Authorization': f'Token {token}'} if token else {}
+        return async_to_sync(AsyncClient().post)(path, headers=headers)
+
+    def test_initiate_matches_drf_action(self):
+        """Initiating through the async view gives the DRF action's response and side effects"""
+        response = self.post(self.initiate_url, self.guest_token)
+        self.assertEqual(response.status_code, 200)
+        payment = Payment.objects.get(booking=self.booking)
+        self.assertEqual(payment.chapa_reference, str(payment.payment_id))
+
+        drf = APIClient()
+        drf.credentials(HTTP_AUTHORIZATION=f'Token {self.guest_token}')
+        sync_response = drf.post(f'/api/bookings/{self.booking.pk}/initiate_payment/')
+        self.assertEqual(response.json(), sync_response.json())
+        self.assertEqual(Payment.objects.filter(booking=self.booking).count(), 1)
+
+    def test_verify_completes_payment(self):
+        """A successful verification settles the payment, its booking and the rollups"""
+        self.post(self.initiate_url, self.guest_token)
+        payment = Payment.objects.get(booking=self.booking)
+        self.server.fail_statuses = [503, 502]
+
+        response = self.post(f'/api/async/payments/{payment.pk}/verify_status/', self.host_token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'completed')
+        # Retried on 5xx like the sync client: initialize, then three verify attempts
+        self.assertEqual(self.server.requests, 4)
+        payment.refresh_from_db()
+        self.booking.refresh_from_db()
+        self.assertEqual(payment.status, 'completed')
+        self.assertEqual(self.booking.status, 'confirmed')
+        self.assertEqual(DailyRevenue.objects.get().bookings, 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+        # Settled payments can't be initiated again
+        response = self.post(self.initiate_url, self.guest_token)
+        self.assertEqual(response.status_code, 400)
+
+    def test_verify_requires_initiation(self):
+        """Payments Chapa has never seen are not sent for verification"""
+        payment = Payment.objects.create(booking=self.booking, amount=Decimal('1000.00'))
+        response = self.post(f'/api/async/payments/{payment.pk}/verify_status/', self.guest_token)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.server.requests, 0)
+
+    def test_authentication_and_permissions(self):
+        """Anonymous, bad-token, non-guest and unrelated users are refused as by the DRF actions"""
+        response = self.post(self.initiate_url)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+        self.assertEqual(self.post(self.initiate_url, 'not-a-token').json(), {'detail': 'Invalid token.'})
+
+        response = self.post(self.initiate_url, self.host_token)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json(), {'detail': 'You can only initiate payment for your own bookings.'})
+
+        stranger = Token.objects.create(user=User.objects.create(username='stranger')).key
+        self.assertEqual(self.post(self.initiate_url, stranger).status_code, 404)
+        self.assertEqual(async_to_sync(AsyncClient().get)(self.initiate_url).status_code, 405)
+        self.assertEqual(self.server.requests, 0)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_profiled_under_asgi(self):
+        """Queries run on the ORM threads and the Chapa call both reach Server-Timing"""
+        with override_settings(REQUEST_PROFILING_ENABLED=True):
+            response = self.post(self.initiate_url, self.guest_token)
+        self.assertEqual(response.status_code, 200)
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertNotIn('"0 queries"', timing)
+        self.assertIn('chapa;dur=', timing)
+
+    def test_refused_while_breaker_is_open(self):
+        """An open breaker answers 503 with Retry-After, and the payment is not created or failed"""
+        reset_chapa_client()
+        breaker, _ = get_chapa_breaker()
+        with breaker.lock:
+            breaker.trip()
+        response = self.post(self.initiate_url, self.guest_token)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(settings.CHAPA_BREAKER_OPEN_SECONDS))
+        self.assertEqual(self.server.requests, 0)
+        self.assertEqual(Payment.objects.get(booking=self.booking).status, 'pending')
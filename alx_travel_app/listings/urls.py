@@ -1,14 +1,21 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ListingViewSet, BookingViewSet, ReviewViewSet, PaymentViewSet
+from . import async_views
+from .views import ListingViewSet, BookingViewSet, ReviewViewSet, PaymentViewSet, AnalyticsViewSet
 
 router = DefaultRouter()
 router.register(r'listings', ListingViewSet, basename='listing')
 router.register(r'bookings', BookingViewSet, basename='booking')
 router.register(r'reviews', ReviewViewSet, basename='review')
 router.register(r'payments', PaymentViewSet, basename='payment')
+router.register(r'analytics', AnalyticsViewSet, basename='analytics')
 
 urlpatterns = [
+    # Served without holding a worker thread while Chapa answers, when run under ASGI
+    path('api/async/bookings/<uuid:pk>/initiate_payment/', async_views.initiate_payment,
+         name='async-booking-initiate-payment'),
+    path('api/async/payments/<uuid:pk>/verify_status/', async_views.verify_status,
+         name='async-payment-verify-status'),
     path('api/', include(router.urls)),
 ]
 
@@ -1,24 +1,53 @@
 from rest_framework import viewsets
-from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework import status
-from django.db.models import Q
+from rest_framework.filters import OrderingFilter
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import as_serializer_error
+from django_filters.rest_framework import DjangoFilterBackend
+from django.db import transaction
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 import logging
 from .models import Listing, Booking, Review, Payment
-from .serializers import ListingSerializer, BookingSerializer, ReviewSerializer, PaymentSerializer
-from .chapa_utils import ChapaAPIClient, create_payment_for_booking, update_payment_status
-from .email_tasks import send_payment_confirmation_email, send_payment_failure_email
+from .serializers import (
+    ListingSerializer, BookingSerializer, BookingBatchSerializer, ReviewSerializer, PaymentSerializer,
+    HostRevenueSerializer, optimize_for_serializer
+)
+from .chapa_utils import get_chapa_client
+from .circuit_breaker import chapa_breaker_stats
+from .payment_actions import (
+    ChapaUnavailable, chapa_failure, payment_to_initiate, record_initiation, record_verification, verification_refusal
+)
+from .availability import (
+    HOLDING_STATUSES, booked_nights_version, filter_available, release_nights, sync_booking_nights
+)
+from .reservations import hold_nights_or_conflict, reserve_booking, reserve_bookings
+from .ratings import apply_review_delta
+from .cache import CachedReadMixin, cache_stats, invalidate_listing
+from .conditional import ConditionalReadMixin, rendered_relations, version_fields
+from .callbacks import record_callback
+from .search import ListingSearchFilter
+from .amenities import filter_amenities, parse_amenity_filter
+from .exports import export_bookings, export_payments, export_response, parse_export_params
+from .revenue import host_revenue, parse_revenue_params, record_cancellation
+from .visibility import VisibilityMixin, booking_branches, payment_branches
 
 logger = logging.getLogger(__name__)
 
 
-class ListingViewSet(viewsets.ModelViewSet):
+class ListingViewSet(ConditionalReadMixin, CachedReadMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing travel property listings.
     
     Provides CRUD operations:
     - GET /api/listings/ - List all listings
+      (?check_in=YYYY-MM-DD&check_out=YYYY-MM-DD keeps only listings free for the stay,
+      ?search= ranks by full-text relevance, ?price_per_night__gte=/__lte= bound the price,
+      ?amenities=wifi,pool keeps only listings offering every listed amenity)
     - POST /api/listings/ - Create a new listing
     - GET /api/listings/{id}/ - Retrieve a specific listing
     - PUT /api/listings/{id}/ - Update a listing
@@ -26,39 +55,105 @@ class ListingViewSet(viewsets.ModelViewSet):
     
     Additional actions:
     - GET /api/listings/{id}/reviews/ - Get reviews for a listing
+    - GET /api/listings/my_listings/ - Get listings owned by the current user
+    - GET /api/listings/available/ - Get all available listings
+    - GET /api/listings/cache_stats/ - Response cache hit/miss counters (admin only)
+
+    List and retrieve responses are served from a versioned cache (see listings.cache).
+    They and the reviews action answer If-None-Match/If-Modified-Since with 304
+    (see listings.conditional).
     """
     queryset = Listing.objects.all()
     serializer_class = ListingSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
-    filterset_fields = ['location', 'is_available']
-    search_fields = ['title', 'description', 'location']
-    ordering_fields = ['created_at', 'price_per_night', 'title']
+    filter_backends = [DjangoFilterBackend, OrderingFilter, ListingSearchFilter]
+    filterset_fields = {
+        'location': ['exact'],
+        'is_available': ['exact'],
+        'price_per_night': ['gte', 'lte'],
+    }
+    ordering_fields = ['created_at', 'price_per_night', 'title', 'average_rating', 'review_count']
     ordering = ['-created_at']
 
+    def get_queryset(self):
+        """Serve listings with the relations the requested fields render preloaded"""
+        if self.action == 'reviews':
+            return Listing.objects.all()
+        queryset = optimize_for_serializer(Listing.objects.with_average_rating(), self.get_serializer())
+
+        stay = self.get_stay_dates()
+        if stay:
+            queryset = filter_available(queryset, *stay)
+
+        amenities = parse_amenity_filter(self.request.query_params.get('amenities'))
+        if amenities:
+            queryset = filter_amenities(queryset, amenities)
+        return queryset
+
+    def get_stay_dates(self):
+        """Parse the optional ?check_in=&check_out= availability filter"""
+        params = self.request.query_params
+        check_in = params.get('check_in')
+        check_out = params.get('check_out')
+        if not check_in and not check_out:
+            return None
+        if not (check_in and check_out):
+            raise ValidationError("Both check_in and check_out are required to filter by availability.")
+
+        try:
+            check_in, check_out = parse_date(check_in), parse_date(check_out)
+        except ValueError:
+            check_in = check_out = None
+        if not check_in or not check_out:
+            raise ValidationError("check_in and check_out must be dates in YYYY-MM-DD format.")
+        if check_in >= check_out:
+            raise ValidationError("Check-out date must be after check-in date.")
+        return check_in, check_out
+
     def perform_create(self, serializer):
         """Automatically set the host to the current user when creating a listing"""
         serializer.save(host=self.request.user)
 
     def perform_update(self, serializer):
         """Allow only the listing host to update their listing"""
-        if serializer.instance.host != self.request.user:
+        if serializer.instance.host_id != self.request.user.pk:
             from rest_framework.exceptions import PermissionDenied
             raise PermissionDenied("You can only update your own listings.")
         serializer.save()
 
     def perform_destroy(self, instance):
         """Allow only the listing host to delete their listing"""
-        if instance.host != self.request.user:
+        if instance.host_id != self.request.user.pk:
             from rest_framework.exceptions import PermissionDenied
             raise PermissionDenied("You can only delete your own listings.")
         instance.delete()
 
+    def get_version_extras(self):
+        """Lists filtered by availability change with the nights booked during the stay"""
+        stay = self.get_stay_dates() if self.action == 'list' else None
+        return booked_nights_version(*stay) if stay else None
+
+    def get_version_relations(self):
+        """The reviews action renders the listing's reviews rather than the listing"""
+        if self.action == 'reviews':
+            serializer = ReviewSerializer(context=self.get_serializer_context())
+            return [('reviews', version_fields(serializer)), *rendered_relations(serializer, 'reviews__')]
+        return super().get_version_relations()
+
     @action(detail=True, methods=['get'])
     def reviews(self, request, pk=None):
         """Get all reviews for a specific listing"""
+        return self.conditional_response(self.listing_reviews, None, request)
+
+    def listing_reviews(self, request):
         listing = self.get_object()
-        reviews = listing.reviews.all()
-        serializer = ReviewSerializer(reviews, many=True)
+        context = self.get_serializer_context()
+        reviews = optimize_for_serializer(listing.reviews.all(), ReviewSerializer(context=context))
+        page = self.paginate_queryset(reviews)
+        if page is not None:
+            serializer = ReviewSerializer(page, many=True, context=context)
+            return self.get_paginated_response(serializer.data)
+        serializer = ReviewSerializer(reviews, many=True, context=context)
         return Response(serializer.data)
 
     @action(detail=False, methods=['get'])
@@ -69,33 +164,51 @@ class ListingViewSet(viewsets.ModelViewSet):
                 {'detail': 'Authentication required.'}, 
                 status=status.HTTP_401_UNAUTHORIZED
             )
-        listings = Listing.objects.filter(host=request.user)
+        listings = self.get_queryset().filter(host=request.user)
+        page = self.paginate_queryset(listings)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         serializer = self.get_serializer(listings, many=True)
         return Response(serializer.data)
 
-    @action(detail=True, methods=['get'])
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def cache_stats(self, request):
+        """Get hit/miss counters of the listing response cache"""
+        return Response(cache_stats())
+
+    @action(detail=False, methods=['get'])
     def available(self, request):
         """Get all available listings"""
-        listings = Listing.objects.filter(is_available=True)
+        listings = self.get_queryset().filter(is_available=True)
+        page = self.paginate_queryset(listings)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         serializer = self.get_serializer(listings, many=True)
         return Response(serializer.data)
 
 
-class BookingViewSet(viewsets.ModelViewSet):
+class BookingViewSet(VisibilityMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing travel bookings.
     
     Provides CRUD operations:
     - GET /api/bookings/ - List all bookings
-    - POST /api/bookings/ - Create a new booking
+    - POST /api/bookings/ - Create a new booking (409 if the nights are taken)
+    - POST /api/bookings/batch/ - Create many bookings, each succeeding or failing on its own
     - GET /api/bookings/{id}/ - Retrieve a specific booking
     - PUT /api/bookings/{id}/ - Update a booking
     - DELETE /api/bookings/{id}/ - Delete a booking
     
     Additional actions:
     - GET /api/bookings/my_bookings/ - Get bookings made by the current user
+    - GET /api/bookings/export/ - Stream bookings of the user's listings as CSV or NDJSON
     - PATCH /api/bookings/{id}/cancel/ - Cancel a booking
     - POST /api/bookings/{id}/initiate_payment/ - Initiate payment for booking
+
+    Users see the bookings they made and those of their listings; lists read
+    each on its own index (see listings.visibility).
     """
     queryset = Booking.objects.all()
     serializer_class = BookingSerializer
@@ -105,50 +218,128 @@ class BookingViewSet(viewsets.ModelViewSet):
     ordering = ['-created_at']
 
     def perform_create(self, serializer):
-        """Automatically set the guest to the current user when creating a booking"""
-        # Get listing from write_only field
-        listing_id = self.request.data.get('listing_id')
-        from .models import Listing
-        listing = Listing.objects.get(listing_id=listing_id)
-        
-        # Calculate total_price if not provided
-        total_price = serializer.validated_data.get('total_price')
-        if not total_price and listing:
-            from datetime import datetime
-            check_in = serializer.validated_data['check_in_date']
-            check_out = serializer.validated_data['check_out_date']
-            days = (check_out - check_in).days
-            total_price = listing.price_per_night * days
-        
-        booking = serializer.save(guest=self.request.user, listing=listing, total_price=total_price)
-        
-        # Automatically create a payment record for the booking
-        create_payment_for_booking(booking)
+        """
+        Reserve the nights for the current user.
+
+        The booking, its availability entries and its payment are created in one
+        transaction; overlapping requests for the same listing get a 409.
+        """
+        data = serializer.validated_data
+        serializer.instance = reserve_booking(
+            listing_id=data['listing_id'],
+            guest=self.request.user,
+            check_in=data['check_in_date'],
+            check_out=data['check_out_date'],
+            total_price=data.get('total_price'),
+        )
+
+    def perform_update(self, serializer):
+        """Keep the availability index and revenue rollups in step with changed dates or status"""
+        cancelling = (
+            serializer.validated_data.get('status') == 'cancelled' and serializer.instance.status != 'cancelled'
+        )
+        with transaction.atomic():
+            if cancelling:
+                booking = serializer.save(cancelled_at=timezone.now())
+                record_cancellation(booking)
+            else:
+                booking = serializer.save()
+            release_nights(booking)
+            if booking.status in HOLDING_STATUSES:
+                hold_nights_or_conflict(booking)
+
+    def get_visibility_branches(self):
+        return booking_branches(self.request.user)
 
     def get_queryset(self):
         """Filter bookings based on user role"""
         user = self.request.user
         if user.is_authenticated:
             # Users can see their own bookings and bookings for their listings
-            return Booking.objects.filter(
-                Q(guest=user) | Q(listing__host=user)
-            ).distinct()
+            bookings = self.visible(Booking.objects.all())
+            if self.action == 'initiate_payment':
+                # Only what Chapa is sent and the latest payment are read, not a serialized booking
+                return bookings.select_related('guest', 'listing').with_payment()
+            return optimize_for_serializer(bookings, self.get_serializer())
         return Booking.objects.none()
 
     @action(detail=False, methods=['get'])
     def my_bookings(self, request):
         """Get all bookings made by the current user"""
-        bookings = Booking.objects.filter(guest=request.user)
+        bookings = optimize_for_serializer(Booking.objects.filter(guest=request.user), self.get_serializer())
+        page = self.paginate_queryset(bookings)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         serializer = self.get_serializer(bookings, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Create many bookings for the current user in one request
+
+        Takes {"bookings": [...]}, each item what POST /api/bookings/ takes.
+        Items are validated and reserved on their own: the response lists,
+        in request order, each item's status with its booking or its errors,
+        and is a 201 when every item was created and a 207 otherwise.
+        """
+        batch = BookingBatchSerializer(data=request.data)
+        batch.is_valid(raise_exception=True)
+        items = batch.validated_data['bookings']
+
+        results = [None] * len(items)
+        stays, positions = [], []
+        validator = self.get_serializer()
+        for position, item in enumerate(items):
+            try:
+                stays.append(validator.run_validation(item))
+                positions.append(position)
+            except ValidationError as exc:
+                results[position] = self.batch_failure(exc)
+
+        outcomes = reserve_bookings(request.user, stays) if stays else []
+        created = [outcome.pk for outcome in outcomes if isinstance(outcome, Booking)]
+        # Read back and serialized once with what the serializer renders, rather than per booking
+        bookings = optimize_for_serializer(Booking.objects.filter(pk__in=created), self.get_serializer()).in_bulk()
+        rendered = iter(self.get_serializer([bookings[pk] for pk in created], many=True).data)
+        for position, outcome in zip(positions, outcomes):
+            if isinstance(outcome, Booking):
+                results[position] = {'status': status.HTTP_201_CREATED, 'booking': next(rendered)}
+            else:
+                results[position] = self.batch_failure(outcome)
+
+        all_created = len(created) == len(items)
+        return Response(
+            {'results': results},
+            status=status.HTTP_201_CREATED if all_created else status.HTTP_207_MULTI_STATUS,
+        )
+
+    def batch_failure(self, exc):
+        """A batch item's result for the exception it failed with, as its own response would carry it"""
+        errors = as_serializer_error(exc) if isinstance(exc, ValidationError) else {'detail': exc.detail}
+        return {'status': exc.status_code, 'errors': errors}
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream the bookings of the current user's listings
+
+        ?role=guest exports the user's own stays instead. ?start= and ?end=
+        bound the check-in date, ?status=confirmed,completed keeps those
+        statuses and ?output=ndjson switches from CSV.
+        """
+        options = parse_export_params(request.query_params, dict(Booking.STATUS_CHOICES))
+        columns, rows = export_bookings(request.user, options, chunk_size=settings.EXPORT_CHUNK_SIZE)
+        return export_response(columns, rows, options['output'], 'bookings')
+
     @action(detail=True, methods=['patch'])
     def cancel(self, request, pk=None):
         """Cancel a booking (change status to 'cancelled')"""
         booking = self.get_object()
         
         # Only guest or listing host can cancel
-        if booking.guest != request.user and booking.listing.host != request.user:
+        if booking.guest_id != request.user.pk and booking.listing.host_id != request.user.pk:
             from rest_framework.exceptions import PermissionDenied
             raise PermissionDenied("You can only cancel your own bookings or bookings for your listings.")
         
@@ -160,7 +351,11 @@ class BookingViewSet(viewsets.ModelViewSet):
             )
         
         booking.status = 'cancelled'
-        booking.save()
+        booking.cancelled_at = timezone.now()
+        with transaction.atomic():
+            booking.save()
+            sync_booking_nights(booking)
+            record_cancellation(booking)
         serializer = self.get_serializer(booking)
         return Response(serializer.data)
 
@@ -170,7 +365,7 @@ class BookingViewSet(viewsets.ModelViewSet):
         booking = self.get_object()
         
         # Only listing host can confirm
-        if booking.listing.host != request.user:
+        if booking.listing.host_id != request.user.pk:
             from rest_framework.exceptions import PermissionDenied
             raise PermissionDenied("Only the listing host can confirm bookings.")
         
@@ -182,7 +377,9 @@ class BookingViewSet(viewsets.ModelViewSet):
             )
         
         booking.status = 'confirmed'
-        booking.save()
+        with transaction.atomic():
+            booking.save()
+            sync_booking_nights(booking)
         serializer = self.get_serializer(booking)
         return Response(serializer.data)
 
@@ -198,73 +395,24 @@ class BookingViewSet(viewsets.ModelViewSet):
         booking = self.get_object()
         
         # Only guest can initiate payment
-        if booking.guest != request.user:
+        if booking.guest_id != request.user.pk:
             from rest_framework.exceptions import PermissionDenied
             raise PermissionDenied("You can only initiate payment for your own bookings.")
         
-        # Check if payment already exists
-        try:
-            payment = booking.payment
-        except Payment.DoesNotExist:
-            payment = create_payment_for_booking(booking)
-        
-        # Only pending payments can be initiated
-        if payment.status != 'pending':
-            return Response(
-                {'detail': f'Cannot initiate payment for {payment.status} payment.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
+        payment, refusal = payment_to_initiate(booking)
+        if refusal:
+            return Response(*refusal)
+
         try:
-            # Initialize Chapa API client
-            chapa_client = ChapaAPIClient()
-            
-            # Initiate payment with Chapa
-            result = chapa_client.initiate_payment(payment, booking)
-            
-            if result['success']:
-                # Update payment reference
-                update_payment_status(
-                    payment,
-                    'pending',
-                    chapa_reference=result.get('reference')
-                )
-                
-                return Response({
-                    'success': True,
-                    'checkout_url': result.get('checkout_url'),
-                    'payment_id': str(payment.payment_id),
-                    'amount': str(payment.amount),
-                    'currency': payment.currency,
-                }, status=status.HTTP_200_OK)
-            else:
-                error_msg = result.get('error', 'Unknown error')
-                update_payment_status(
-                    payment,
-                    'failed',
-                    error_message=error_msg
-                )
-                
-                return Response({
-                    'success': False,
-                    'error': error_msg,
-                }, status=status.HTTP_400_BAD_REQUEST)
-                
-        except ValueError as e:
-            logger.error(f"Configuration error: {str(e)}")
-            return Response(
-                {'error': f'Configuration error: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+            result = get_chapa_client().initiate_payment(payment, booking)
+            return Response(*record_initiation(payment, result))
+        except ChapaUnavailable:
+            raise
         except Exception as e:
-            logger.error(f"Unexpected error during payment initiation: {str(e)}")
-            return Response(
-                {'error': f'Unexpected error: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+            return Response(*chapa_failure(e, 'payment initiation'))
 
 
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(VisibilityMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing payments.
     
@@ -272,9 +420,14 @@ class PaymentViewSet(viewsets.ModelViewSet):
     - GET /api/payments/ - List all payments
     - GET /api/payments/{id}/ - Retrieve a specific payment
     - POST /api/payments/verify/ - Verify payment status with Chapa
+    - GET /api/payments/export/ - Stream payments for the user's listings as CSV or NDJSON
     
     Additional actions:
     - POST /api/payments/{id}/verify_status/ - Verify specific payment status
+    - GET /api/payments/chapa_breaker/ - Chapa circuit breaker state and counters (admin only)
+
+    Users see the payments for their bookings and for bookings of their
+    listings; lists read each on its own index (see listings.visibility).
     """
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
@@ -283,16 +436,39 @@ class PaymentViewSet(viewsets.ModelViewSet):
     ordering_fields = ['created_at', 'amount', 'status']
     ordering = ['-created_at']
 
+    def get_visibility_branches(self):
+        return payment_branches(self.request.user)
+
     def get_queryset(self):
         """Filter payments based on user role"""
         user = self.request.user
         if user.is_authenticated:
             # Users can see payments for their bookings and bookings for their listings
-            return Payment.objects.filter(
-                Q(booking__guest=user) | Q(booking__listing__host=user)
-            ).distinct()
+            payments = self.visible(Payment.objects.all())
+            if self.action == 'verify_status':
+                # Completing a payment confirms its booking and rolls it up by listing and host
+                return payments.select_related('booking__listing')
+            return optimize_for_serializer(payments, self.get_serializer())
         return Payment.objects.none()
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream the payments for bookings of the current user's listings
+
+        ?role=guest exports the user's own payments instead. ?start= and
+        ?end= bound the day the payment was created, ?status=completed keeps
+        those statuses and ?output=ndjson switches from CSV.
+        """
+        options = parse_export_params(request.query_params, dict(Payment.PAYMENT_STATUS_CHOICES))
+        columns, rows = export_payments(request.user, options, chunk_size=settings.EXPORT_CHUNK_SIZE)
+        return export_response(columns, rows, options['output'], 'payments')
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def chapa_breaker(self, request):
+        """Get this process's Chapa circuit breaker state, bulkhead and call counters"""
+        return Response(chapa_breaker_stats())
+
     @action(detail=True, methods=['post'])
     def verify_status(self, request, pk=None):
         """
@@ -306,92 +482,30 @@ class PaymentViewSet(viewsets.ModelViewSet):
         payment = self.get_object()
         
         # Only guest or host can verify payment
-        if payment.booking.guest != request.user and payment.booking.listing.host != request.user:
+        if payment.booking.guest_id != request.user.pk and payment.booking.listing.host_id != request.user.pk:
             from rest_framework.exceptions import PermissionDenied
             raise PermissionDenied("You can only verify your own payments.")
         
-        if not payment.chapa_reference:
-            return Response(
-                {'detail': 'Payment has not been initiated yet.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
+        refusal = verification_refusal(payment)
+        if refusal:
+            return Response(*refusal)
+
         try:
-            chapa_client = ChapaAPIClient()
-            result = chapa_client.verify_payment(payment.chapa_reference)
-            
-            if result['success']:
-                # Update payment status based on Chapa response
-                chapa_status = result.get('status', 'pending').lower()
-                
-                if chapa_status == 'success':
-                    update_payment_status(
-                        payment,
-                        'completed',
-                        transaction_id=result.get('reference'),
-                        payment_method=result.get('method')
-                    )
-                    
-                    # Send confirmation email
-                    send_payment_confirmation_email(payment.booking, payment)
-                    
-                    return Response({
-                        'success': True,
-                        'status': 'completed',
-                        'message': 'Payment completed successfully',
-                        'amount': str(result.get('amount')),
-                        'received_amount': str(result.get('received_amount')),
-                        'transaction_id': result.get('reference'),
-                    }, status=status.HTTP_200_OK)
-                    
-                elif chapa_status == 'failed':
-                    update_payment_status(
-                        payment,
-                        'failed',
-                        error_message='Payment failed on Chapa'
-                    )
-                    
-                    send_payment_failure_email(
-                        payment.booking,
-                        payment,
-                        'Your payment failed. Please try again.'
-                    )
-                    
-                    return Response({
-                        'success': False,
-                        'status': 'failed',
-                        'message': 'Payment failed',
-                    }, status=status.HTTP_400_BAD_REQUEST)
-                    
-                else:  # pending
-                    return Response({
-                        'success': True,
-                        'status': 'pending',
-                        'message': 'Payment is still pending',
-                    }, status=status.HTTP_200_OK)
-            else:
-                return Response({
-                    'success': False,
-                    'error': result.get('error', 'Failed to verify payment'),
-                }, status=status.HTTP_400_BAD_REQUEST)
-                
-        except ValueError as e:
-            logger.error(f"Configuration error: {str(e)}")
-            return Response(
-                {'error': f'Configuration error: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+            result = get_chapa_client().verify_payment(payment.chapa_reference)
+            return Response(*record_verification(payment, result))
+        except ChapaUnavailable:
+            raise
         except Exception as e:
-            logger.error(f"Unexpected error during payment verification: {str(e)}")
-            return Response(
-                {'error': f'Unexpected error: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+            return Response(*chapa_failure(e, 'payment verification'))
 
     @action(detail=False, methods=['post'], permission_classes=[AllowAny])
     def verify(self, request):
         """
-        Verify payment status via callback from Chapa
+        Acknowledge a payment callback from Chapa
+        
+        The tx_ref is recorded and verified with Chapa by a background
+        worker, so the response never waits on Chapa. Retried callbacks for
+        the same tx_ref are acknowledged without doing anything.
         
         Expected data:
         - tx_ref: Transaction reference (payment_id)
@@ -404,70 +518,21 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        try:
-            payment = Payment.objects.get(payment_id=tx_ref)
-        except Payment.DoesNotExist:
+        outcome = record_callback(str(tx_ref))
+        if outcome == 'unknown':
             return Response(
                 {'error': 'Payment not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        try:
-            chapa_client = ChapaAPIClient()
-            result = chapa_client.verify_payment(payment.chapa_reference or tx_ref)
-            
-            if result['success']:
-                chapa_status = result.get('status', 'pending').lower()
-                
-                if chapa_status == 'success':
-                    update_payment_status(
-                        payment,
-                        'completed',
-                        transaction_id=result.get('reference'),
-                        payment_method=result.get('method')
-                    )
-                    
-                    send_payment_confirmation_email(payment.booking, payment)
-                    
-                    return Response({
-                        'success': True,
-                        'status': 'completed',
-                        'message': 'Payment verified successfully',
-                    }, status=status.HTTP_200_OK)
-                    
-                elif chapa_status == 'failed':
-                    update_payment_status(
-                        payment,
-                        'failed',
-                        error_message='Payment failed'
-                    )
-                    
-                    return Response({
-                        'success': False,
-                        'status': 'failed',
-                        'message': 'Payment failed',
-                    }, status=status.HTTP_400_BAD_REQUEST)
-                    
-                else:
-                    return Response({
-                        'success': True,
-                        'status': 'pending',
-                        'message': 'Payment verification pending',
-                    }, status=status.HTTP_200_OK)
-            else:
-                return Response({
-                    'error': result.get('error', 'Verification failed'),
-                }, status=status.HTTP_400_BAD_REQUEST)
-                
-        except Exception as e:
-            logger.error(f"Error verifying payment: {str(e)}")
-            return Response(
-                {'error': str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        return Response({
+            'success': True,
+            'status': outcome,
+            'message': 'Callback received',
+        }, status=status.HTTP_202_ACCEPTED if outcome == 'accepted' else status.HTTP_200_OK)
 
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(ConditionalReadMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing listing reviews.
     
@@ -477,6 +542,8 @@ class ReviewViewSet(viewsets.ModelViewSet):
     - GET /api/reviews/{id}/ - Retrieve a specific review
     - PUT /api/reviews/{id}/ - Update a review
     - DELETE /api/reviews/{id}/ - Delete a review
+
+    List and retrieve answer If-None-Match/If-Modified-Since with 304 (see listings.conditional).
     """
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
@@ -485,21 +552,68 @@ class ReviewViewSet(viewsets.ModelViewSet):
     ordering_fields = ['created_at', 'rating']
     ordering = ['-created_at']
 
+    def get_queryset(self):
+        """Preload the relations the requested fields render"""
+        return optimize_for_serializer(Review.objects.all(), self.get_serializer())
+
     def perform_create(self, serializer):
         """Automatically set the reviewer to the current user"""
-        serializer.save(reviewer=self.request.user)
+        with transaction.atomic():
+            review = serializer.save(reviewer=self.request.user)
+            apply_review_delta(review.listing_id, added=review.rating)
 
     def perform_update(self, serializer):
         """Allow only the reviewer to update their review"""
-        if serializer.instance.reviewer != self.request.user:
+        if serializer.instance.reviewer_id != self.request.user.pk:
             from rest_framework.exceptions import PermissionDenied
             raise PermissionDenied("You can only update your own reviews.")
-        serializer.save()
+        with transaction.atomic():
+            # Locked, so concurrent edits each take back the rating the other left
+            previous_listing_id, previous_rating = Review.objects.select_for_update().values_list(
+                'listing_id', 'rating'
+            ).get(pk=serializer.instance.pk)
+            serializer.instance.listing_id = previous_listing_id
+            serializer.instance.rating = previous_rating
+            review = serializer.save()
+            if review.listing_id == previous_listing_id:
+                apply_review_delta(review.listing_id, added=review.rating, removed=previous_rating)
+            else:
+                # Moved to another listing: it stops counting towards the old one, whose
+                # cached responses review_changed() doesn't know about
+                apply_review_delta(previous_listing_id, removed=previous_rating)
+                apply_review_delta(review.listing_id, added=review.rating)
+                invalidate_listing(previous_listing_id)
 
     def perform_destroy(self, instance):
         """Allow only the reviewer to delete their review"""
-        if instance.reviewer != self.request.user:
+        if instance.reviewer_id != self.request.user.pk:
             from rest_framework.exceptions import PermissionDenied
             raise PermissionDenied("You can only delete your own reviews.")
-        instance.delete()
+        with transaction.atomic():
+            # Locked, so of concurrent deletes only the one removing the row takes its rating back
+            stored = Review.objects.select_for_update().filter(pk=instance.pk).values_list(
+                'listing_id', 'rating'
+            ).first()
+            if stored is None:
+                return
+            instance.listing_id, instance.rating = stored
+            deleted, _ = instance.delete()
+            if deleted:
+                apply_review_delta(instance.listing_id, removed=instance.rating)
+
 
+class AnalyticsViewSet(viewsets.ViewSet):
+    """
+    Reporting for hosts, answered from the daily revenue rollups.
+
+    - GET /api/analytics/host/ - Revenue, completed payments and cancellations of the
+      current user's listings (?start=&end= default to the last 30 days,
+      ?listing= and ?currency= narrow them)
+    """
+    permission_classes = [IsAuthenticated]
+
+    @action(detail=False, methods=['get'])
+    def host(self, request):
+        """Sum the host's rollup rows in the range, by currency, listing and day"""
+        options = parse_revenue_params(request.query_params)
+        return Response(HostRevenueSerializer(host_revenue(request.user, **options)).data)
@@ -0,0 +1,100 @@
+"""
+Which bookings and payments a user can see
+
+A user sees a booking as its guest or as the host of its listing. As one
+filter that is Q(guest=user) | Q(listing__host=user): an OR across a join,
+which no index can serve, so every list scanned the whole bookings table.
+Here each way of seeing a row is a branch of its own, and each branch is
+read on the index made for it: the guest branch on (guest, created_at),
+the host branch on (listing, created_at) below the host's listings.
+
+Lists combine the branches in two phases. First the keys of the rows to
+serve are read from each branch, then those rows are loaded by primary key
+with everything the serializer needs:
+
+- a keyset page reads at most a page of (created_at, pk) keys per branch
+  (see KeysetPagination), however many rows the user can see;
+- other lists read every visible primary key, up to VISIBLE_IDS_LIMIT;
+  longer ones fall back to the single OR filter, which their rendering
+  outweighs anyway.
+
+Lookups of one row keep the OR filter: the primary key narrows them first.
+"""
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+
+from .models import Listing
+
+VISIBLE_IDS_LIMIT = 1000
+
+
+def hosted_listings(user):
+    """Primary keys of the user's listings, as a subquery"""
+    return Listing.objects.filter(host=user).values('pk')
+
+
+def booking_branches(user):
+    """Filters on Booking, one per way a user sees a booking"""
+    return [Q(guest=user), Q(listing__in=hosted_listings(user))]
+
+
+def payment_branches(user):
+    """Filters on Payment, one per way a user sees a payment"""
+    return [Q(booking__guest=user), Q(booking__listing__in=hosted_listings(user))]
+
+
+def visible_ids(queryset, branches, limit):
+    """
+    Primary keys of a queryset's rows in any branch, one query per branch
+
+    Returns:
+        set: The keys, or None if there are more than limit of them
+    """
+    ids = set()
+    for branch in branches:
+        rows = queryset.filter(branch).order_by().prefetch_related(None)
+        ids.update(rows.values_list('pk', flat=True)[:limit + 1])
+        if len(ids) > limit:
+            return None
+    return ids
+
+
+class VisibilityMixin:
+    """
+    Restrict a view to the rows its user can see, reading lists branch by branch
+
+    Views implement get_visibility_branches() and filter get_queryset() with
+    visible(). Other actions get the OR filter there; lists are restricted
+    in filter_queryset() instead, after every other filter, so that no
+    branch is read with the OR still attached: keyset pages by the
+    paginator, everything else by narrowing to visible_ids().
+    """
+
+    def get_visibility_branches(self):
+        """Q filters, one per way the request's user sees a row"""
+        raise NotImplementedError
+
+    def visible(self, queryset):
+        """queryset restricted to rows in any branch; lists are left to filter_queryset()"""
+        if self.action == 'list':
+            return queryset
+        return queryset.filter(self.visibility_filter())
+
+    def visibility_filter(self):
+        return reduce(or_, self.get_visibility_branches())
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action != 'list' or self.paginator_reads_branches():
+            return queryset
+        ids = visible_ids(queryset, self.get_visibility_branches(), VISIBLE_IDS_LIMIT)
+        if ids is None:
+            return queryset.filter(self.visibility_filter())
+        return queryset.filter(pk__in=ids)
+
+    def paginator_reads_branches(self):
+        """Whether the paginator reads this request's page from the branches itself"""
+        reads_branches = getattr(self.paginator, 'reads_branches', None)
+        return bool(reads_branches and reads_branches(self.request))